@@ -0,0 +1,107 @@
+"""
+広告セグメント集計モジュール
+セッション単位のフラグ（CV・クリック・FV残存・最終CTA到達・エンゲージ）を一度だけ作り、
+キャンペーン・広告コンテンツ・参照元/メディアとその掛け合わせごとの広告指標を
+1回のグループ集計でまとめて計算する
+"""
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+AD_DIMENSIONS = ['utm_campaign', 'utm_content', 'utm_source', 'utm_medium']
+
+# 最終CTAとみなすページ番号と、エンゲージとみなす1ページあたりの滞在時間
+FINAL_CTA_PAGE = 10
+ENGAGED_STAY_MS = 30000
+
+AD_METRICS = [
+    'セッション数', 'CV数', 'CVR', 'クリック数', 'CTR', 'FV残存率', '最終CTA到達率',
+    '平均到達ページ', '平均滞在時間', 'エンゲージメント率',
+]
+
+
+def build_ad_flags(sessions: pd.DataFrame, final_cta_page: int = FINAL_CTA_PAGE,
+                   engaged_stay_ms: int = ENGAGED_STAY_MS) -> pd.DataFrame:
+    """
+    セッションテーブルから広告指標の集計に使う数値フラグ列を作成する
+
+    Args:
+        sessions: build_session_table() で作成したセッションテーブル
+        final_cta_page: このページ以上に到達したセッションを最終CTA到達とする
+        engaged_stay_ms: いずれかのページでこの滞在時間以上のセッションをエンゲージとする
+
+    Returns:
+        pd.DataFrame: 広告の次元列と、合計するだけで指標が計算できる数値列
+    """
+    dims = [d for d in AD_DIMENSIONS if d in sessions.columns]
+    flags = sessions[dims].copy()
+    flags['sessions'] = 1
+    flags['cv'] = sessions['is_cv'].to_numpy(dtype=np.int64)
+    flags['clicked'] = sessions['clicked'].to_numpy(dtype=np.int64)
+    flags['fv_retained'] = (sessions['max_page_reached'] >= 2).to_numpy(dtype=np.int64)
+    flags['final_cta'] = (sessions['max_page_reached'] >= final_cta_page).to_numpy(dtype=np.int64)
+    flags['engaged'] = (sessions['stay_ms_max'] >= engaged_stay_ms).to_numpy(dtype=np.int64)
+    flags['max_page_reached'] = sessions['max_page_reached'].to_numpy(dtype=float)
+    flags['stay_ms_sum'] = sessions['stay_ms_sum'].to_numpy(dtype=float)
+    flags['stay_ms_count'] = sessions['stay_ms_count'].to_numpy(dtype=np.int64)
+    return flags
+
+
+def aggregate_ad_segments(flags: pd.DataFrame, by) -> pd.DataFrame:
+    """
+    指定した次元（単独または掛け合わせ）ごとに全ての広告指標を1回の groupby で計算する
+
+    Args:
+        flags: build_ad_flags() の戻り値
+        by: 次元の列名、またはそのリスト（例: ['utm_campaign', 'utm_content']）
+
+    Returns:
+        pd.DataFrame: 次元列と AD_METRICS の列（率は%、平均滞在時間は秒）。
+            次元が欠損しているセッションは対象外
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    value_cols = ['sessions', 'cv', 'clicked', 'fv_retained', 'final_cta', 'engaged',
+                  'max_page_reached', 'stay_ms_sum', 'stay_ms_count']
+    sums = flags.dropna(subset=by).groupby(by, observed=True)[value_cols].sum()
+
+    n = sums['sessions'].to_numpy(dtype=float)
+
+    def rate(col):
+        return np.divide(sums[col].to_numpy(dtype=float), n, out=np.zeros(len(n)), where=n > 0) * 100
+
+    result = pd.DataFrame({
+        'セッション数': sums['sessions'],
+        'CV数': sums['cv'],
+        'CVR': rate('cv'),
+        'クリック数': sums['clicked'],
+        'CTR': rate('clicked'),
+        'FV残存率': rate('fv_retained'),
+        '最終CTA到達率': rate('final_cta'),
+        '平均到達ページ': np.divide(sums['max_page_reached'], n, out=np.zeros(len(n)), where=n > 0),
+        # 平均滞在時間は滞在時間が記録されたイベント（ページビュー）あたりの平均（クリック・動画・フォームの行は含めない）
+        '平均滞在時間': np.divide(sums['stay_ms_sum'], sums['stay_ms_count'], out=np.zeros(len(n)),
+                            where=sums['stay_ms_count'].to_numpy() > 0) / 1000,
+        'エンゲージメント率': rate('engaged'),
+    }, index=sums.index)
+    return result.reset_index()
+
+
+def aggregate_all(flags: pd.DataFrame, dimensions=AD_DIMENSIONS, max_order: int = 2) -> dict:
+    """
+    次元の単独・掛け合わせ（max_order まで）の全組み合わせについて広告指標を計算する
+
+    Args:
+        flags: build_ad_flags() の戻り値
+        dimensions: 対象の次元
+        max_order: 掛け合わせる次元数の上限
+
+    Returns:
+        dict: 次元のタプル -> aggregate_ad_segments() の結果
+    """
+    dimensions = [d for d in dimensions if d in flags.columns]
+    results = {}
+    for order in range(1, max_order + 1):
+        for combo in combinations(dimensions, order):
+            results[combo] = aggregate_ad_segments(flags, list(combo))
+    return results
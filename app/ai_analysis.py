@@ -3,6 +3,8 @@ import google.generativeai as genai
 import pandas as pd
 import json
 
+from app.profiling import profiled
+
 def get_gemini_model():
     """
     Initialize and return the Gemini model.
@@ -38,6 +40,7 @@ def _safe_generate(prompt):
     except Exception as e:
         return f"Error generating content: {str(e)}"
 
+@profiled()
 def generate_quiz_content(prompt):
     """
     クイズ生成用のプロンプトをGeminiに送信し、レスポンスを取得する。
@@ -63,6 +66,7 @@ APIを有効にするには、サイドバーの「AIモデル設定」で「Gem
 3.  **考察**: モックモードでは課金は発生しません。UI/UXの確認にご利用ください。
 """
 
+@profiled()
 def analyze_overall_performance(kpi_data, comparison_data=None):
     """
     Analyze overall KPI performance.
@@ -90,6 +94,7 @@ def analyze_overall_performance(kpi_data, comparison_data=None):
     """
     return _safe_generate(prompt)
 
+@profiled()
 def analyze_page_bottlenecks(page_stats_df):
     """
     Analyze page-level statistics to identify bottlenecks.
@@ -117,6 +122,7 @@ def analyze_page_bottlenecks(page_stats_df):
     """
     return _safe_generate(prompt)
 
+@profiled()
 def analyze_device_performance(device_stats_df):
     """
     Analyze performance by device type.
@@ -142,6 +148,7 @@ def analyze_device_performance(device_stats_df):
     """
     return _safe_generate(prompt)
 
+@profiled()
 def analyze_demographics(age_df, gender_df, region_df):
     """
     Analyze demographic data (Age, Gender, Region).
@@ -171,6 +178,7 @@ def analyze_demographics(age_df, gender_df, region_df):
     """
     return _safe_generate(prompt)
 
+@profiled()
 def generate_improvement_proposal(kpi_data, page_stats_df, device_stats_df, target_customer, other_info):
     """
     Generate a comprehensive improvement proposal.
@@ -205,6 +213,7 @@ def generate_improvement_proposal(kpi_data, page_stats_df, device_stats_df, targ
     """
     return _safe_generate(prompt)
 
+@profiled()
 def answer_user_question(context_data, question):
     """
     Answer a specific user question based on provided context.
@@ -224,6 +233,7 @@ def answer_user_question(context_data, question):
     """
     return _safe_generate(prompt)
 
+@profiled()
 def analyze_lpo_factors(kpi_data, page_stats_df, hearing_sheet_text, lp_text_content, lp_format="縦長"):
     """
     Perform a comprehensive LPO factor analysis based on the user's detailed prompt.
@@ -333,6 +343,7 @@ def analyze_lpo_factors(kpi_data, page_stats_df, hearing_sheet_text, lp_text_con
     """
     return _safe_generate(prompt)
 
+@profiled()
 def analyze_ad_performance_expert(ad_stats_df, analysis_target):
     """
     Analyze Ad performance using the Expert Consultant persona.
@@ -353,7 +364,7 @@ def analyze_ad_performance_expert(ad_stats_df, analysis_target):
     ---
 
     # Input Data
-    分析対象: {analysis_target} (キャンペーン別 / 広告コンテンツ別)
+    分析対象: {analysis_target} (キャンペーン別 / 広告コンテンツ別 / 参照元/メディア別 / キャンペーン×広告コンテンツ別)
     
     データ:
     {stats_str}
@@ -401,6 +412,7 @@ def analyze_ad_performance_expert(ad_stats_df, analysis_target):
     """
     return _safe_generate(prompt)
 
+@profiled()
 def analyze_ab_test_expert(ab_stats_df):
     """
     Analyze A/B Test results using the Expert Consultant persona.
@@ -464,6 +476,7 @@ def analyze_ab_test_expert(ab_stats_df):
     """
     return _safe_generate(prompt)
 
+@profiled()
 def analyze_interaction_expert(contribution_df):
     """
     Analyze Interaction data using the Expert Consultant persona.
@@ -527,6 +540,7 @@ def analyze_interaction_expert(contribution_df):
     """
     return _safe_generate(prompt)
 
+@profiled()
 def analyze_video_scroll_expert(video_stats, scroll_stats):
     """
     Analyze Video and Scroll data using the Expert Consultant persona.
@@ -551,7 +565,7 @@ def analyze_video_scroll_expert(video_stats, scroll_stats):
     動画データ:
     {video_str}
     
-    スクロールデータ（逆行率など）:
+    スクロールデータ（ページ別のスクロール到達率）:
     {scroll_str}
 
     ---
@@ -595,6 +609,7 @@ def analyze_video_scroll_expert(video_stats, scroll_stats):
     """
     return _safe_generate(prompt)
 
+@profiled()
 def analyze_timeseries_expert(timeseries_df):
     """
     Analyze Time Series data using the Expert Consultant persona.
@@ -658,6 +673,7 @@ def analyze_timeseries_expert(timeseries_df):
     """
     return _safe_generate(prompt)
 
+@profiled()
 def analyze_demographics_expert(demo_df):
     """
     Analyze Demographics data using the Expert Consultant persona.
@@ -721,6 +737,7 @@ def analyze_demographics_expert(demo_df):
     """
     return _safe_generate(prompt)
 
+@profiled()
 def analyze_improvement_proposal_expert(lp_text_content, kpi_data, target_info):
     """
     Generate a comprehensive improvement proposal using the Expert Consultant persona.
@@ -805,6 +822,7 @@ def analyze_improvement_proposal_expert(lp_text_content, kpi_data, target_info):
     """
     return _safe_generate(prompt)
 
+@profiled()
 def analyze_product_characteristics(product_description):
     """
     Analyze product description to estimate CVR, target audience, and bottlenecks.
@@ -855,6 +873,7 @@ def analyze_product_characteristics(product_description):
     """
     return _safe_generate(prompt)
 
+@profiled()
 def chat_with_data(user_query, dataframe_summary):
     """
     Answer user questions based on the provided dataframe summary.
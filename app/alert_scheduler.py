@@ -0,0 +1,412 @@
+"""
+アラート定期評価モジュール
+新しく追加された日のデータだけを対象にアラートルールを定期的に評価し、
+発火したアラートをローカルのSQLiteに履歴として保存する。
+アプリ内のバックグラウンドスレッドとしても、単独のワーカープロセスとしても動作する
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from app.analytics.dataset import prepare_events
+from app.session_table import build_session_table
+import app.anomaly_detection as anomaly_detection
+
+DEFAULT_INTERVAL_SEC = 300
+DEFAULT_STORE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'alert_history.sqlite3')
+
+# 全体の日次KPIに対するルール（アラートページの前日比ルールと同じ閾値）
+#   change: 前日比の変化率がこの値未満で発火（lower が指定されていればその値以上のときのみ）
+ALERT_RULES = [
+    {'name': 'cvr_dod_high', 'metric': 'cvr', 'level': 'high', 'title': 'CVRが急落', 'change': -0.5},
+    {'name': 'sessions_dod_high', 'metric': 'sessions', 'level': 'high', 'title': 'セッションが急減', 'change': -0.5},
+    {'name': 'cvr_dod_medium', 'metric': 'cvr', 'level': 'medium', 'title': 'CVRが低下', 'change': -0.3, 'lower': -0.5},
+    {'name': 'sessions_dod_medium', 'metric': 'sessions', 'level': 'medium', 'title': 'セッションが減少', 'change': -0.3, 'lower': -0.5},
+]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    fingerprint TEXT PRIMARY KEY,
+    dataset TEXT NOT NULL,
+    rule TEXT NOT NULL,
+    level TEXT NOT NULL,
+    title TEXT NOT NULL,
+    series TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    event_date TEXT NOT NULL,
+    value REAL,
+    baseline REAL,
+    change REAL,
+    z REAL,
+    impact_cv REAL,
+    context TEXT,
+    first_seen TEXT NOT NULL,
+    last_seen TEXT NOT NULL,
+    occurrences INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_alerts_dataset ON alerts (dataset, last_seen);
+CREATE TABLE IF NOT EXISTS watermarks (
+    dataset TEXT PRIMARY KEY,
+    last_date TEXT NOT NULL,
+    evaluated_at TEXT NOT NULL
+);
+"""
+
+
+class AlertStore:
+    """
+    発火したアラートの履歴を保存するSQLiteストア
+
+    同じ (データセット, ルール, 系列, 指標, 日付) のアラートは fingerprint で1件にまとめ、
+    再検知のたびに last_seen と occurrences だけを更新する。
+    """
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get_watermark(self, dataset: str):
+        """データセットの評価済み最終日を返す（未評価なら None）"""
+        with self._connect() as conn:
+            row = conn.execute('SELECT last_date FROM watermarks WHERE dataset = ?', (dataset,)).fetchone()
+        return pd.Timestamp(row[0]) if row else None
+
+    def set_watermark(self, dataset: str, last_date):
+        now = datetime.now().isoformat(timespec='seconds')
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                'INSERT INTO watermarks (dataset, last_date, evaluated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(dataset) DO UPDATE SET last_date = excluded.last_date, evaluated_at = excluded.evaluated_at',
+                (dataset, pd.Timestamp(last_date).strftime('%Y-%m-%d'), now),
+            )
+
+    def record(self, dataset: str, alerts: pd.DataFrame) -> int:
+        """
+        アラートを保存する（重複は last_seen / occurrences の更新のみ）
+
+        Args:
+            dataset: データセットのバージョンID
+            alerts: evaluate_alerts() の戻り値
+
+        Returns:
+            int: 新規に追加されたアラート数
+        """
+        if alerts.empty:
+            return 0
+        now = datetime.now().isoformat(timespec='seconds')
+        rows = []
+        for alert in alerts.to_dict('records'):
+            event_date = pd.Timestamp(alert['date']).strftime('%Y-%m-%d')
+            key = '|'.join([dataset, alert['rule'], alert['series'], alert['metric'], event_date])
+            rows.append((
+                hashlib.sha1(key.encode('utf-8')).hexdigest(), dataset, alert['rule'], alert['level'],
+                alert['title'], alert['series'], alert['metric'], event_date,
+                _to_float(alert.get('value')), _to_float(alert.get('baseline')), _to_float(alert.get('change')),
+                _to_float(alert.get('z')), _to_float(alert.get('impact_cv')),
+                json.dumps(alert.get('context') or {}, ensure_ascii=False, default=str), now, now,
+            ))
+        fingerprints = [row[0] for row in rows]
+        with self._lock, self._connect() as conn:
+            placeholders = ','.join('?' * len(fingerprints))
+            existing = conn.execute(
+                f'SELECT COUNT(*) FROM alerts WHERE fingerprint IN ({placeholders})', fingerprints
+            ).fetchone()[0]
+            conn.executemany(
+                'INSERT INTO alerts (fingerprint, dataset, rule, level, title, series, metric, event_date, value, '
+                'baseline, change, z, impact_cv, context, first_seen, last_seen) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(fingerprint) DO UPDATE SET last_seen = excluded.last_seen, '
+                'occurrences = alerts.occurrences + 1, level = excluded.level, value = excluded.value, '
+                'change = excluded.change, z = excluded.z, impact_cv = excluded.impact_cv',
+                rows,
+            )
+        return len(set(fingerprints)) - existing
+
+    def fetch(self, dataset: str = None, level: str = None, limit: int = 100) -> pd.DataFrame:
+        """
+        アラートフィードを新しい順に取得する
+
+        Args:
+            dataset: データセットのバージョンID（None なら全データセット）
+            level: 'high' / 'medium' で絞り込む
+            limit: 取得件数の上限
+
+        Returns:
+            pd.DataFrame: アラート履歴（context は dict に復元済み）
+        """
+        query = 'SELECT * FROM alerts'
+        clauses, params = [], []
+        if dataset is not None:
+            clauses.append('dataset = ?')
+            params.append(dataset)
+        if level is not None:
+            clauses.append('level = ?')
+            params.append(level)
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += " ORDER BY event_date DESC, CASE level WHEN 'high' THEN 0 ELSE 1 END, ABS(impact_cv) DESC LIMIT ?"
+        params.append(int(limit))
+        with self._connect() as conn:
+            feed = pd.read_sql_query(query, conn, params=params)
+        feed['context'] = feed['context'].map(lambda c: json.loads(c) if c else {})
+        return feed
+
+
+def _to_float(value):
+    """SQLiteに保存できる float（欠損は None）に変換する"""
+    if value is None:
+        return None
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+def evaluate_rules(cube: dict, new_days: np.ndarray) -> pd.DataFrame:
+    """
+    全体の日次KPIに対して前日比ルール（ALERT_RULES）を評価する
+
+    Args:
+        cube: anomaly_detection.build_daily_cube() の戻り値（先頭行が全体の系列）
+        new_days: 評価対象の日のインデックス
+
+    Returns:
+        pd.DataFrame: 発火したアラート
+    """
+    new_days = new_days[new_days >= 1]
+    if len(new_days) == 0 or len(cube['series']) == 0:
+        return pd.DataFrame()
+    sessions = cube['sessions'][0].astype(float)
+    conversions = cube['conversions'][0].astype(float)
+    cvr = np.divide(conversions, sessions, out=np.zeros(len(sessions)), where=sessions > 0)
+    values = {'sessions': sessions, 'cvr': cvr}
+
+    alerts = []
+    for rule in ALERT_RULES:
+        current = values[rule['metric']][new_days]
+        previous = values[rule['metric']][new_days - 1]
+        change = np.divide(current - previous, previous, out=np.zeros(len(current)), where=previous > 0)
+        fired = change < rule['change']
+        if 'lower' in rule:
+            fired &= change >= rule['lower']
+        for day, value, base, rate in zip(new_days[fired], current[fired], previous[fired], change[fired]):
+            alerts.append({
+                'rule': rule['name'], 'level': rule['level'], 'title': rule['title'], 'series': '全体',
+                'metric': rule['metric'], 'date': cube['dates'][day], 'value': value, 'baseline': base,
+                'change': rate, 'z': np.nan,
+                'impact_cv': (value - base) * (sessions[day] if rule['metric'] == 'cvr' else cvr[day - 1]),
+                'context': {'comparison': '前日比'},
+            })
+    return pd.DataFrame(alerts)
+
+
+def evaluate_alerts(sessions: pd.DataFrame, since=None, history: int = 28, min_daily_sessions: float = 20) -> tuple:
+    """
+    watermark（評価済み最終日）より後の日だけを対象にアラートを評価する
+
+    基準の計算に必要な過去 history 日分と新しい日だけでキューブを作るため、
+    データ全体を毎回評価し直す必要はない。
+
+    Args:
+        sessions: build_session_table() で作成したセッションテーブル
+        since: 評価済み最終日（None なら初回として最初の1週間以降の全日を評価）
+        history: 基準に使う過去日数
+        min_daily_sessions: セグメント系列の異常検知の対象とする1日平均セッション数の下限
+
+    Returns:
+        (alerts, last_date): 発火したアラートのDataFrameと、評価した最終日
+    """
+    if sessions.empty:
+        return pd.DataFrame(), None
+    event_dates = pd.to_datetime(sessions['event_date']).dt.normalize()
+    last_date = event_dates.max()
+    if since is not None and last_date <= since:
+        return pd.DataFrame(), last_date
+    # 初回は基準を作るための最初の1週間を除いた全日を評価する
+    first_new = event_dates.min() + pd.Timedelta(days=7) if since is None else since + pd.Timedelta(days=1)
+    first_new = min(first_new, last_date)
+    window_start = first_new - pd.Timedelta(days=history)
+    cube = anomaly_detection.build_daily_cube(sessions[event_dates >= window_start])
+    new_days = np.flatnonzero(cube['dates'] >= first_new)
+
+    alerts = [evaluate_rules(cube, new_days)]
+    cube = anomaly_detection.filter_cube(cube, min_daily_sessions)
+    scored = [anomaly_detection.score_latest_day(cube, history=history, target=int(target)) for target in new_days]
+    changepoints = anomaly_detection.detect_changepoints(cube)
+    if not changepoints.empty:
+        # 変化点は新しい日に起きたものだけを対象にする（キューブは window_start から作っているので、
+        # それ以前の日で絞ると評価済みの日の変化点を毎回報告し直すことになる）
+        scored.append(changepoints[changepoints['date'] >= first_new])
+    scored = [f for f in scored if not f.empty]
+    if scored:
+        flagged = anomaly_detection.rank_anomalies(pd.concat(scored, ignore_index=True))
+        if not flagged.empty:
+            labels = {'sessions': 'セッション数', 'cvr': 'CVR'}
+            flagged['rule'] = 'anomaly_' + flagged['kind']
+            flagged['title'] = (flagged['metric'].map(labels)
+                                + np.where(flagged['direction'] == 'down', 'が低下', 'が上昇')
+                                + np.where(flagged['kind'] == 'changepoint', '（変化点）', '（異常値）'))
+            context_cols = [c for c in anomaly_detection.ANOMALY_DIMENSIONS if c in flagged.columns] + ['kind', 'exposure']
+            flagged['context'] = flagged[context_cols].to_dict('records')
+            alerts.append(flagged)
+    alerts = [a for a in alerts if not a.empty]
+    return (pd.concat(alerts, ignore_index=True) if alerts else pd.DataFrame()), last_date
+
+
+class AlertScheduler:
+    """
+    アラートを一定間隔で評価するバックグラウンドスケジューラ
+
+    スケジューラはプロセスで1つだけ起動し、複数のセッションから submit() されたデータセットを
+    {バージョンID: データ} の形で保持して、周期ごとに登録されたすべてのデータセットを評価する。
+    評価結果は AlertStore に保存されるので、アラートページは store.fetch(dataset=...) で自分のデータセットの分だけを読み出す。
+    """
+
+    def __init__(self, store: AlertStore = None, interval_sec: float = DEFAULT_INTERVAL_SEC, max_datasets: int = 8):
+        """
+        Args:
+            store: アラート履歴のストア
+            interval_sec: 評価間隔（秒）
+            max_datasets: 保持するデータセット数の上限（超えたら最後に登録された時刻が古いものから外す）
+        """
+        self.store = store or AlertStore()
+        self.interval_sec = interval_sec
+        self.max_datasets = max_datasets
+        # バージョンID → {'df': イベントデータ, 'sessions': セッションテーブル（未作成なら None）}（登録が古い順）
+        self._datasets = OrderedDict()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_run = None
+        self.last_error = None
+
+    def submit(self, dataset: str, df: pd.DataFrame, refresh: bool = False):
+        """
+        評価対象のデータセットを登録し、すぐに評価を起動する
+
+        登録済みのデータセットIDの再登録は無視する（データが追記された場合は refresh=True を指定する）。
+        """
+        with self._lock:
+            if dataset in self._datasets and not refresh:
+                self._datasets.move_to_end(dataset)
+                return
+            self._datasets[dataset] = {'df': df, 'sessions': None}
+            self._datasets.move_to_end(dataset)
+            while len(self._datasets) > self.max_datasets:
+                self._datasets.popitem(last=False)
+        self._wake.set()
+
+    def datasets(self) -> list:
+        """登録されているデータセットのバージョンID"""
+        with self._lock:
+            return list(self._datasets)
+
+    def run_once(self, dataset: str = None) -> int:
+        """
+        登録されたデータセットを1回評価し、新規アラート数の合計を返す
+
+        Args:
+            dataset: 評価するデータセットのバージョンID（None なら登録されたすべて）
+        """
+        with self._lock:
+            targets = [(k, dict(v)) for k, v in self._datasets.items() if dataset is None or k == dataset]
+        inserted = 0
+        errors = []
+        for version, entry in targets:
+            try:
+                inserted += self._evaluate(version, entry)
+            except Exception as e:  # 1つのデータセットの失敗で他のデータセットの評価を止めない
+                errors.append(f"{version}: {e}")
+        self.last_run = datetime.now()
+        self.last_error = '; '.join(errors) or None
+        return inserted
+
+    def _evaluate(self, dataset: str, entry: dict) -> int:
+        sessions = entry['sessions']
+        if sessions is None:
+            sessions = build_session_table(entry['df'])
+            with self._lock:
+                current = self._datasets.get(dataset)
+                if current is not None and current['df'] is entry['df']:
+                    current['sessions'] = sessions
+        alerts, last_date = evaluate_alerts(sessions, since=self.store.get_watermark(dataset))
+        inserted = self.store.record(dataset, alerts)
+        if last_date is not None:
+            self.store.set_watermark(dataset, last_date)
+        return inserted
+
+    def start(self):
+        """バックグラウンドスレッドを開始する（起動済みなら何もしない）"""
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='alert-scheduler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._wake.wait(self.interval_sec)
+            self._wake.clear()
+
+
+def _load_dataset(path: str) -> pd.DataFrame:
+    """ワーカー用にイベントデータを読み込み、アプリと同じ前処理（prepare_events()）をする"""
+    if path.endswith('.parquet'):
+        df = pd.read_parquet(path)
+    elif path.endswith(('.pkl', '.pickle')):
+        df = pd.read_pickle(path)
+    else:
+        df = pd.read_csv(path)
+    # アプリ内のスケジューラと同じ列（channel など）で評価し、同じアラートを出す
+    return prepare_events(df)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='アラートを定期評価するワーカー')
+    parser.add_argument('data', help='イベントデータのファイル（csv / parquet / pkl）')
+    parser.add_argument('--dataset', default=None, help='データセットID（省略時はファイルパス）')
+    parser.add_argument('--store', default=DEFAULT_STORE_PATH, help='アラート履歴のSQLiteファイル')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL_SEC, help='評価間隔（秒）')
+    parser.add_argument('--once', action='store_true', help='1回だけ評価して終了する')
+    args = parser.parse_args()
+
+    scheduler = AlertScheduler(AlertStore(args.store), interval_sec=args.interval)
+    dataset = args.dataset or os.path.abspath(args.data)
+    loaded_mtime = None
+    while True:
+        # ファイルが更新されていれば読み直す（新しい日だけが評価される）
+        mtime = os.path.getmtime(args.data)
+        if mtime != loaded_mtime:
+            scheduler.submit(dataset, _load_dataset(args.data), refresh=True)
+            loaded_mtime = mtime
+        inserted = scheduler.run_once()
+        print(f"{datetime.now():%Y-%m-%d %H:%M:%S} 新規アラート: {inserted}件")
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+"""
+Streamlit に依存しない集計関数
+分析画面（main_v2.py）の各ページが表示する指標・表の計算部分をページごとのモジュールにまとめたもの。
+各ページのレポート関数はデータセットのハンドル（dataset.open_dataset()）とフィルター条件（filters.filter_spec()）を受け取り、
+{表の名前: DataFrame} を返す。画面・ベンチマーク（benchmarks/）・ローカルHTTP API（api.py）から同じ関数を呼ぶ
+"""
@@ -0,0 +1,114 @@
+"""
+A/Bテスト分析の集計
+テスト種別×バリアントごとのセッション数・CVR・FV残存率・最終CTA到達率と、バリアントAとのCVR差分・有意差
+"""
+import pandas as pd
+
+from app.analytics.common import safe_rate
+from app.analytics.filters import select_events
+
+# A/Bテスト種別のマッピング
+TEST_TYPE_MAP = {
+    'hero_image': 'FVテスト',
+    'cta_button': 'CTAテスト',
+    'headline': 'ヘッドラインテスト',
+    'layout': 'レイアウトテスト',
+    'copy': 'コピーテスト',
+    'form': 'フォームテスト',
+    'video': '動画テスト'
+}
+
+
+def test_type_labels(df: pd.DataFrame) -> pd.Series:
+    """
+    ab_test_target をテスト種別の日本語名にする
+
+    Args:
+        df: イベントデータ
+
+    Returns:
+        pd.Series: テスト種別（テスト対象外、または ab_test_target 列がないときは '-'）
+    """
+    if 'ab_test_target' in df.columns:
+        return df['ab_test_target'].map(TEST_TYPE_MAP).fillna('-')
+    return pd.Series('-', index=df.index, dtype=object)
+
+
+def significance_stars(p_value: float) -> str:
+    """p値を有意差の星（★★★: p<0.01, ★★: p<0.05, ★: p<0.1）にする"""
+    return '★★★' if p_value < 0.01 else ('★★' if p_value < 0.05 else ('★' if p_value < 0.1 else '-'))
+
+
+def ab_stats(filtered_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    テスト種別×バリアントごとの指標を計算する
+
+    Args:
+        filtered_df: フィルター適用済みのイベントデータ（ab_test_target は test_type_labels() で日本語名にしたもの）
+
+    Returns:
+        pd.DataFrame: 'テスト種別', 'バリアント', 'セッション数', 'コンバージョン率', 'CVR差分(pt)', 'p値', '有意差', '有意性',
+            'FV残存率', '最終CTA到達率', '平均到達ページ数', '平均滞在時間(秒)' など（テスト対象外の行は除く）
+    """
+    keys = ['ab_test_target', 'ab_variant']
+    # p_valueカラムが存在するかどうかでaggの内容を分岐
+    agg_dict = {
+        'session_id': 'nunique',
+        'stay_ms': 'mean',
+        'max_page_reached': 'mean',
+        'completion_rate': 'mean'
+    }
+    if 'p_value' in filtered_df.columns:
+        agg_dict['p_value'] = 'first'
+        stats = filtered_df.groupby(keys).agg(agg_dict).reset_index()
+        stats.columns = ['テスト種別', 'バリアント', 'セッション数', '平均滞在時間(ms)', '平均到達ページ数', '平均完了率', 'p値']
+    else:
+        stats = filtered_df.groupby(keys).agg(agg_dict).reset_index()
+        stats.columns = ['テスト種別', 'バリアント', 'セッション数', '平均滞在時間(ms)', '平均到達ページ数', '平均完了率']
+        # p_valueカラムが存在しない場合は、1.0で初期化
+        stats['p値'] = 1.0
+
+    stats['平均滞在時間(秒)'] = stats['平均滞在時間(ms)'] / 1000
+    stats['p値'] = stats['p値'].fillna(1.0)  # p値がない場合は1.0で埋める
+
+    # コンバージョン数・FV残存数・最終CTA到達数（テスト種別とバリアントでグループ化）
+    for name, mask in [
+        ('コンバージョン数', filtered_df['cv_type'].notna()),
+        ('FV残存数', filtered_df['max_page_reached'] >= 2),
+        ('最終CTA到達数', filtered_df['max_page_reached'] >= 10),
+    ]:
+        counts = filtered_df[mask].groupby(keys)['session_id'].nunique().reset_index()
+        counts.columns = ['テスト種別', 'バリアント', name]
+        stats = stats.merge(counts, on=['テスト種別', 'バリアント'], how='left').fillna({name: 0})
+    stats['コンバージョン率'] = safe_rate(stats['コンバージョン数'], stats['セッション数']) * 100
+    stats['FV残存率'] = safe_rate(stats['FV残存数'], stats['セッション数']) * 100
+    stats['最終CTA到達率'] = safe_rate(stats['最終CTA到達数'], stats['セッション数']) * 100
+
+    # テスト種別が'-'の行（テスト対象外のデータ）を除外
+    stats = stats[stats['テスト種別'] != '-'].reset_index(drop=True)
+
+    # テスト種別ごとに、バリアントAを基準としたCVR差分を計算（Aがないテスト種別は NaN）
+    baseline = stats[stats['バリアント'] == 'A'].groupby('テスト種別')['コンバージョン率'].first()
+    stats['CVR差分(pt)'] = stats['コンバージョン率'] - stats['テスト種別'].map(baseline)
+    stats.loc[stats['バリアント'] == 'A', 'CVR差分(pt)'] = 0.0
+
+    # p値から有意差と有意性を計算
+    stats['有意差'] = stats['p値'].apply(significance_stars)
+    stats['有意性'] = 1 - stats['p値']  # バブルチャート用
+    return stats
+
+
+def ab_report(dataset: dict, spec: dict = None) -> dict:
+    """
+    A/Bテスト分析ページの表を計算する
+
+    Args:
+        dataset: open_dataset() の戻り値
+        spec: filter_spec() の戻り値（None なら全期間・絞り込みなし）
+
+    Returns:
+        dict: 'variants'（ab_stats()）
+    """
+    labeled = select_events(dataset, spec).copy(deep=False)
+    labeled['ab_test_target'] = test_type_labels(labeled)
+    return {'variants': ab_stats(labeled)}
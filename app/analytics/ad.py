@@ -0,0 +1,57 @@
+"""
+広告分析の集計
+キャンペーン・広告コンテンツ・参照元/メディア別の指標と、マルチタッチアトリビューション
+"""
+from app import ad_aggregation, attribution
+from app.analytics.filters import period_spec, select_events
+from app.session_table import build_session_table
+
+# 分析軸ごとの集計する次元
+AD_SEGMENTS = {
+    'campaign': ('utm_campaign',),
+    'content': ('utm_content',),
+    'source_medium': ('utm_source', 'utm_medium'),
+    'campaign_content': ('utm_campaign', 'utm_content'),
+}
+
+
+def ad_report(dataset: dict, spec: dict = None, by=('utm_campaign',)) -> dict:
+    """
+    広告分析ページのセグメント別の表を計算する
+
+    Args:
+        dataset: open_dataset() の戻り値
+        spec: filter_spec() の戻り値（None なら全期間・絞り込みなし）
+        by: 集計する次元（AD_SEGMENTS のキー、ad_aggregation.AD_DIMENSIONS の列名のリスト、
+            または API のクエリ文字列のように列名をカンマでつないだ文字列）
+
+    Returns:
+        dict: 'segments'（ad_aggregation.aggregate_ad_segments() の戻り値）
+
+    Raises:
+        ValueError: AD_SEGMENTS のキーでも広告の次元でもない値を指定した場合
+    """
+    if isinstance(by, str):
+        by = AD_SEGMENTS.get(by) or [column.strip() for column in by.split(',') if column.strip()]
+    unknown = [column for column in by if column not in ad_aggregation.AD_DIMENSIONS]
+    if unknown or not by:
+        choices = ', '.join(list(AD_SEGMENTS) + ad_aggregation.AD_DIMENSIONS)
+        raise ValueError(f"未知の集計軸です: {', '.join(unknown) or '(空)'}（指定できる値: {choices}）")
+    sessions = build_session_table(select_events(dataset, spec))
+    return {'segments': ad_aggregation.aggregate_ad_segments(ad_aggregation.build_ad_flags(sessions), list(by))}
+
+
+def attribution_report(dataset: dict, spec: dict = None, dimension: str = 'channel') -> dict:
+    """
+    マルチタッチアトリビューションを計算する（ユーザーの過去の接触を取りこぼさないよう、期間だけで絞り込んだ全ユーザーのセッションを使う）
+
+    Args:
+        dataset: open_dataset() の戻り値
+        spec: filter_spec() の戻り値（期間だけを使う。None なら全期間）
+        dimension: CVを配分する軸（'channel', 'utm_source', 'utm_campaign'）
+
+    Returns:
+        dict: 'attribution'（attribution.attribute() の戻り値）
+    """
+    period_df = select_events(dataset, period_spec(spec) if spec is not None else None)
+    return {'attribution': attribution.attribute(build_session_table(period_df), dimension)}
@@ -0,0 +1,103 @@
+"""
+アラートの判定
+日次のセッション数・CVRの前日比と7日移動平均比から、急な変化をアラートにする（BigQuery の v_alerts ビューと同じ計算）
+"""
+import pandas as pd
+
+from app.analytics.common import safe_rate
+from app.analytics.filters import select_events
+
+# 移動平均と前日比を計算するのに必要な日数（これ以下ならアラートは判定しない）
+MIN_DAYS_FOR_ALERTS = 7
+ALERT_COLUMNS = ['level', 'title', 'description', 'details', 'action', 'page']
+
+
+def daily_kpi_alerts(df: pd.DataFrame) -> tuple:
+    """
+    日次KPIを集計し、最新日のアラートを判定する
+
+    Args:
+        df: イベントデータ（全期間）
+
+    Returns:
+        tuple: (日次KPI, アラートのリスト)。日次KPIは 'event_date', 'sessions', 'conversions', 'cvr' と
+            移動平均・変化率の列、アラートは 'level'（'high' / 'medium'）, 'title', 'description', 'details', 'action', 'page' の dict。
+            日数が MIN_DAYS_FOR_ALERTS 以下のときは移動平均の列がなく、アラートは空
+    """
+    # 1. 日次KPIサマリーを作成 (v_kpi_daily相当)
+    daily_kpi = df.groupby(df['event_date'].dt.date).agg(
+        sessions=('session_id', 'nunique'),
+    )
+    # cv_typeがNaNでないセッションのユニーク数をカウント（CVイベントだけを一度で集計）
+    cv_events = df[df['cv_type'].notna()]
+    daily_kpi['conversions'] = cv_events.groupby(cv_events['event_date'].dt.date)['session_id'].nunique()
+    daily_kpi['conversions'] = daily_kpi['conversions'].fillna(0).astype(int)
+    daily_kpi = daily_kpi.rename_axis('event_date').reset_index()
+    daily_kpi['cvr'] = safe_rate(daily_kpi['conversions'], daily_kpi['sessions'])
+    if len(daily_kpi) <= MIN_DAYS_FOR_ALERTS:
+        return daily_kpi, []
+
+    # 2. 移動平均と前日比を計算 (ma相当)
+    daily_kpi = daily_kpi.sort_values('event_date').reset_index(drop=True)
+    daily_kpi['sessions_ma7'] = daily_kpi['sessions'].rolling(window=7, min_periods=1).mean().shift(1)
+    daily_kpi['cvr_ma7'] = daily_kpi['cvr'].rolling(window=7, min_periods=1).mean().shift(1)
+    daily_kpi['sessions_prev'] = daily_kpi['sessions'].shift(1)
+    daily_kpi['cvr_prev'] = daily_kpi['cvr'].shift(1)
+
+    # 3. 変化率を計算
+    daily_kpi['sessions_dod'] = safe_rate(daily_kpi['sessions'] - daily_kpi['sessions_prev'], daily_kpi['sessions_prev'])
+    daily_kpi['cvr_dod'] = safe_rate(daily_kpi['cvr'] - daily_kpi['cvr_prev'], daily_kpi['cvr_prev'])
+    daily_kpi['sessions_vs_ma7'] = safe_rate(daily_kpi['sessions'] - daily_kpi['sessions_ma7'], daily_kpi['sessions_ma7'])
+    daily_kpi['cvr_vs_ma7'] = safe_rate(daily_kpi['cvr'] - daily_kpi['cvr_ma7'], daily_kpi['cvr_ma7'])
+
+    # 最新日のデータを取得
+    latest = daily_kpi.iloc[-1]
+    alerts = []
+
+    # --- 重要度：高 ---
+    if latest['cvr_dod'] < -0.5:
+        alerts.append({
+            'level': 'high', 'title': 'CVRが急落',
+            'description': f"**コンバージョン率が前日比で {abs(latest['cvr_dod']):.1%} 大幅に低下しました。**",
+            'details': f"前日: {latest['cvr_prev']:.2%}, 本日: {latest['cvr']:.2%}",
+            'action': '時系列分析で確認', 'page': '時系列分析'
+        })
+    if latest['sessions_dod'] < -0.5:
+        alerts.append({
+            'level': 'high', 'title': 'セッションが急減',
+            'description': f"**セッション数が前日比で {abs(latest['sessions_dod']):.1%} 大幅に減少しました。**",
+            'details': f"前日: {int(latest['sessions_prev']):,}, 本日: {int(latest['sessions']):,}",
+            'action': '全体サマリで確認', 'page': '全体サマリ'
+        })
+
+    # --- 重要度：中 ---
+    if -0.5 <= latest['cvr_dod'] < -0.3:
+        alerts.append({
+            'level': 'medium', 'title': 'CVRが低下',
+            'description': f"**コンバージョン率が前日比で {abs(latest['cvr_dod']):.1%} 低下しています。**",
+            'details': f"前日: {latest['cvr_prev']:.2%}, 本日: {latest['cvr']:.2%}",
+            'action': '時系列分析で確認', 'page': '時系列分析'
+        })
+    if -0.5 <= latest['sessions_dod'] < -0.3:
+        alerts.append({
+            'level': 'medium', 'title': 'セッションが減少',
+            'description': f"**セッション数が前日比で {abs(latest['sessions_dod']):.1%} 減少しています。**",
+            'details': f"前日: {int(latest['sessions_prev']):,}, 本日: {int(latest['sessions']):,}",
+            'action': '時系列分析で確認', 'page': '時系列分析'
+        })
+    return daily_kpi, alerts
+
+
+def alerts_report(dataset: dict, spec: dict = None) -> dict:
+    """
+    アラートページの表を計算する
+
+    Args:
+        dataset: open_dataset() の戻り値
+        spec: filter_spec() の戻り値（None なら全データ。アラートページは全データで判定する）
+
+    Returns:
+        dict: 'daily_kpi'（日次KPI）, 'alerts'（ALERT_COLUMNS のアラート一覧）
+    """
+    daily_kpi, alerts = daily_kpi_alerts(select_events(dataset, spec))
+    return {'daily_kpi': daily_kpi, 'alerts': pd.DataFrame(alerts, columns=ALERT_COLUMNS)}
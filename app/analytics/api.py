@@ -0,0 +1,178 @@
+"""
+分析レポートのローカルHTTP API
+画面を開かずに、分析画面と同じ集計（app.analytics.reports）を JSON で取得できるようにする。
+データセットは起動時に1回だけ読み込み、派生テーブルはリクエストをまたいで使い回す（127.0.0.1 でのみ待ち受ける）。
+レポートは app.result_cache の共有キャッシュに保存し、ディスクの段は同じディレクトリを使う分析画面のプロセスとも共有する
+
+    python -m app.analytics.api --scenario 標準（ベースライン） --days 90 --port 8765
+    curl 'http://127.0.0.1:8765/reports/summary?start_date=2025-01-01&end_date=2025-01-31&device=mobile'
+
+    GET /reports                 レポート名と受け付けるオプションの一覧
+    GET /reports/<name>?...      フィルター（FILTER_FIELDS）とオプションを指定してレポートを計算する
+    GET /cache                   共有キャッシュのヒット数・バイト数・追い出し件数
+"""
+import argparse
+import hashlib
+import json
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from app.analytics.dataset import open_dataset
+from app.analytics.filters import FILTER_FIELDS, filter_spec, full_spec
+from app.analytics.reports import REPORT_OPTIONS, REPORTS, cached_report
+from app.result_cache import DEFAULT_CACHE_DIR, ResultCache
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+
+def _table_json(table) -> str:
+    """表を JSON にする（DataFrame はレコードのリスト、それ以外はそのまま）"""
+    if isinstance(table, pd.DataFrame):
+        # 意味のあるインデックス（アトリビューションの配分先など）は列に戻し、多段の列名は '.' でつなぐ
+        if not isinstance(table.index, pd.RangeIndex):
+            table = table.reset_index()
+        if isinstance(table.columns, pd.MultiIndex):
+            table = table.set_axis(['.'.join(str(level) for level in col if str(level)) for col in table.columns], axis=1)
+        return table.to_json(orient='records', date_format='iso', force_ascii=False)
+    if isinstance(table, pd.Series):
+        return table.to_json(date_format='iso', force_ascii=False)
+    return json.dumps(table, ensure_ascii=False, default=str)
+
+
+def report_to_json(name: str, spec: dict, report: dict) -> str:
+    """
+    レポートをレスポンスの JSON 文字列にする
+
+    Returns:
+        str: {"report": 名前, "filters": フィルター条件, "tables": {表の名前: レコードのリスト}}
+    """
+    tables = ', '.join(f"{json.dumps(key, ensure_ascii=False)}: {_table_json(table)}" for key, table in report.items())
+    return f'{{"report": {json.dumps(name)}, "filters": {json.dumps(spec, ensure_ascii=False)}, "tables": {{{tables}}}}}'
+
+
+def parse_request(dataset: dict, query: str):
+    """
+    クエリ文字列をフィルター条件とレポートのオプションに分ける（期間を省略したらデータセットの全期間）
+
+    Returns:
+        tuple: (filter_spec() の戻り値, オプションの dict)
+    """
+    params = {key: values[-1] for key, values in parse_qs(query).items()}
+    defaults = full_spec(dataset)
+    spec = filter_spec(**{field: params.pop(field, defaults[field]) for field in FILTER_FIELDS})
+    return spec, params
+
+
+def make_handler(dataset: dict, cache: ResultCache = None):
+    """dataset を読むリクエストハンドラーのクラスを作る（cache を渡すとレポートを共有キャッシュに保存する）"""
+    class ReportHandler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: str):
+            payload = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _error(self, status: int, message: str):
+            self._send(status, json.dumps({'error': message}, ensure_ascii=False))
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = [p for p in url.path.split('/') if p]
+            if parts == ['reports']:
+                listing = [{'name': name, 'options': REPORT_OPTIONS.get(name, [])} for name in REPORTS]
+                self._send(200, json.dumps({'dataset': dataset['version'], 'filters': FILTER_FIELDS, 'reports': listing}, ensure_ascii=False))
+                return
+            if parts == ['cache']:
+                self._send(200, json.dumps(cache.stats() if cache is not None else None))
+                return
+            if len(parts) != 2 or parts[0] != 'reports':
+                self._error(404, f"見つかりません: {url.path}")
+                return
+            name = parts[1]
+            if name not in REPORTS:
+                self._error(404, f"未知のレポートです: {name}")
+                return
+            try:
+                spec, options = parse_request(dataset, url.query)
+                report = cached_report(cache, dataset, name, spec, **options)
+            except ValueError as e:
+                self._error(400, str(e))
+                return
+            except Exception as e:  # 集計の失敗でスレッドの接続を切らず、JSON のエラーとして返す
+                self._error(500, f"{type(e).__name__}: {e}")
+                return
+            self._send(200, report_to_json(name, spec, report))
+
+    return ReportHandler
+
+
+def serve(dataset: dict, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, cache: ResultCache = None) -> ThreadingHTTPServer:
+    """
+    APIサーバーを作る（serve_forever() で待ち受けを始め、shutdown() で止める）
+
+    Args:
+        dataset: open_dataset() の戻り値（リクエストのスレッド間で共有する）
+        host, port: 待ち受けるアドレス（port=0 なら空いているポート）
+        cache: レポートを保存する共有キャッシュ（None ならリクエストごとに計算する）
+    """
+    return ThreadingHTTPServer((host, port), make_handler(dataset, cache))
+
+
+def _load_events(args) -> tuple:
+    """コマンドライン引数からイベントデータとデータセットのバージョンIDを用意する"""
+    if args.data:
+        if args.data.endswith('.parquet'):
+            events = pd.read_parquet(args.data)
+        else:
+            events = pd.read_csv(args.data)
+        return events, f"{os.path.abspath(args.data)}:{os.path.getmtime(args.data):.0f}"
+    from app.bulk_generator import generate_bulk_data
+    # 生成データは現在時刻を基準日にするので、シナリオ・日数・シードが同じでも中身が違う。内容のハッシュをバージョンに含める
+    events = generate_bulk_data(args.scenario, num_days=args.days, seed=args.seed)
+    digest = hashlib.sha1(pd.util.hash_pandas_object(events, index=False).to_numpy().tobytes()).hexdigest()[:16]
+    return events, f"{_generated_prefix(args)}:{digest}"
+
+
+def _generated_prefix(args) -> str:
+    """生成データのバージョンIDの接頭辞（シナリオ・日数・シード）"""
+    return f"{args.scenario}:{args.days}:{args.seed}"
+
+
+def main():
+    from app.bulk_generator import SCENARIO_CONFIGS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', help='イベントデータのファイル（csv / parquet）。省略時は --scenario のデータを生成する')
+    parser.add_argument('--scenario', default='標準（ベースライン）', choices=list(SCENARIO_CONFIGS))
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='共有キャッシュのディスクの段を置くディレクトリ')
+    parser.add_argument('--no-cache', action='store_true', help='レポートをキャッシュしない')
+    args = parser.parse_args()
+
+    events, version = _load_events(args)
+    cache = None
+    if not args.no_cache:
+        cache = ResultCache(args.cache_dir)
+        # 追記・上書きされる前のファイル（更新時刻の違う同じパス）や、以前に生成したデータの結果を捨てる
+        cache.invalidate(os.path.abspath(args.data) if args.data else _generated_prefix(args), keep=version)
+    server = serve(open_dataset(events, version), args.host, args.port, cache)
+    print(f"http://{args.host}:{server.server_address[1]}/reports で待ち受けています（{len(events):,} events）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
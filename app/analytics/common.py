@@ -0,0 +1,159 @@
+"""
+全ページ共通の前処理とフィルター
+イベントデータへのチャネル・LPのベースURL・新規/リピートなどの列の追加と、期間・LP・デバイスなどによる絞り込み
+"""
+import numpy as np
+import pandas as pd
+
+from app import lp_partitions
+
+ALL_LABEL = 'すべて'
+
+
+def safe_rate(numerator, denominator):
+    """ゼロ除算を回避して率を計算する (inf対応)"""
+    if isinstance(denominator, pd.Series):
+        # 分母が0の場所をnanに置き換えてから計算し、結果のinf/nanを0で埋める
+        denominator_safe = denominator.replace(0, np.nan)
+        rate = numerator.divide(denominator_safe)
+        return rate.replace([np.inf, -np.inf], np.nan).fillna(0)
+    # denominatorが単一の数値の場合
+    return numerator / denominator if denominator != 0 else 0.0
+
+
+def assign_channel(row):
+    """
+    utm_sourceとutm_mediumに基づいてチャネルを割り当てる関数。
+    YouTube広告やその他の有料広告に対応。
+    """
+    source = str(row.get('utm_source', '(direct)')).lower()
+    medium = str(row.get('utm_medium', '(none)')).lower()
+    referrer = str(row.get('page_referrer', ''))
+
+    # 1. Paid Search (有料検索)
+    # mediumがcpc, ppc, paidsearchの場合。sourceが検索エンジン系であることを優先。
+    if medium in ['cpc', 'ppc', 'paidsearch']:
+        return 'Paid Search'
+
+    # 2. Paid Social (有料ソーシャル)
+    # mediumがpaid_social, paidsocial, social_adなど。
+    if medium in ['paid_social', 'paidsocial', 'social_ad']:
+        return 'Paid Social'
+
+    # 3. Paid Video (有料動画)
+    if medium in ['paidvideo', 'paid_video']:
+        return 'Paid Video'
+
+    # 4. Display (ディスプレイ広告)
+    if medium in ['display', 'banner', 'cpm']:
+        return 'Display'
+
+    # 5. Organic Search (自然検索)
+    if medium == 'organic':
+        return 'Organic Search'
+
+    # 6. Organic Social (自然ソーシャル)
+    # mediumがsocial、またはsourceが主要SNSの場合
+    if medium == 'social' or source in ['facebook', 'instagram', 'twitter', 'x.com', 't.co', 'linkedin', 'tiktok', 'youtube']:
+        return 'Organic Social'
+
+    # 7. Direct (直接流入)
+    if source == '(direct)' and medium == '(none)':
+        return 'Direct'
+
+    # 8. Email
+    if medium == 'email':
+        return 'Email'
+
+    # 9. Referral (参照)
+    if medium == 'referral':
+        return 'Referral'
+
+    return 'Other' # どの条件にも当てはまらない場合
+
+
+def enrich_events(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    全ページで使う列を追加する
+
+    Args:
+        df: イベント単位のデータフレーム（event_date / event_timestamp は datetime 型）
+
+    Returns:
+        pd.DataFrame: channel, lp_base_url, utm_source_display, source_medium, user_type, conversion_status 列を追加し、
+            不自然な流入元（direct なのに medium がある行）を除いたデータフレーム
+    """
+    # 浅いコピーに列を足すので、呼び出し元のデータフレームは変わらない
+    df = df.copy(deep=False)
+    # channel列を追加
+    df['channel'] = df.apply(assign_channel, axis=1)
+    # LPのベースURL列を追加
+    df['lp_base_url'] = df['page_location'].str.split('#').str[0]
+    # twitterをXに置換し、NaN値を '(direct)' / '(none)' に置換
+    df['utm_source_display'] = df['utm_source'].replace('twitter', 'X').fillna('(direct)')
+    df['utm_medium'] = df['utm_medium'].fillna('(none)')
+    # source / medium を作成
+    df['source_medium'] = df['utm_source_display'] + ' / ' + df['utm_medium']
+    # 論理的に不自然な組み合わせを除外 (例: direct / cpc)
+    df = df[~((df['utm_source_display'] == '(direct)') & (df['utm_medium'] != '(none)'))]
+    # 新規/リピート、CV/非CV の列（全データのセッションテーブルなど、ページをまたいで共有するキャッシュが同じ列を持つように共通で追加）
+    df['user_type'] = np.where(df['ga_session_number'] == 1, '新規', 'リピート')
+    df['conversion_status'] = np.where(df['session_id'].isin(df.loc[df['cv_type'].notna(), 'session_id'].unique()), 'コンバージョン', '非コンバージョン')
+    return df
+
+
+def filter_events(df, start_date, end_date, lp_url, device, user_type, cv_status, channel, source_medium, partitions=None):
+    """
+    データフレームを各種条件でフィルタリングする
+    partitions（LPごとの行番号）を渡すと、LPを選んだときはそのLPの行だけを走査する
+    （データフレーム全体をハッシュするキャッシュより速く、LPの数が増えても遅くならない）
+    """
+    if lp_url and partitions is not None:
+        df = lp_partitions.select(df, partitions, lp_url)
+
+    # 期間フィルター
+    # datetime.date型の場合はpd.Timestampに変換して比較
+    start_ts = pd.to_datetime(start_date)
+    end_ts = pd.to_datetime(end_date)
+
+    mask = (df['event_date'] >= start_ts) & (df['event_date'] <= end_ts)
+
+    if lp_url and partitions is None:
+        mask &= (df['lp_base_url'] == lp_url)
+
+    if device != ALL_LABEL:
+        mask &= (df['device_type'] == device)
+
+    if user_type != ALL_LABEL:
+        mask &= (df['user_type'] == user_type)
+
+    if cv_status != ALL_LABEL:
+        mask &= (df['conversion_status'] == cv_status)
+
+    if channel != ALL_LABEL:
+        mask &= (df['channel'] == channel)
+
+    if source_medium != ALL_LABEL:
+        mask &= (df['source_medium'] == source_medium)
+
+    return df[mask]
+
+
+def session_mask(sessions: pd.DataFrame, start_date, end_date, filters: dict = None) -> np.ndarray:
+    """
+    セッションテーブルのうち、期間とフィルターに一致するセッションのマスクを作る
+
+    Args:
+        sessions: セッションテーブル（event_date 列とフィルター対象の列を含むもの）
+        start_date, end_date: 期間（両端を含む）
+        filters: {列名: 値}。値が None または 'すべて' の条件は無視する
+
+    Returns:
+        np.ndarray: bool の配列（sessions と同じ長さ）
+    """
+    session_dates = pd.to_datetime(sessions['event_date'])
+    mask = ((session_dates >= pd.to_datetime(start_date)) & (session_dates <= pd.to_datetime(end_date))).to_numpy()
+    for column, value in (filters or {}).items():
+        if value and value != ALL_LABEL:
+            mask = mask & (sessions[column] == value).to_numpy()
+    return mask
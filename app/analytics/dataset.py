@@ -0,0 +1,96 @@
+"""
+分析対象のデータセット（ハンドル）
+前処理済みのイベントデータ・LPごとの行番号と、全データから1回だけ作る派生テーブル（セッションテーブル・事前集計キューブなど）をまとめて持つ。
+派生テーブルは最初に使われたときに作ってハンドルに保持するので、同じハンドルを共有する画面・API・ベンチマークは同じテーブルを使い回せる
+"""
+import threading
+
+import pandas as pd
+
+from app import calendar_cube, click_heatmap, demographics, depth_funnel, distinct_sketch, interaction_matrix, lp_partitions, profiling, quantile_sketch
+from app.analytics.common import enrich_events
+from app.session_table import build_session_table
+
+
+def _sessions(dataset):
+    return build_session_table(dataset['events'])
+
+
+# 派生テーブルの名前と作り方（全データが対象。フィルター条件ごとの集計は各ページのレポート関数で行う）
+TABLE_BUILDERS = {
+    'sessions': _sessions,
+    'interaction_matrix': lambda ds: interaction_matrix.build_interaction_matrix(ds['events'], dataset_table(ds, 'sessions')),
+    'depth_table': lambda ds: depth_funnel.build_depth_table(ds['events'], dataset_table(ds, 'sessions')),
+    'hourly_cube': lambda ds: calendar_cube.build_hourly_cube(dataset_table(ds, 'sessions')),
+    'demographic_cube': lambda ds: demographics.build_demographic_cube(dataset_table(ds, 'sessions')),
+    'distinct_sketches': lambda ds: distinct_sketch.build_distinct_sketches(ds['events']),
+    'quantile_sketches': lambda ds: quantile_sketch.build_quantile_sketches(ds['events']),
+    'click_grids': lambda ds: click_heatmap.build_click_grids(ds['events']),
+}
+
+
+def prepare_events(raw: pd.DataFrame) -> pd.DataFrame:
+    """
+    生成・読み込みしたイベントデータに、全ページで使う列を追加する
+
+    Args:
+        raw: イベント単位のデータフレーム（generate_bulk_data() などの戻り値）
+
+    Returns:
+        pd.DataFrame: 日時列を datetime 型にし、enrich_events() の列とセッション開始の時間帯・曜日・週・月
+            （calendar_cube.CALENDAR_COLUMNS）を追加したデータフレーム（raw は変更しない）
+    """
+    events = raw.copy(deep=False)
+    events['event_date'] = pd.to_datetime(events['event_date'])
+    events['event_timestamp'] = pd.to_datetime(events['event_timestamp'])
+    events = enrich_events(events)
+    # セッション開始の時間帯・曜日・週・月（小さな整数コード。各ページでは dt アクセサを使わない）
+    codes = calendar_cube.calendar_codes(events)
+    for col in calendar_cube.CALENDAR_COLUMNS:
+        events[col] = codes[col].to_numpy()
+    return events
+
+
+def open_dataset(events: pd.DataFrame, version: str, prepared: bool = False) -> dict:
+    """
+    データセットのハンドルを作る
+
+    Args:
+        events: イベントデータ（prepared=True なら prepare_events() 済みのもの）
+        version: データセットのバージョンID（生成・追記のたびに変わる値。キャッシュキーに使う）
+        prepared: events が前処理済みなら True
+
+    Returns:
+        dict: 'version', 'events'（前処理済みのイベントデータ）, 'partitions'（LPのベースURLごとの行番号）,
+            'tables'（作成済みの派生テーブル）。ハンドルとそのイベントデータは読み取り専用として扱う
+    """
+    if not prepared:
+        events = prepare_events(events)
+    return {
+        'version': version,
+        'events': events,
+        'partitions': lp_partitions.build_partitions(events, 'lp_base_url'),
+        'tables': {},
+        '_lock': threading.RLock(),
+    }
+
+
+def dataset_table(dataset: dict, name: str):
+    """
+    派生テーブルを取得する（初回だけ TABLE_BUILDERS で作り、以降はハンドルに保持したものを返す）
+
+    Args:
+        dataset: open_dataset() の戻り値
+        name: TABLE_BUILDERS のキー
+
+    Returns:
+        派生テーブル（テーブルごとに DataFrame または dict）
+    """
+    if name not in TABLE_BUILDERS:
+        raise KeyError(f"未知の派生テーブルです: {name}")
+    # 複数のセッション・APIのスレッドから同時に呼ばれても、同じテーブルは1回だけ作る
+    with dataset['_lock'], profiling.stage(f"table:{name}", cached=True):
+        if name not in dataset['tables']:
+            profiling.note_cache_miss()
+            dataset['tables'][name] = TABLE_BUILDERS[name](dataset)
+        return dataset['tables'][name]
@@ -0,0 +1,58 @@
+"""
+ユーザー属性分析の集計
+年齢層・性別・都道府県は事前集計キューブから、デバイスはフィルター適用済みのイベントから集計する
+"""
+import pandas as pd
+
+from app import demographics
+from app.analytics.common import safe_rate
+from app.analytics.dataset import dataset_table
+from app.analytics.filters import cube_filters, full_spec, select_events
+
+# 属性 → 表示用の列名
+ATTRIBUTE_LABELS = {'age_group': '年齢層', 'gender': '性別', 'prefecture': '地域'}
+
+
+def device_breakdown(filtered_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    デバイスごとのセッション数・CV数・平均滞在時間・CVRを計算する
+
+    Args:
+        filtered_df: フィルター適用済みのイベントデータ
+
+    Returns:
+        pd.DataFrame: 'デバイス', 'セッション数', 'CV数', '平均滞在時間 (秒)', 'CVR (%)'
+    """
+    device_sessions = filtered_df.groupby('device_type')['session_id'].nunique()
+    device_cv = filtered_df[filtered_df['cv_type'].notna()].groupby('device_type')['session_id'].nunique()
+    device_stay = filtered_df.groupby('device_type')['stay_ms'].mean() / 1000
+
+    device_df = pd.DataFrame({
+        'セッション数': device_sessions,
+        'CV数': device_cv,
+        '平均滞在時間 (秒)': device_stay,
+    }).fillna(0).reset_index().rename(columns={'device_type': 'デバイス'})
+    device_df['CVR (%)'] = safe_rate(device_df['CV数'], device_df['セッション数']) * 100
+    return device_df
+
+
+def demographics_report(dataset: dict, spec: dict = None) -> dict:
+    """
+    ユーザー属性分析ページの表を計算する
+
+    Args:
+        dataset: open_dataset() の戻り値
+        spec: filter_spec() の戻り値（None なら全期間・絞り込みなし）
+
+    Returns:
+        dict: 'age_group'（'年齢層'）, 'gender'（'性別'）, 'prefecture'（'地域'）, 'device'（device_breakdown()）。
+            年齢・性別・都道府県の列がないデータでは、前の3つは空のデータフレーム
+    """
+    spec = spec or full_spec(dataset)
+    cube = dataset_table(dataset, 'demographic_cube')
+    report = {
+        attribute: demographics.demographic_breakdown(cube, attribute, spec['start_date'], spec['end_date'], cube_filters(spec)).rename(columns={attribute: label})
+        for attribute, label in ATTRIBUTE_LABELS.items()
+    }
+    report['device'] = device_breakdown(select_events(dataset, spec))
+    return report
@@ -0,0 +1,101 @@
+"""
+フィルター条件（フィルタースペック）
+分析画面の期間・LP・デバイス・新規/リピート・CV/非CV・チャネル・参照元/メディアの選択を正規化した dict にし、
+イベント・セッション・事前集計キューブの絞り込みとキャッシュキーに使う
+"""
+import pandas as pd
+
+from app.analytics.common import ALL_LABEL, filter_events, session_mask
+from app.analytics.dataset import dataset_table
+
+# フィルタースペックのキー（この順でキャッシュキーのタプルになる）
+FILTER_FIELDS = ['start_date', 'end_date', 'lp_url', 'device', 'user_type', 'cv_status', 'channel', 'source_medium']
+# フィルターのキー → セッションテーブル・事前集計キューブの列
+FILTER_COLUMNS = {
+    'lp_url': 'lp_base_url',
+    'device': 'device_type',
+    'user_type': 'user_type',
+    'cv_status': 'conversion_status',
+    'channel': 'channel',
+    'source_medium': 'source_medium',
+}
+
+
+def _date_str(value) -> str:
+    return pd.Timestamp(value).strftime('%Y-%m-%d')
+
+
+def filter_spec(start_date, end_date, lp_url=None, device=ALL_LABEL, user_type=ALL_LABEL, cv_status=ALL_LABEL,
+                channel=ALL_LABEL, source_medium=ALL_LABEL) -> dict:
+    """
+    フィルター条件を正規化する
+
+    Args:
+        start_date, end_date: 期間（両端を含む。date・Timestamp・'YYYY-MM-DD' のいずれでもよい）
+        lp_url: LPのベースURL（None または空文字ならすべてのLP）
+        device, user_type, cv_status, channel, source_medium: 選択値（'すべて' または None なら絞り込まない）
+
+    Returns:
+        dict: FILTER_FIELDS をキーとする dict（日付は 'YYYY-MM-DD'、未選択は lp_url が None、それ以外が 'すべて'）
+    """
+    return {
+        'start_date': _date_str(start_date),
+        'end_date': _date_str(end_date),
+        'lp_url': lp_url or None,
+        'device': device or ALL_LABEL,
+        'user_type': user_type or ALL_LABEL,
+        'cv_status': cv_status or ALL_LABEL,
+        'channel': channel or ALL_LABEL,
+        'source_medium': source_medium or ALL_LABEL,
+    }
+
+
+def full_spec(dataset: dict) -> dict:
+    """データセットの全期間・絞り込みなしのフィルター条件"""
+    dates = dataset['events']['event_date']
+    return filter_spec(dates.min(), dates.max())
+
+
+def period_spec(spec: dict) -> dict:
+    """spec の期間だけを残し、LPなどの絞り込みを外したフィルター条件"""
+    return filter_spec(spec['start_date'], spec['end_date'])
+
+
+def spec_key(spec: dict) -> tuple:
+    """フィルター条件をキャッシュキーとして使えるタプルにする"""
+    return tuple(spec[f] for f in FILTER_FIELDS)
+
+
+def cube_filters(spec: dict) -> dict:
+    """事前集計キューブ・セッションテーブル用の {列名: 値} にする"""
+    return {column: spec[field] for field, column in FILTER_COLUMNS.items()}
+
+
+def select_events(dataset: dict, spec: dict = None) -> pd.DataFrame:
+    """
+    フィルター条件に一致するイベントを取り出す（LPを選んだときはそのLPの行だけを走査する）
+
+    Args:
+        dataset: open_dataset() の戻り値
+        spec: filter_spec() の戻り値（None なら全イベント）
+
+    Returns:
+        pd.DataFrame: 一致するイベント
+    """
+    if spec is None:
+        return dataset['events']
+    return filter_events(dataset['events'], spec['start_date'], spec['end_date'], spec['lp_url'], spec['device'],
+                         spec['user_type'], spec['cv_status'], spec['channel'], spec['source_medium'],
+                         partitions=dataset['partitions'])
+
+
+def select_session_mask(dataset: dict, spec: dict = None):
+    """
+    全データのセッションテーブル（dataset_table(dataset, 'sessions')）のうち、フィルター条件に一致するセッションのマスク
+
+    Returns:
+        np.ndarray: bool の配列
+    """
+    sessions = dataset_table(dataset, 'sessions')
+    spec = spec or full_spec(dataset)
+    return session_mask(sessions, spec['start_date'], spec['end_date'], cube_filters(spec))
@@ -0,0 +1,29 @@
+"""
+フォーム分析の集計
+フォーム行動（開始・進行・送信）をセッション単位にまとめ、スコアカードの指標とページごとの到達率・離脱率を計算する
+"""
+import pandas as pd
+
+from app import form_funnel
+from app.analytics.filters import select_events
+
+
+def form_report(dataset: dict, spec: dict = None) -> dict:
+    """
+    フォーム分析ページの表を計算する
+
+    Args:
+        dataset: open_dataset() の戻り値
+        spec: filter_spec() の戻り値（None なら全期間・絞り込みなし）
+
+    Returns:
+        dict: 'summary'（form_funnel.form_summary() の1行）, 'steps'（form_funnel.form_step_funnel()）。
+            フォームのデータがなければどちらも空のデータフレーム
+    """
+    form = form_funnel.build_form_sessions(select_events(dataset, spec))
+    if form['sessions'].empty:
+        return {'summary': pd.DataFrame(), 'steps': pd.DataFrame()}
+    return {
+        'summary': pd.DataFrame([form_funnel.form_summary(form)]),
+        'steps': form_funnel.form_step_funnel(form),
+    }
@@ -0,0 +1,54 @@
+"""
+インタラクション分析の集計
+インタラクション要素ごとの表示セッション数・クリック率と、インタラクション有無別のCVR（CV貢献度）
+"""
+import pandas as pd
+
+from app import interaction_matrix
+from app.analytics.dataset import dataset_table
+from app.analytics.filters import select_session_mask
+
+
+def interaction_tables(matrix: dict, sessions: pd.DataFrame, mask=None) -> tuple:
+    """
+    インタラクション要素一覧とCV貢献度の表を作る
+
+    Args:
+        matrix: interaction_matrix.build_interaction_matrix() の戻り値（全データ）
+        sessions: 全データのセッションテーブル
+        mask: 集計するセッションのマスク（common.session_mask() の戻り値。None なら全セッション）
+
+    Returns:
+        tuple: (要素一覧, CV貢献度) の DataFrame
+    """
+    stats = interaction_matrix.interaction_stats(matrix, sessions, interaction_matrix.DEFAULT_INTERACTIONS, mask)
+    list_df = pd.DataFrame({
+        'インタラクション要素': stats['interaction'],
+        '表示セッション数': stats['impressions'],
+        'クリック数または視聴完了数': stats['actions'],
+        'クリック率または視聴完了率': stats['action_rate'].fillna(0) * 100,
+    })
+    contribution_df = pd.DataFrame({
+        'インタラクション要素': stats['interaction'],
+        'インタラクション有りCVR (%)': stats['cvr_with'].fillna(0) * 100,
+        'インタラクション無しCVR (%)': stats['cvr_without'].fillna(0) * 100,
+        'CVRリフト率 (%)': stats['lift'].fillna(0) * 100,
+        'p値': stats['p_value'],
+    })
+    return list_df, contribution_df
+
+
+def interaction_report(dataset: dict, spec: dict = None) -> dict:
+    """
+    インタラクション分析ページの表を計算する（全データのセッション × 要素の行列から、一致するセッションだけを集計する）
+
+    Args:
+        dataset: open_dataset() の戻り値
+        spec: filter_spec() の戻り値（None なら全期間・絞り込みなし）
+
+    Returns:
+        dict: 'elements'（要素一覧）, 'contribution'（CV貢献度）
+    """
+    elements, contribution = interaction_tables(dataset_table(dataset, 'interaction_matrix'), dataset_table(dataset, 'sessions'),
+                                                select_session_mask(dataset, spec))
+    return {'elements': elements, 'contribution': contribution}
@@ -0,0 +1,108 @@
+"""
+ページ分析の集計
+ページごとのビュー数・逆行率・離脱率（95%ブートストラップ信頼区間つき）・平均滞在時間
+"""
+import pandas as pd
+
+from app import bootstrap_ci, lp_partitions
+from app.analytics.common import safe_rate
+from app.analytics.filters import select_events
+from app.session_table import build_session_table
+
+
+def page_stats(filtered_df: pd.DataFrame, session_table: pd.DataFrame, actual_page_count: int) -> pd.DataFrame:
+    """
+    ページ別メトリクスを計算する
+
+    Args:
+        filtered_df: フィルター適用済みのイベントデータ
+        session_table: filtered_df のセッションテーブル（max_page_reached 列を含むもの）
+        actual_page_count: LPの実際のページ数（データのないページも0で行を作る）
+
+    Returns:
+        pd.DataFrame: 'ページ番号', 'ビュー数', '逆行率', '離脱率', '離脱率_下限', '離脱率_上限', '平均滞在時間(秒)' など（ページ番号の昇順）
+    """
+    stats = filtered_df.groupby('page_num_dom').agg({
+        'session_id': 'nunique'
+    }).reset_index()
+    stats.rename(columns={'page_num_dom': 'ページ番号', 'session_id': 'ビュー数'}, inplace=True)
+
+    # 逆行回数を計算
+    # セッションごと、ページごとに逆行イベントをカウント
+    backflow_df = filtered_df[filtered_df['direction'] == 'backward']
+    if not backflow_df.empty:
+        # ページごとの逆行イベントが発生したセッションのユニーク数をカウント
+        backflow_counts = backflow_df.groupby('page_num_dom')['session_id'].nunique().reset_index()
+        backflow_counts.rename(columns={'page_num_dom': 'ページ番号', 'session_id': '逆行セッション数'}, inplace=True)
+
+        stats = pd.merge(stats, backflow_counts, on='ページ番号', how='left').fillna(0)
+        stats['逆行率'] = safe_rate(stats['逆行セッション数'], stats['ビュー数']) * 100
+    else:
+        stats['逆行率'] = 0
+
+    # 離脱率計算（LPの実際のページ数を使用）
+    # セッションテーブルの最大到達ページから、離脱率と95%ブートストラップ信頼区間をまとめて計算
+    exit_df = bootstrap_ci.exit_rate_ci(session_table['max_page_reached'], actual_page_count)
+    exit_df = pd.DataFrame({
+        'ページ番号': exit_df['page'],
+        '離脱率': exit_df['estimate'] * 100,
+        '離脱率_下限': exit_df['ci_low'] * 100,
+        '離脱率_上限': exit_df['ci_high'] * 100,
+    })
+    stats = stats.merge(exit_df, on='ページ番号', how='left')
+
+    # 平均滞在時間(秒)を計算して列を追加
+    stay_time_df = filtered_df.groupby('page_num_dom')['stay_ms'].mean().reset_index()
+    stay_time_df.rename(columns={'page_num_dom': 'ページ番号', 'stay_ms': '平均滞在時間(秒)'}, inplace=True)
+    stay_time_df['平均滞在時間(秒)'] /= 1000
+    stats = stats.merge(stay_time_df, on='ページ番号', how='left')
+
+    # データにないページを0で追加
+    missing = [p for p in range(1, actual_page_count + 1) if p not in stats['ページ番号'].values]
+    if missing:
+        new_rows = pd.DataFrame([{
+            'ページ番号': page_num,
+            'ビュー数': 0,
+            '平均逆行回数': 0,
+            '平均滞在時間(秒)': 0,
+            '離脱率': 0,
+            '離脱率_下限': 0,
+            '離脱率_上限': 0
+        } for page_num in missing])
+        stats = pd.concat([stats, new_rows], ignore_index=True)
+
+    # ページ番号でソート
+    return stats.sort_values('ページ番号').reset_index(drop=True)
+
+
+def lp_page_count(dataset: dict, lp_url=None) -> int:
+    """
+    LPの実際のページ数（フィルター前のそのLPのデータの最大ページ番号。フィルターでページ数が減らないようにする）
+
+    Args:
+        dataset: open_dataset() の戻り値
+        lp_url: LPのベースURL（None なら全LP）
+
+    Returns:
+        int: ページ数（データがなければ 1）
+    """
+    lp_df = lp_partitions.select(dataset['events'], dataset['partitions'], lp_url)
+    if lp_df.empty or lp_df['page_num_dom'].isnull().all():
+        return 1
+    return int(lp_df['page_num_dom'].max())
+
+
+def page_report(dataset: dict, spec: dict = None) -> dict:
+    """
+    ページ分析ページの表を計算する
+
+    Args:
+        dataset: open_dataset() の戻り値
+        spec: filter_spec() の戻り値（None なら全期間・絞り込みなし）
+
+    Returns:
+        dict: 'pages'（page_stats()。ページ数は lp_page_count()）
+    """
+    filtered_df = select_events(dataset, spec)
+    page_count = lp_page_count(dataset, spec['lp_url'] if spec else None)
+    return {'pages': page_stats(filtered_df, build_session_table(filtered_df), page_count)}
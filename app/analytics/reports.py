@@ -0,0 +1,96 @@
+"""
+レポートの一覧と実行
+各ページの集計関数を名前で呼べるようにまとめたもの（分析画面のキャッシュ・ローカルAPI・ベンチマークが共通で使う）。
+cached_report() は app.result_cache の共有キャッシュを通して計算し、同じデータセットを見ている他のセッション・プロセスの結果を使い回す
+"""
+from app import profiling
+from app.analytics.ab_test import ab_report
+from app.analytics.ad import attribution_report, ad_report
+from app.analytics.alerts import alerts_report
+from app.analytics.demographics import demographics_report
+from app.analytics.filters import spec_key
+from app.analytics.form import form_report
+from app.analytics.interaction import interaction_report
+from app.analytics.page_analysis import page_report
+from app.analytics.summary import summary_report
+from app.analytics.timeseries import timeseries_report
+from app.analytics.video_scroll import video_scroll_report
+
+# レポート名 → 集計関数（dataset, spec, **options を受け取り {表の名前: DataFrame} を返す）
+REPORTS = {
+    'summary': summary_report,
+    'page': page_report,
+    'ad': ad_report,
+    'attribution': attribution_report,
+    'ab_test': ab_report,
+    'interaction': interaction_report,
+    'video_scroll': video_scroll_report,
+    'timeseries': timeseries_report,
+    'demographics': demographics_report,
+    'alerts': alerts_report,
+    'form': form_report,
+}
+# レポートごとに受け付けるオプション（フィルター以外の引数）
+REPORT_OPTIONS = {
+    'summary': ['kpis'],
+    'ad': ['by'],
+    'attribution': ['dimension'],
+    'video_scroll': ['segment'],
+}
+
+
+def run_report(dataset: dict, name: str, spec: dict = None, **options) -> dict:
+    """
+    レポートを計算する
+
+    Args:
+        dataset: open_dataset() の戻り値
+        name: REPORTS のキー
+        spec: filter_spec() の戻り値（None なら全期間・絞り込みなし）
+        **options: REPORT_OPTIONS に挙げたレポートごとの引数
+
+    Returns:
+        dict: {表の名前: DataFrame}
+    """
+    if name not in REPORTS:
+        raise KeyError(f"未知のレポートです: {name}")
+    unknown = set(options) - set(REPORT_OPTIONS.get(name, []))
+    if unknown:
+        raise ValueError(f"レポート {name} が受け付けないオプションです: {', '.join(sorted(unknown))}")
+    with profiling.stage(f"report:{name}"):
+        return REPORTS[name](dataset, spec, **options)
+
+
+def report_cache_key(dataset: dict, name: str, spec: dict = None, **options) -> tuple:
+    """
+    レポートの共有キャッシュのキー
+
+    Returns:
+        tuple: (データセットのバージョンID, 'report', レポート名, spec_key(spec), オプションを名前順に並べたタプル)
+    """
+    normalized = tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in options.items()))
+    return (dataset['version'], 'report', name, spec_key(spec) if spec is not None else None, normalized)
+
+
+def cached_report(cache, dataset: dict, name: str, spec: dict = None, **options) -> dict:
+    """
+    共有キャッシュにあるレポートを返し、なければ run_report() で計算して保存する
+
+    Args:
+        cache: app.result_cache.ResultCache（None ならキャッシュせずに計算する）
+        dataset, name, spec, **options: run_report() と同じ
+
+    Returns:
+        dict: {表の名前: DataFrame}（キャッシュと共有する DataFrame の浅いコピー。読み取り専用として扱う）
+    """
+    if name not in REPORTS:
+        raise KeyError(f"未知のレポートです: {name}")
+    if cache is None:
+        return run_report(dataset, name, spec, **options)
+
+    def compute():
+        profiling.note_cache_miss()
+        return run_report(dataset, name, spec, **options)
+
+    with profiling.stage('report', cached=True):
+        return cache.get_or_compute(report_cache_key(dataset, name, spec, **options), compute)
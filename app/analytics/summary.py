@@ -0,0 +1,175 @@
+"""
+全体サマリーの集計
+KPIカード（セッション数・CV数・CVR・クリック率・FV残存率など）・日別KPIテーブル・ページパス別の指標
+"""
+import pandas as pd
+
+from app.analytics.common import safe_rate
+from app.analytics.filters import period_spec, select_events
+
+
+def summary_kpis(filtered_df: pd.DataFrame, sessions: pd.DataFrame = None) -> dict:
+    """
+    KPIカードの指標を計算する
+
+    Args:
+        filtered_df: フィルター適用済みのイベントデータ
+        sessions: filtered_df から build_session_table() で作ったセッションテーブル。渡せば件数をその行数・列の合計で求め、
+            イベントデータの session_id の nunique を使わない（結果は同じ）
+
+    Returns:
+        dict: 'sessions', 'conversions', 'conversion_rate'（%）, 'clicks'（クリックしたセッション数）, 'click_rate'（%）,
+            'avg_stay_time'（秒）, 'avg_pages_reached', 'fv_retention_rate'（%）, 'final_cta_rate'（%）, 'avg_load_time'（ms）
+    """
+    if sessions is not None:
+        total_sessions = len(sessions)
+        total_conversions = int(sessions['is_cv'].sum())
+        clicked_sessions = int(sessions['clicked'].sum())
+        fv_sessions = int((sessions['max_page_reached'] >= 2).sum())
+        final_cta_sessions = int((sessions['max_page_reached'] >= 10).sum())
+        avg_pages_reached = sessions['max_page_reached'].mean()
+    else:
+        total_sessions = filtered_df['session_id'].nunique()
+        total_conversions = filtered_df[filtered_df['cv_type'].notna()]['session_id'].nunique()
+        clicked_sessions = filtered_df[filtered_df['event_name'] == 'click']['session_id'].nunique()
+        fv_sessions = filtered_df[filtered_df['max_page_reached'] >= 2]['session_id'].nunique()
+        final_cta_sessions = filtered_df[filtered_df['max_page_reached'] >= 10]['session_id'].nunique()
+        avg_pages_reached = filtered_df.groupby('session_id')['max_page_reached'].max().mean()
+    return {
+        'sessions': total_sessions,
+        'conversions': total_conversions,
+        'conversion_rate': safe_rate(total_conversions, total_sessions) * 100,
+        'clicks': clicked_sessions,
+        'click_rate': (clicked_sessions / total_sessions * 100) if total_sessions > 0 else 0,
+        'avg_stay_time': filtered_df['stay_ms'].mean() / 1000,  # 秒に変換
+        'avg_pages_reached': avg_pages_reached,
+        'fv_retention_rate': (fv_sessions / total_sessions * 100) if total_sessions > 0 else 0,
+        'final_cta_rate': (final_cta_sessions / total_sessions * 100) if total_sessions > 0 else 0,
+        'avg_load_time': filtered_df['load_time_ms'].mean(),
+    }
+
+
+def daily_kpis(filtered_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    日別KPIテーブルを計算する
+
+    Args:
+        filtered_df: フィルター適用済みのイベントデータ
+
+    Returns:
+        pd.DataFrame: '日付', 'セッション数', 'クリック数', '平均滞在時間'（秒）, 'CV数', 'FV残存数', '最終CTA到達数',
+            'CVR', 'CTR', 'FV残存率', '最終CTA到達率'（%）, '平均到達ページ'（日付の降順）
+    """
+    event_day = filtered_df['event_date'].dt.date
+    daily_df = filtered_df.groupby(event_day).agg(
+        セッション数=('session_id', 'nunique'),
+        クリック数=('event_name', lambda x: (x == 'click').sum()),
+        平均滞在時間=('stay_ms', 'mean')
+    ).reset_index()
+    daily_df.rename(columns={'event_date': '日付'}, inplace=True)
+
+    # --- 平均到達ページ数の正しい計算ロジック ---
+    # 日ごと、セッションごとに最大到達ページ数を取得
+    daily_session_max_page = filtered_df.groupby([event_day, 'session_id'])['max_page_reached'].max().reset_index()
+    # 日ごとにその平均を計算
+    daily_avg_pages = daily_session_max_page.groupby('event_date')['max_page_reached'].mean().reset_index()
+    daily_avg_pages.rename(columns={'event_date': '日付', 'max_page_reached': '平均到達ページ'}, inplace=True)
+
+    # 日別コンバージョン数
+    daily_cv = filtered_df[filtered_df['cv_type'].notna()].groupby(event_day)['session_id'].nunique().reset_index()
+    daily_cv.columns = ['日付', 'CV数']
+    daily_df = pd.merge(daily_df, daily_cv, on='日付', how='left').fillna(0)
+
+    # 日別FV残存数
+    daily_fv = filtered_df[filtered_df['max_page_reached'] >= 2].groupby(event_day)['session_id'].nunique().reset_index()
+    daily_fv.columns = ['日付', 'FV残存数']
+    daily_df = pd.merge(daily_df, daily_fv, on='日付', how='left').fillna(0)
+
+    # 日別最終CTA到達数
+    daily_final_cta = filtered_df[filtered_df['max_page_reached'] >= 10].groupby(event_day)['session_id'].nunique().reset_index()
+    daily_final_cta.columns = ['日付', '最終CTA到達数']
+    daily_df = pd.merge(daily_df, daily_final_cta, on='日付', how='left').fillna(0)
+
+    # 率を計算
+    daily_df['CVR'] = safe_rate(daily_df['CV数'], daily_df['セッション数']) * 100
+    daily_df['CTR'] = safe_rate(daily_df['クリック数'], daily_df['セッション数']) * 100
+    daily_df['FV残存率'] = safe_rate(daily_df['FV残存数'], daily_df['セッション数']) * 100
+    daily_df['最終CTA到達率'] = safe_rate(daily_df['最終CTA到達数'], daily_df['セッション数']) * 100
+    daily_df['平均滞在時間'] = daily_df['平均滞在時間'] / 1000
+    # 正しく計算した平均到達ページ数をマージ
+    daily_df = pd.merge(daily_df, daily_avg_pages, on='日付', how='left')
+
+    # 日付を降順にソート
+    return daily_df.sort_values(by='日付', ascending=False)
+
+
+def path_kpis(period_df: pd.DataFrame) -> tuple:
+    """
+    ページパス別の主要指標とインタラクション指標を計算する
+
+    Args:
+        period_df: 期間だけで絞り込んだイベントデータ
+
+    Returns:
+        tuple: (主要指標, インタラクション指標) の DataFrame。どちらも 'ページパス' 列を持つ
+    """
+    path_sessions = period_df.groupby('page_path')['session_id'].nunique()
+    path_users = period_df.groupby('page_path')['user_pseudo_id'].nunique()
+    path_conversions = period_df[period_df['cv_type'].notna()].groupby('page_path')['session_id'].nunique()
+    clicks = period_df[period_df['event_name'] == 'click']
+    kpi_by_path = pd.DataFrame({
+        'セッション数': path_sessions,
+        'CV数': path_conversions,
+        'クリック数': clicks.groupby('page_path').size(),
+        '平均滞在時間': period_df.groupby('page_path')['stay_ms'].mean() / 1000,
+        '平均到達ページ': period_df.groupby('page_path')['max_page_reached'].mean()
+    }).fillna(0)
+    kpi_by_path['CVR'] = safe_rate(kpi_by_path['CV数'], kpi_by_path['セッション数']) * 100
+    kpi_by_path['CTR'] = safe_rate(kpi_by_path['クリック数'], kpi_by_path['セッション数']) * 100
+    # FV残存率・最終CTA到達率
+    fv_sessions = period_df[period_df['max_page_reached'] >= 2].groupby('page_path')['session_id'].nunique()
+    kpi_by_path['FV残存率'] = (safe_rate(fv_sessions, path_sessions) * 100).fillna(0)
+    final_cta_sessions = period_df[period_df['max_page_reached'] >= 10].groupby('page_path')['session_id'].nunique()
+    kpi_by_path['最終CTA到達率'] = (safe_rate(final_cta_sessions, path_sessions) * 100).fillna(0)
+    kpi_by_path = kpi_by_path.reset_index().rename(columns={'page_path': 'ページパス'})
+
+    # CTA・フローティングバナー・離脱防止ポップアップのクリック
+    elem_classes = clicks['elem_classes']
+    interaction_kpis = pd.DataFrame({
+        'セッション数': path_sessions,
+        'ユニークユーザー数': path_users,
+        'CTAクリック数': clicks[elem_classes.str.contains('cta|btn-primary', na=False)].groupby('page_path').size(),
+        'FBクリック数': clicks[elem_classes.str.contains('floating', na=False)].groupby('page_path').size(),
+        '離脱防止POPクリック数': clicks[elem_classes.str.contains('exit', na=False)].groupby('page_path').size(),
+    }).fillna(0)
+    for name in ['CTA', 'FB', '離脱防止POP']:
+        interaction_kpis[f'{name}クリック率'] = safe_rate(interaction_kpis[f'{name}クリック数'], interaction_kpis['セッション数']) * 100
+    interaction_kpis = interaction_kpis.reset_index().rename(columns={'page_path': 'ページパス'})
+    return kpi_by_path, interaction_kpis
+
+
+def summary_report(dataset: dict, spec: dict = None, kpis: bool = True) -> dict:
+    """
+    全体サマリーページの表を計算する
+
+    Args:
+        dataset: open_dataset() の戻り値
+        spec: filter_spec() の戻り値（None なら全期間・絞り込みなし）
+        kpis: False なら 'kpis' を計算しない（呼び出し側がセッションテーブルやスケッチから求める場合。
+            API のクエリ文字列の 'false' / '0' も False とみなす）
+
+    Returns:
+        dict: 'kpis'（summary_kpis() の1行。kpis=False なら None）, 'daily'（daily_kpis()）,
+            'paths', 'path_interactions'（path_kpis()。期間だけで絞り込む）
+    """
+    if isinstance(kpis, str):
+        kpis = kpis.lower() not in ('false', '0', 'no')
+    filtered_df = select_events(dataset, spec)
+    period_df = select_events(dataset, period_spec(spec)) if spec is not None else filtered_df
+    paths, path_interactions = path_kpis(period_df)
+    return {
+        'kpis': pd.DataFrame([summary_kpis(filtered_df)]) if kpis else None,
+        'daily': daily_kpis(filtered_df),
+        'paths': paths,
+        'path_interactions': path_interactions,
+    }
@@ -0,0 +1,81 @@
+"""
+時系列分析の集計
+日別推移と、セッション開始の月・曜日×時間帯ごとの事前集計キューブから読む月間推移・曜日×時間帯CVR
+"""
+import pandas as pd
+
+from app import calendar_cube
+from app.analytics.common import safe_rate
+from app.analytics.dataset import dataset_table
+from app.analytics.filters import cube_filters, full_spec, select_events
+
+
+def daily_trend(filtered_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    日別推移の指標を計算する
+
+    Args:
+        filtered_df: フィルター適用済みのイベントデータ
+
+    Returns:
+        pd.DataFrame: '日付', 'セッション数', '平均滞在時間(秒)', '平均到達ページ数', 'コンバージョン数', 'コンバージョン率',
+            'FV残存率', '最終CTA到達率'（%）など（日付の昇順）
+    """
+    event_day = filtered_df['event_date'].dt.date
+    daily_stats = filtered_df.groupby(event_day).agg({
+        'session_id': 'nunique',
+        'stay_ms': 'mean',
+        'max_page_reached': 'mean'
+    }).reset_index()
+    daily_stats.columns = ['日付', 'セッション数', '平均滞在時間(ms)', '平均到達ページ数']
+    daily_stats['平均滞在時間(秒)'] = daily_stats['平均滞在時間(ms)'] / 1000
+
+    # コンバージョン数・FV残存数・最終CTA到達数を日ごとに数え、セッション数に対する率にする
+    for name, rate_name, mask in [
+        ('コンバージョン数', 'コンバージョン率', filtered_df['cv_type'].notna()),
+        ('FV残存数', 'FV残存率', filtered_df['max_page_reached'] >= 2),
+        ('最終CTA到達数', '最終CTA到達率', filtered_df['max_page_reached'] >= 10),
+    ]:
+        counts = filtered_df[mask].groupby(event_day[mask])['session_id'].nunique().reset_index()
+        counts.columns = ['日付', name]
+        daily_stats = daily_stats.merge(counts, on='日付', how='left').fillna({name: 0})
+        daily_stats[rate_name] = safe_rate(daily_stats[name], daily_stats['セッション数']) * 100
+    return daily_stats
+
+
+def weekday_hour_cvr(cube: dict, spec: dict) -> pd.DataFrame:
+    """
+    曜日×時間帯ごとのセッション数・CV数・CVRを事前集計キューブから集計する
+
+    Returns:
+        pd.DataFrame: 'hour', 'dow_name'（英語の曜日名の順序つきカテゴリ）, 'セッション数', 'コンバージョン数', 'コンバージョン率'
+    """
+    stats = calendar_cube.calendar_breakdown(
+        cube, ['session_weekday', 'session_hour'], spec['start_date'], spec['end_date'], cube_filters(spec)
+    ).rename(columns={'session_hour': 'hour'})
+    stats = stats[['hour', 'session_weekday', 'セッション数', 'コンバージョン数', 'コンバージョン率']]
+    dow_order = calendar_cube.WEEKDAY_NAMES
+    stats.insert(1, 'dow_name', pd.Categorical([dow_order[int(d)] for d in stats['session_weekday']], categories=dow_order, ordered=True))
+    return stats.drop(columns='session_weekday').reset_index(drop=True)
+
+
+def timeseries_report(dataset: dict, spec: dict = None) -> dict:
+    """
+    時系列分析ページの表を計算する
+
+    Args:
+        dataset: open_dataset() の戻り値
+        spec: filter_spec() の戻り値（None なら全期間・絞り込みなし）
+
+    Returns:
+        dict: 'daily'（daily_trend()）, 'monthly'（セッション開始の月ごと。'月' 列つき）, 'weekday_hour'（weekday_hour_cvr()）
+    """
+    spec = spec or full_spec(dataset)
+    cube = dataset_table(dataset, 'hourly_cube')
+    monthly = calendar_cube.calendar_breakdown(cube, 'session_month', spec['start_date'], spec['end_date'], cube_filters(spec))
+    monthly['月'] = [calendar_cube.month_label(m) for m in monthly['session_month']]
+    return {
+        'daily': daily_trend(select_events(dataset, spec)),
+        'monthly': monthly,
+        'weekday_hour': weekday_hour_cvr(cube, spec),
+    }
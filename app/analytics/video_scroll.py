@@ -0,0 +1,62 @@
+"""
+動画・スクロール分析の集計
+動画視聴ファネル・視聴完了とCVRの関係・ページ別スクロール到達率・スクロール率別CVR（95%ブートストラップ信頼区間つき）
+"""
+import numpy as np
+import pandas as pd
+
+from app import bootstrap_ci, depth_funnel
+from app.analytics.dataset import dataset_table
+from app.analytics.filters import select_session_mask
+
+
+def _with_ci(table: pd.DataFrame, conversions, sessions, rate_column: str) -> pd.DataFrame:
+    """率（%）の列に、95%ブートストラップ信頼区間までの上下の幅（'CI上側', 'CI下側'）を追加する"""
+    ci_low, ci_high = bootstrap_ci.rate_ci(conversions, sessions)
+    table['CI上側'] = (ci_high * 100 - table[rate_column]).clip(lower=0)
+    table['CI下側'] = (table[rate_column] - ci_low * 100).clip(lower=0)
+    return table
+
+
+def video_scroll_report(dataset: dict, spec: dict = None, segment: str = None) -> dict:
+    """
+    動画・スクロール分析ページの表を計算する（全データのセッションごとの視聴段階・スクロール率から、一致するセッションだけを集計する）
+
+    Args:
+        dataset: open_dataset() の戻り値
+        spec: filter_spec() の戻り値（None なら全期間・絞り込みなし）
+        segment: 比較するセグメントの列（'device_type', 'channel', 'user_type'。None なら全体）
+
+    Returns:
+        dict: 'video_funnel', 'video_overall'（全体の視聴完了リフト1行）, 'video_lift'（segment 別）,
+            'completion'（視聴完了あり/なしのCVR。信頼区間つき）, 'scroll_reach', 'scroll_range'（スクロール率別CVR。信頼区間つき）
+    """
+    depth = dataset_table(dataset, 'depth_table')
+    sessions = dataset_table(dataset, 'sessions')
+    mask = select_session_mask(dataset, spec)
+
+    video_lift = depth_funnel.video_completion_lift(depth, sessions, mask, segment)
+    completion = pd.DataFrame({
+        'セグメント': np.repeat(video_lift['segment'].to_numpy(), 2),
+        'グループ': np.tile(['視聴完了', '視聴完了なし'], len(video_lift)),
+        'セッション数': np.column_stack([video_lift['completed'], video_lift['exposed'] - video_lift['completed']]).ravel(),
+        'コンバージョン率': np.column_stack([video_lift['cvr_completed'], video_lift['cvr_not_completed']]).ravel() * 100,
+    })
+    completion = _with_ci(completion, (completion['コンバージョン率'].fillna(0) / 100 * completion['セッション数']).round(),
+                          completion['セッション数'], 'コンバージョン率')
+
+    scroll_range = depth_funnel.scroll_range_cvr(depth, sessions, mask, segment).rename(columns={
+        'segment': 'セグメント', 'scroll_range': 'スクロール率', 'sessions': 'セッション数', 'conversions': 'コンバージョン数', 'cvr': 'コンバージョン率',
+    })
+    scroll_range = scroll_range[scroll_range['セッション数'] > 0].copy()
+    scroll_range['コンバージョン率'] = scroll_range['コンバージョン率'] * 100
+    scroll_range = _with_ci(scroll_range, scroll_range['コンバージョン数'], scroll_range['セッション数'], 'コンバージョン率')
+
+    return {
+        'video_funnel': depth_funnel.video_funnel(depth, sessions, mask, segment),
+        'video_overall': depth_funnel.video_completion_lift(depth, sessions, mask),
+        'video_lift': video_lift,
+        'completion': completion,
+        'scroll_reach': depth_funnel.scroll_reach(depth, sessions, mask).rename(columns={'page': 'ページ番号', 'views': '表示数'}),
+        'scroll_range': scroll_range,
+    }
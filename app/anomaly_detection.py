@@ -0,0 +1,358 @@
+"""
+異常検知エンジン
+(デバイス, チャネル, LP, A/Bバリアント) の組み合わせごとの日次系列を作成し、
+曜日季節性を除いたロバストzスコアと変化点検出で、急な変化や急降下をまとめて検知する
+"""
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+ANOMALY_DIMENSIONS = ['device_type', 'channel', 'lp_base_url', 'ab_variant']
+ALL_LABEL = 'すべて'
+
+# MAD を標準偏差に換算する係数
+_MAD_SCALE = 1.4826
+
+
+def build_daily_cube(sessions: pd.DataFrame, dimensions=ANOMALY_DIMENSIONS, max_order: int = None,
+                     min_total_sessions: int = 0) -> dict:
+    """
+    セッションテーブルから、次元の組み合わせごとの日次セッション数・CV数の行列を作成する
+
+    各次元について「値ごと」と「すべて（集約）」の両方を作るため、
+    全体・単一次元・次元の掛け合わせの系列がまとめて得られる。
+
+    Args:
+        sessions: build_session_table() で作成したセッションテーブル
+        dimensions: 系列を分ける次元の列名
+        max_order: 掛け合わせる次元数の上限（None なら全次元）
+        min_total_sessions: 期間合計のセッション数がこれ未満の系列は除外する
+
+    Returns:
+        dict: 'series'（系列ごとの次元値のDataFrame）, 'dates'（日付のDatetimeIndex）,
+              'sessions' / 'conversions'（系列 × 日付 の int 行列）
+    """
+    dimensions = [d for d in dimensions if d in sessions.columns]
+    max_order = len(dimensions) if max_order is None else min(max_order, len(dimensions))
+
+    event_dates = pd.to_datetime(sessions['event_date']).dt.normalize()
+    if event_dates.empty:
+        dates = pd.DatetimeIndex([])
+    else:
+        dates = pd.date_range(event_dates.min(), event_dates.max(), freq='D')
+    n_days = len(dates)
+    day_idx = ((event_dates - dates[0]).dt.days.to_numpy() if n_days else np.zeros(0, dtype=np.int64))
+    is_cv = sessions['is_cv'].to_numpy(dtype=float)
+
+    dim_codes = {}
+    dim_labels = {}
+    for dim in dimensions:
+        codes, labels = pd.factorize(sessions[dim].fillna('(not set)'), sort=True)
+        dim_codes[dim] = codes
+        dim_labels[dim] = labels
+
+    # 値が1種類しかない次元を掛け合わせても、その次元を除いた系列と同じ系列になるだけなので作らない
+    single_valued = {d for d in dimensions if len(dim_labels[d]) <= 1}
+
+    series_frames, session_rows, cv_rows = [], [], []
+    for order in range(0, max_order + 1):
+        for combo in combinations(dimensions, order):
+            if single_valued.intersection(combo):
+                continue
+            if combo:
+                shape = tuple(len(dim_labels[d]) for d in combo)
+                combined = np.ravel_multi_index(tuple(dim_codes[d] for d in combo), shape)
+                keys, inverse = np.unique(combined, return_inverse=True)
+            else:
+                keys, inverse = np.zeros(1, dtype=np.int64), np.zeros(len(sessions), dtype=np.int64)
+            n_series = len(keys)
+            flat = inverse * n_days + day_idx
+            session_mat = np.bincount(flat, minlength=n_series * n_days).reshape(n_series, n_days)
+            cv_mat = np.bincount(flat, weights=is_cv, minlength=n_series * n_days).reshape(n_series, n_days)
+
+            frame = pd.DataFrame({d: ALL_LABEL for d in dimensions}, index=range(n_series))
+            if combo:
+                for dim, codes in zip(combo, np.unravel_index(keys, shape)):
+                    frame[dim] = dim_labels[dim][codes]
+            series_frames.append(frame)
+            session_rows.append(session_mat)
+            cv_rows.append(cv_mat.astype(np.int64))
+
+    series = pd.concat(series_frames, ignore_index=True)
+    session_mat = np.vstack(session_rows) if session_rows else np.zeros((0, n_days), dtype=np.int64)
+    cv_mat = np.vstack(cv_rows) if cv_rows else np.zeros((0, n_days), dtype=np.int64)
+
+    keep = session_mat.sum(axis=1) >= min_total_sessions
+    series = series[keep].reset_index(drop=True)
+    # 系列名は「すべて」以外の次元値を ' / ' でつないだもの（全次元が「すべて」なら「全体」）
+    label = pd.Series('', index=series.index, dtype=object)
+    for dim in dimensions:
+        value = series[dim].astype(str)
+        part = value.where(value != ALL_LABEL, '')
+        label = label.where(part == '', label.where(label == '', label + ' / ') + part)
+    series.insert(0, 'series', label.where(label != '', '全体'))
+    return {
+        'series': series,
+        'dates': dates,
+        'sessions': session_mat[keep],
+        'conversions': cv_mat[keep],
+    }
+
+
+def filter_cube(cube: dict, min_daily_sessions: float) -> dict:
+    """1日平均セッション数が min_daily_sessions 未満の系列をキューブから除く"""
+    keep = cube['sessions'].sum(axis=1) >= min_daily_sessions * len(cube['dates'])
+    return {
+        'series': cube['series'][keep].reset_index(drop=True),
+        'dates': cube['dates'],
+        'sessions': cube['sessions'][keep],
+        'conversions': cube['conversions'][keep],
+    }
+
+
+def weekday_factors(values: np.ndarray, weekdays: np.ndarray, min_obs: int = 2) -> np.ndarray:
+    """
+    系列ごとの曜日係数（曜日の中央値 / 全体の中央値）を計算する
+
+    Args:
+        values: 系列 × 日付 の行列（対象外の日は NaN）
+        weekdays: 日付ごとの曜日番号（0=月曜）
+        min_obs: 係数を推定するのに必要な同じ曜日の日数。足りない場合は 1.0
+
+    Returns:
+        np.ndarray: 系列 × 7 の曜日係数
+    """
+    factors = np.ones((values.shape[0], 7))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        overall = _nanmedian(values)
+        for w in range(7):
+            cols = values[:, weekdays == w]
+            if cols.shape[1] == 0:
+                continue
+            enough = np.sum(~np.isnan(cols), axis=1) >= min_obs
+            factor = _nanmedian(cols) / overall
+            valid = enough & np.isfinite(factor) & (factor > 0)
+            factors[valid, w] = factor[valid]
+    return factors
+
+
+def _nanmedian(values: np.ndarray) -> np.ndarray:
+    """全て NaN の行で警告を出さない行方向の中央値"""
+    out = np.full(values.shape[0], np.nan)
+    has_value = ~np.all(np.isnan(values), axis=1) if values.shape[1] else np.zeros(values.shape[0], dtype=bool)
+    if has_value.any():
+        out[has_value] = np.nanmedian(values[has_value], axis=1)
+    return out
+
+
+def score_latest_day(cube: dict, history: int = 28, target: int = -1) -> pd.DataFrame:
+    """
+    対象日（既定は最新日）のセッション数・CVRを、曜日補正したロバストzスコアで採点する
+
+    セッション数は曜日係数で割った値の過去中央値を基準とし、MAD とポアソン誤差の大きい方を尺度とする。
+    CVR は過去のプール率を基準とし、日次CVRの MAD と当日の二項誤差の大きい方を尺度とする。
+
+    Args:
+        cube: build_daily_cube() の戻り値
+        history: 基準に使う過去日数
+        target: 対象日のインデックス
+
+    Returns:
+        pd.DataFrame: 系列 × 指標（'sessions', 'cvr'）ごとの値・基準値・zスコア・影響度（CV数換算）・
+            検定数（'tests'。1日分なので1）
+    """
+    sessions = cube['sessions'].astype(float)
+    conversions = cube['conversions'].astype(float)
+    dates = cube['dates']
+    n_days = len(dates)
+    target = target % n_days if n_days else 0
+    start = max(0, target - history)
+    if target - start < 2:
+        return pd.DataFrame()
+
+    weekdays = dates.weekday.to_numpy()
+    hist = slice(start, target)
+    hist_sessions = sessions[:, hist]
+    factors = weekday_factors(hist_sessions, weekdays[hist])
+    target_factor = factors[:, weekdays[target]]
+
+    # --- セッション数 ---
+    adjusted = hist_sessions / factors[:, weekdays[hist]]
+    base = _nanmedian(adjusted)
+    mad = _nanmedian(np.abs(adjusted - base[:, None])) * _MAD_SCALE
+    scale = np.maximum(np.maximum(mad, np.sqrt(np.maximum(base, 0))), 1.0)
+    x_t = sessions[:, target]
+    expected_sessions = base * target_factor
+    z_sessions = (x_t / target_factor - base) / scale
+
+    # --- CVR ---
+    hist_cv = conversions[:, hist]
+    total_sessions = hist_sessions.sum(axis=1)
+    p0 = np.divide(hist_cv.sum(axis=1), total_sessions, out=np.zeros(len(total_sessions)), where=total_sessions > 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        daily_rate = np.where(hist_sessions > 0, hist_cv / hist_sessions, np.nan)
+    rate_mad = _nanmedian(np.abs(daily_rate - p0[:, None])) * _MAD_SCALE
+    n_t = sessions[:, target]
+    p_t = np.divide(conversions[:, target], n_t, out=np.zeros(len(n_t)), where=n_t > 0)
+    se_t = np.sqrt(np.divide(p0 * (1 - p0), n_t, out=np.full(len(n_t), np.inf), where=n_t > 0))
+    rate_scale = np.fmax(se_t, rate_mad)
+    z_cvr = np.divide(p_t - p0, rate_scale, out=np.zeros(len(p_t)), where=(rate_scale > 0) & np.isfinite(rate_scale))
+
+    series = cube['series']
+    date = dates[target]
+    frames = [
+        series.assign(metric='sessions', kind='spike', date=date, value=x_t, baseline=expected_sessions,
+                      z=z_sessions, impact_cv=(x_t - expected_sessions) * p0, exposure=n_t, tests=1),
+        series.assign(metric='cvr', kind='spike', date=date, value=p_t, baseline=p0,
+                      z=z_cvr, impact_cv=(p_t - p0) * n_t, exposure=n_t, tests=1),
+    ]
+    return pd.concat(frames, ignore_index=True)
+
+
+def detect_changepoints(cube: dict, min_segment: int = 3) -> pd.DataFrame:
+    """
+    系列ごとに、前後で水準が最も大きく変わる日（単一の変化点）を検出する
+
+    累積和から全ての分割点の前後平均を一度に計算する。
+    CVR は二項比率の差の z 値、セッション数は曜日補正後の平均差を差分系列の MAD で標準化した値を使う。
+
+    Args:
+        cube: build_daily_cube() の戻り値
+        min_segment: 変化点の前後に最低限必要な日数
+
+    Returns:
+        pd.DataFrame: 系列 × 指標ごとの変化点の日付・前後の値・z値・影響度（CV数換算）・
+            検定数（'tests'。z値は全分割点の最大値なので分割点の数）
+    """
+    sessions = cube['sessions'].astype(float)
+    conversions = cube['conversions'].astype(float)
+    dates = cube['dates']
+    n_days = len(dates)
+    if n_days < 2 * min_segment:
+        return pd.DataFrame()
+
+    splits = np.arange(min_segment, n_days - min_segment + 1)
+    rows = np.arange(sessions.shape[0])
+
+    # --- CVR: 分割点 t の前（0..t-1）と後（t..）の二項比率を比較 ---
+    cum_n = np.cumsum(sessions, axis=1)
+    cum_c = np.cumsum(conversions, axis=1)
+    total_n = cum_n[:, -1:]
+    total_c = cum_c[:, -1:]
+    n_before = cum_n[:, splits - 1]
+    c_before = cum_c[:, splits - 1]
+    n_after = total_n - n_before
+    c_after = total_c - c_before
+    with np.errstate(invalid='ignore', divide='ignore'):
+        p_before = c_before / n_before
+        p_after = c_after / n_after
+        p_pool = total_c / total_n
+        se = np.sqrt(p_pool * (1 - p_pool) * (1 / n_before + 1 / n_after))
+        z_cvr = np.where(se > 0, (p_after - p_before) / se, 0.0)
+    z_cvr = np.nan_to_num(z_cvr)
+    best_cvr = np.argmax(np.abs(z_cvr), axis=1)
+
+    # --- セッション数: 曜日補正後の日次値の平均差 ---
+    factors = weekday_factors(sessions, dates.weekday.to_numpy())
+    adjusted = sessions / factors[:, dates.weekday.to_numpy()]
+    cum_x = np.cumsum(adjusted, axis=1)
+    mean_before = cum_x[:, splits - 1] / splits
+    mean_after = (cum_x[:, -1:] - cum_x[:, splits - 1]) / (n_days - splits)
+    # 差分系列の MAD は水準シフトの影響を受けにくい
+    diff_sigma = _nanmedian(np.abs(np.diff(adjusted, axis=1) - _nanmedian(np.diff(adjusted, axis=1))[:, None]))
+    sigma = np.maximum(diff_sigma * _MAD_SCALE / np.sqrt(2), np.sqrt(np.maximum(_nanmedian(adjusted), 1.0)))
+    z_sessions = (mean_after - mean_before) / (sigma[:, None] * np.sqrt(1 / splits + 1 / (n_days - splits)))
+    best_sessions = np.argmax(np.abs(z_sessions), axis=1)
+
+    series = cube['series']
+    cvr_split = splits[best_cvr]
+    ses_split = splits[best_sessions]
+    cvr_before = p_before[rows, best_cvr]
+    cvr_after = p_after[rows, best_cvr]
+    ses_before = mean_before[rows, best_sessions]
+    ses_after = mean_after[rows, best_sessions]
+    frames = [
+        series.assign(metric='sessions', kind='changepoint', date=dates[ses_split], value=ses_after,
+                      baseline=ses_before, z=z_sessions[rows, best_sessions],
+                      impact_cv=(ses_after - ses_before) * (n_days - ses_split) * np.nan_to_num(p_pool[:, 0]),
+                      exposure=total_n[:, 0] - cum_n[rows, ses_split - 1], tests=len(splits)),
+        series.assign(metric='cvr', kind='changepoint', date=dates[cvr_split], value=cvr_after,
+                      baseline=cvr_before, z=z_cvr[rows, best_cvr],
+                      impact_cv=np.nan_to_num((cvr_after - cvr_before) * n_after[rows, best_cvr]),
+                      exposure=n_after[rows, best_cvr], tests=len(splits)),
+    ]
+    return pd.concat(frames, ignore_index=True)
+
+
+def rank_anomalies(results: pd.DataFrame, z_threshold: float = 3.0, changepoint_z: float = 4.0,
+                   high_z: float = 5.0, min_change: float = 0.2, high_change: float = 0.5,
+                   family_alpha: float = 0.05) -> pd.DataFrame:
+    """
+    score_latest_day() / detect_changepoints() の採点結果から異常を抽出し、影響度順に並べる
+
+    数千の系列（変化点はさらに全分割点）を同時に検定するため、種類・指標ごとの検定数
+    （系列数 × 'tests'）で Bonferroni 補正した |z| の下限も満たすものだけを残す。
+    影響度（変化量 × 件数）で並べる前に有意性で絞るので、小さな系列の偶然の変化点が上位に来にくい。
+
+    Args:
+        results: 採点結果（複数を連結したものでも可）
+        z_threshold: 最新日の値を異常とみなす |z| の下限
+        changepoint_z: 変化点とみなす |z| の下限（全分割点の最大値を取るため最新日より高くする）
+        high_z: 重要度：高 とみなす |z| の下限
+        min_change: 基準値からの相対変化率の下限（統計的に有意でも小さな変化は除外する）
+        high_change: この相対変化率以上の場合も重要度：高 とする
+        family_alpha: 種類・指標ごとの検定全体での有意水準（両側。Bonferroni 補正に使う）
+
+    Returns:
+        pd.DataFrame: 採点結果の列に 'change', 'direction', 'level' を加えたもの。
+            影響度（CV数換算）の絶対値が大きい順
+    """
+    if results.empty:
+        return results
+    results = results.copy()
+    results['change'] = np.divide(results['value'] - results['baseline'], results['baseline'],
+                                  out=np.zeros(len(results)), where=results['baseline'].to_numpy() > 0)
+    threshold = np.where(results['kind'] == 'changepoint', changepoint_z, z_threshold)
+    tests = results['tests'] if 'tests' in results.columns else pd.Series(1, index=results.index)
+    family_size = tests.groupby([results['kind'], results['metric']]).transform('sum').to_numpy(dtype=float)
+    threshold = np.maximum(threshold, norm.isf(family_alpha / (2 * np.maximum(family_size, 1))))
+    flagged = (results['z'].abs() >= threshold) & (results['change'].abs() >= min_change)
+    results = results[flagged].copy()
+    results['direction'] = np.where(results['z'] < 0, 'down', 'up')
+    is_high = (results['z'].abs() >= high_z) | (results['change'].abs() >= high_change)
+    results['level'] = np.where(is_high, 'high', 'medium')
+    results['_rank'] = results['impact_cv'].abs()
+    return results.sort_values('_rank', ascending=False).drop(columns='_rank').reset_index(drop=True)
+
+
+def detect_anomalies(sessions: pd.DataFrame, dimensions=ANOMALY_DIMENSIONS, history: int = 28,
+                     min_daily_sessions: float = 20, min_segment: int = 3, max_order: int = None,
+                     **thresholds) -> pd.DataFrame:
+    """
+    全セグメント系列について最新日の異常と変化点を検出し、影響度順に並べる
+
+    Args:
+        sessions: build_session_table() で作成したセッションテーブル
+        dimensions: 系列を分ける次元の列名
+        history: 最新日の基準に使う過去日数
+        min_daily_sessions: 1日平均セッション数がこれ未満の系列は対象外
+        min_segment: 変化点の前後に最低限必要な日数
+        max_order: 掛け合わせる次元数の上限
+        **thresholds: rank_anomalies() の閾値
+
+    Returns:
+        pd.DataFrame: 'series', 各次元, 'metric', 'kind', 'date', 'value', 'baseline', 'change',
+            'z', 'impact_cv', 'exposure', 'tests', 'direction', 'level'。影響度（CV数換算）の絶対値が大きい順
+    """
+    if sessions.empty:
+        return pd.DataFrame()
+    cube = filter_cube(build_daily_cube(sessions, dimensions, max_order=max_order), min_daily_sessions)
+    if len(cube['dates']) == 0:
+        return pd.DataFrame()
+    results = pd.concat([
+        score_latest_day(cube, history=history),
+        detect_changepoints(cube, min_segment=min_segment),
+    ], ignore_index=True)
+    return rank_anomalies(results, **thresholds)
@@ -0,0 +1,194 @@
+"""
+マルチタッチアトリビューションエンジン
+同じ user_pseudo_id の複数セッションを時系列に並べてタッチポイント列（ジャーニー）を作り、
+ファーストタッチ・ラストタッチ・線形・時間減衰・マルコフ連鎖（除去効果）の各モデルで
+チャネル・参照元・キャンペーンにCVを配分する。
+全ユーザーをまとめてソートした配列上で計算するため、ユーザーごとのループは使わない
+"""
+import numpy as np
+import pandas as pd
+
+ATTRIBUTION_MODELS = {
+    'first_touch': 'ファーストタッチ',
+    'last_touch': 'ラストタッチ',
+    'linear': '線形',
+    'time_decay': '時間減衰',
+    'markov': 'マルコフ連鎖',
+}
+
+DEFAULT_HALF_LIFE_DAYS = 7
+DEFAULT_LOOKBACK_DAYS = 30
+NOT_SET = '(not set)'
+
+
+def build_touchpoints(sessions: pd.DataFrame, dimension: str = 'channel',
+                      lookback_days: float = DEFAULT_LOOKBACK_DAYS) -> pd.DataFrame:
+    """
+    セッションテーブルからユーザーごとのタッチポイント列を作成する
+
+    ユーザー内をセッション開始時刻でソートし、CVのたびにジャーニーを区切る。
+    CVしたセッションまでのタッチ（lookback_days 以内）がそのCVのジャーニーになり、
+    最後のCV以降のセッションは「CVしなかったジャーニー」として残す（マルコフ連鎖で使用）。
+
+    Args:
+        sessions: build_session_table() で作成したセッションテーブル
+        dimension: タッチポイントとして扱う列（'channel', 'utm_source', 'utm_campaign' など）
+        lookback_days: CVからさかのぼってタッチとみなす日数
+
+    Returns:
+        pd.DataFrame: 'journey', 'touch'（タッチポイントの値）, 'position', 'length',
+            'days_before_cv', 'converted'（ジャーニーがCVで終わったか）, 'cv_value'（ジャーニーのCV価値）
+    """
+    user_codes, _ = pd.factorize(sessions['user_pseudo_id'])
+    starts = pd.to_datetime(sessions['session_start']).to_numpy(dtype='datetime64[s]').astype(np.int64)
+    order = np.lexsort((starts, user_codes))
+    user_codes = user_codes[order]
+    starts = starts[order]
+    is_cv = sessions['is_cv'].to_numpy(dtype=bool)[order]
+    cv_value = np.nan_to_num(sessions['cv_value'].to_numpy(dtype=float)[order]) if 'cv_value' in sessions.columns else np.zeros(len(order))
+    touches = sessions[dimension].fillna(NOT_SET).astype(str).to_numpy()[order]
+    n = len(order)
+    if n == 0:
+        return pd.DataFrame(columns=['journey', 'touch', 'position', 'length', 'days_before_cv', 'converted', 'cv_value'])
+
+    # ジャーニー番号: ユーザーが変わる位置と、直前のセッションがCVだった位置で区切る
+    new_journey = np.ones(n, dtype=bool)
+    new_journey[1:] = (user_codes[1:] != user_codes[:-1]) | is_cv[:-1]
+    journey = np.cumsum(new_journey) - 1
+
+    # ジャーニーの最後のセッションの時刻とCV有無
+    last_index = np.r_[np.flatnonzero(new_journey)[1:] - 1, n - 1]
+    converted = is_cv[last_index]
+    end_time = starts[last_index]
+    days_before_cv = (end_time[journey] - starts) / 86400
+
+    # CVジャーニーでは lookback_days より古いタッチを除く
+    keep = ~converted[journey] | (days_before_cv <= lookback_days)
+    journey, touches, days_before_cv = journey[keep], touches[keep], days_before_cv[keep]
+    journey_start = np.flatnonzero(np.r_[True, journey[1:] != journey[:-1]])
+    lengths = np.diff(np.r_[journey_start, len(journey)])
+    position = np.arange(len(journey)) - np.repeat(journey_start, lengths)
+
+    # ジャーニー番号を詰め直す（除外で空になったジャーニーは存在しない：CVセッション自身は必ず残る）
+    journey_ids = journey[journey_start]
+    compact = np.repeat(np.arange(len(journey_start)), lengths)
+    return pd.DataFrame({
+        'journey': compact,
+        'touch': touches,
+        'position': position,
+        'length': np.repeat(lengths, lengths),
+        'days_before_cv': days_before_cv,
+        'converted': np.repeat(converted[journey_ids], lengths),
+        'cv_value': np.repeat(cv_value[last_index][journey_ids], lengths),
+    })
+
+
+def heuristic_weights(touchpoints: pd.DataFrame, half_life_days: float = DEFAULT_HALF_LIFE_DAYS) -> pd.DataFrame:
+    """
+    CVジャーニーの各タッチに対するルールベースモデルの配分比率（ジャーニー内で合計1）を計算する
+
+    Args:
+        touchpoints: build_touchpoints() の戻り値
+        half_life_days: 時間減衰モデルの半減期（日）
+
+    Returns:
+        pd.DataFrame: CVジャーニーのタッチに 'first_touch', 'last_touch', 'linear', 'time_decay' 列を加えたもの
+    """
+    tp = touchpoints[touchpoints['converted']].copy()
+    tp['first_touch'] = (tp['position'] == 0).astype(float)
+    tp['last_touch'] = (tp['position'] == tp['length'] - 1).astype(float)
+    tp['linear'] = 1.0 / tp['length']
+    decay = np.power(0.5, tp['days_before_cv'].to_numpy() / half_life_days)
+    journey = tp['journey'].to_numpy()
+    totals = np.bincount(journey, weights=decay, minlength=int(journey.max()) + 1 if len(journey) else 0)
+    tp['time_decay'] = decay / totals[journey] if len(journey) else decay
+    return tp
+
+
+def markov_removal_effects(touchpoints: pd.DataFrame) -> pd.Series:
+    """
+    1次マルコフ連鎖の除去効果（そのタッチを除いたときにCV確率がどれだけ下がるか）を計算する
+
+    状態は 開始・各タッチ・CV・非CV。遷移数は隣接するタッチの組を bincount で数え、
+    CV確率は吸収マルコフ連鎖の連立方程式を解いて求める。
+
+    Args:
+        touchpoints: build_touchpoints() の戻り値（CVしなかったジャーニーも含む）
+
+    Returns:
+        pd.Series: タッチごとの除去効果（0〜1）
+    """
+    if touchpoints.empty:
+        return pd.Series(dtype=float)
+    touch_codes, labels = pd.factorize(touchpoints['touch'], sort=True)
+    k = len(labels)
+    start, conv, null = k, k + 1, k + 2
+    size = k + 3
+
+    journey = touchpoints['journey'].to_numpy()
+    position = touchpoints['position'].to_numpy()
+    is_last = position == touchpoints['length'].to_numpy() - 1
+    converted = touchpoints['converted'].to_numpy()
+
+    # 開始 -> 最初のタッチ、タッチ -> 次のタッチ、最後のタッチ -> CV/非CV
+    src = np.r_[np.full(int((position == 0).sum()), start), touch_codes[:-1][journey[1:] == journey[:-1]], touch_codes[is_last]]
+    dst = np.r_[touch_codes[position == 0], touch_codes[1:][journey[1:] == journey[:-1]], np.where(converted[is_last], conv, null)]
+    counts = np.bincount(src * size + dst, minlength=size * size).reshape(size, size).astype(float)
+
+    def conversion_probability(matrix):
+        totals = matrix.sum(axis=1, keepdims=True)
+        probs = np.divide(matrix, totals, out=np.zeros_like(matrix), where=totals > 0)
+        transient = list(range(k + 1))  # 各タッチ + 開始
+        q = probs[np.ix_(transient, transient)]
+        r = probs[transient, conv]
+        solution = np.linalg.lstsq(np.eye(len(transient)) - q, r, rcond=None)[0]
+        return solution[start]
+
+    base = conversion_probability(counts)
+    effects = np.zeros(k)
+    if base > 0:
+        for i in range(k):
+            removed = counts.copy()
+            # タッチ i に入った遷移はすべて非CVに吸収されるものとみなす
+            removed[:, null] += removed[:, i]
+            removed[:, i] = 0
+            removed[i, :] = 0
+            effects[i] = max(0.0, 1 - conversion_probability(removed) / base)
+    return pd.Series(effects, index=labels)
+
+
+def attribute(sessions: pd.DataFrame, dimension: str = 'channel', half_life_days: float = DEFAULT_HALF_LIFE_DAYS,
+              lookback_days: float = DEFAULT_LOOKBACK_DAYS) -> pd.DataFrame:
+    """
+    各アトリビューションモデルでCV数とCV価値をタッチポイントの値に配分する
+
+    Args:
+        sessions: build_session_table() で作成したセッションテーブル
+        dimension: 配分先の列（'channel', 'utm_source', 'utm_campaign' など）
+        half_life_days: 時間減衰モデルの半減期（日）
+        lookback_days: CVからさかのぼってタッチとみなす日数
+
+    Returns:
+        pd.DataFrame: 行がタッチの値、列が (指標, モデル) の配分結果。
+            指標は 'conversions'（配分CV数）と 'value'（配分CV価値）、モデルは ATTRIBUTION_MODELS のキー
+    """
+    touchpoints = build_touchpoints(sessions, dimension, lookback_days)
+    weights = heuristic_weights(touchpoints, half_life_days)
+    models = ['first_touch', 'last_touch', 'linear', 'time_decay']
+    conversions = weights.groupby('touch')[models].sum()
+    values = weights[models].mul(weights['cv_value'], axis=0).groupby(weights['touch']).sum()
+
+    # マルコフ連鎖: 除去効果の比率で総CV数・総CV価値を配分する
+    effects = markov_removal_effects(touchpoints)
+    total_cv = weights['first_touch'].sum()
+    total_value = (weights['first_touch'] * weights['cv_value']).sum()
+    share = effects / effects.sum() if effects.sum() > 0 else effects * 0
+    index = conversions.index.union(share.index)
+    conversions = conversions.reindex(index, fill_value=0.0)
+    values = values.reindex(index, fill_value=0.0)
+    conversions['markov'] = share.reindex(index, fill_value=0.0) * total_cv
+    values['markov'] = share.reindex(index, fill_value=0.0) * total_value
+
+    result = pd.concat({'conversions': conversions, 'value': values}, axis=1)
+    result.index.name = dimension
+    return result.sort_values(('conversions', 'last_touch'), ascending=False)
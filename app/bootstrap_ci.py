@@ -0,0 +1,256 @@
+"""
+ブートストラップ信頼区間エンジン
+セッション単位の指標（CVR、クリック率、平均滞在時間など）について、
+イベントではなくセッションを再抽出するブートストラップで信頼区間を計算する
+"""
+import numpy as np
+import pandas as pd
+
+DEFAULT_N_BOOT = 2000
+DEFAULT_ALPHA = 0.05
+# 1チャンクで展開する (レプリケート数 × セッション数) の上限。メモリ使用量を抑えるため
+_MAX_CHUNK_ELEMENTS = 4_000_000
+
+# 指標名 -> (分子の列, 分母の列, 種別)
+#   rate : 0/1 のセッションフラグの平均（二項分布で厳密に再抽出できる）
+#   ratio: セッション合計の比（分母列が None の場合はセッション数。滞在時間は stay_ms のあるイベント数で割る）
+SESSION_METRICS = {
+    'cvr': ('is_cv', None, 'rate'),
+    'click_rate': ('clicked', None, 'rate'),
+    'fv_retention': ('fv_retained', None, 'rate'),
+    'avg_stay_sec': ('stay_sec_sum', 'stay_ms_count', 'ratio'),
+    'avg_pages': ('max_page_reached', None, 'ratio'),
+}
+
+
+def rate_ci(successes, trials, n_boot: int = DEFAULT_N_BOOT, alpha: float = DEFAULT_ALPHA, seed: int = 0):
+    """
+    0/1 フラグの平均（率）のブートストラップ信頼区間をグループごとに計算する
+
+    n 件のセッションを多項分布の重みで再抽出したときの成功数は Binomial(n, p̂) に従うため、
+    セッション配列を展開せずに二項乱数だけで同じ分布を得られる。
+
+    Args:
+        successes: グループごとの成功セッション数
+        trials: グループごとのセッション数
+        n_boot: レプリケート数
+        alpha: 有意水準（0.05 なら95%区間）
+        seed: 乱数シード
+
+    Returns:
+        (ci_low, ci_high): 率（0〜1）の下限・上限の配列（trials が0のグループは NaN）
+    """
+    successes = np.asarray(successes, dtype=np.int64)
+    trials = np.asarray(trials, dtype=np.int64)
+    p_hat = np.divide(successes, trials, out=np.zeros(len(trials)), where=trials > 0)
+    rng = np.random.default_rng(seed)
+    draws = rng.binomial(trials, p_hat, size=(n_boot, len(trials)))
+    rates = np.divide(draws, trials, out=np.zeros(draws.shape), where=trials > 0)
+    low, high = np.quantile(rates, [alpha / 2, 1 - alpha / 2], axis=0)
+    # セッションのないグループは率が定義されないので区間も NaN
+    return np.where(trials > 0, low, np.nan), np.where(trials > 0, high, np.nan)
+
+
+def _poisson_thresholds(levels: int = 1 << 16) -> np.ndarray:
+    """Poisson(1) の累積分布を levels 段階に量子化したしきい値（一様な整数 u に対し、u 以下のしきい値の個数が重みになる）"""
+    thresholds, cdf, pmf, k = [], 0.0, np.exp(-1.0), 0
+    while True:
+        cdf += pmf
+        threshold = int(round(cdf * levels))
+        if threshold >= levels:
+            return np.array(thresholds, dtype=np.uint16)
+        thresholds.append(threshold)
+        k += 1
+        pmf /= k
+
+
+# 16ビットの一様乱数を Poisson(1) の重みに変換するしきい値（量子化の誤差は各確率で 2^-16 以下）
+_POISSON_THRESHOLDS = _poisson_thresholds()
+# このしきい値までは全要素で比較し、それより大きい重み（全体の約0.4%）は該当する要素だけで数える
+_DENSE_THRESHOLDS = 4
+# セッション数がこれ未満のグループは Poisson 重みではなく多項分布（復元抽出）で再抽出する
+_MULTINOMIAL_MAX_SESSIONS = 200
+
+
+def _poisson_weights(rng: np.random.Generator, out: np.ndarray):
+    """out（float32 の2次元配列）に独立な Poisson(1) の重みを書き込む"""
+    size = out.size
+    # 64ビットの一様乱数を16ビットずつに分けて使う（全範囲の整数は棄却なしで生成できる）
+    u = rng.integers(0, np.iinfo(np.uint64).max, (size + 3) // 4, dtype=np.uint64, endpoint=True).view(np.uint16)[:size]
+    counts = np.zeros(size, dtype=np.uint8)
+    hit = np.empty(size, dtype=bool)
+    for threshold in _POISSON_THRESHOLDS[:_DENSE_THRESHOLDS]:
+        np.greater_equal(u, threshold, out=hit)
+        np.add(counts, hit, out=counts, casting='unsafe')
+    tail = np.flatnonzero(u >= _POISSON_THRESHOLDS[_DENSE_THRESHOLDS])
+    if len(tail):
+        counts[tail] += np.searchsorted(_POISSON_THRESHOLDS[_DENSE_THRESHOLDS:], u[tail], side='right').astype(np.uint8)
+    np.copyto(out, counts.reshape(out.shape))
+
+
+def _replicate_sums(numerator, denominator, group_codes, n_groups, n_boot, seed):
+    """
+    レプリケートごとの分子・分母合計を返す（Poisson ブートストラップ）
+
+    各セッションの再抽出回数を、多項分布の代わりに独立な Poisson(1) の重みで表す（セッション数が多いときの
+    多項分布の重みの極限で、グループをまたいで独立に生成できる）。重みは16ビットの一様乱数としきい値の比較で作り、
+    (レプリケート × セッション) の重み行列とグループ内の分子・分母の行列積でまとめて合計する。
+    Poisson 重みでは再抽出の件数がレプリケートごとに変わり、小さなグループでは区間が広がるため、
+    _MULTINOMIAL_MAX_SESSIONS 未満のグループはセッションを復元抽出する多項ブートストラップで合計する。
+    """
+    order = np.argsort(group_codes, kind='stable')
+    values = np.column_stack([numerator[order], denominator[order]]).astype(np.float32)
+    counts = np.bincount(group_codes, minlength=n_groups)
+    bounds = np.concatenate(([0], np.cumsum(counts)))
+    small = np.flatnonzero((counts > 0) & (counts < _MULTINOMIAL_MAX_SESSIONS))
+    large = np.flatnonzero(counts >= _MULTINOMIAL_MAX_SESSIONS)
+
+    rng = np.random.default_rng(seed)
+    sums = np.zeros((n_boot, n_groups, 2))
+    for g in small:
+        group_values = values[bounds[g]:bounds[g + 1]]
+        sums[:, g] = group_values[rng.integers(0, counts[g], (n_boot, counts[g]))].sum(axis=1)
+
+    if len(large):
+        # 大きなグループのセッションだけを詰めて重み行列の列にする
+        columns = np.concatenate([np.arange(bounds[g], bounds[g + 1]) for g in large])
+        large_values = values[columns]
+        large_bounds = np.concatenate(([0], np.cumsum(counts[large])))
+        n_total = len(columns)
+        chunk = max(1, _MAX_CHUNK_ELEMENTS // n_total)
+        weights = np.empty((min(chunk, n_boot), n_total), dtype=np.float32)
+        for b0 in range(0, n_boot, chunk):
+            b = min(chunk, n_boot - b0)
+            w = weights[:b]
+            _poisson_weights(rng, w)
+            for k, g in enumerate(large):
+                lo, hi = large_bounds[k], large_bounds[k + 1]
+                sums[b0:b0 + b, g] = w[:, lo:hi] @ large_values[lo:hi]
+    return sums[..., 0], sums[..., 1]
+
+
+def ratio_ci(numerator, denominator=None, group_codes=None, n_groups: int = None,
+             n_boot: int = DEFAULT_N_BOOT, alpha: float = DEFAULT_ALPHA, seed: int = 0):
+    """
+    セッション合計の比 sum(分子) / sum(分母) のブートストラップ信頼区間を計算する
+
+    Args:
+        numerator: セッションごとの分子の配列
+        denominator: セッションごとの分母の配列（None ならセッション数 = 平均）
+        group_codes: セッションごとのグループ番号（0始まり）。None なら全体で1グループ
+        n_groups: グループ数
+        n_boot: レプリケート数
+        alpha: 有意水準
+        seed: 乱数シード
+
+    Returns:
+        (estimate, ci_low, ci_high): グループごとの推定値と下限・上限の配列（分母の合計が0のグループは NaN）
+    """
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.ones_like(numerator) if denominator is None else np.asarray(denominator, dtype=np.float64)
+    if group_codes is None:
+        group_codes = np.zeros(len(numerator), dtype=np.int64)
+        n_groups = 1
+    group_codes = np.asarray(group_codes, dtype=np.int64)
+    if n_groups is None:
+        n_groups = int(group_codes.max()) + 1 if len(group_codes) else 0
+
+    num_total = np.bincount(group_codes, weights=numerator, minlength=n_groups)
+    den_total = np.bincount(group_codes, weights=denominator, minlength=n_groups)
+    estimate = np.divide(num_total, den_total, out=np.full(n_groups, np.nan), where=den_total > 0)
+    if len(numerator) == 0:
+        return estimate, estimate.copy(), estimate.copy()
+
+    num_rep, den_rep = _replicate_sums(numerator, denominator, group_codes, n_groups, n_boot, seed)
+    # 分母が0のレプリケート（小さなグループで全セッションの重みが0など）は除く。推定値のないグループの区間は NaN
+    ratios = np.divide(num_rep, den_rep, out=np.full(num_rep.shape, np.nan), where=den_rep > 0)
+    low, high = np.full(n_groups, np.nan), np.full(n_groups, np.nan)
+    defined = np.flatnonzero(np.isfinite(estimate))
+    if len(defined):
+        low[defined], high[defined] = np.nanquantile(ratios[:, defined], [alpha / 2, 1 - alpha / 2], axis=0)
+    return estimate, low, high
+
+
+def _metric_columns(sessions: pd.DataFrame, metric: str):
+    """指標名からセッションテーブル上の分子・分母配列を取り出す"""
+    if metric not in SESSION_METRICS:
+        raise ValueError(f"未対応の指標です: {metric}")
+    num_col, den_col, kind = SESSION_METRICS[metric]
+    if num_col == 'fv_retained':
+        numerator = (sessions['max_page_reached'] >= 2).to_numpy()
+    elif num_col == 'stay_sec_sum':
+        numerator = sessions['stay_ms_sum'].to_numpy(dtype=float) / 1000
+    else:
+        numerator = sessions[num_col].to_numpy()
+    denominator = sessions[den_col].to_numpy(dtype=float) if den_col else None
+    return numerator, denominator, kind
+
+
+def grouped_ci(sessions: pd.DataFrame, metric: str, by: str = None, n_boot: int = DEFAULT_N_BOOT,
+               alpha: float = DEFAULT_ALPHA, seed: int = 0) -> pd.DataFrame:
+    """
+    セッションテーブルから指標の推定値と信頼区間をグループ別に計算する
+
+    Args:
+        sessions: build_session_table() で作成したセッションテーブル
+        metric: SESSION_METRICS のキー（'cvr', 'click_rate', 'fv_retention', 'avg_stay_sec', 'avg_pages'）
+        by: グループ化する列名（'event_date', 'channel' など）。None なら全体
+        n_boot, alpha, seed: ratio_ci() / rate_ci() を参照
+
+    Returns:
+        pd.DataFrame: [by,] 'sessions', 'estimate', 'ci_low', 'ci_high'
+            率の指標は 0〜1 のまま返す（表示側で100倍する）
+    """
+    if by is None:
+        group_codes = np.zeros(len(sessions), dtype=np.int64)
+        labels = None
+    else:
+        group_codes, labels = pd.factorize(sessions[by], sort=True)
+        # 欠損値（-1）は集計対象外
+        valid = group_codes >= 0
+        sessions = sessions[valid]
+        group_codes = group_codes[valid]
+    n_groups = 1 if labels is None else len(labels)
+
+    numerator, denominator, kind = _metric_columns(sessions, metric)
+    session_counts = np.bincount(group_codes, minlength=n_groups)
+    if kind == 'rate':
+        successes = np.bincount(group_codes, weights=numerator.astype(float), minlength=n_groups)
+        estimate = np.divide(successes, session_counts, out=np.full(n_groups, np.nan), where=session_counts > 0)
+        low, high = rate_ci(successes, session_counts, n_boot=n_boot, alpha=alpha, seed=seed)
+    else:
+        estimate, low, high = ratio_ci(numerator, denominator, group_codes, n_groups,
+                                       n_boot=n_boot, alpha=alpha, seed=seed)
+
+    result = pd.DataFrame({'sessions': session_counts, 'estimate': estimate, 'ci_low': low, 'ci_high': high})
+    if labels is not None:
+        result.insert(0, by, labels)
+    return result
+
+
+def exit_rate_ci(max_page_reached, page_count: int, n_boot: int = DEFAULT_N_BOOT,
+                 alpha: float = DEFAULT_ALPHA, seed: int = 0) -> pd.DataFrame:
+    """
+    ページ別離脱率（そのページで終わったセッション / そのページに到達したセッション）の信頼区間
+
+    Args:
+        max_page_reached: セッションごとの最大到達ページの配列
+        page_count: LPのページ数
+
+    Returns:
+        pd.DataFrame: 'page', 'reached', 'exited', 'estimate', 'ci_low', 'ci_high'
+    """
+    max_pages = np.clip(np.asarray(max_page_reached, dtype=np.int64), 0, page_count)
+    exited = np.bincount(max_pages, minlength=page_count + 1)[1:page_count + 1]
+    # 到達数は「そのページ以降で終わったセッション数」の累積和（後ろから）
+    reached = np.cumsum(exited[::-1])[::-1]
+    estimate = np.divide(exited, reached, out=np.zeros(page_count), where=reached > 0)
+    low, high = rate_ci(exited, reached, n_boot=n_boot, alpha=alpha, seed=seed)
+    return pd.DataFrame({
+        'page': np.arange(1, page_count + 1),
+        'reached': reached,
+        'exited': exited,
+        'estimate': estimate,
+        'ci_low': low,
+        'ci_high': high,
+    })
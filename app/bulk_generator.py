@@ -0,0 +1,613 @@
+"""
+高速なダミーデータ一括生成エンジン
+generate_dummy_data() と同じ行動モデル（SCENARIO_CONFIGS / DEFAULT_CONFIG）と、研修用の「好調・普通・不調」シナリオを、
+1日分のセッションをまとめて配列で抽選する方式で生成する。
+イベントごとの Python ループや確率ベクトル付きの np.random.choice を使わず、
+カテゴリ列は日ごとに一括抽選し、文字列はセッション・ページ単位の表から参照する。
+出力は両方の旧ジェネレーターの列を合わせた共通スキーマ（BULK_SCHEMA）で、列の型は常に同じになる
+"""
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+import numpy as np
+import pandas as pd
+
+from app.demographics import draw_user_demographics
+from app.generate_dummy_data import (
+    AB_TEST_TARGETS, AB_VARIANTS, DEFAULT_CONFIG, SCENARIO_CONFIGS, TRAFFIC_SOURCES,
+    UTM_CAMPAIGNS, VIDEO_PROGRESS_EVENTS,
+)
+
+DEFAULT_LP_URL = "https://shungene.lm-c.jp/tst08/tst08.html"
+DEFAULT_CLIENT_ID = 'client_01'
+LP_ASSET_BASE = "https://shungene.lm-c.jp/tst08/"
+# tst08 の各ページのコンテンツ（動画・画像）。デモ用の他のLPもこの素材を組み替えて使う
+DEFAULT_LP_CONTENT_URLS = {
+    1: LP_ASSET_BASE + "01.mp4",
+    **{p: LP_ASSET_BASE + f"{p - 1:02d}.jpg" for p in range(2, 8)},
+    8: LP_ASSET_BASE + "06.mp4",
+    **{p: LP_ASSET_BASE + f"{p - 2:02d}.jpg" for p in range(9, 19)},
+}
+LP_IMAGE_ASSETS = [LP_ASSET_BASE + f"{i:02d}.jpg" for i in range(1, 17)]
+LP_VIDEO_ASSETS = [LP_ASSET_BASE + "01.mp4", LP_ASSET_BASE + "06.mp4"]
+DIFFICULTIES = ('初級（穏やかな波）', '中級（乱高下）', '上級（急降下）')
+WEEKDAY_NAMES = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+NAVIGATION_METHODS = ('scroll', 'swipe', 'click')
+# A/Bテストの対象ごとのテスト種別（要素の有無を比べる presence / 表現を比べる creative）
+AB_TEST_TYPES = {'hero_image': 'creative', 'headline': 'creative', 'cta_button': 'presence', 'layout': 'presence', None: None}
+
+# 研修用シナリオ（旧 generate_training_data の「好調・普通・不調」）を共通の設定形式で表したもの
+# CVRは想定CVR 4% に対する倍率で、旧スクリプトのCVR範囲の中央に合わせている
+TRAINING_SCENARIO_CONFIGS = {
+    '好調': {
+        'description': '研修用: CVRが高くFV離脱が少ない',
+        'num_sessions_per_day_range': (300, 400),
+        'fv_exit_rate': 0.15,
+        'transition_mean': 0.88,
+        'transition_sd': 0.03,
+        'bottleneck_pages': {},
+        'cta_click_rate_base': 0.15,
+        'cvr_multiplier': 1.625, # 5〜8%
+        'stay_time_mu_base': 2.8,
+        'stay_time_sigma': 0.6,
+        'backflow_base': 0.05,
+        'device_dist': ['mobile', 'desktop', 'tablet'],
+        'device_weights': [0.7, 0.25, 0.05],
+        'num_pages_range': (10, 10),
+        'lp_urls': {'https://example.com/lp/product-a': 0.4, 'https://example.com/lp/product-b': 0.3, 'https://example.com/lp/service-x': 0.3},
+    },
+    '普通': {
+        'description': '研修用: 標準的なパフォーマンス',
+        'num_sessions_per_day_range': (300, 400),
+        'fv_exit_rate': 0.30,
+        'transition_mean': 0.86,
+        'transition_sd': 0.03,
+        'bottleneck_pages': {},
+        'cta_click_rate_base': 0.10,
+        'cvr_multiplier': 0.625, # 2〜3%
+        'stay_time_mu_base': 2.7,
+        'stay_time_sigma': 0.6,
+        'backflow_base': 0.05,
+        'device_dist': ['mobile', 'desktop', 'tablet'],
+        'device_weights': [0.7, 0.25, 0.05],
+        'num_pages_range': (10, 10),
+        'lp_urls': {'https://example.com/lp/product-a': 0.4, 'https://example.com/lp/product-b': 0.3, 'https://example.com/lp/service-x': 0.3},
+    },
+    '不調': {
+        'description': '研修用: CVRが低く3ページ目にボトルネック',
+        'num_sessions_per_day_range': (300, 400),
+        'fv_exit_rate': 0.40,
+        'transition_mean': 0.86,
+        'transition_sd': 0.03,
+        'bottleneck_pages': {3: 0.6},
+        'cta_click_rate_base': 0.05,
+        'cvr_multiplier': 0.1875, # 0.5〜1%
+        'stay_time_mu_base': 2.5,
+        'stay_time_sigma': 0.7,
+        'backflow_base': 0.05,
+        'device_dist': ['mobile', 'desktop', 'tablet'],
+        'device_weights': [0.7, 0.25, 0.05],
+        'num_pages_range': (10, 10),
+        'lp_urls': {'https://example.com/lp/product-a': 0.4, 'https://example.com/lp/product-b': 0.3, 'https://example.com/lp/service-x': 0.3},
+    },
+}
+
+# 共通スキーマ（列名 -> 型）。文字列列は欠損を None とする object 型、欠損のある整数列は float64
+BULK_SCHEMA = {
+    'client_id': 'object',
+    'event_date': 'datetime64[ns]',
+    'event_timestamp': 'datetime64[ns]',
+    'event_timestamp_jst': 'datetime64[ns]',
+    'event_name': 'object',
+    'user_pseudo_id': 'object',
+    'ga_session_id': 'int64',
+    'ga_session_number': 'int64',
+    'session_id': 'object',
+    'page_location': 'object',
+    'page_referrer': 'object',
+    'page_path': 'object',
+    'prev_page_path': 'object',
+    'page_num_dom': 'int64',
+    'original_page_num': 'int64',
+    'stay_ms': 'float64',
+    'load_time_ms': 'float64',
+    'max_page_reached': 'int64',
+    'total_pages': 'int64',
+    'completion_rate': 'float64',
+    'scroll_pct': 'float64',
+    'utm_source': 'object',
+    'utm_medium': 'object',
+    'utm_campaign': 'object',
+    'utm_content': 'object',
+    'device_type': 'object',
+    'age': 'int64',
+    'gender': 'object',
+    'prefecture': 'object',
+    'direction': 'object',
+    'navigation_method': 'object',
+    'ab_variant': 'object',
+    'ab_test_target': 'object',
+    'session_variant': 'object',
+    'presence_test_variant': 'object',
+    'creative_test_variant': 'object',
+    'ab_test_type': 'object',
+    'cv_type': 'object',
+    'cv_value': 'float64',
+    'value': 'float64',
+    'form_page_number': 'float64',
+    'form_duration_ms': 'float64',
+    'form_direction': 'object',
+    'click_x_rel': 'float64',
+    'click_y_rel': 'float64',
+    'elem_tag': 'object',
+    'elem_id': 'object',
+    'elem_classes': 'object',
+    'link_url': 'object',
+    'video_src': 'object',
+    'total_duration_ms': 'float64',
+}
+
+
+def resolve_config(scenario: str) -> dict:
+    """
+    シナリオ名から生成設定を作る（DEFAULT_CONFIG にシナリオの設定を上書きしたもの）
+
+    Args:
+        scenario: SCENARIO_CONFIGS または TRAINING_SCENARIO_CONFIGS のキー
+
+    Returns:
+        dict: 生成設定
+    """
+    scenario_config = TRAINING_SCENARIO_CONFIGS.get(scenario) or SCENARIO_CONFIGS.get(scenario, SCENARIO_CONFIGS['標準（ベースライン）'])
+    config = DEFAULT_CONFIG.copy()
+    config.update(scenario_config)
+    return config
+
+
+def _daily_multipliers(num_days: int, difficulty: str, rng: np.random.Generator):
+    """難易度に応じた日ごとのCVR倍率とセッション数倍率（generate_dummy_data と同じ考え方）"""
+    days = np.arange(num_days)
+    session_factor = np.ones(num_days)
+    if difficulty == '中級（乱高下）':
+        cvr_factor = np.maximum(0.2, 1.0 + np.sin(days / 2.0) * 0.2 + rng.uniform(-0.3, 0.3, num_days))
+    elif difficulty == '上級（急降下）':
+        crashed = days >= num_days - 7
+        cvr_factor = np.where(crashed, 0.4, rng.uniform(0.9, 1.1, num_days))
+        session_factor = np.where(crashed, 0.8, 1.0)
+    else:
+        cvr_factor = rng.uniform(0.9, 1.1, num_days)
+    return cvr_factor, session_factor
+
+
+def _draw_num_pages(config: dict, n: int, rng: np.random.Generator) -> np.ndarray:
+    """セッションごとのLPページ数（num_pages_range があれば一括抽選、なければ num_pages_dist を呼ぶ）"""
+    if 'num_pages_range' in config:
+        low, high = config['num_pages_range']
+        return rng.integers(low, high + 1, n)
+    return np.fromiter((config['num_pages_dist']() for _ in range(n)), dtype=np.int64, count=n)
+
+
+def _segment_offsets(counts: np.ndarray):
+    """グループごとの件数から、各行のグループ番号とグループ内の通し番号（0始まり）を作る"""
+    group = np.repeat(np.arange(len(counts)), counts)
+    starts = np.cumsum(counts) - counts
+    return group, np.arange(len(group)) - starts[group]
+
+
+class _Columns:
+    """イベント種別ごとの列の配列を集め、最後に1つの DataFrame に結合する"""
+
+    def __init__(self):
+        self.parts = []
+
+    def add(self, n: int, **columns):
+        if n:
+            self.parts.append((n, columns))
+
+    def frame(self) -> pd.DataFrame:
+        data = {}
+        for column, dtype in BULK_SCHEMA.items():
+            arrays = []
+            for n, columns in self.parts:
+                value = columns.get(column)
+                if value is None:
+                    value = np.full(n, None, dtype=object) if dtype == 'object' else np.full(n, np.nan)
+                elif np.ndim(value) == 0:
+                    value = np.full(n, value, dtype=object if dtype == 'object' else None)
+                arrays.append(np.asarray(value))
+            data[column] = np.concatenate(arrays) if arrays else np.empty(0)
+        return pd.DataFrame({c: pd.Series(v, dtype=BULK_SCHEMA[c]) if BULK_SCHEMA[c] != 'object' else pd.Series(v, dtype=object)
+                             for c, v in data.items() if c != 'total_duration_ms'})
+
+
+def _generate_day(columns: _Columns, config: dict, day: datetime, base_cvr: float, session_factor: float,
+                  user_pool_size: int, users: dict, rng: np.random.Generator):
+    """1日分のセッションを一括で抽選し、イベント種別ごとの列を columns に追加する"""
+    weekday_factor = config['weekday_seasonality'].get(WEEKDAY_NAMES[day.weekday()], 1.0)
+    n = int(rng.uniform(*config['num_sessions_per_day_range']) * weekday_factor * session_factor)
+    if n <= 0:
+        return
+
+    # --- セッション属性（カテゴリ列は1日分まとめて抽選） ---
+    user_ids = rng.integers(0, user_pool_size, n)
+    ga_session_id = rng.integers(1000000000, 10000000000, n)
+    ga_session_number = rng.integers(1, 11, n)
+    user_pseudo_id = np.array([f"user_{u:06d}" for u in user_ids], dtype=object)
+    session_id = np.array([f"user_{u:06d}-{g}" for u, g in zip(user_ids, ga_session_id)], dtype=object)
+
+    hour_weights = np.array([config['hour_seasonality'].get(h, 1.0) for h in range(24)])
+    seconds = rng.choice(24, n, p=hour_weights / hour_weights.sum()) * 3600 + rng.integers(0, 3600, n)
+    session_start = np.datetime64(day.date(), 'ms') + seconds.astype('timedelta64[s]')
+
+    devices = np.asarray(config['device_dist'], dtype=object)
+    device_weights = np.asarray(config['device_weights'], dtype=float)
+    device_codes = rng.choice(len(devices), n, p=device_weights / device_weights.sum())
+    channels = np.asarray(config['channel_dist'], dtype=object)
+    channel_weights = np.asarray(config['channel_weights'], dtype=float)
+    channel_codes = rng.choice(len(channels), n, p=channel_weights / channel_weights.sum())
+    device_coeff = [config['device_coeff'][d] for d in devices]
+    channel_coeff = [config['channel_coeff'].get(c, {'cvr': 1.0, 'stay': 1.0}) for c in channels]
+
+    # UTM: Direct 以外のチャネルは参照元を一様に選び、参照元ごとのメディアから一様に選ぶ
+    sources = list(TRAFFIC_SOURCES)
+    source_codes = rng.integers(0, len(sources), n)
+    medium_counts = np.array([len(TRAFFIC_SOURCES[s]['mediums']) for s in sources])
+    medium_index = (rng.random(n) * medium_counts[source_codes]).astype(np.int64)
+    medium_table = np.array([m for s in sources for m in TRAFFIC_SOURCES[s]['mediums']], dtype=object)
+    medium_offsets = np.cumsum(medium_counts) - medium_counts
+    has_source = (channels[channel_codes] != 'Direct') & (np.asarray(sources, dtype=object)[source_codes] != 'direct')
+    utm_source = np.where(has_source, np.asarray(sources, dtype=object)[source_codes], '(direct)')
+    utm_medium = np.where(has_source, medium_table[medium_offsets[source_codes] + medium_index], '(none)')
+    page_referrer = np.where(has_source, np.array([TRAFFIC_SOURCES[s]['referrer'] for s in sources], dtype=object)[source_codes], None)
+    utm_campaign = np.asarray(UTM_CAMPAIGNS, dtype=object)[rng.integers(0, len(UTM_CAMPAIGNS), n)]
+    ad_content = np.array([f"ad_{i}" for i in range(1, 6)], dtype=object)[rng.integers(0, 5, n)]
+    utm_content = np.where(np.isin(utm_medium, ['cpc', 'paidsocial', 'display']), ad_content, None)
+    ab_variant = np.asarray(AB_VARIANTS, dtype=object)[rng.integers(0, len(AB_VARIANTS), n)]
+    target_codes = rng.integers(0, len(AB_TEST_TARGETS), n)
+    ab_test_target = np.asarray(AB_TEST_TARGETS, dtype=object)[target_codes]
+    ab_test_type = np.array([AB_TEST_TYPES.get(t) for t in AB_TEST_TARGETS], dtype=object)[target_codes]
+    num_pages = _draw_num_pages(config, n, rng)
+    lp_table = _lp_table(config, int(num_pages.max()))
+    lp_codes = rng.choice(len(lp_table['urls']), n, p=lp_table['weights'])
+
+    # --- CV判定とページ遷移 ---
+    cvr = base_cvr * np.array([c['cvr'] for c in device_coeff])[device_codes] * np.array([c['cvr'] for c in channel_coeff])[channel_codes]
+    cvr = cvr * users['cvr_coeff'][user_ids]
+    converting = rng.random(n) < cvr
+    max_page = np.ones(n, dtype=np.int64)
+    alive = ~converting & (rng.random(n) >= config['fv_exit_rate'])
+    for p in range(2, int(num_pages.max()) + 1):
+        p_trans = np.clip(rng.normal(config['transition_mean'], config['transition_sd'], n)
+                          - config.get('bottleneck_pages', {}).get(p - 1, 0.0), 0.05, 0.99)
+        alive &= (p <= num_pages) & (rng.random(n) < p_trans)
+        max_page[alive] = p
+    max_page = np.where(converting, num_pages, max_page)
+
+    # --- ページ表示イベント ---
+    sess, page_index = _segment_offsets(max_page)
+    page = page_index + 1
+    e = len(sess)
+    device_load = np.array([c['load'] for c in device_coeff])[device_codes]
+    load_ms = np.maximum(100, rng.gamma(config['load_time_k'], config['load_time_theta_ms'] * device_load[sess]))
+    stay_scale = (np.exp(config['stay_time_mu_base'] + 0.5 * converting)
+                  * np.array([c['stay'] for c in device_coeff])[device_codes]
+                  * np.array([c['stay'] for c in channel_coeff])[channel_codes] * 1000)
+    stay_ms = np.maximum(1000, rng.lognormal(np.log(stay_scale[sess]), config['stay_time_sigma']))
+    stay_ms = np.where(np.isin(page, [1, 8]), stay_ms * 1.5, stay_ms)
+    backward = (page > 1) & (rng.random(e) < config['backflow_base'])
+    stay_ms = np.where(backward, stay_ms * (1 + config['backflow_stay_bonus']), stay_ms)
+    stay_ms = stay_ms.astype(np.int64)
+    base_scroll = np.where(converting[sess], rng.uniform(0.8, 1.0, e), rng.uniform(0.2, 0.8, e))
+    scroll_pct = np.minimum(1.0, base_scroll + stay_ms / 20000 * 0.5)
+    # セッション内の経過時間（前のページまでの滞在＋読込時間の累積）
+    step_ms = stay_ms + load_ms.astype(np.int64)
+    elapsed = np.cumsum(step_ms) - step_ms
+    session_offset = elapsed[np.cumsum(max_page) - max_page]
+    elapsed = elapsed - session_offset[sess]
+    pv_time = session_start[sess] + elapsed.astype('timedelta64[ms]')
+    session_pv_ms = np.bincount(sess, weights=step_ms, minlength=n).astype(np.int64)
+
+    lp_page = lp_codes[sess] * lp_table['size'] + page
+    video_urls = config.get('video_pages', {})
+    video_src = np.array([video_urls.get(p) for p in range(lp_table['size'])], dtype=object)[page]
+
+    session_columns = {
+        'user_pseudo_id': user_pseudo_id, 'ga_session_id': ga_session_id, 'ga_session_number': ga_session_number,
+        'session_id': session_id, 'utm_source': utm_source, 'utm_medium': utm_medium, 'utm_campaign': utm_campaign,
+        'utm_content': utm_content, 'device_type': devices[device_codes], 'ab_variant': ab_variant,
+        'age': users['age'][user_ids], 'gender': users['gender'][user_ids], 'prefecture': users['prefecture'][user_ids],
+        'ab_test_target': ab_test_target, 'session_variant': ab_variant, 'ab_test_type': ab_test_type,
+        'presence_test_variant': np.where(ab_test_type == 'presence', ab_variant, None),
+        'creative_test_variant': np.where(ab_test_type == 'creative', ab_variant, None), 'max_page_reached': max_page,
+        'total_pages': num_pages, 'completion_rate': max_page / num_pages,
+    }
+
+    def rows(index, page_rows):
+        """セッション属性とページ属性を行番号で引いた列"""
+        out = {k: v[index] for k, v in session_columns.items()}
+        out.update({
+            'page_referrer': np.where(page[page_rows] == 1, page_referrer[index], None),
+            'page_location': lp_table['page_location'][lp_page[page_rows]],
+            'page_path': lp_table['page_path'][lp_page[page_rows]],
+            'page_num_dom': page[page_rows],
+            'original_page_num': page[page_rows],
+        })
+        return out
+
+    all_pv = np.arange(e)
+    columns.add(
+        e, **rows(sess, all_pv),
+        event_name=np.where(page == 1, 'session_start', 'page_view').astype(object),
+        event_timestamp=pv_time,
+        prev_page_path=np.where(page > 1, lp_table['page_path'][lp_page - 1], None),
+        stay_ms=stay_ms.astype(float), load_time_ms=load_ms.astype(np.int64).astype(float), scroll_pct=scroll_pct,
+        direction=np.where(backward, 'backward', 'forward').astype(object),
+        navigation_method=np.asarray(NAVIGATION_METHODS, dtype=object)[rng.integers(0, len(NAVIGATION_METHODS), e)],
+        video_src=video_src,
+    )
+
+    # --- クリック（CTAボタン付近に集中し、残りは画像などへのクリック） ---
+    click_prob = np.where(converting[sess] & (page == max_page[sess]), 0.9, config['cta_click_rate_base'])
+    clicked = np.flatnonzero(rng.random(e) < click_prob)
+    k = len(clicked)
+    if k:
+        on_button = rng.random(k) < 0.75
+        spread_x = np.where(devices[device_codes[sess[clicked]]] == 'mobile', 0.12, 0.07)
+        click_x = np.where(on_button, rng.normal(0.5, spread_x), rng.beta(2, 2, k))
+        click_y = np.where(on_button, rng.normal(0.84, 0.03, k), rng.beta(1.5, 1.8, k))
+        click_offset = (rng.random(k) * (stay_ms[clicked] - 100) + 100).astype(np.int64)
+        columns.add(
+            k, **rows(sess[clicked], clicked),
+            event_name='click', event_timestamp=pv_time[clicked] + click_offset.astype('timedelta64[ms]'),
+            stay_ms=stay_ms[clicked].astype(float), load_time_ms=load_ms[clicked].astype(np.int64).astype(float),
+            scroll_pct=scroll_pct[clicked], direction=np.where(backward[clicked], 'backward', 'forward').astype(object),
+            click_x_rel=np.round(np.clip(click_x, 0, 1), 4), click_y_rel=np.round(np.clip(click_y, 0, 1), 4),
+            elem_tag='button', elem_id='cta_button', video_src=video_src[clicked],
+        )
+
+    # --- 動画（再生開始と、視聴割合に応じた段階イベント） ---
+    play_prob = np.minimum(0.95, config['video_play_rate'] + np.where(converting[sess], config['cta_video_bonus'] / 2, 0))
+    played = np.flatnonzero((video_src != None) & (rng.random(e) < play_prob))  # noqa: E711
+    if len(played):
+        share = np.where(converting[sess[played]], rng.uniform(0.7, 1.0, len(played)), rng.uniform(0.2, 1.0, len(played)))
+        watched = np.minimum(1.0, stay_ms[played] * share / config['video_duration_ms'])
+        fractions = np.array([0.0] + [f for f, _ in VIDEO_PROGRESS_EVENTS])
+        names = np.array(['video_play'] + [name for _, name in VIDEO_PROGRESS_EVENTS], dtype=object)
+        n_events = 1 + np.searchsorted(fractions[1:], watched, side='right')
+        owner, stage = _segment_offsets(n_events)
+        video_rows = played[owner]
+        offset_ms = 500 + (config['video_duration_ms'] * fractions[stage]).astype(np.int64)
+        columns.add(
+            len(video_rows), **rows(sess[video_rows], video_rows),
+            event_name=names[stage], event_timestamp=pv_time[video_rows] + offset_ms.astype('timedelta64[ms]'),
+            direction=np.where(backward[video_rows], 'backward', 'forward').astype(object),
+            elem_tag='video', video_src=video_src[video_rows],
+        )
+
+    # --- フォーム（最終ページ。ページを離れるごとに form_progress、送信時に form_submit） ---
+    last_pv = np.cumsum(max_page) - 1
+    form_sessions = np.flatnonzero((max_page == num_pages) & (converting | (rng.random(n) < config['form_start_rate'])))
+    form_total = np.zeros(n, dtype=np.int64)
+    submit_sessions = np.zeros(0, dtype=np.int64)
+    if len(form_sessions):
+        form_start_time = session_start + session_pv_ms.astype('timedelta64[ms]')
+        form_common = dict(elem_tag='form', direction=np.where(backward[last_pv], 'backward', 'forward').astype(object))
+        columns.add(
+            len(form_sessions), **rows(form_sessions, last_pv[form_sessions]),
+            event_name='form_start', event_timestamp=form_start_time[form_sessions],
+            form_page_number=1.0, form_duration_ms=0.0, elem_tag='form',
+            direction=form_common['direction'][form_sessions],
+        )
+        num_steps = config['form_steps']
+        step_seconds = np.asarray(config['form_step_seconds'], dtype=float)
+        continue_prob = config['form_step_continue'] - np.array([config['form_bottleneck_steps'].get(s, 0.0) for s in range(num_steps + 2)])
+        active = form_sessions[converting[form_sessions] | (rng.random(len(form_sessions)) >= config['form_bounce_rate'])]
+        step = np.ones(len(active), dtype=np.int64)
+        progress = []
+        while len(active):
+            conv = converting[active]
+            duration = rng.lognormal(np.log(step_seconds[step - 1] * 1000), 0.5).astype(np.int64)
+            duration = np.where(conv, (duration * 0.9).astype(np.int64), duration)
+            form_total[active] += duration
+            back = (step > 1) & (rng.random(len(active)) < config['form_backflow_rate'])
+            forward = ~back & (conv | ((step < num_steps) & (rng.random(len(active)) < continue_prob[step])))
+            progress.append((active, step, duration, np.where(back, 'backward', np.where(forward, 'forward', 'exit')), form_total[active].copy()))
+            next_step = np.where(back, step - 1, step + 1)
+            submitted = forward & (next_step > num_steps)
+            submit_sessions = np.concatenate([submit_sessions, active[submitted]])
+            # 送信・離脱したセッションと、10分以上入力しているセッションは終了
+            keep = (back | forward) & ~submitted & (form_total[active] <= 600000)
+            active, step = active[keep], next_step[keep]
+        p_sess, p_step, p_duration, p_direction, p_elapsed = (np.concatenate(x) for x in zip(*progress)) if progress else [np.zeros(0, dtype=np.int64)] * 5
+        columns.add(
+            len(p_sess), **rows(p_sess, last_pv[p_sess]),
+            event_name='form_progress', event_timestamp=form_start_time[p_sess] + p_elapsed.astype('timedelta64[ms]'),
+            form_page_number=p_step.astype(float), form_duration_ms=p_duration.astype(float),
+            form_direction=p_direction.astype(object), elem_tag='form', direction=form_common['direction'][p_sess],
+        )
+        if len(submit_sessions):
+            columns.add(
+                len(submit_sessions), **rows(submit_sessions, last_pv[submit_sessions]),
+                event_name='form_submit',
+                event_timestamp=form_start_time[submit_sessions] + (form_total[submit_sessions] + 500).astype('timedelta64[ms]'),
+                form_page_number=float(num_steps), form_duration_ms=form_total[submit_sessions].astype(float),
+                elem_tag='form', direction=form_common['direction'][submit_sessions],
+            )
+
+    # --- CV（最後のイベントの1秒後） ---
+    cv_sessions = np.flatnonzero(converting)
+    if len(cv_sessions):
+        cv_time = session_start[cv_sessions] + (session_pv_ms[cv_sessions] + form_total[cv_sessions] + 1500).astype('timedelta64[ms]')
+        cv_value = rng.integers(1000, 10001, len(cv_sessions)).astype(float)
+        cv_rows = last_pv[cv_sessions]
+        columns.add(
+            len(cv_sessions), **rows(cv_sessions, cv_rows),
+            event_name='conversion', event_timestamp=cv_time,
+            stay_ms=stay_ms[cv_rows].astype(float), load_time_ms=load_ms[cv_rows].astype(np.int64).astype(float),
+            scroll_pct=scroll_pct[cv_rows], direction=np.where(backward[cv_rows], 'backward', 'forward').astype(object),
+            cv_type=np.array(['primary', 'micro'], dtype=object)[rng.integers(0, 2, len(cv_sessions))],
+            cv_value=cv_value, value=cv_value, video_src=video_src[cv_rows],
+        )
+
+
+def _lp_table(config: dict, max_pages: int) -> dict:
+    """LPごとの page_location / page_path を (LP, ページ番号) の表にしておく"""
+    lp_urls = config.get('lp_urls', {DEFAULT_LP_URL: 1.0})
+    urls = list(lp_urls)
+    weights = np.asarray([lp_urls[u] for u in urls], dtype=float)
+    size = max_pages + 1  # ページ番号をそのまま添字に使う
+    location = np.empty(len(urls) * size, dtype=object)
+    path = np.empty(len(urls) * size, dtype=object)
+    for i, url in enumerate(urls):
+        base_path = urlparse(url).path
+        for p in range(size):
+            location[i * size + p] = f"{url}#page-{p}"
+            path[i * size + p] = f"{base_path}#page-{p}"
+    return {'urls': urls, 'weights': weights / weights.sum(), 'size': size, 'page_location': location, 'page_path': path}
+
+
+def generate_bulk_data(scenario: str = '標準（ベースライン）', num_days: int = 30, target_cvr: float = 0.04,
+                       difficulty: str = '初級（穏やかな波）', start_date: datetime = None, end_date: datetime = None,
+                       seed: int = None, client_id: str = DEFAULT_CLIENT_ID, config_overrides: dict = None,
+                       demographic_seed: int = None) -> pd.DataFrame:
+    """
+    ダミーのイベントデータを一括生成する
+
+    Args:
+        scenario: SCENARIO_CONFIGS または TRAINING_SCENARIO_CONFIGS（'好調', '普通', '不調'）のキー
+        num_days: 生成する日数
+        target_cvr: 想定CVR（シナリオの cvr_multiplier を掛けたものが基準CVRになる）
+        difficulty: '初級（穏やかな波）', '中級（乱高下）', '上級（急降下）'
+        start_date: 初日（指定すると start_date から生成する。end_date も指定すると num_days は無視してその間の全日）
+        end_date: 基準日時（start_date がなければ end_date の num_days 日前から生成する。None なら現在時刻）
+        seed: 乱数シード（同じシードなら同じデータになる。ただし num_pages_dist を使うシナリオのページ数は random モジュールで決まる）
+        client_id: client_id 列に入れるクライアントID
+        config_overrides: シナリオの設定をさらに上書きする設定（'lp_urls', 'num_pages_range', 'video_pages' など）
+        demographic_seed: ユーザー属性（年齢・性別・都道府県）の乱数シード（None なら seed から決める）
+
+    Returns:
+        pd.DataFrame: BULK_SCHEMA の列を持ち、event_timestamp 順に並んだイベントデータ
+    """
+    config = resolve_config(scenario)
+    config.update(config_overrides or {})
+    rng = np.random.default_rng(seed)
+    if start_date is not None:
+        start_date = datetime.combine(pd.Timestamp(start_date).date(), datetime.min.time())
+        if end_date is not None:
+            num_days = (pd.Timestamp(end_date).date() - start_date.date()).days + 1
+    else:
+        start_date = (end_date or datetime.now()) - timedelta(days=num_days)
+    base_cvr = target_cvr * config.get('cvr_multiplier', 1.0)
+    cvr_factor, session_factor = _daily_multipliers(num_days, difficulty, rng)
+    user_pool_size = max(1, int(config['num_sessions_per_day_range'][1] * num_days / 1.5))
+    # ユーザー属性はユーザー番号ごとに1回だけ決める（同じユーザーのセッションは同じ属性）
+    users = draw_user_demographics(user_pool_size, demographic_seed if demographic_seed is not None else int(rng.integers(2 ** 32)))
+
+    columns = _Columns()
+    for i in range(num_days):
+        _generate_day(columns, config, start_date + timedelta(days=i), base_cvr * cvr_factor[i], session_factor[i],
+                      user_pool_size, users, rng)
+    if not columns.parts:
+        return pd.DataFrame({c: pd.Series(dtype=t) for c, t in BULK_SCHEMA.items()})
+
+    df = columns.frame()
+    df['client_id'] = pd.Series(client_id, index=df.index, dtype=object)
+    df = df.sort_values('event_timestamp', kind='stable').reset_index(drop=True)
+    df['event_timestamp_jst'] = df['event_timestamp'] + pd.Timedelta(hours=9)
+    df['event_date'] = df['event_timestamp'].dt.normalize()
+    # セッションの最初と最後のイベントの間隔
+    codes, _ = pd.factorize(df['session_id'])
+    ts = df['event_timestamp'].to_numpy().astype(np.int64)
+    first = np.full(codes.max() + 1, np.iinfo(np.int64).max)
+    last = np.full(codes.max() + 1, np.iinfo(np.int64).min)
+    np.minimum.at(first, codes, ts)
+    np.maximum.at(last, codes, ts)
+    df['total_duration_ms'] = (last - first)[codes] / 1e6
+    return df[list(BULK_SCHEMA)]
+
+
+def make_lp_catalog(num_clients: int = 1, lps_per_client: int = 1, base_scenario: str = '標準（ベースライン）', seed: int = None) -> list:
+    """
+    デモ用のLP一覧を作る（LPごとにページ数・素材・シナリオが異なる）
+
+    1件目は tst08 のLP（base_scenario、素材は DEFAULT_LP_CONTENT_URLS）で、2件目以降はページ数を6〜18からランダムに決め、
+    tst08 の画像・動画を組み替えた素材と、SCENARIO_CONFIGS のシナリオを順番に割り当てる。
+
+    Args:
+        num_clients: クライアント数
+        lps_per_client: 1クライアントあたりのLP数
+        base_scenario: 1件目のLPのシナリオ
+        seed: 乱数シード
+
+    Returns:
+        list: LPごとの dict（'client_id', 'lp_url', 'scenario', 'num_pages'（None ならシナリオのページ数の分布）,
+            'content_urls'（ページ番号 -> 素材URL）, 'video_pages', 'traffic_scale'（シナリオのセッション数に掛ける倍率））
+    """
+    rng = np.random.default_rng(seed)
+    scenarios = [s for s in SCENARIO_CONFIGS if s != base_scenario]
+    catalog = [{
+        'client_id': DEFAULT_CLIENT_ID, 'lp_url': DEFAULT_LP_URL, 'scenario': base_scenario, 'num_pages': None,
+        'content_urls': DEFAULT_LP_CONTENT_URLS, 'video_pages': DEFAULT_CONFIG['video_pages'], 'traffic_scale': 1.0,
+    }]
+    for c in range(num_clients):
+        client_id = f"client_{c + 1:02d}"
+        for j in range(1 if c == 0 else 0, lps_per_client):
+            num_pages = int(rng.integers(6, 19))
+            offset = int(rng.integers(0, len(LP_IMAGE_ASSETS)))
+            content_urls = {p: LP_IMAGE_ASSETS[(offset + p) % len(LP_IMAGE_ASSETS)] for p in range(1, num_pages + 1)}
+            # 半分のLPはFVが動画で、さらにその半分は途中にも動画がある
+            video_positions = [1] if rng.random() < 0.5 else []
+            if video_positions and rng.random() < 0.5:
+                video_positions.append(int(rng.integers(3, num_pages + 1)))
+            for k, p in enumerate(video_positions):
+                content_urls[p] = LP_VIDEO_ASSETS[k % len(LP_VIDEO_ASSETS)]
+            catalog.append({
+                'client_id': client_id,
+                'lp_url': f"https://shungene.lm-c.jp/{client_id}/lp{j + 1:02d}.html",
+                'scenario': scenarios[(len(catalog) - 1) % len(scenarios)] if scenarios else base_scenario,
+                'num_pages': num_pages,
+                'content_urls': content_urls,
+                'video_pages': {p: content_urls[p] for p in video_positions},
+                'traffic_scale': float(rng.uniform(0.1, 0.5)),
+            })
+    return catalog
+
+
+def generate_multi_lp_data(catalog: list, num_days: int = 30, target_cvr: float = 0.04, difficulty: str = '初級（穏やかな波）',
+                           seed: int = None) -> pd.DataFrame:
+    """
+    LP一覧のLPごとにデータを生成して1つにまとめる
+
+    Args:
+        catalog: make_lp_catalog() の戻り値と同じ形式のLP一覧
+        num_days: 生成する日数
+        target_cvr: 想定CVR
+        difficulty: 難易度
+        seed: 乱数シード（LPごとに独立した乱数列に分けて使う）
+
+    Returns:
+        pd.DataFrame: BULK_SCHEMA の列を持ち、event_timestamp 順に並んだ全LPのイベントデータ
+    """
+    end_date = datetime.now()
+    seed_sequence = np.random.SeedSequence(seed)
+    seeds = seed_sequence.spawn(len(catalog))
+    # 同じユーザー番号はどのLPでも同じ属性になるよう、属性のシードは全LPで共通にする
+    demographic_seed = int(seed_sequence.generate_state(1)[0])
+    frames = []
+    for spec, lp_seed in zip(catalog, seeds):
+        config = resolve_config(spec['scenario'])
+        low, high = config['num_sessions_per_day_range']
+        scale = spec.get('traffic_scale', 1.0)
+        overrides = {
+            'lp_urls': {spec['lp_url']: 1.0},
+            'video_pages': spec.get('video_pages', {}),
+            'num_sessions_per_day_range': (max(1, int(low * scale)), max(1, int(high * scale))),
+        }
+        if spec.get('num_pages'):
+            overrides['num_pages_range'] = (spec['num_pages'], spec['num_pages'])
+        frames.append(generate_bulk_data(spec['scenario'], num_days=num_days, target_cvr=target_cvr, difficulty=difficulty,
+                                         end_date=end_date, seed=lp_seed, client_id=spec['client_id'], config_overrides=overrides,
+                                         demographic_seed=demographic_seed))
+    if not frames:
+        return generate_bulk_data(num_days=0)
+    return pd.concat(frames, ignore_index=True).sort_values('event_timestamp', kind='stable').reset_index(drop=True)
@@ -0,0 +1,115 @@
+"""
+カレンダー（時間帯・曜日・週・月）の事前集計
+セッションの開始時刻から時間帯・曜日・週・月を小さな整数コードとして1回だけ作り（イベントごとに dt アクセサを呼ばない）、
+(日, 時間帯, LP, デバイスなど) ごとのセッション数・CV数を事前集計したキューブから
+時間帯別・曜日別・曜日×時間帯・月別の表を作る
+"""
+import numpy as np
+import pandas as pd
+
+from app.demographics import CUBE_DIMENSIONS
+from app.quantile_sketch import cell_mask
+
+# セッション単位のカレンダー列（時間帯 0〜23、曜日 0=月曜〜6=日曜、1970-01-05（月曜）からの週番号、年*12+月-1）
+CALENDAR_COLUMNS = ['session_hour', 'session_weekday', 'session_week', 'session_month']
+WEEKDAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+WEEKDAY_LABELS_JP = ['月', '火', '水', '木', '金', '土', '日']
+
+
+def calendar_codes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    イベントごとに、そのセッションの開始時刻の時間帯・曜日・週・月のコードを作る
+
+    Args:
+        df: イベント単位のデータフレーム（session_id, event_timestamp 列を含むもの）
+
+    Returns:
+        pd.DataFrame: df と同じ行数・行順の CALENDAR_COLUMNS 列（int8 / int16）
+    """
+    if df.empty:
+        return pd.DataFrame({c: np.zeros(0, dtype=np.int8 if c in ('session_hour', 'session_weekday') else np.int16) for c in CALENDAR_COLUMNS})
+    codes, uniques = pd.factorize(df['session_id'])
+    ts = pd.to_datetime(df['event_timestamp']).to_numpy(dtype='datetime64[s]').astype(np.int64)
+    # セッションごとの開始時刻（秒）を求めてから、セッション数の長さの配列だけで暦の計算をする
+    start = np.full(len(uniques), np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(start, codes, ts)
+    days = start // 86400
+    hour = (start % 86400) // 3600
+    # 1970-01-01 は木曜日なので、+3 すると月曜日が 0 になる
+    weekday = (days + 3) % 7
+    week = (days - 4) // 7
+    months = start.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64)
+    year_month = months + 1970 * 12
+    return pd.DataFrame({
+        'session_hour': hour.astype(np.int8)[codes],
+        'session_weekday': weekday.astype(np.int8)[codes],
+        'session_week': week.astype(np.int16)[codes],
+        'session_month': year_month.astype(np.int16)[codes],
+    })
+
+
+def month_label(code) -> str:
+    """月のコード（年*12+月-1）を 'YYYY-MM' に変換する"""
+    year, month = divmod(int(code), 12)
+    return f"{year:04d}-{month + 1:02d}"
+
+
+def build_hourly_cube(sessions: pd.DataFrame) -> dict:
+    """
+    (日, 時間帯, CUBE_DIMENSIONS) ごとのセッション数・CV数・到達ページ数の合計を事前集計する
+
+    Args:
+        sessions: build_session_table() の戻り値（CALENDAR_COLUMNS を含むもの）
+
+    Returns:
+        dict: 'cells'（day, CALENDAR_COLUMNS, CUBE_DIMENSIONS の列）・'dimensions'・
+            'metrics'（'sessions', 'conversions', 'max_page_sum' の配列）。カレンダー列がないデータでは空の dict
+    """
+    if sessions.empty or not all(c in sessions.columns for c in CALENDAR_COLUMNS):
+        return {}
+    dims = [c for c in CUBE_DIMENSIONS if c in sessions.columns]
+    work = sessions[CALENDAR_COLUMNS + dims].copy()
+    work['day'] = pd.to_datetime(sessions['event_date']).dt.normalize()
+    work['sessions'] = 1
+    work['conversions'] = sessions['is_cv'].astype(np.int64)
+    work['max_page_sum'] = sessions['max_page_reached'].astype(float)
+    # 週・月・曜日は日から決まるのでセルは増えない
+    keys = ['day'] + CALENDAR_COLUMNS + dims
+    grouped = work.groupby(keys, sort=False, dropna=False, observed=True)[['sessions', 'conversions', 'max_page_sum']].sum().reset_index()
+    return {
+        'cells': grouped[keys],
+        'dimensions': dims,
+        'metrics': {m: grouped[m].to_numpy() for m in ['sessions', 'conversions', 'max_page_sum']},
+    }
+
+
+def calendar_breakdown(cube: dict, by, start_date=None, end_date=None, filters: dict = None) -> pd.DataFrame:
+    """
+    期間とフィルターに一致するセルをカレンダー列ごとに足し合わせる
+
+    Args:
+        cube: build_hourly_cube() の戻り値
+        by: 集計するカレンダー列（CALENDAR_COLUMNS の列名、またはそのリスト）
+        start_date, end_date: 期間（両端を含む）
+        filters: {CUBE_DIMENSIONS の列: 値}。値が None または 'すべて' の条件は無視する
+
+    Returns:
+        pd.DataFrame: by の列, 'セッション数', 'コンバージョン数', 'コンバージョン率'（%）, '平均到達ページ数'（by の昇順）
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    columns = by + ['セッション数', 'コンバージョン数', 'コンバージョン率', '平均到達ページ数']
+    if not cube:
+        return pd.DataFrame(columns=columns)
+    mask = cell_mask(cube, start_date, end_date, filters)
+    if not mask.any():
+        return pd.DataFrame(columns=columns)
+    metrics = pd.DataFrame({m: v[mask] for m, v in cube['metrics'].items()})
+    keys = [cube['cells'][c].to_numpy()[mask] for c in by]
+    totals = metrics.groupby(keys, sort=True).sum()
+    sessions = totals['sessions'].to_numpy(dtype=np.int64)
+    result = totals.index.to_frame(index=False, name=by) if len(by) > 1 else pd.DataFrame({by[0]: totals.index.to_numpy()})
+    result['セッション数'] = sessions
+    result['コンバージョン数'] = totals['conversions'].to_numpy(dtype=np.int64)
+    result['コンバージョン率'] = np.where(sessions > 0, totals['conversions'].to_numpy() / np.maximum(sessions, 1), 0.0) * 100
+    result['平均到達ページ数'] = np.where(sessions > 0, totals['max_page_sum'].to_numpy() / np.maximum(sessions, 1), 0.0)
+    return result
@@ -66,6 +66,32 @@ def create_placeholder_image(width: int, height: int) -> Image.Image:
     return img
 
 
+@st.cache_data(ttl=3600, max_entries=64)  # 1時間キャッシュ
+def fetch_page_thumbnail(url: str, max_width: int = 480):
+    """
+    LPページの画像を取得し、ヒートマップの背景用に縮小する
+
+    Args:
+        url: ページ画像のURL
+        max_width: 縮小後の最大幅
+
+    Returns:
+        PIL Image object（動画ページや取得できない場合は None）
+    """
+    if url.endswith(('.mp4', '.webm', '.mov')):
+        return None
+    try:
+        response = requests.get(url, timeout=10, headers={'User-Agent': 'Mozilla/5.0'})
+        if response.status_code != 200:
+            return None
+        img = Image.open(BytesIO(response.content)).convert('RGB')
+        img.thumbnail((max_width, max_width * 4))
+        return img
+    except Exception as e:
+        print(f"ページ画像の取得エラー: {e}")
+        return None
+
+
 @st.cache_data(ttl=3600)
 def extract_swipe_lp_images(url: str):
     """
@@ -0,0 +1,142 @@
+"""
+チャートのペイロード（ブラウザに送る図の JSON）の間引きとサイズ計測
+長い時系列の折れ線は LTTB（Largest-Triangle-Three-Buckets）法で形を保ったまま点数を減らし、
+期間を長くしても1つのチャートで送る点数とバイト数が上限を超えないようにする
+"""
+import base64
+
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+
+# 1トレースあたりの点数の上限（365日の日次なら間引かない）
+DEFAULT_MAX_POINTS = 500
+# 間引く対象のトレース種別（棒グラフやヒートマップの各要素は1つずつ意味があるので間引かない）
+DOWNSAMPLE_TRACE_TYPES = ('scatter', 'scattergl')
+# x, y と同じ長さなら一緒に間引くトレースの属性
+POINT_ATTRIBUTES = ('text', 'hovertext', 'customdata', 'ids')
+MARKER_ATTRIBUTES = ('color', 'size', 'symbol', 'opacity')
+
+
+def lttb_indices(x, y, threshold: int) -> np.ndarray:
+    """
+    LTTB 法で残す点の位置を選ぶ
+
+    Args:
+        x: 昇順の x 座標（数値）
+        y: y 座標（数値。欠損は 0 として面積を計算する）
+        threshold: 残す点数（3 未満、または点数以下なら間引かない）
+
+    Returns:
+        np.ndarray: 残す点の位置（昇順。先頭と末尾の点は必ず含む）
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+    n = len(x)
+    if threshold < 3 or n <= threshold:
+        return np.arange(n)
+
+    # 先頭と末尾を除いた点を threshold - 2 個のバケットに分け、各バケットから1点を選ぶ
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    prev = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # 次のバケットの平均点（最後のバケットでは末尾の点）
+        next_lo, next_hi = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = y[next_lo:next_hi].mean()
+        # 前に選んだ点・次のバケットの平均点と作る三角形の面積が最大の点を選ぶ
+        area = np.abs((x[prev] - avg_x) * (y[lo:hi] - y[prev]) - (x[prev] - x[lo:hi]) * (avg_y - y[prev]))
+        prev = lo + int(np.argmax(area))
+        selected[i + 1] = prev
+    return selected
+
+
+def _numeric_x(x) -> np.ndarray:
+    """x 座標を LTTB 用の数値にする（日時はエポック秒、文字列などは並び順の番号）"""
+    values = np.asarray(x)
+    if np.issubdtype(values.dtype, np.number):
+        return values.astype(float)
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype('datetime64[ms]').astype(np.int64).astype(float)
+    parsed = pd.to_datetime(pd.Series(values), errors='coerce', format='ISO8601')
+    if parsed.notna().all():
+        return parsed.to_numpy(dtype='datetime64[ms]').astype(np.int64).astype(float)
+    return np.arange(len(values), dtype=float)
+
+
+def _as_array(value):
+    """トレースの属性を配列にする（plotly 6 以降の to_dict() が返す base64 の型付き配列 {'dtype', 'bdata'} も戻す）"""
+    if isinstance(value, dict) and 'bdata' in value:
+        array = np.frombuffer(base64.b64decode(value['bdata']), dtype=np.dtype(value['dtype']))
+        if 'shape' in value:
+            # shape は '7, 24' のような文字列
+            array = array.reshape([int(v) for v in str(value['shape']).split(',')])
+        return array
+    if value is None or isinstance(value, (str, bytes, dict)) or np.ndim(value) == 0:
+        return None
+    return value
+
+
+def _take(value, idx: np.ndarray, n: int):
+    """トレースの属性が点ごとの配列（長さ n）なら idx の要素だけにする"""
+    array = _as_array(value)
+    if array is None or len(array) != n:
+        return value
+    if isinstance(array, np.ndarray):
+        return array[idx]
+    return [array[i] for i in idx]
+
+
+def downsample_figure(fig, max_points: int = DEFAULT_MAX_POINTS) -> dict:
+    """
+    図を dict にし、点数が max_points を超える折れ線・散布図のトレースを LTTB 法で間引く
+
+    Args:
+        fig: plotly の Figure または図の dict
+        max_points: 1トレースあたりの点数の上限
+
+    Returns:
+        dict: 図の dict（'data', 'layout'）
+    """
+    spec = fig.to_dict() if hasattr(fig, 'to_dict') else {'data': list(fig.get('data', [])), 'layout': dict(fig.get('layout', {}))}
+    for trace in spec['data']:
+        if trace.get('type', 'scatter') not in DOWNSAMPLE_TRACE_TYPES:
+            continue
+        x, y = _as_array(trace.get('x')), _as_array(trace.get('y'))
+        if x is None or y is None or len(x) != len(y) or len(x) <= max_points:
+            continue
+        n = len(x)
+        x_num = _numeric_x(x)
+        order = np.argsort(x_num, kind='stable')
+        y_num = pd.to_numeric(pd.Series(np.asarray(y)[order]), errors='coerce').to_numpy(dtype=float)
+        idx = order[lttb_indices(x_num[order], y_num, max_points)]
+        for attr in ('x', 'y') + POINT_ATTRIBUTES:
+            if attr in trace:
+                trace[attr] = _take(trace[attr], idx, n)
+        marker = trace.get('marker')
+        if isinstance(marker, dict):
+            for attr in MARKER_ATTRIBUTES:
+                if attr in marker:
+                    marker[attr] = _take(marker[attr], idx, n)
+    return spec
+
+
+def count_points(spec: dict) -> int:
+    """図の全トレースの点数（x または y の要素数）を数える"""
+    total = 0
+    for trace in spec.get('data', []):
+        for attr in ('x', 'y', 'z'):
+            values = _as_array(trace.get(attr))
+            if values is not None:
+                total += int(np.size(values)) if attr == 'z' else len(values)
+                break
+    return total
+
+
+def payload_bytes(spec) -> int:
+    """図をブラウザに送るときの JSON のバイト数"""
+    return len(pio.to_json(spec, validate=False).encode('utf-8'))
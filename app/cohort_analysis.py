@@ -0,0 +1,178 @@
+"""
+コホート分析エンジン
+各 user_pseudo_id を初回訪問日（日次または週次）のコホートに割り当て、
+コホート経過期間ごとの再訪率・リピート訪問でのCV率・累積CV価値を三角行列として計算する。
+セッションテーブルを (ユーザー, 期間) 単位の活動テーブルに圧縮して保持し、
+新しいセッションは活動テーブルに追記するだけで行列を更新できるようにしている
+"""
+import numpy as np
+import pandas as pd
+
+COHORT_FREQS = {'D': '日次', 'W': '週次'}
+ACTIVITY_COLUMNS = ['user_pseudo_id', 'period', 'sessions', 'conversions', 'cv_value']
+
+
+def _periods(starts: pd.Series, freq: str) -> np.ndarray:
+    """セッション開始時刻を期間の先頭日（日次は日付、週次は月曜日）に変換する"""
+    days = pd.to_datetime(starts).to_numpy(dtype='datetime64[D]')
+    if freq == 'W':
+        # 1970-01-01 は木曜日なので、3日ずらして月曜始まりの週にそろえる
+        offset = (days.astype(np.int64) + 3) % 7
+        days = days - offset.astype('timedelta64[D]')
+    elif freq != 'D':
+        raise ValueError(f"freq は {list(COHORT_FREQS)} のいずれかを指定してください: {freq}")
+    return days
+
+
+def build_user_activity(sessions: pd.DataFrame, freq: str = 'D') -> pd.DataFrame:
+    """
+    セッションテーブルを (ユーザー, 期間) 単位の活動テーブルに集約する
+
+    Args:
+        sessions: build_session_table() で作成したセッションテーブル
+        freq: 'D'（日次）または 'W'（週次、月曜始まり）
+
+    Returns:
+        pd.DataFrame: 'user_pseudo_id', 'period'（期間の先頭日）, 'sessions', 'conversions', 'cv_value'
+    """
+    if sessions.empty:
+        return pd.DataFrame(columns=ACTIVITY_COLUMNS)
+    # (ユーザー, 期間) を1つの整数キーにまとめ、キーごとの合計を bincount で求める
+    user_codes, user_ids = pd.factorize(sessions['user_pseudo_id'])
+    days = _periods(sessions['session_start'], freq).astype(np.int64)
+    first_day = days.min()
+    span = int(days.max() - first_day) + 1
+    keys, key_values = pd.factorize(user_codes.astype(np.int64) * span + (days - first_day))
+    n_keys = len(key_values)
+    cv_value = np.nan_to_num(sessions['cv_value'].to_numpy(dtype=float)) if 'cv_value' in sessions.columns else np.zeros(len(keys))
+    key_values = np.asarray(key_values)
+    return pd.DataFrame({
+        'user_pseudo_id': np.asarray(user_ids)[key_values // span],
+        'period': (key_values % span + first_day).astype('datetime64[D]'),
+        'sessions': np.bincount(keys, minlength=n_keys),
+        'conversions': np.bincount(keys, weights=sessions['is_cv'].to_numpy(dtype=float), minlength=n_keys).astype(np.int64),
+        'cv_value': np.bincount(keys, weights=cv_value, minlength=n_keys),
+    })
+
+
+def update_user_activity(activity: pd.DataFrame, new_sessions: pd.DataFrame, freq: str = 'D') -> pd.DataFrame:
+    """
+    活動テーブルに新しいセッションを追記する
+
+    既存の期間と重なる行（週次で週の途中から追記した場合など）は合算するため、
+    全セッションから build_user_activity() し直した結果と一致する。
+
+    Args:
+        activity: build_user_activity() または前回の update_user_activity() の戻り値
+        new_sessions: 追加するセッション（前回までに含めたセッションは含めないこと）
+        freq: activity を作成したときと同じ期間の単位
+
+    Returns:
+        pd.DataFrame: 更新後の活動テーブル
+    """
+    added = build_user_activity(new_sessions, freq)
+    if activity.empty:
+        return added
+    if added.empty:
+        return activity
+    merged = pd.concat([activity, added], ignore_index=True)
+    keys = merged[['user_pseudo_id', 'period']]
+    if not keys.duplicated().any():
+        return merged
+    return merged.groupby(['user_pseudo_id', 'period'], as_index=False, sort=False).sum()
+
+
+def cohort_matrix(activity: pd.DataFrame, freq: str = 'D', max_age: int = None) -> dict:
+    """
+    活動テーブルからコホート × 経過期間の三角行列を計算する
+
+    初回訪問期間をユーザーごとの最小期間で求め、(コホート, 経過期間) の2次元 bincount で
+    アクティブユーザー数・CVユーザー数・CV価値を一括集計する。
+    まだ観測できない経過期間（データの最終期間より先）は NaN にする。
+
+    Args:
+        activity: build_user_activity() の戻り値
+        freq: activity の期間の単位（'D' または 'W'）
+        max_age: 集計する最大経過期間（None ならデータ中の最大）
+
+    Returns:
+        dict: 行がコホート（初回訪問期間の先頭日）、列が経過期間（0 = 初回訪問期間）の DataFrame
+            'retention'（再訪率: その期間に訪問したユーザーの割合）,
+            'repeat_cvr'（リピート訪問のCV率: その期間に訪問したユーザーのうちCVした割合。経過期間0は NaN）,
+            'cumulative_value'（コホートのユーザー1人あたり累積CV価値）,
+            'active_users'（その期間に訪問したユーザー数）と、
+            'cohort_size'（コホートのユーザー数の Series）
+    """
+    empty = pd.DataFrame()
+    if activity.empty:
+        return {'retention': empty, 'repeat_cvr': empty, 'cumulative_value': empty,
+                'active_users': empty, 'cohort_size': pd.Series(dtype=np.int64)}
+    step = 7 if freq == 'W' else 1
+    user_codes, _ = pd.factorize(activity['user_pseudo_id'])
+    period_days = activity['period'].to_numpy(dtype='datetime64[D]').astype(np.int64)
+
+    # ユーザーごとの初回訪問期間
+    first_seen = np.full(int(user_codes.max()) + 1, np.iinfo(np.int64).max)
+    np.minimum.at(first_seen, user_codes, period_days)
+    cohort_days = first_seen[user_codes]
+    age = (period_days - cohort_days) // step
+
+    cohort_values, cohort_codes = np.unique(first_seen, return_inverse=True)
+    row_codes = cohort_codes[user_codes]
+    n_cohorts = len(cohort_values)
+    last_period = int(period_days.max())
+    observable = (last_period - cohort_values) // step
+    n_ages = int(observable.max()) + 1
+    if max_age is not None:
+        n_ages = min(n_ages, max_age + 1)
+        in_range = age < n_ages
+        row_codes, age = row_codes[in_range], age[in_range]
+        activity = activity[in_range]
+
+    flat = row_codes * n_ages + age
+    size = n_cohorts * n_ages
+    active = np.bincount(flat, minlength=size).reshape(n_cohorts, n_ages).astype(float)
+    converted = np.bincount(flat, weights=(activity['conversions'].to_numpy() > 0), minlength=size).reshape(n_cohorts, n_ages)
+    value = np.bincount(flat, weights=activity['cv_value'].to_numpy(dtype=float), minlength=size).reshape(n_cohorts, n_ages)
+    cohort_size = np.bincount(cohort_codes, minlength=n_cohorts)
+
+    # 三角行列: 各コホートで観測可能な経過期間より先は NaN
+    unobserved = np.arange(n_ages)[None, :] > observable[:, None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        retention = active / cohort_size[:, None]
+        repeat_cvr = np.where(active > 0, converted / active, 0.0)
+        cumulative_value = np.cumsum(value, axis=1) / cohort_size[:, None]
+    for matrix in (active, retention, repeat_cvr, cumulative_value):
+        matrix[unobserved] = np.nan
+    # 経過期間0は初回訪問期間（リピート訪問ではない）ので、リピート訪問のCV率からは外す
+    repeat_cvr[:, 0] = np.nan
+
+    index = pd.DatetimeIndex(cohort_values.astype('datetime64[D]'), name='コホート')
+    columns = pd.RangeIndex(n_ages, name='経過期間')
+    return {
+        'retention': pd.DataFrame(retention, index=index, columns=columns),
+        'repeat_cvr': pd.DataFrame(repeat_cvr, index=index, columns=columns),
+        'cumulative_value': pd.DataFrame(cumulative_value, index=index, columns=columns),
+        'active_users': pd.DataFrame(active, index=index, columns=columns),
+        'cohort_size': pd.Series(cohort_size, index=index, name='ユーザー数'),
+    }
+
+
+def cohort_summary(matrices: dict, ages=(1, 7, 14, 28)) -> pd.DataFrame:
+    """
+    コホートごとのユーザー数と、主要な経過期間の再訪率・累積CV価値をまとめる
+
+    Args:
+        matrices: cohort_matrix() の戻り値
+        ages: 表に含める経過期間
+
+    Returns:
+        pd.DataFrame: 'ユーザー数' と、経過期間ごとの '再訪率(n)', '累積CV価値(n)' 列
+    """
+    summary = matrices['cohort_size'].to_frame()
+    retention, value = matrices['retention'], matrices['cumulative_value']
+    for a in ages:
+        if a in retention.columns:
+            summary[f'再訪率({a})'] = retention[a]
+            summary[f'累積CV価値({a})'] = value[a]
+    return summary
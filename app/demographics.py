@@ -0,0 +1,173 @@
+"""
+デモグラフィック（年齢・性別・都道府県）の生成と集計
+ユーザーごとの属性はデータ生成時に1回だけ抽選し（年齢層・性別・都道府県ごとにCVRの差がある）、
+分析画面では (日, LP, デバイスなど, 属性値) ごとのセッション数・CV数・滞在時間を事前集計したキューブから
+期間とフィルターに一致するセルを足し合わせるだけで表を作る。
+都道府県の地図は同梱の簡略化済み GeoJSON（japan_prefectures.geojson）を使うので、描画時にダウンロードしない
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from app.quantile_sketch import cell_mask
+
+AGE_BINS = [18, 25, 35, 45, 55, 65, 80]
+AGE_LABELS = ['18-24', '25-34', '35-44', '45-54', '55-64', '65+']
+AGE_WEIGHTS = [0.14, 0.22, 0.24, 0.19, 0.12, 0.09]
+AGE_CVR_COEFF = [0.7, 1.1, 1.3, 1.1, 0.8, 0.6]
+
+GENDERS = ['男性', '女性', 'その他/未回答']
+GENDER_WEIGHTS = [0.52, 0.45, 0.03]
+GENDER_CVR_COEFF = [0.9, 1.1, 1.0]
+
+# 都道府県（JISコード順）と人口（万人、2020年国勢調査の概数）。流入の重みに使う
+PREFECTURES = [
+    ('北海道', 522), ('青森県', 124), ('岩手県', 121), ('宮城県', 230), ('秋田県', 96), ('山形県', 107), ('福島県', 183),
+    ('茨城県', 287), ('栃木県', 193), ('群馬県', 194), ('埼玉県', 734), ('千葉県', 628), ('東京都', 1405), ('神奈川県', 924),
+    ('新潟県', 220), ('富山県', 103), ('石川県', 113), ('福井県', 77), ('山梨県', 81), ('長野県', 205), ('岐阜県', 198),
+    ('静岡県', 363), ('愛知県', 754), ('三重県', 177), ('滋賀県', 141), ('京都府', 258), ('大阪府', 884), ('兵庫県', 547),
+    ('奈良県', 132), ('和歌山県', 92), ('鳥取県', 55), ('島根県', 67), ('岡山県', 189), ('広島県', 280), ('山口県', 134),
+    ('徳島県', 72), ('香川県', 95), ('愛媛県', 133), ('高知県', 69), ('福岡県', 514), ('佐賀県', 81), ('長崎県', 131),
+    ('熊本県', 174), ('大分県', 112), ('宮崎県', 107), ('鹿児島県', 159), ('沖縄県', 147),
+]
+# 都市部はCVRがやや高い（地域キャンペーン・配送条件などを想定）。ここにない県は 1.0
+PREFECTURE_CVR_COEFF = {'東京都': 1.2, '神奈川県': 1.1, '大阪府': 1.15, '愛知県': 1.1, '福岡県': 1.1, '北海道': 0.9, '沖縄県': 0.8}
+
+DEMOGRAPHIC_COLUMNS = ['age', 'gender', 'prefecture']
+# 事前集計キューブのディメンション（分析画面のフィルターと同じ列）
+CUBE_DIMENSIONS = ['lp_base_url', 'device_type', 'user_type', 'conversion_status', 'channel', 'source_medium']
+GEOJSON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'japan_prefectures.geojson')
+
+
+def draw_user_demographics(num_users: int, seed: int = None) -> dict:
+    """
+    ユーザー番号ごとの年齢・性別・都道府県と、それによるCVRの倍率を抽選する
+
+    ユーザーごとに一様乱数を4つずつ（ユーザー順に）引いて重みの累積和で区分するので、同じシードなら
+    num_users が違っても先頭のユーザーの属性は変わらない（LPごとにユーザー数が違っても同じユーザーは同じ属性）。
+
+    Args:
+        num_users: ユーザー数（ユーザー番号 0 〜 num_users - 1）
+        seed: 乱数シード
+
+    Returns:
+        dict: 'age'（int）, 'gender', 'prefecture'（object）, 'cvr_coeff'（人口構成で加重平均すると1になる倍率）の配列
+    """
+    rng = np.random.default_rng(seed)
+    u_age, u_age_in_bin, u_gender, u_pref = rng.random((num_users, 4)).T
+
+    age_p = np.asarray(AGE_WEIGHTS) / np.sum(AGE_WEIGHTS)
+    gender_p = np.asarray(GENDER_WEIGHTS) / np.sum(GENDER_WEIGHTS)
+    pref_p = np.array([pop for _, pop in PREFECTURES], dtype=float)
+    pref_p /= pref_p.sum()
+    age_code = np.minimum(np.searchsorted(np.cumsum(age_p), u_age, side='right'), len(AGE_LABELS) - 1)
+    gender_code = np.minimum(np.searchsorted(np.cumsum(gender_p), u_gender, side='right'), len(GENDERS) - 1)
+    pref_code = np.minimum(np.searchsorted(np.cumsum(pref_p), u_pref, side='right'), len(PREFECTURES) - 1)
+
+    bins = np.asarray(AGE_BINS)
+    age = bins[age_code] + (u_age_in_bin * (bins[age_code + 1] - bins[age_code])).astype(np.int64)
+    pref_coeff = np.array([PREFECTURE_CVR_COEFF.get(name, 1.0) for name, _ in PREFECTURES])
+    # 属性ごとの倍率を、それぞれの構成比で加重平均すると1になるように正規化する（全体のCVRは変えない）
+    age_coeff = np.asarray(AGE_CVR_COEFF) / np.dot(age_p, AGE_CVR_COEFF)
+    gender_coeff = np.asarray(GENDER_CVR_COEFF) / np.dot(gender_p, GENDER_CVR_COEFF)
+    pref_coeff = pref_coeff / np.dot(pref_p, pref_coeff)
+    return {
+        'age': age.astype(np.int64),
+        'gender': np.asarray(GENDERS, dtype=object)[gender_code],
+        'prefecture': np.array([name for name, _ in PREFECTURES], dtype=object)[pref_code],
+        'cvr_coeff': age_coeff[age_code] * gender_coeff[gender_code] * pref_coeff[pref_code],
+    }
+
+
+def age_group(age) -> pd.Categorical:
+    """年齢を年齢層（AGE_LABELS）に区分する"""
+    return pd.cut(age, bins=AGE_BINS[:-1] + [np.inf], labels=AGE_LABELS, right=False)
+
+
+def build_demographic_cube(sessions: pd.DataFrame) -> dict:
+    """
+    (日, CUBE_DIMENSIONS, 属性値) ごとのセッション数・CV数・滞在時間を事前集計する
+
+    Args:
+        sessions: build_session_table() の戻り値（age, gender, prefecture 列を含むもの）
+
+    Returns:
+        dict: 属性（'age_group', 'gender', 'prefecture'）ごとに、'cells'（day と CUBE_DIMENSIONS と属性値の列）・
+            'dimensions'・'metrics'（'sessions', 'conversions', 'stay_ms_sum', 'stay_ms_count' の配列）を持つ dict。
+            属性列がないデータでは空の dict
+    """
+    if sessions.empty or not all(c in sessions.columns for c in DEMOGRAPHIC_COLUMNS):
+        return {}
+    dims = [c for c in CUBE_DIMENSIONS if c in sessions.columns]
+    work = sessions[dims].copy()
+    work['day'] = pd.to_datetime(sessions['event_date']).dt.normalize()
+    work['sessions'] = 1
+    work['conversions'] = sessions['is_cv'].astype(np.int64)
+    work['stay_ms_sum'] = sessions['stay_ms_sum'].astype(float)
+    work['stay_ms_count'] = sessions['stay_ms_count'].astype(float)
+    values = {
+        'age_group': age_group(sessions['age']).astype(object),
+        'gender': sessions['gender'],
+        'prefecture': sessions['prefecture'],
+    }
+    cube = {}
+    for name, value in values.items():
+        work[name] = value.to_numpy()
+        grouped = work.groupby(['day'] + dims + [name], sort=False, dropna=False, observed=True)[['sessions', 'conversions', 'stay_ms_sum', 'stay_ms_count']].sum().reset_index()
+        cube[name] = {
+            'cells': grouped[['day'] + dims + [name]],
+            'dimensions': dims,
+            'metrics': {m: grouped[m].to_numpy() for m in ['sessions', 'conversions', 'stay_ms_sum', 'stay_ms_count']},
+        }
+        work = work.drop(columns=name)
+    return cube
+
+
+def demographic_breakdown(cube: dict, attribute: str, start_date=None, end_date=None, filters: dict = None) -> pd.DataFrame:
+    """
+    期間とフィルターに一致するセルを属性値ごとに足し合わせる
+
+    Args:
+        cube: build_demographic_cube() の戻り値
+        attribute: 'age_group', 'gender', 'prefecture'
+        start_date, end_date: 期間（両端を含む）
+        filters: {CUBE_DIMENSIONS の列: 値}。値が None または 'すべて' の条件は無視する
+
+    Returns:
+        pd.DataFrame: attribute, 'セッション数', 'CV数', '平均滞在時間 (秒)', 'CVR (%)'（年齢層は若い順、それ以外はセッション数の多い順）
+    """
+    columns = [attribute, 'セッション数', 'CV数', '平均滞在時間 (秒)', 'CVR (%)']
+    if attribute not in cube:
+        return pd.DataFrame(columns=columns)
+    part = cube[attribute]
+    mask = cell_mask(part, start_date, end_date, filters)
+    keys = part['cells'][attribute].to_numpy()[mask]
+    metrics = pd.DataFrame({m: v[mask] for m, v in part['metrics'].items()})
+    totals = metrics.groupby(keys, sort=False).sum()
+    result = pd.DataFrame({
+        attribute: totals.index,
+        'セッション数': totals['sessions'].to_numpy(dtype=np.int64),
+        'CV数': totals['conversions'].to_numpy(dtype=np.int64),
+        '平均滞在時間 (秒)': np.where(totals['stay_ms_count'] > 0, totals['stay_ms_sum'] / totals['stay_ms_count'].clip(lower=1), 0.0) / 1000,
+        'CVR (%)': np.where(totals['sessions'] > 0, totals['conversions'] / totals['sessions'].clip(lower=1), 0.0) * 100,
+    })
+    if attribute == 'age_group':
+        order = {label: i for i, label in enumerate(AGE_LABELS)}
+        return result.sort_values(attribute, key=lambda s: s.map(order)).reset_index(drop=True)
+    return result.sort_values('セッション数', ascending=False).reset_index(drop=True)
+
+
+def load_prefecture_geojson() -> dict:
+    """
+    同梱の都道府県 GeoJSON を読み込む
+
+    japanmap パッケージ（Apache License 2.0）の県境データから各都道府県の本土部分を取り出し、
+    県境ごとに Douglas-Peucker 法（許容誤差 0.02 度）で簡略化したもの。feature の properties は 'code'（JISコード）と 'name'。
+
+    Returns:
+        dict: GeoJSON（FeatureCollection）
+    """
+    with open(GEOJSON_PATH, encoding='utf-8') as f:
+        return json.load(f)
@@ -0,0 +1,239 @@
+"""
+スクロール深度・動画視聴ファネルエンジン
+セッションごとの「ページ別の最大スクロール率」と「動画の最大視聴段階」をデータセットごとに1度だけ求めて保持し、
+視聴ファネル・ページ別のスクロール到達率・スクロール率帯別CVR・動画完了によるCVRリフトを、
+任意のセッションの絞り込みとセグメントについて (セグメント, 段階) の bincount と累積和から計算する
+"""
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+# 動画視聴の段階（表示名 -> イベント名）。段階番号は 1 始まりで、0 は「再生なし」
+VIDEO_STAGES = {
+    '再生開始': 'video_play',
+    '25%視聴': 'video_progress_25',
+    '50%視聴': 'video_progress_50',
+    '75%視聴': 'video_progress_75',
+    '視聴完了': 'video_completion',
+}
+# スクロール率の到達ライン（ページ別到達率）と、セッションのスクロール率帯
+SCROLL_THRESHOLDS = (0.25, 0.5, 0.75, 1.0)
+SCROLL_RANGES = ['0-25%', '25-50%', '50-75%', '75-100%']
+
+
+def build_depth_table(df: pd.DataFrame, sessions: pd.DataFrame) -> dict:
+    """
+    セッションごとの動画視聴段階と、(セッション, ページ) ごとの最大スクロール率を作成する
+
+    Args:
+        df: イベント単位のデータフレーム
+        sessions: 同じデータから build_session_table() で作成したセッションテーブル（行の並びを保持する）
+
+    Returns:
+        dict: 'video_stage'（セッションごとの最大視聴段階、0 = 再生なし）,
+            'video_exposed'（動画のあるページを表示したか）,
+            'page_scroll'（'row'（セッションの行番号）, 'page', 'scroll' の配列）,
+            'session_scroll'（セッションごとの、表示したページの最大スクロール率の平均。表示なしは NaN）
+    """
+    n = len(sessions)
+    session_index = pd.Index(sessions['session_id'])
+
+    # 動画: 視聴段階イベントの段階番号の最大値
+    stage_numbers = {event: i + 1 for i, event in enumerate(VIDEO_STAGES.values())}
+    video_events = df[df['event_name'].isin(list(stage_numbers))]
+    rows = session_index.get_indexer(video_events['session_id'])
+    stages = video_events['event_name'].map(stage_numbers).to_numpy(dtype=np.int8)
+    video_stage = np.zeros(n, dtype=np.int8)
+    np.maximum.at(video_stage, rows[rows >= 0], stages[rows >= 0])
+
+    video_exposed = np.zeros(n, dtype=bool)
+    if 'video_src' in df.columns:
+        exposed_rows = session_index.get_indexer(df.loc[df['video_src'].notna(), 'session_id'].unique())
+        video_exposed[exposed_rows[exposed_rows >= 0]] = True
+    video_exposed |= video_stage > 0
+
+    # スクロール: (セッション, ページ) ごとの最大値（キーとスクロール率でソートし、キーごとの末尾を残す）
+    views = df[df['scroll_pct'].notna() & df['page_num_dom'].notna()] if 'scroll_pct' in df.columns else df.iloc[:0]
+    rows = session_index.get_indexer(views['session_id'])
+    valid = rows >= 0
+    rows = rows[valid].astype(np.int64)
+    pages = views['page_num_dom'].to_numpy(dtype=np.int64)[valid]
+    scroll = np.clip(views['scroll_pct'].to_numpy(dtype=float)[valid], 0, 1)
+    n_pages = int(pages.max()) + 1 if len(pages) else 1
+    keys = rows * n_pages + pages
+    order = np.lexsort((scroll, keys))
+    keys, scroll = keys[order], scroll[order]
+    last = np.r_[keys[1:] != keys[:-1], True] if len(keys) else np.zeros(0, dtype=bool)
+    keys, scroll = keys[last], scroll[last]
+    page_rows = keys // n_pages
+
+    viewed_pages = np.bincount(page_rows, minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        session_scroll = np.bincount(page_rows, weights=scroll, minlength=n) / viewed_pages
+    return {
+        'video_stage': video_stage,
+        'video_exposed': video_exposed,
+        'page_scroll': {'row': page_rows, 'page': keys % n_pages, 'scroll': scroll.astype(np.float32)},
+        'session_scroll': session_scroll,
+    }
+
+
+def _segment_codes(sessions: pd.DataFrame, session_mask, segment: str):
+    """セッションをセグメント番号に変換する（対象外のセッションは -1）"""
+    n = len(sessions)
+    if segment is None:
+        codes, labels = np.zeros(n, dtype=np.int64), np.array(['全体'], dtype=object)
+    else:
+        codes, labels = pd.factorize(sessions[segment].fillna('(not set)'), sort=True)
+    if session_mask is not None:
+        codes = np.where(np.asarray(session_mask, dtype=bool), codes, -1)
+    return codes, np.asarray(labels, dtype=object)
+
+
+def _counts_by_level(codes: np.ndarray, levels: np.ndarray, n_segments: int, n_levels: int, weights=None) -> np.ndarray:
+    """(セグメント, 段階) ごとの件数を2次元 bincount で求める"""
+    valid = codes >= 0
+    flat = codes[valid] * n_levels + levels[valid]
+    w = None if weights is None else np.asarray(weights, dtype=float)[valid]
+    return np.bincount(flat, weights=w, minlength=n_segments * n_levels).reshape(n_segments, n_levels)
+
+
+def _reached(counts: np.ndarray) -> np.ndarray:
+    """段階ごとの件数から「その段階以上に到達した件数」を逆順の累積和で求める"""
+    return np.cumsum(counts[:, ::-1], axis=1)[:, ::-1]
+
+
+def video_funnel(depth: dict, sessions: pd.DataFrame, session_mask=None, segment: str = None) -> pd.DataFrame:
+    """
+    動画視聴ファネル（各段階まで視聴したセッション数）を計算する
+
+    Args:
+        depth: build_depth_table() の戻り値
+        sessions: depth と同じ並びのセッションテーブル
+        session_mask: 対象セッションの真偽配列
+        segment: セグメントに分ける列名（None なら全体）
+
+    Returns:
+        pd.DataFrame: 'segment', 'stage', 'sessions'（その段階以上まで視聴）,
+            'rate_from_start'（再生開始に対する割合）, 'rate_from_prev'（前の段階に対する割合）
+    """
+    codes, labels = _segment_codes(sessions, session_mask, segment)
+    n_levels = len(VIDEO_STAGES) + 1
+    reached = _reached(_counts_by_level(codes, depth['video_stage'].astype(np.int64), len(labels), n_levels))[:, 1:]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        from_start = np.where(reached[:, :1] > 0, reached / reached[:, :1], np.nan)
+        from_prev = np.where(reached[:, :-1] > 0, reached[:, 1:] / reached[:, :-1], np.nan)
+    from_prev = np.column_stack([np.where(reached[:, 0] > 0, 1.0, np.nan), from_prev])
+    n_stages = len(VIDEO_STAGES)
+    return pd.DataFrame({
+        'segment': np.repeat(labels, n_stages),
+        'stage': np.tile(np.asarray(list(VIDEO_STAGES), dtype=object), len(labels)),
+        'sessions': reached.ravel().astype(np.int64),
+        'rate_from_start': from_start.ravel(),
+        'rate_from_prev': from_prev.ravel(),
+    })
+
+
+def video_completion_lift(depth: dict, sessions: pd.DataFrame, session_mask=None, segment: str = None) -> pd.DataFrame:
+    """
+    動画のあるページを表示したセッションについて、視聴完了の有無によるCVRの差を計算する
+
+    Args:
+        depth: build_depth_table() の戻り値
+        sessions: depth と同じ並びのセッションテーブル
+        session_mask: 対象セッションの真偽配列
+        segment: セグメントに分ける列名（None なら全体）
+
+    Returns:
+        pd.DataFrame: 'segment', 'exposed'（動画表示セッション数）, 'played'（再生セッション数）,
+            'completed'（視聴完了セッション数）, 'cvr_completed', 'cvr_not_completed', 'lift'（相対リフト）,
+            'z', 'p_value'
+    """
+    codes, labels = _segment_codes(sessions, session_mask, segment)
+    codes = np.where(depth['video_exposed'], codes, -1)
+    n_levels = len(VIDEO_STAGES) + 1
+    converted = sessions['is_cv'].to_numpy(dtype=float)
+    stage = depth['video_stage'].astype(np.int64)
+    counts = _counts_by_level(codes, stage, len(labels), n_levels)
+    cv = _counts_by_level(codes, stage, len(labels), n_levels, weights=converted)
+
+    exposed = counts.sum(axis=1)
+    completed, completed_cv = counts[:, -1], cv[:, -1]
+    rest, rest_cv = exposed - completed, cv.sum(axis=1) - completed_cv
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cvr_completed = np.where(completed > 0, completed_cv / completed, np.nan)
+        cvr_rest = np.where(rest > 0, rest_cv / rest, np.nan)
+        lift = np.where(cvr_rest > 0, cvr_completed / cvr_rest - 1, np.nan)
+        pooled = cv.sum(axis=1) / np.maximum(exposed, 1)
+        se = np.sqrt(pooled * (1 - pooled) * (1 / completed + 1 / rest))
+        z = np.where(se > 0, (cvr_completed - cvr_rest) / se, np.nan)
+    return pd.DataFrame({
+        'segment': labels,
+        'exposed': exposed.astype(np.int64),
+        'played': (exposed - counts[:, 0]).astype(np.int64),
+        'completed': completed.astype(np.int64),
+        'cvr_completed': cvr_completed,
+        'cvr_not_completed': cvr_rest,
+        'lift': lift,
+        'z': z,
+        'p_value': np.where(np.isfinite(z), 2 * norm.sf(np.abs(z)), np.nan),
+    })
+
+
+def scroll_reach(depth: dict, sessions: pd.DataFrame, session_mask=None, thresholds=SCROLL_THRESHOLDS) -> pd.DataFrame:
+    """
+    ページごとに、各スクロール率のラインまでスクロールした表示の割合を計算する
+
+    Args:
+        depth: build_depth_table() の戻り値
+        sessions: depth と同じ並びのセッションテーブル
+        session_mask: 対象セッションの真偽配列
+        thresholds: 到達ライン（昇順）
+
+    Returns:
+        pd.DataFrame: 'page', 'views'（ページを表示したセッション数）と、ラインごとの到達率の列（'25%' など）
+    """
+    page_scroll = depth['page_scroll']
+    selected = np.ones(len(page_scroll['row']), dtype=bool) if session_mask is None else np.asarray(session_mask, dtype=bool)[page_scroll['row']]
+    pages = page_scroll['page'][selected]
+    # 到達したラインの数（0〜len(thresholds)）を段階とし、ページ × 段階の件数から逆順の累積和で到達数を求める
+    levels = np.searchsorted(np.asarray(thresholds, dtype=np.float32), page_scroll['scroll'][selected], side='right')
+    n_pages = int(pages.max()) + 1 if len(pages) else 1
+    reached = _reached(_counts_by_level(pages, levels, n_pages, len(thresholds) + 1))
+    views = reached[:, 0]
+    result = pd.DataFrame({'page': np.arange(n_pages), 'views': views.astype(np.int64)})
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for i, threshold in enumerate(thresholds):
+            result[f"{threshold:.0%}"] = np.where(views > 0, reached[:, i + 1] / views, np.nan)
+    return result[result['views'] > 0].reset_index(drop=True)
+
+
+def scroll_range_cvr(depth: dict, sessions: pd.DataFrame, session_mask=None, segment: str = None) -> pd.DataFrame:
+    """
+    セッションのスクロール率（表示したページの最大スクロール率の平均）の帯ごとのCVRを計算する
+
+    Args:
+        depth: build_depth_table() の戻り値
+        sessions: depth と同じ並びのセッションテーブル
+        session_mask: 対象セッションの真偽配列
+        segment: セグメントに分ける列名（None なら全体）
+
+    Returns:
+        pd.DataFrame: 'segment', 'scroll_range', 'sessions', 'conversions', 'cvr'
+    """
+    codes, labels = _segment_codes(sessions, session_mask, segment)
+    session_scroll = depth['session_scroll']
+    codes = np.where(np.isnan(session_scroll), -1, codes)
+    edges = np.linspace(0, 1, len(SCROLL_RANGES) + 1)[1:-1]
+    levels = np.searchsorted(edges, np.nan_to_num(session_scroll), side='right')
+    counts = _counts_by_level(codes, levels, len(labels), len(SCROLL_RANGES))
+    cv = _counts_by_level(codes, levels, len(labels), len(SCROLL_RANGES), weights=sessions['is_cv'].to_numpy(dtype=float))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cvr = np.where(counts > 0, cv / counts, np.nan)
+    return pd.DataFrame({
+        'segment': np.repeat(labels, len(SCROLL_RANGES)),
+        'scroll_range': np.tile(np.asarray(SCROLL_RANGES, dtype=object), len(labels)),
+        'sessions': counts.ravel().astype(np.int64),
+        'conversions': cv.ravel().astype(np.int64),
+        'cvr': cvr.ravel(),
+    })
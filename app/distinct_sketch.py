@@ -0,0 +1,263 @@
+"""
+ユニーク数スケッチ（HyperLogLog）
+(日, ディメンションの組み合わせ) のセルごとに session_id / user_pseudo_id の HyperLogLog レジスタを保持し、
+任意の期間・フィルターのユニーク数をセルのレジスタの最大値マージで概算する。
+1日・1セルあたりの件数は少ないため、レジスタは (セル, レジスタ番号, 値) の疎な形式で持ち、
+問い合わせ時に該当セルだけを密なレジスタにまとめる
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_PRECISION = 12
+# merged_registers() がスケッチごとに保持するマージ結果の件数
+MERGED_CACHE_ENTRIES = 64
+SKETCH_COLUMNS = ('session_id', 'user_pseudo_id')
+SKETCH_DIMENSIONS = ['device_type', 'channel', 'source_medium', 'lp_base_url', 'user_type', 'conversion_status']
+ALL_LABEL = 'すべて'
+NOT_SET = '(not set)'
+
+_merged_lock = threading.Lock()
+
+
+def relative_error(precision: int = DEFAULT_PRECISION) -> float:
+    """HyperLogLog の相対標準誤差（1.04 / √m）"""
+    return float(1.04 / np.sqrt(1 << precision))
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    """uint64 配列のビット長（上位・下位32ビットに分けて float64 で正確に求める）"""
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(high > 0, 32 + np.frexp(high)[1], np.frexp(low)[1])
+
+
+def _register_ranks(values, precision: int):
+    """値をハッシュし、(レジスタ番号, 先頭の0の数 + 1) に変換する"""
+    hashes = pd.util.hash_array(np.asarray(values, dtype=object))
+    index = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    rest = hashes << np.uint64(precision)
+    rank = np.minimum(64 - _bit_length(rest), 64 - precision) + 1
+    return index, rank.astype(np.uint8)
+
+
+def _max_by_key(keys: np.ndarray, ranks: np.ndarray):
+    """同じキーのランクを最大値でまとめる（キーとランクでソートし、キーごとの末尾を残す）"""
+    if len(keys) == 0:
+        return keys, ranks
+    order = np.lexsort((ranks, keys))
+    keys, ranks = keys[order], ranks[order]
+    # キー内はランクの昇順なので、各キーの最後の要素が最大値
+    last = np.r_[keys[1:] != keys[:-1], True]
+    return keys[last], ranks[last]
+
+
+def _order_by_register(keys: np.ndarray, ranks: np.ndarray, m: int):
+    """疎なレジスタをレジスタ番号の順（同じ番号の中はセル番号の順）に並べ替える"""
+    order = np.argsort(keys % m, kind='stable')
+    return keys[order], ranks[order]
+
+
+def build_distinct_sketches(df: pd.DataFrame, columns=SKETCH_COLUMNS, dimensions=None,
+                            precision: int = DEFAULT_PRECISION) -> dict:
+    """
+    イベントデータから (日, ディメンションの組み合わせ) ごとのユニーク数スケッチを作成する
+
+    Args:
+        df: イベント単位のデータフレーム
+        columns: ユニーク数を数える列
+        dimensions: セルを分けるディメンション列（None なら SKETCH_DIMENSIONS のうち存在する列）
+        precision: レジスタ数 m = 2^precision のビット数
+
+    Returns:
+        dict: 'cells'（セルごとの 'day' とディメンション値の DataFrame）, 'dimensions', 'precision',
+            'registers'（列名 -> {'key': セル番号 * m + レジスタ番号, 'rank': レジスタ値} の疎なレジスタ。レジスタ番号の順に並ぶ）
+    """
+    if dimensions is None:
+        dimensions = [d for d in SKETCH_DIMENSIONS if d in df.columns]
+    cell_frame = df[dimensions].astype(object).fillna(NOT_SET)
+    cell_frame.insert(0, 'day', df['event_date'].to_numpy(dtype='datetime64[D]'))
+    cell_codes = cell_frame.groupby(list(cell_frame.columns), sort=False, dropna=False).ngroup().to_numpy()
+    first_rows = np.unique(cell_codes, return_index=True)[1]
+    cells = cell_frame.iloc[first_rows].reset_index(drop=True)
+
+    m = 1 << precision
+    registers = {}
+    for column in columns:
+        valid = df[column].notna().to_numpy()
+        index, rank = _register_ranks(df[column].to_numpy()[valid], precision)
+        keys, ranks = _max_by_key(cell_codes[valid].astype(np.int64) * m + index, rank)
+        keys, ranks = _order_by_register(keys, ranks, m)
+        registers[column] = {'key': keys, 'rank': ranks}
+    return {'cells': cells, 'dimensions': list(dimensions), 'precision': precision, 'registers': registers}
+
+
+def merge_sketches(a: dict, b: dict) -> dict:
+    """
+    同じ設定で作成した2つのスケッチを1つにまとめる（日次の追加分を取り込む場合など）
+
+    Args:
+        a, b: build_distinct_sketches() の戻り値（dimensions と precision が同じもの）
+
+    Returns:
+        dict: build_distinct_sketches() と同じ形式のスケッチ
+    """
+    if a['dimensions'] != b['dimensions'] or a['precision'] != b['precision']:
+        raise ValueError("ディメンションと精度が同じスケッチだけをマージできます")
+    m = 1 << a['precision']
+    cells = pd.concat([a['cells'], b['cells']], ignore_index=True)
+    cell_codes = cells.groupby(list(cells.columns), sort=False, dropna=False).ngroup().to_numpy()
+    first_rows = np.unique(cell_codes, return_index=True)[1]
+    offset = len(a['cells'])
+    registers = {}
+    for column in a['registers'].keys() & b['registers'].keys():
+        keys = []
+        for sketch, remap in ((a, cell_codes[:offset]), (b, cell_codes[offset:])):
+            key = sketch['registers'][column]['key']
+            keys.append(remap[key // m].astype(np.int64) * m + key % m)
+        ranks = np.r_[a['registers'][column]['rank'], b['registers'][column]['rank']]
+        merged_keys, merged_ranks = _order_by_register(*_max_by_key(np.concatenate(keys), ranks), m)
+        registers[column] = {'key': merged_keys, 'rank': merged_ranks}
+    return {'cells': cells.iloc[first_rows].reset_index(drop=True), 'dimensions': a['dimensions'],
+            'precision': a['precision'], 'registers': registers}
+
+
+def cell_mask(sketch: dict, start_date=None, end_date=None, filters: dict = None) -> np.ndarray:
+    """
+    期間とフィルター条件に一致するセルの真偽配列を返す
+
+    Args:
+        sketch: build_distinct_sketches() の戻り値
+        start_date, end_date: 期間（両端を含む。None なら制限なし）
+        filters: {ディメンション列: 値}。値が None または 'すべて' の条件は無視する
+
+    Returns:
+        np.ndarray: セルごとの真偽値
+
+    Raises:
+        KeyError: スケッチにないディメンションでフィルターした場合
+    """
+    cells = sketch['cells']
+    days = cells['day'].to_numpy(dtype='datetime64[D]')
+    mask = np.ones(len(cells), dtype=bool)
+    if start_date is not None:
+        mask &= days >= np.datetime64(pd.Timestamp(start_date).date(), 'D')
+    if end_date is not None:
+        mask &= days <= np.datetime64(pd.Timestamp(end_date).date(), 'D')
+    for dim, value in (filters or {}).items():
+        if value is None or value == ALL_LABEL:
+            continue
+        if dim not in sketch['dimensions']:
+            raise KeyError(f"スケッチにないディメンションです: {dim}")
+        mask &= (cells[dim] == value).to_numpy()
+    return mask
+
+
+def merged_registers(sketch: dict, column: str, mask: np.ndarray) -> np.ndarray:
+    """
+    マスクで選んだセルのレジスタを最大値でマージした密なレジスタ（長さ m）を返す
+
+    同じスケッチ・列・マスクの結果はスケッチに保持し（MERGED_CACHE_ENTRIES 件まで）、
+    同じ期間・フィルターの再問い合わせではマージし直さない。
+    """
+    cache = sketch.setdefault('_merged', OrderedDict())
+    key = (column, hashlib.sha1(np.packbits(mask)).hexdigest(), len(mask))
+    with _merged_lock:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+    dense = _merge_registers(sketch, column, mask)
+    dense.flags.writeable = False
+    with _merged_lock:
+        cache[key] = dense
+        while len(cache) > MERGED_CACHE_ENTRIES:
+            cache.popitem(last=False)
+    return dense
+
+
+def _merge_registers(sketch: dict, column: str, mask: np.ndarray) -> np.ndarray:
+    m = 1 << sketch['precision']
+    reg = sketch['registers'][column]
+    selected = mask[reg['key'] // m]
+    index, rank = reg['key'][selected] % m, reg['rank'][selected]
+    dense = np.zeros(m, dtype=np.uint8)
+    if len(index) == 0:
+        return dense
+    # 疎なレジスタはレジスタ番号の順に並んでいるので、番号ごとの区間の最大値を reduceat でまとめて求める
+    starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+    dense[index[starts]] = np.maximum.reduceat(rank, starts)
+    return dense
+
+
+def estimate_cardinality(registers: np.ndarray) -> float:
+    """
+    密なレジスタから HyperLogLog のユニーク数推定値を計算する（小さい値は線形カウンティングで補正）
+
+    Args:
+        registers: 長さ m のレジスタ配列（2次元なら行ごとに推定する）
+
+    Returns:
+        float または np.ndarray: 推定ユニーク数
+    """
+    registers = np.asarray(registers)
+    m = registers.shape[-1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.sum(np.power(2.0, -registers.astype(np.float64)), axis=-1)
+    zeros = np.sum(registers == 0, axis=-1)
+    with np.errstate(divide='ignore'):
+        linear = m * np.log(m / np.maximum(zeros, 1))
+    return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+
+def query_distinct(sketch: dict, column: str, start_date=None, end_date=None, filters: dict = None,
+                   confidence_z: float = 1.96) -> dict:
+    """
+    期間・フィルター条件でのユニーク数をスケッチから概算する
+
+    Args:
+        sketch: build_distinct_sketches() の戻り値
+        column: 'session_id' または 'user_pseudo_id'
+        start_date, end_date: 期間（両端を含む）
+        filters: {ディメンション列: 値}
+        confidence_z: 誤差範囲に使う標準正規分布の値（1.96 で95%）
+
+    Returns:
+        dict: 'estimate'（推定ユニーク数）, 'low', 'high'（誤差範囲）, 'relative_error'（相対標準誤差）
+    """
+    mask = cell_mask(sketch, start_date, end_date, filters)
+    estimate = float(estimate_cardinality(merged_registers(sketch, column, mask)))
+    error = relative_error(sketch['precision'])
+    return {
+        'estimate': estimate,
+        'low': max(0.0, estimate * (1 - confidence_z * error)),
+        'high': estimate * (1 + confidence_z * error),
+        'relative_error': error,
+    }
+
+
+def daily_distinct(sketch: dict, column: str, start_date=None, end_date=None, filters: dict = None) -> pd.Series:
+    """
+    日ごとのユニーク数をスケッチから概算する
+
+    Args:
+        sketch: build_distinct_sketches() の戻り値
+        column: 'session_id' または 'user_pseudo_id'
+        start_date, end_date: 期間（両端を含む）
+        filters: {ディメンション列: 値}
+
+    Returns:
+        pd.Series: 日付をインデックスとする推定ユニーク数
+    """
+    m = 1 << sketch['precision']
+    mask = cell_mask(sketch, start_date, end_date, filters)
+    day_codes, days = pd.factorize(sketch['cells']['day'], sort=True)
+    reg = sketch['registers'][column]
+    cells = reg['key'] // m
+    selected = mask[cells]
+    dense = np.zeros((len(days), m), dtype=np.uint8)
+    np.maximum.at(dense, (day_codes[cells[selected]], reg['key'][selected] % m), reg['rank'][selected])
+    observed = np.bincount(day_codes[mask], minlength=len(days)) > 0
+    return pd.Series(estimate_cardinality(dense[observed]), index=pd.DatetimeIndex(days[observed]), name=column)
@@ -0,0 +1,290 @@
+"""
+フィルター適用後のデータのエクスポート
+ダウンロードを求められたときだけファイルを作り、CSV はチャンクごとに書き出して全体を1つの文字列にしない。
+CSV（Excelで開ける utf-8-sig）・gzip圧縮のCSV・Parquet・Excel を、イベント単位・セッション単位で作れる。
+大きなファイルはバックグラウンドのスレッドで作り、(データセットのバージョンID, フィルター条件, 単位, 形式) ごとに
+ディスクに残しておくので、同じ条件のダウンロードは作り直さない
+"""
+import gzip
+import hashlib
+import importlib.util
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+from app.result_cache import version_matches
+
+DEFAULT_CHUNK_ROWS = 50_000
+# これ以上の行数のエクスポートはバックグラウンドで作る
+DEFAULT_BACKGROUND_ROWS = 200_000
+DEFAULT_MAX_DISK_BYTES = 1024 * 1024 * 1024
+DEFAULT_EXPORT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'exports')
+# Excel の1シートの最大行数（見出しの1行を除く）
+EXCEL_MAX_ROWS = 1_048_575
+# バージョンのディレクトリに置く、バージョンIDを書いたファイル
+_VERSION_FILE = 'VERSION'
+
+# 形式 → 表示名・拡張子・MIMEタイプ・必要なパッケージ・行数によらずバックグラウンドで作るか
+# （Excel はセルごとに書き出すので CSV の数十倍遅く、1万行でも数秒かかる）
+EXPORT_FORMATS = {
+    'csv': {'label': 'CSV', 'extension': 'csv', 'mime': 'text/csv', 'requires': None, 'background': False},
+    'csv_gz': {'label': 'CSV（gzip圧縮）', 'extension': 'csv.gz', 'mime': 'application/gzip', 'requires': None, 'background': False},
+    'parquet': {'label': 'Parquet', 'extension': 'parquet', 'mime': 'application/vnd.apache.parquet', 'requires': 'pyarrow', 'background': False},
+    'xlsx': {'label': 'Excel', 'extension': 'xlsx', 'mime': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'requires': 'openpyxl', 'background': True},
+}
+# 単位 → 表示名（'events' はフィルター適用後のイベント、'sessions' はそのセッションテーブル）
+EXPORT_LEVELS = {
+    'events': 'イベント単位（生データ）',
+    'sessions': 'セッション単位',
+}
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:20]
+
+
+def available_formats() -> list:
+    """必要なパッケージがインストールされている形式のキー"""
+    return [fmt for fmt, info in EXPORT_FORMATS.items() if info['requires'] is None or importlib.util.find_spec(info['requires'])]
+
+
+def iter_csv_chunks(df: pd.DataFrame, chunk_rows: int = DEFAULT_CHUNK_ROWS, encoding: str = 'utf-8-sig'):
+    """
+    CSV をチャンクごとのバイト列として返す（見出しと BOM は最初のチャンクだけに付ける）
+
+    Args:
+        df: 書き出すデータフレーム（インデックスは書き出さない）
+        chunk_rows: 1チャンクの行数
+        encoding: 文字コード（既定の utf-8-sig はExcelで開いても日本語が文字化けしない）
+
+    Yields:
+        bytes: チャンクのCSV
+    """
+    if df.empty:
+        yield df.to_csv(index=False).encode(encoding)
+        return
+    for start in range(0, len(df), chunk_rows):
+        text = df.iloc[start:start + chunk_rows].to_csv(index=False, header=start == 0)
+        # utf-8-sig の BOM は最初のチャンクにだけ付ける
+        yield text.encode(encoding if start == 0 else encoding.replace('-sig', ''))
+
+
+def write_export(df: pd.DataFrame, path: str, fmt: str, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> int:
+    """
+    データフレームを指定した形式のファイルに書き出す
+
+    Parquet は数値・真偽値・日時（単位も含む）・カテゴリ（辞書型として）の型をそのまま保つ。文字列の object 列は
+    Arrow の文字列型で書くので、pandas で読み直すと文字列型の列になり、すべて欠損の列は null 型になる。
+
+    Args:
+        df: 書き出すデータフレーム
+        path: 書き出し先のパス
+        fmt: EXPORT_FORMATS のキー
+        chunk_rows: CSV のチャンク・Parquet の行グループの行数
+
+    Returns:
+        int: ファイルのバイト数
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"未知のエクスポート形式です: {fmt}")
+    if fmt == 'csv':
+        with open(path, 'wb') as f:
+            for chunk in iter_csv_chunks(df, chunk_rows):
+                f.write(chunk)
+    elif fmt == 'csv_gz':
+        with gzip.open(path, 'wb', compresslevel=6) as f:
+            for chunk in iter_csv_chunks(df, chunk_rows):
+                f.write(chunk)
+    elif fmt == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # 列の型は全体から決め、行グループごとに変換する（全体を1つの Arrow テーブルにしない）
+        schema = pa.Schema.from_pandas(df, preserve_index=False)
+        with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+            for start in range(0, max(len(df), 1), chunk_rows):
+                writer.write_table(pa.Table.from_pandas(df.iloc[start:start + chunk_rows], schema=schema, preserve_index=False))
+    elif fmt == 'xlsx':
+        if len(df) > EXCEL_MAX_ROWS:
+            raise ValueError(f"Excel の1シートに収まらない行数です（{len(df):,}行）。CSV か Parquet を選んでください")
+        df.to_excel(path, index=False, engine='openpyxl')
+    return os.path.getsize(path)
+
+
+def export_file_name(prefix: str, start_date, end_date, level: str, fmt: str) -> str:
+    """ダウンロードするファイルの名前（例: analysis_data_sessions_20250101_20250131.csv.gz）"""
+    start, end = (pd.Timestamp(d).strftime('%Y%m%d') for d in (start_date, end_date))
+    return f"{prefix}_{level}_{start}_{end}.{EXPORT_FORMATS[fmt]['extension']}"
+
+
+class ExportManager:
+    """
+    エクスポートのファイルを作って保持するマネージャー
+
+    ファイルはキー（(データセットのバージョンID, ...) のタプル。最後の要素が形式）から決まるパスに書き出すので、
+    同じキーのダウンロードはアプリを再起動しても作り直さない。ジョブの状態は job() で確認する。
+    ファイルはバージョンごとのディレクトリ（バージョンIDを書いた VERSION ファイルつき）に置くので、
+    以前のプロセスが作ったファイルもバージョンを指定して消せる。
+    """
+
+    def __init__(self, directory: str = DEFAULT_EXPORT_DIR, background_rows: int = DEFAULT_BACKGROUND_ROWS,
+                 max_disk_bytes: int = DEFAULT_MAX_DISK_BYTES, chunk_rows: int = DEFAULT_CHUNK_ROWS, workers: int = 2):
+        """
+        Args:
+            directory: ファイルを置くディレクトリ
+            background_rows: この行数以上のエクスポートはバックグラウンドのスレッドで作る
+            max_disk_bytes: ディレクトリのバイト数の上限（超えたら最後に使った時刻が古いファイルから消す）
+            chunk_rows: write_export() の chunk_rows
+            workers: バックグラウンドのスレッド数
+        """
+        self.directory = directory
+        self.background_rows = background_rows
+        self.max_disk_bytes = max_disk_bytes
+        self.chunk_rows = chunk_rows
+        self._lock = threading.Lock()
+        self._request_lock = threading.Lock()
+        self._jobs = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='export')
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: tuple) -> str:
+        """キーのファイルのパス（<directory>/<バージョンのハッシュ>/<キーのハッシュ>.<拡張子>）"""
+        return os.path.join(self._version_dir(str(key[0])), f"{_digest(repr(key))}.{EXPORT_FORMATS[key[-1]]['extension']}")
+
+    def _version_dir(self, version: str) -> str:
+        return os.path.join(self.directory, _digest(version))
+
+    def job(self, key: tuple):
+        """
+        キーのジョブの状態
+
+        Returns:
+            dict: 'status'（'running' / 'done' / 'error'）, 'path', 'rows', 'bytes', 'error', 'started_at', 'finished_at'。
+                ジョブがなく、ファイルもなければ None
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and (job['status'] != 'done' or os.path.exists(job['path'])):
+                return dict(job)
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        # 以前のプロセス・他のプロセスが作ったファイル
+        return {'status': 'done', 'path': path, 'rows': None, 'bytes': os.path.getsize(path), 'error': None,
+                'started_at': None, 'finished_at': datetime.fromtimestamp(os.path.getmtime(path))}
+
+    def request(self, key: tuple, df: pd.DataFrame) -> dict:
+        """
+        キーのファイルを作る（作成済み・作成中ならそのジョブを返す）
+
+        行数が background_rows 未満ならこの場で作り、それ以上（と Excel）ならバックグラウンドで作り始めてすぐに返す。
+
+        Args:
+            key: (データセットのバージョンID, ..., 形式) のタプル。形式は EXPORT_FORMATS のキー
+            df: 書き出すデータフレーム（書き終わるまで変更しない）
+
+        Returns:
+            dict: job() と同じ
+        """
+        # 同じキーを複数のセッションが同時に頼んでも、ファイルは1回だけ作る
+        with self._request_lock:
+            existing = self.job(key)
+            if existing is not None and existing['status'] != 'error':
+                if existing['status'] == 'done':
+                    os.utime(existing['path'])
+                return existing
+            job = {'status': 'running', 'path': self.path(key), 'rows': len(df), 'bytes': None, 'error': None,
+                   'started_at': datetime.now(), 'finished_at': None}
+            with self._lock:
+                self._jobs[key] = job
+        if len(df) >= self.background_rows or EXPORT_FORMATS[key[-1]]['background']:
+            self._executor.submit(self._run, key, df)
+        else:
+            self._run(key, df)
+        return self.job(key)
+
+    def invalidate(self, version: str) -> int:
+        """
+        データセットのバージョン（とそのクライアント別のバージョン）のファイルを消し、消した件数を返す
+
+        このプロセスのジョブだけでなく、ディレクトリを走査して以前のプロセス・他のプロセスが作ったファイルも消す
+        （作成中のファイルは残す）。
+        """
+        with self._lock:
+            running = {job['path'] for job in self._jobs.values() if job['status'] == 'running'}
+            for key in [k for k, job in self._jobs.items() if version_matches(str(k[0]), version) and job['status'] != 'running']:
+                del self._jobs[key]
+        removed = 0
+        for version_dir, dir_version in self._disk_versions():
+            if not version_matches(dir_version, version):
+                continue
+            names = [name for name in os.listdir(version_dir) if name != _VERSION_FILE]
+            busy = [name for name in names if name.startswith('.tmp-') or os.path.join(version_dir, name) in running]
+            if busy:
+                for name in set(names) - set(busy):
+                    os.remove(os.path.join(version_dir, name))
+            else:
+                shutil.rmtree(version_dir, ignore_errors=True)
+            removed += len(names) - len(busy)
+        return removed
+
+    def _run(self, key, df):
+        with self._lock:
+            job = self._jobs[key]
+        version_dir = os.path.dirname(job['path'])
+        # 書きかけのファイルをダウンロードさせないよう、一時ファイルに書いてから名前を変える
+        tmp_path = os.path.join(version_dir, f".tmp-{uuid.uuid4().hex}")
+        try:
+            os.makedirs(version_dir, exist_ok=True)
+            with open(os.path.join(version_dir, _VERSION_FILE), 'w', encoding='utf-8') as f:
+                f.write(str(key[0]))
+            n_bytes = write_export(df, tmp_path, key[-1], self.chunk_rows)
+            os.replace(tmp_path, job['path'])
+        except Exception as e:  # ページに表示し、もう一度作り直せるようにする
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            with self._lock:
+                job.update(status='error', error=str(e), finished_at=datetime.now())
+            return
+        with self._lock:
+            job.update(status='done', bytes=n_bytes, finished_at=datetime.now())
+        self._enforce_disk_limit()
+
+    def _disk_versions(self):
+        """[(バージョンのディレクトリ, バージョンID)]"""
+        versions = []
+        for name in os.listdir(self.directory):
+            version_dir = os.path.join(self.directory, name)
+            try:
+                with open(os.path.join(version_dir, _VERSION_FILE), encoding='utf-8') as f:
+                    versions.append((version_dir, f.read()))
+            except OSError:
+                continue
+        return versions
+
+    def _enforce_disk_limit(self):
+        """ディレクトリのバイト数が上限を超えていたら、最後に使った時刻が古いファイルから消す"""
+        files = []
+        for version_dir, _ in self._disk_versions():
+            for name in os.listdir(version_dir):
+                path = os.path.join(version_dir, name)
+                if name == _VERSION_FILE or name.startswith('.tmp-') or not os.path.isfile(path):
+                    continue
+                stat = os.stat(path)
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            os.remove(path)
+            total -= size
+        # 消したファイルのジョブは作り直せるように忘れる
+        with self._lock:
+            for key in [k for k, j in self._jobs.items() if j['status'] == 'done' and not os.path.exists(j['path'])]:
+                del self._jobs[key]
+
@@ -0,0 +1,127 @@
+"""
+フォーム分析エンジン（瞬フォーム）
+フォームイベント（form_start / form_progress / form_submit）を1回走査して、セッションごとの
+到達ページ・送信有無・ページ別の入力時間・逆行有無をまとめ、
+全ページの到達数・離脱数・入力時間を (ページ) ごとの bincount と逆順の累積和で一括計算する
+"""
+import numpy as np
+import pandas as pd
+
+FORM_EVENTS = ('form_start', 'form_progress', 'form_submit')
+FORM_SESSION_COLUMNS = ['session_id', 'max_step', 'submitted', 'bounced', 'duration_ms', 'backflow']
+
+
+def build_form_sessions(df: pd.DataFrame) -> dict:
+    """
+    フォームを開始したセッションごとのフォーム行動を集計する
+
+    form_progress はページを離れるときに送られ、form_page_number（離れたページ）・form_duration_ms
+    （そのページの入力時間）・form_direction（'forward' / 'backward' / 'exit'）を持つものとする。
+
+    Args:
+        df: イベント単位のデータフレーム（フィルター適用済みでも可）
+
+    Returns:
+        dict: 'sessions'（'session_id', 'max_step'（到達した最大ページ）, 'submitted', 'bounced'（開始後に入力なし）,
+            'duration_ms'（合計入力時間）, 'backflow'（前のページへ戻ったか）の DataFrame）,
+            'step_time_ms'（セッション × ページの入力時間の合計。行は sessions と同じ並び、列0はページ1）
+    """
+    events = df[df['event_name'].isin(FORM_EVENTS)]
+    session_codes, session_ids = pd.factorize(events['session_id'])
+    n = len(session_ids)
+    names = events['event_name'].to_numpy()
+    steps = pd.to_numeric(events['form_page_number'], errors='coerce').fillna(1).to_numpy(dtype=np.int64) if 'form_page_number' in events.columns else np.ones(len(events), dtype=np.int64)
+    durations = pd.to_numeric(events['form_duration_ms'], errors='coerce').fillna(0).to_numpy(dtype=float) if 'form_duration_ms' in events.columns else np.zeros(len(events))
+    is_progress = names == 'form_progress'
+    is_submit = names == 'form_submit'
+
+    max_step = np.zeros(n, dtype=np.int64)
+    np.maximum.at(max_step, session_codes, steps)
+    started = np.bincount(session_codes, weights=(names == 'form_start'), minlength=n) > 0
+    submitted = np.bincount(session_codes, weights=is_submit, minlength=n) > 0
+    progressed = np.bincount(session_codes, weights=is_progress, minlength=n) > 0
+    backward = is_progress & (events['form_direction'].to_numpy() == 'backward') if 'form_direction' in events.columns else np.zeros(len(events), dtype=bool)
+    backflow = np.bincount(session_codes, weights=backward, minlength=n) > 0
+
+    # ページ別の入力時間は form_progress の時間を (セッション, ページ) ごとに合計する
+    n_steps = int(steps.max()) if len(steps) else 0
+    flat = session_codes[is_progress] * max(n_steps, 1) + steps[is_progress] - 1
+    step_time = np.bincount(flat, weights=durations[is_progress], minlength=n * max(n_steps, 1)).reshape(n, max(n_steps, 1))
+
+    sessions = pd.DataFrame({
+        'session_id': np.asarray(session_ids),
+        'max_step': max_step,
+        'submitted': submitted,
+        'bounced': started & ~progressed & ~submitted,
+        'duration_ms': step_time.sum(axis=1),
+        'backflow': backflow,
+    })
+    # form_start のないセッション（期間の境界で開始が切れたものなど）は除く
+    keep = started | submitted
+    return {'sessions': sessions[keep].reset_index(drop=True), 'step_time_ms': step_time[keep, :n_steps]}
+
+
+def form_summary(form: dict) -> dict:
+    """
+    フォーム全体の主要指標を計算する
+
+    Args:
+        form: build_form_sessions() の戻り値
+
+    Returns:
+        dict: 'start_sessions', 'submit_sessions', 'submission_rate', 'bounce_rate', 'avg_max_step',
+            'avg_duration_sec'（入力したセッションの平均合計入力時間）, 'backflow_rate'
+    """
+    sessions = form['sessions']
+    n = len(sessions)
+    entered = sessions.loc[~sessions['bounced'], 'duration_ms']
+    return {
+        'start_sessions': n,
+        'submit_sessions': int(sessions['submitted'].sum()),
+        'submission_rate': float(sessions['submitted'].mean()) if n else 0.0,
+        'bounce_rate': float(sessions['bounced'].mean()) if n else 0.0,
+        'avg_max_step': float(sessions['max_step'].mean()) if n else 0.0,
+        'avg_duration_sec': float(entered.mean() / 1000) if len(entered) else 0.0,
+        'backflow_rate': float(sessions['backflow'].mean()) if n else 0.0,
+    }
+
+
+def form_step_funnel(form: dict) -> pd.DataFrame:
+    """
+    フォームのページごとの到達数・離脱数・入力時間を計算する
+
+    到達数は「最大到達ページがそのページ以上のセッション数」を逆順の累積和で、
+    離脱数は「送信せずに最大到達ページがそのページのセッション数」を bincount で求める。
+
+    Args:
+        form: build_form_sessions() の戻り値
+
+    Returns:
+        pd.DataFrame: 'ページ', '到達数', '到達率'（開始に対する割合）, '離脱数', '離脱率'（到達に対する割合）,
+            '平均入力時間(秒)'（そのページで入力したセッションの平均）, '入力時間の中央値(秒)'
+    """
+    columns = ['ページ', '到達数', '到達率', '離脱数', '離脱率', '平均入力時間(秒)', '入力時間の中央値(秒)']
+    sessions, step_time = form['sessions'], form['step_time_ms']
+    if sessions.empty:
+        return pd.DataFrame(columns=columns)
+    n_steps = max(int(sessions['max_step'].max()), step_time.shape[1])
+    max_step = sessions['max_step'].to_numpy()
+    reached = np.cumsum(np.bincount(max_step, minlength=n_steps + 1)[::-1])[::-1][1:]
+    exits = np.bincount(max_step[~sessions['submitted'].to_numpy()], minlength=n_steps + 1)[1:]
+
+    step_time = np.pad(step_time, ((0, 0), (0, n_steps - step_time.shape[1])))
+    entered = step_time > 0
+    entered_count = entered.sum(axis=0)
+    # 入力したセッションだけの中央値（入力なしは NaN にして除く）
+    median = np.nanmedian(np.where(entered, step_time, np.nan), axis=0) if entered.any() else np.full(n_steps, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(entered_count > 0, step_time.sum(axis=0) / entered_count, np.nan)
+    return pd.DataFrame({
+        'ページ': np.arange(1, n_steps + 1),
+        '到達数': reached.astype(np.int64),
+        '到達率': reached / len(sessions),
+        '離脱数': exits.astype(np.int64),
+        '離脱率': np.where(reached > 0, exits / np.maximum(reached, 1), np.nan),
+        '平均入力時間(秒)': mean / 1000,
+        '入力時間の中央値(秒)': median / 1000,
+    })
@@ -112,8 +112,40 @@ DEFAULT_CONFIG = {
     'fb_depth_bonus': 0.1,
     'exit_pop_bounce_bonus': 0.2,
     'info_jump_backflow_bonus': 0.6,
+    # 動画ページ（ページ番号 -> 動画URL）と視聴モデル
+    'video_pages': {1: 'https://shungene.lm-c.jp/tst08/01.mp4', 8: 'https://shungene.lm-c.jp/tst08/06.mp4'},
+    'video_duration_ms': 30000,
+    'video_play_rate': 0.6,
+    # 最終ページの入力フォーム（瞬フォーム）のモデル
+    'form_steps': 5, # フォームのページ数
+    'form_start_rate': 0.4, # 最終ページまで来たCVしない人がフォームを開始する確率
+    'form_bounce_rate': 0.15, # 開始したが何も入力せずに離れる確率
+    'form_step_continue': 0.85, # CVしない人が次のページへ進む確率
+    'form_bottleneck_steps': {3: 0.2}, # 3ページ目（住所など）で追加で脱落
+    'form_step_seconds': [6, 12, 20, 10, 5], # ページごとの入力時間の目安（秒）
+    'form_backflow_rate': 0.08, # 前のページへ戻る確率
 }
 
+# 動画の視聴段階のイベント（視聴割合 -> イベント名）
+VIDEO_PROGRESS_EVENTS = [(0.25, 'video_progress_25'), (0.5, 'video_progress_50'), (0.75, 'video_progress_75'), (1.0, 'video_completion')]
+
+# UTMパラメータ設定（参照元 -> 取りうるメディアと参照元URL）
+TRAFFIC_SOURCES = {
+    "google": {"mediums": ["organic", "cpc"], "referrer": "https://www.google.com/"},
+    "yahoo": {"mediums": ["organic", "cpc"], "referrer": "https://www.yahoo.co.jp/"},
+    "bing": {"mediums": ["organic", "cpc"], "referrer": "https://www.bing.com/"},
+    "facebook": {"mediums": ["social", "paidsocial", "referral"], "referrer": "https://www.facebook.com/"},
+    "instagram": {"mediums": ["social", "paidsocial"], "referrer": "https://www.instagram.com/"},
+    "twitter": {"mediums": ["social", "paidsocial"], "referrer": "https://t.co/"},
+    "youtube": {"mediums": ["paidvideo", "referral"], "referrer": "https://www.youtube.com/"},
+    "smartnews": {"mediums": ["display", "referral"], "referrer": "https://www.smartnews.com/"},
+    "line": {"mediums": ["social", "paidsocial"], "referrer": "https://line.me/"},
+    "direct": {"mediums": ["(none)"], "referrer": None}
+}
+UTM_CAMPAIGNS = ["spring_sale", "summer_campaign", "brand_awareness", None]
+AB_VARIANTS = ["A", "B"]
+AB_TEST_TARGETS = ['hero_image', 'cta_button', 'headline', 'layout', None]
+
 def generate_dummy_data(scenario: str = '標準（ベースライン）', num_days: int = 30, num_pages: int = 10, target_cvr: float = 0.04, difficulty: str = '初級（穏やかな波）'):
     """
     リアルなスワイプLPイベントデータを生成
@@ -141,22 +173,10 @@ def generate_dummy_data(scenario: str = '標準（ベースライン）', num_da
         "form_progress", "scroll", "video_play", "conversion", "session_start"
     ]
     
-    # UTMパラメータ設定
-    traffic_sources = {
-        "google": {"mediums": ["organic", "cpc"], "referrer": "https://www.google.com/"},
-        "yahoo": {"mediums": ["organic", "cpc"], "referrer": "https://www.yahoo.co.jp/"},
-        "bing": {"mediums": ["organic", "cpc"], "referrer": "https://www.bing.com/"},
-        "facebook": {"mediums": ["social", "paidsocial", "referral"], "referrer": "https://www.facebook.com/"},
-        "instagram": {"mediums": ["social", "paidsocial"], "referrer": "https://www.instagram.com/"},
-        "twitter": {"mediums": ["social", "paidsocial"], "referrer": "https://t.co/"},
-        "youtube": {"mediums": ["paidvideo", "referral"], "referrer": "https://www.youtube.com/"},
-        "smartnews": {"mediums": ["display", "referral"], "referrer": "https://www.smartnews.com/"},
-        "line": {"mediums": ["social", "paidsocial"], "referrer": "https://line.me/"},
-        "direct": {"mediums": ["(none)"], "referrer": None}
-    }
-    utm_campaigns = ["spring_sale", "summer_campaign", "brand_awareness", None]
-    ab_variants = ["A", "B"]
-    ab_test_targets = ['hero_image', 'cta_button', 'headline', 'layout', None]
+    traffic_sources = TRAFFIC_SOURCES
+    utm_campaigns = UTM_CAMPAIGNS
+    ab_variants = AB_VARIANTS
+    ab_test_targets = AB_TEST_TARGETS
     
     data = []
     
@@ -358,9 +378,29 @@ def generate_dummy_data(scenario: str = '標準（ベースライン）', num_da
                     "elem_id": None,
                     "elem_classes": None,
                     "link_url": None,
-                    "video_src": None,
+                    "video_src": config['video_pages'].get(page_num),
                 }
                 current_page_events.append(event_data)
+
+                # Video Events: 動画ページでは再生開始と視聴段階（25%・50%・75%・完了）のイベントを出す
+                if event_data['video_src'] and random.random() < min(0.95, config['video_play_rate'] + (config['cta_video_bonus'] / 2 if is_converting else 0)):
+                    # 視聴時間は滞在時間の一部（CVする人は最後まで見やすい）
+                    watch_share = random.uniform(0.7, 1.0) if is_converting else random.uniform(0.2, 1.0)
+                    watched_fraction = min(1.0, stay_ms * watch_share / config['video_duration_ms'])
+                    play_event = event_data.copy()
+                    play_event['event_name'] = 'video_play'
+                    play_event['event_timestamp'] += timedelta(milliseconds=500)
+                    play_event['elem_tag'] = 'video'
+                    # ページ表示の指標は page_view 側だけに持たせる（平均滞在時間などに重複して数えない）
+                    play_event.update({'stay_ms': None, 'load_time_ms': None, 'scroll_pct': None})
+                    current_page_events.append(play_event)
+                    for fraction, progress_event_name in VIDEO_PROGRESS_EVENTS:
+                        if watched_fraction < fraction:
+                            break
+                        progress_event = play_event.copy()
+                        progress_event['event_name'] = progress_event_name
+                        progress_event['event_timestamp'] += timedelta(milliseconds=int(config['video_duration_ms'] * fraction))
+                        current_page_events.append(progress_event)
                 
                 # Click Event (CVする人はCTAクリック率も高い)
                 click_prob = config['cta_click_rate_base']
@@ -373,13 +413,66 @@ def generate_dummy_data(scenario: str = '標準（ベースライン）', num_da
                     click_event['event_timestamp'] += timedelta(milliseconds=random.randint(100, int(stay_ms)))
                     click_event['elem_tag'] = 'button'
                     click_event['elem_id'] = 'cta_button'
+                    # クリック位置（ページ内の相対座標、左上が0）: 大半はページ下部のCTAボタン付近、残りは画像などへのクリック
+                    if random.random() < 0.75:
+                        spread_x = 0.12 if device_type == 'mobile' else 0.07
+                        click_x, click_y = np.random.normal(0.5, spread_x), np.random.normal(0.84, 0.03)
+                    else:
+                        click_x, click_y = np.random.beta(2, 2), np.random.beta(1.5, 1.8)
+                    click_event['click_x_rel'] = round(float(np.clip(click_x, 0, 1)), 4)
+                    click_event['click_y_rel'] = round(float(np.clip(click_y, 0, 1)), 4)
                     current_page_events.append(click_event)
 
                 session_total_duration_ms += int(stay_ms + load_time_ms)
 
+            # --- フォームイベント生成 ---
+            # 最終ページまで来たセッションが入力フォームを開始し、ページを離れるごとに form_progress
+            # （そのページの番号・入力時間・移動方向）を、送信時に form_submit（合計入力時間）を出す
+            if max_page_reached == session_num_pages and (is_converting or random.random() < config['form_start_rate']):
+                form_base = event_data.copy()
+                form_base.update({'elem_tag': 'form', 'page_referrer': None, 'stay_ms': None, 'load_time_ms': None, 'scroll_pct': None})
+                form_time_ms = session_total_duration_ms
+                form_start_event = dict(form_base, event_name='form_start', form_page_number=1, form_duration_ms=0)
+                form_start_event['event_timestamp'] = session_start_time + timedelta(milliseconds=form_time_ms)
+                current_page_events.append(form_start_event)
+
+                if is_converting or random.random() >= config['form_bounce_rate']:
+                    step, form_total_ms, submitted = 1, 0, False
+                    num_steps = config['form_steps']
+                    while True:
+                        step_ms = int(lognorm.rvs(s=0.5, scale=config['form_step_seconds'][step - 1] * 1000))
+                        if is_converting:
+                            step_ms = int(step_ms * 0.9) # CVする人は迷わず入力する
+                        form_total_ms += step_ms
+                        if step > 1 and random.random() < config['form_backflow_rate']:
+                            direction, next_step = 'backward', step - 1
+                        elif is_converting or (step < num_steps and random.random() < config['form_step_continue'] - config['form_bottleneck_steps'].get(step, 0.0)):
+                            # 送信するのはCVする人だけ（CVしない人は最終ページで離脱する）
+                            direction, next_step = 'forward', step + 1
+                        else:
+                            direction, next_step = 'exit', None
+                        progress_event = dict(form_base, event_name='form_progress', form_page_number=step,
+                                              form_duration_ms=step_ms, form_direction=direction)
+                        progress_event['event_timestamp'] = session_start_time + timedelta(milliseconds=form_time_ms + form_total_ms)
+                        current_page_events.append(progress_event)
+                        if next_step is None:
+                            break
+                        if next_step > num_steps:
+                            submitted = True
+                            break
+                        step = next_step
+                        if form_total_ms > 600000: # 10分以上入力していたら離脱
+                            break
+                    if submitted:
+                        submit_event = dict(form_base, event_name='form_submit', form_page_number=num_steps, form_duration_ms=form_total_ms)
+                        submit_event['event_timestamp'] = session_start_time + timedelta(milliseconds=form_time_ms + form_total_ms + 500)
+                        current_page_events.append(submit_event)
+                    session_total_duration_ms += form_total_ms
+
             # --- CVイベント生成 ---
             if is_converting:
                 cv_event = current_page_events[-1].copy()
+                cv_event.update({'form_page_number': None, 'form_duration_ms': None, 'form_direction': None})
                 cv_event['event_name'] = 'conversion'
                 cv_event['event_timestamp'] += timedelta(milliseconds=1000)
                 cv_event['cv_type'] = random.choice(["primary", "micro"])
@@ -0,0 +1,191 @@
+"""
+インタラクション貢献度エンジン
+イベントデータから「セッション × インタラクション要素」の疎な回数行列をデータセットごとに1度だけ作成し、
+クリック率・表示ベースの率・CVRリフト・有意性を、全要素・全セグメントについて行列の積と集計で求める。
+elem_classes は作成時に要素ごとのクラス名トークンへ分解し、パターンの照合は要素の一覧に対してだけ行うため、
+イベント全体に正規表現を適用しない
+"""
+import re
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.stats import norm
+
+# 要素として扱わない（ページ表示そのものや成果を表す）イベント
+NON_INTERACTION_EVENTS = ('session_start', 'page_view', 'conversion')
+
+# 画面に表示する主要なインタラクションの定義
+# event: 対象イベント、classes / ids: クラス名トークン・要素IDに対するパターン（どちらかに一致すればよい）、
+# page_num: 要素が表示されるページ（1 なら全セッションに表示機会があるとみなす。CTAボタンは全ページにあるので 1）
+DEFAULT_INTERACTIONS = {
+    'CTAボタンクリック': {'event': 'click', 'classes': 'cta|btn-primary', 'ids': 'cta', 'page_num': 1},
+    'フローティングバナークリック': {'event': 'click', 'classes': 'floating', 'page_num': 1},
+    '離脱防止ポップアップクリック': {'event': 'click', 'classes': 'exit', 'page_num': 1},
+    '動画視聴完了': {'event': 'video_completion', 'page_num': 1},
+}
+
+
+def build_interaction_matrix(df: pd.DataFrame, sessions: pd.DataFrame) -> dict:
+    """
+    セッション × インタラクション要素の回数行列を作成する
+
+    要素は (イベント名, elem_classes, elem_id) の組み合わせで識別する。各イベントはちょうど1つの要素に
+    対応するため、複数の要素をまとめた定義でもイベント数を二重に数えない。
+    クラス名はユニークな要素ごとに空白で分解したトークンとして持つ。
+
+    Args:
+        df: イベント単位のデータフレーム
+        sessions: 同じデータから build_session_table() で作成したセッションテーブル（行の並びが行列の行になる）
+
+    Returns:
+        dict: 'counts'（セッション × 要素の CSR 行列、イベント数）, 'items'（要素の DataFrame:
+            'item'（表示名）, 'event', 'classes'（クラス名トークンのタプル）, 'elem_id'）, 'session_ids'
+    """
+    session_index = pd.Index(sessions['session_id'])
+    events = df[~df['event_name'].isin(NON_INTERACTION_EVENTS)]
+    rows = session_index.get_indexer(events['session_id'])
+    valid = rows >= 0
+    events, rows = events[valid], rows[valid]
+
+    keys = pd.DataFrame({
+        'event': events['event_name'].astype(str).to_numpy(),
+        'elem_classes': events['elem_classes'].to_numpy() if 'elem_classes' in events.columns else None,
+        'elem_id': events['elem_id'].to_numpy() if 'elem_id' in events.columns else None,
+    })
+    item_codes = keys.groupby(['event', 'elem_classes', 'elem_id'], sort=True, dropna=False).ngroup().to_numpy()
+    first_rows = np.unique(item_codes, return_index=True)[1]
+    items = keys.iloc[first_rows].reset_index(drop=True)
+    items['classes'] = [tuple(dict.fromkeys(str(v).split())) if isinstance(v, str) else () for v in items.pop('elem_classes')]
+    items['elem_id'] = pd.Series([str(v) if pd.notna(v) else None for v in items['elem_id']], dtype=object)
+    items.insert(0, 'item', [
+        event + ''.join('.' + c for c in classes) + (f"#{elem_id}" if elem_id else '')
+        for event, classes, elem_id in zip(items['event'], items['classes'], items['elem_id'])
+    ])
+    counts = sparse.csr_matrix(
+        (np.ones(len(item_codes), dtype=np.int32), (rows, item_codes)),
+        shape=(len(sessions), len(items)),
+    )
+    counts.sum_duplicates()
+    return {'counts': counts, 'items': items, 'session_ids': session_index.to_numpy()}
+
+
+def definition_selector(items: pd.DataFrame, definitions: dict = None) -> sparse.csr_matrix:
+    """
+    インタラクションの定義を「要素 × 定義」の0/1行列に変換する（パターンの照合は要素の一覧に対してだけ行う）
+
+    Args:
+        items: build_interaction_matrix() の 'items'
+        definitions: {名前: 定義}（DEFAULT_INTERACTIONS と同じ形式）。None なら全要素をそのまま使う
+
+    Returns:
+        sparse.csr_matrix: 要素 × 定義の行列
+    """
+    if definitions is None:
+        return sparse.identity(len(items), dtype=np.int32, format='csr')
+    columns = []
+    for definition in definitions.values():
+        match = (items['event'] == definition['event']).to_numpy().copy()
+        class_pattern, id_pattern = definition.get('classes'), definition.get('ids')
+        if class_pattern or id_pattern:
+            class_regex = re.compile(class_pattern) if class_pattern else None
+            id_regex = re.compile(id_pattern) if id_pattern else None
+            element_match = np.array([
+                (class_regex is not None and any(class_regex.search(c) for c in classes))
+                or (id_regex is not None and elem_id is not None and bool(id_regex.search(elem_id)))
+                for classes, elem_id in zip(items['classes'], items['elem_id'])
+            ], dtype=bool)
+            match &= element_match
+        columns.append(match)
+    selector = np.column_stack(columns) if columns else np.zeros((len(items), 0), dtype=bool)
+    return sparse.csr_matrix(selector.astype(np.int32))
+
+
+def interaction_stats(matrix: dict, sessions: pd.DataFrame, definitions: dict = None, session_mask=None,
+                      segment: str = None, min_sessions: int = 0) -> pd.DataFrame:
+    """
+    全インタラクション（・全セグメント）の実行数・クリック率・CVRリフト・有意性を計算する
+
+    インタラクション有無の行列 B（セッション × インタラクション）とセグメントのone-hot行列 G から、
+    B^T G で実行セッション数、B^T (G × CV) で実行セッションのCV数を一括で求める。
+    同じセッションが複数の要素に一致しても、1つの定義の中では1回と数える。
+
+    Args:
+        matrix: build_interaction_matrix() の戻り値
+        sessions: matrix と同じ並びのセッションテーブル
+        definitions: {名前: 定義}。None なら全要素を個別のインタラクションとして扱う
+        session_mask: 対象セッションの真偽配列（フィルター条件）
+        segment: セグメントに分ける列名（None なら全体）
+        min_sessions: 実行セッション数がこれ未満の行を除く
+
+    Returns:
+        pd.DataFrame: 'interaction', 'segment', 'sessions', 'impressions'（表示機会のあるセッション数）,
+            'actions'（イベント数）, 'action_sessions', 'action_rate'（表示あたりの実行率）,
+            'cvr_with', 'cvr_without', 'lift'（相対リフト）, 'z', 'p_value'
+    """
+    n = len(sessions)
+    mask = np.ones(n, dtype=bool) if session_mask is None else np.asarray(session_mask, dtype=bool)
+    selector = definition_selector(matrix['items'], definitions)
+    names = list(definitions.keys()) if definitions is not None else matrix['items']['item'].tolist()
+    page_nums = np.array([d.get('page_num', 1) for d in definitions.values()]) if definitions is not None else np.ones(len(names))
+
+    counts = (matrix['counts'] @ selector).tocsc()
+    did = (counts > 0).astype(np.float64)
+
+    if segment is None:
+        seg_codes = np.zeros(n, dtype=np.int64)
+        seg_labels = np.array(['全体'], dtype=object)
+    else:
+        seg_codes, seg_labels = pd.factorize(sessions[segment].fillna('(not set)'), sort=True)
+    seg_codes = np.where(mask, seg_codes, -1)
+    in_seg = seg_codes >= 0
+    n_segments = len(seg_labels)
+    group = sparse.csr_matrix((np.ones(int(in_seg.sum())), (np.flatnonzero(in_seg), seg_codes[in_seg])), shape=(n, n_segments))
+
+    converted = sessions['is_cv'].to_numpy(dtype=bool)
+    max_page = sessions['max_page_reached'].to_numpy(dtype=float)
+    group_cv = group.multiply(converted[:, None]).tocsr()
+
+    # (インタラクション × セグメント) の集計
+    action_sessions = (did.T @ group).toarray()
+    action_cv = (did.T @ group_cv).toarray()
+    actions = (counts.T @ group).toarray()
+    seg_sessions = np.asarray(group.sum(axis=0)).ravel()
+    seg_cv = np.asarray(group_cv.sum(axis=0)).ravel()
+    # 表示機会: 要素のあるページまで到達したセッション（page_num の種類ごとに1回だけ数える）
+    impressions = np.zeros_like(action_sessions)
+    for page in np.unique(page_nums):
+        reached = (max_page >= page) if page > 1 else np.ones(n, dtype=bool)
+        impressions[page_nums == page] = np.bincount(seg_codes[in_seg & reached], minlength=n_segments)
+
+    without_sessions = seg_sessions[None, :] - action_sessions
+    without_cv = seg_cv[None, :] - action_cv
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cvr_with = np.where(action_sessions > 0, action_cv / action_sessions, np.nan)
+        cvr_without = np.where(without_sessions > 0, without_cv / without_sessions, np.nan)
+        lift = np.where(cvr_without > 0, cvr_with / cvr_without - 1, np.nan)
+        action_rate = np.where(impressions > 0, action_sessions / impressions, np.nan)
+        # 2標本の比率の差の z 検定（プールした比率で標準誤差を求める）
+        pooled = seg_cv[None, :] / np.maximum(seg_sessions[None, :], 1)
+        se = np.sqrt(pooled * (1 - pooled) * (1 / action_sessions + 1 / without_sessions))
+        z = np.where(se > 0, (cvr_with - cvr_without) / se, np.nan)
+    p_value = np.where(np.isfinite(z), 2 * norm.sf(np.abs(z)), np.nan)
+
+    k = len(names)
+    result = pd.DataFrame({
+        'interaction': np.repeat(np.asarray(names, dtype=object), n_segments),
+        'segment': np.tile(np.asarray(seg_labels, dtype=object), k),
+        'sessions': np.tile(seg_sessions, k).astype(np.int64),
+        'impressions': impressions.ravel().astype(np.int64),
+        'actions': actions.ravel().astype(np.int64),
+        'action_sessions': action_sessions.ravel().astype(np.int64),
+        'action_rate': action_rate.ravel(),
+        'cvr_with': cvr_with.ravel(),
+        'cvr_without': cvr_without.ravel(),
+        'lift': lift.ravel(),
+        'z': z.ravel(),
+        'p_value': p_value.ravel(),
+    })
+    if min_sessions:
+        result = result[result['action_sessions'] >= min_sessions].reset_index(drop=True)
+    return result
@@ -0,0 +1,51 @@
+"""
+LP・クライアント単位のパーティション
+データセットごとに1回だけ、キー列（client_id / lp_base_url）の値ごとの行番号を factorize と安定ソートで作っておき、
+LPやクライアントを選んだときはその行番号で行を取り出す。
+選択したLPの行数だけに比例した処理になり、保存しているLPの数が増えても1つのLPの絞り込みは遅くならない
+"""
+import numpy as np
+import pandas as pd
+
+PARTITION_COLUMNS = ('client_id', 'lp_base_url')
+
+
+def build_partitions(df: pd.DataFrame, column: str) -> dict:
+    """
+    キー列の値ごとの行番号（元の並び順のまま）を作る
+
+    Args:
+        df: イベント単位のデータフレーム
+        column: パーティションのキー列（'client_id' や 'lp_base_url'）
+
+    Returns:
+        dict: キーの値（昇順） -> 行番号（np.ndarray）。列がない・値が欠損の行は含めない
+    """
+    if column not in df.columns or df.empty:
+        return {}
+    codes, uniques = pd.factorize(df[column], sort=True)
+    valid = codes >= 0
+    rows = np.flatnonzero(valid)
+    # 安定ソートなので、パーティション内の行は元の並び（event_timestamp 順）のまま
+    order = rows[np.argsort(codes[valid], kind='stable')]
+    bounds = np.cumsum(np.bincount(codes[valid], minlength=len(uniques)))
+    return {key: rows_ for key, rows_ in zip(uniques.tolist(), np.split(order, bounds[:-1]))}
+
+
+def select(df: pd.DataFrame, partitions: dict, key) -> pd.DataFrame:
+    """
+    パーティションの行を取り出す
+
+    Args:
+        df: build_partitions() に渡したデータフレーム
+        partitions: build_partitions() の戻り値
+        key: キーの値（None なら絞り込まずに df を返す）
+
+    Returns:
+        pd.DataFrame: key の行だけのデータフレーム（key がなければ空）
+    """
+    if key is None:
+        return df
+    rows = partitions.get(key)
+    return df.iloc[rows] if rows is not None else df.iloc[:0]
+
@@ -27,9 +27,38 @@ import numpy as np
 import time
 import json
 import random
+import uuid
 
-from app.generate_dummy_data import generate_dummy_data
+from app.bulk_generator import DEFAULT_LP_CONTENT_URLS, generate_multi_lp_data, make_lp_catalog
 from app.capture_lp import extract_lp_text_content
+from app.session_table import build_session_table
+import app.bootstrap_ci as bootstrap_ci
+import app.anomaly_detection as anomaly_detection
+import app.path_analysis as path_analysis
+import app.survival_analysis as survival_analysis
+import app.attribution as attribution
+import app.cohort_analysis as cohort_analysis
+import app.distinct_sketch as distinct_sketch
+import app.quantile_sketch as quantile_sketch
+import app.performance_analysis as performance_analysis
+import app.interaction_matrix as interaction_matrix
+import app.click_heatmap as click_heatmap
+import app.lp_partitions as lp_partitions
+import app.demographics as demographics
+import app.calendar_cube as calendar_cube
+import app.chart_payload as chart_payload
+import app.profiling as profiling
+from app.analytics.common import filter_events, safe_rate
+import app.analytics.summary as summary_analytics
+import app.analytics.page_analysis as page_analytics
+import app.analytics.ab_test as ab_analytics
+import app.analytics.alerts as alert_analytics
+from app.analytics.dataset import dataset_table, open_dataset
+from app.analytics.filters import cube_filters, filter_spec, full_spec, period_spec, select_events, select_session_mask, spec_key
+from app.analytics.reports import cached_report
+from app.result_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_DISK_BYTES, DEFAULT_MAX_MEMORY_BYTES, DEFAULT_TTL_SEC, ResultCache
+import app.export as data_export
+from app.alert_scheduler import AlertScheduler, AlertStore, DEFAULT_INTERVAL_SEC, DEFAULT_STORE_PATH
 import app.ai_analysis as ai_analysis
 import app.capture_lp as capture_lp
 import app.quiz_generator as quiz_gen # Move import to top level to ensure reloading.
@@ -97,6 +126,12 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
+# リランごとの処理時間のトレース（直近のリランは「パフォーマンス診断」ページで p50 / p95 を確認できる）
+PROFILING_HISTORY_SIZE = 100
+rerun_trace = profiling.start_trace()
+st.session_state.setdefault('profiling_traces', []).append(rerun_trace)
+del st.session_state.profiling_traces[:-PROFILING_HISTORY_SIZE]
+
 # 上部のオレンジ色のバーを非表示にするためのカスタムCSS
 hide_decoration_bar_style = '''
     <style>
@@ -318,16 +353,14 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# --- 堅牢化のためのヘルパー関数 ---
-def safe_rate(numerator, denominator):
-    """ゼロ除算を回避して率を計算する (inf対応)"""
-    if isinstance(denominator, pd.Series):
-        # 分母が0の場所をnanに置き換えてから計算し、結果のinf/nanを0で埋める
-        denominator_safe = denominator.replace(0, np.nan)
-        rate = numerator.divide(denominator_safe)
-        return rate.replace([np.inf, -np.inf], np.nan).fillna(0)
-    # denominatorが単一の数値の場合
-    return numerator / denominator if denominator != 0 else 0.0
+
+def add_ci_band(fig, x, ci_low, ci_high, name='95%信頼区間', color='rgba(0, 32, 96, 0.15)'):
+    """折れ線グラフに信頼区間の帯（上限→下限の塗りつぶし）を追加する"""
+    fig.add_trace(go.Scatter(x=list(x), y=list(ci_high), mode='lines', line=dict(width=0),
+                             showlegend=False, hoverinfo='skip'))
+    fig.add_trace(go.Scatter(x=list(x), y=list(ci_low), mode='lines', line=dict(width=0),
+                             fill='tonexty', fillcolor=color, name=name, hoverinfo='skip'))
+    return fig
 
 # 比較期間のデータを取得する関数
 def get_comparison_data(df, current_start, current_end, comparison_type):
@@ -687,6 +720,11 @@ with st.sidebar.expander("難易度設定ガイド"):
     最初は順調ですが、ある時点から急激にパフォーマンスが悪化します。異常検知と緊急対応のトレーニングに適しています。
     """)
 
+# 複数クライアント・複数LPのデータを生成する（1件目のLPは上の設定、2件目以降はページ数・素材・シナリオがLPごとに異なる）
+with st.sidebar.expander("クライアント・LPの数"):
+    num_clients_gen = st.number_input("クライアント数", min_value=1, max_value=10, value=1, step=1, key="generate_num_clients")
+    lps_per_client_gen = st.number_input("1クライアントあたりのLP数", min_value=1, max_value=50, value=1, step=1, key="generate_lps_per_client")
+
 # Update session state from widgets
 # st.session_state.custom_cvr_multiplier = custom_cvr_mult # Removed
 # Values are already updated in session state via slider_and_input callbacks
@@ -711,16 +749,26 @@ if st.sidebar.button("ダミーデータを生成", key="global_generate_data",
             'backflow_base': 0.05,
             'device_dist': ['mobile', 'desktop'],
             'device_weights': [0.7, 0.3],
-            'num_pages_dist': lambda: random.randint(10, 15),
+            'num_pages_range': (10, 15),
         }
         
-        st.session_state.generated_data = generate_dummy_data(
-            scenario='カスタム（AI分析反映）',
-            num_days=num_days_gen,
-            target_cvr=target_cvr_input / 100,
-            difficulty=difficulty_mode
-        )
+        lp_catalog = make_lp_catalog(int(num_clients_gen), int(lps_per_client_gen), base_scenario='カスタム（AI分析反映）')
+        with profiling.stage('generate_data') as generate_stage:
+            st.session_state.generated_data = generate_multi_lp_data(
+                lp_catalog,
+                num_days=num_days_gen,
+                target_cvr=target_cvr_input / 100,
+                difficulty=difficulty_mode
+            )
+            generate_stage['rows_out'] = len(st.session_state.generated_data)
+        # LPごとの素材（ページ分析のコンテンツ表示に使用）
+        st.session_state.lp_catalog = {spec['lp_url']: spec for spec in lp_catalog}
         st.session_state.data_scenario = 'カスタム（AI分析反映）'
+        # 作り直す前のデータセットの集計結果・ダウンロード用ファイルは捨てる（次のリランで invalidate する）
+        if st.session_state.get('data_version'):
+            st.session_state.stale_data_version = st.session_state.data_version
+        # データセットのバージョンID（フィルター結果・信頼区間などのキャッシュキーに使用）
+        st.session_state.data_version = uuid.uuid4().hex
     
     # ページリダイレクトを削除し、現在のページを維持する
     pass
@@ -732,88 +780,250 @@ if st.sidebar.button("ダミーデータを生成", key="global_generate_data",
 
 st.sidebar.markdown("---")
 
-# --- 堅牢化のためのヘルパー関数 ---
-def assign_channel(row):
+@profiling.profiled('filter_dataframe')
+def filter_dataframe(df, start_date, end_date, lp_url, device, user_type, cv_status, channel, source_medium, partitions=None):
+    """
+    データフレームを各種条件でフィルタリングする
+    partitions（LPごとの行番号）を渡すと、LPを選んだときはそのLPの行だけを走査する
+    （データフレーム全体をハッシュするキャッシュより速く、LPの数が増えても遅くならない）
+    """
+    return filter_events(df, start_date, end_date, lp_url, device, user_type, cv_status, channel, source_medium, partitions=partitions)
+
+def make_filter_key(start_date, end_date, lp_url, device, user_type, cv_status, channel, source_medium):
+    """フィルター条件をキャッシュキーとして使えるタプルに正規化する"""
+    return (str(start_date), str(end_date), lp_url, device, user_type, cv_status, channel, source_medium)
+
+@profiling.profiled('session_table', cached=True)
+@st.cache_data(show_spinner=False, max_entries=64)
+def get_session_table(data_version, filter_key, _filtered_df):
     """
-    utm_sourceとutm_mediumに基づいてチャネルを割り当てる関数。
-    YouTube広告やその他の有料広告に対応。
+    フィルター適用済みデータのセッションテーブルを取得する（データバージョン＋フィルター条件でキャッシュ）
+    _filtered_df は先頭のアンダースコアによりハッシュ対象外
     """
-    source = str(row.get('utm_source', '(direct)')).lower()
-    medium = str(row.get('utm_medium', '(none)')).lower()
-    referrer = str(row.get('page_referrer', ''))
+    profiling.note_cache_miss()
+    return build_session_table(_filtered_df)
+
+@profiling.profiled('bootstrap_ci', cached=True)
+@st.cache_data(show_spinner=False, max_entries=256)
+def get_bootstrap_ci(data_version, filter_key, metric, by, _session_table):
+    """指標のブートストラップ信頼区間を取得する（フィルター条件×指標でキャッシュ）"""
+    profiling.note_cache_miss()
+    return bootstrap_ci.grouped_ci(_session_table, metric, by=by)
+
+
+@profiling.profiled('anomaly_report', cached=True)
+@st.cache_data(show_spinner=False, max_entries=16)
+def get_anomaly_report(data_version, _dataset):
+    """全セグメント系列の異常検知結果（データセットごとにキャッシュ）"""
+    profiling.note_cache_miss()
+    return anomaly_detection.detect_anomalies(dataset_table(_dataset, 'sessions'))
+
+
+@profiling.profiled('path_analysis', cached=True)
+@st.cache_data(show_spinner=False, max_entries=32)
+def get_path_analysis(data_version, filter_key, page_count, _filtered_df, top_n=10):
+    """ページ遷移パス分析の結果一式を取得する（データバージョン＋フィルター条件でキャッシュ）"""
+    profiling.note_cache_miss()
+    sequences = path_analysis.build_page_sequences(_filtered_df)
+    return {
+        'sequences': sequences,
+        'transitions': path_analysis.transition_matrix(sequences, page_count),
+        'transition_rates': path_analysis.transition_matrix(sequences, page_count, normalize=True),
+        'top_paths': path_analysis.top_paths(sequences, n=top_n),
+        'backflow': path_analysis.backflow_loops(sequences),
+        'time_to_next': path_analysis.time_to_next_page(sequences),
+    }
+
 
-    # 1. Paid Search (有料検索)
-    # mediumがcpc, ppc, paidsearchの場合。sourceが検索エンジン系であることを優先。
-    if medium in ['cpc', 'ppc', 'paidsearch']:
-        return 'Paid Search'
+@profiling.profiled('survival_curves', cached=True)
+@st.cache_data(show_spinner=False, max_entries=64)
+def get_survival_curves(data_version, filter_key, by, max_page, _session_table):
+    """セグメント別のカプラン・マイヤー到達率・離脱ハザードを取得する（フィルター条件×セグメント軸でキャッシュ）"""
+    profiling.note_cache_miss()
+    return survival_analysis.kaplan_meier(_session_table, by=by, max_page=max_page)
 
-    # 2. Paid Social (有料ソーシャル)
-    # mediumがpaid_social, paidsocial, social_adなど。
-    if medium in ['paid_social', 'paidsocial', 'social_ad']:
-        return 'Paid Social'
 
-    # 3. Paid Video (有料動画)
-    if medium in ['paidvideo', 'paid_video']:
-        return 'Paid Video'
+@profiling.profiled('cohort_matrix', cached=True)
+@st.cache_data(show_spinner=False, max_entries=64)
+def get_cohort_matrix(data_version, filter_key, freq, _session_table):
+    """コホート × 経過期間の行列を取得する（データバージョン＋フィルター条件＋期間単位でキャッシュ）"""
+    profiling.note_cache_miss()
+    activity = cohort_analysis.build_user_activity(_session_table, freq)
+    return cohort_analysis.cohort_matrix(activity, freq)
 
-    # 4. Display (ディスプレイ広告)
-    if medium in ['display', 'banner', 'cpm']:
-        return 'Display'
 
-    # 5. Organic Search (自然検索)
-    if medium == 'organic':
-        return 'Organic Search'
+@profiling.profiled('page_view_loads', cached=True)
+@st.cache_data(show_spinner=False, max_entries=64)
+def get_page_view_loads(data_version, filter_key, _filtered_df):
+    """セッション × ページごとの読込時間と離脱フラグを取得する（データバージョン＋フィルター条件でキャッシュ）"""
+    profiling.note_cache_miss()
+    return performance_analysis.page_view_loads(_filtered_df)
 
-    # 6. Organic Social (自然ソーシャル)
-    # mediumがsocial、またはsourceが主要SNSの場合
-    if medium == 'social' or source in ['facebook', 'instagram', 'twitter', 'x.com', 't.co', 'linkedin', 'tiktok', 'youtube']:
-        return 'Organic Social'
 
-    # 7. Direct (直接流入)
-    if source == '(direct)' and medium == '(none)':
-        return 'Direct'
+@profiling.profiled('cvr_load_regression', cached=True)
+@st.cache_data(show_spinner=False, max_entries=64)
+def get_cvr_load_regression(data_version, filter_key, control, _session_table):
+    """読込時間100msあたりのCVR変化の推定結果を取得する（データバージョン＋フィルター条件でキャッシュ）"""
+    profiling.note_cache_miss()
+    return performance_analysis.cvr_load_regression(_session_table, control=control)
 
-    # 8. Email
-    if medium == 'email':
-        return 'Email'
 
-    # 9. Referral (参照)
-    if medium == 'referral':
-        return 'Referral'
+@profiling.profiled('partitions', cached=True)
+@st.cache_data(show_spinner=False, max_entries=32)
+def get_partitions(data_version, column, _df):
+    """キー列（client_id / lp_base_url）の値ごとの行番号を取得する（データバージョン＋キー列でキャッシュ）"""
+    profiling.note_cache_miss()
+    return lp_partitions.build_partitions(_df, column)
 
-    return 'Other' # どの条件にも当てはまらない場合
 
-@st.cache_data
-def filter_dataframe(df, start_date, end_date, lp_url, device, user_type, cv_status, channel, source_medium):
+@profiling.profiled('dataset', cached=True)
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_dataset(data_version, _df):
     """
-    データフレームを各種条件でフィルタリングする（キャッシュ対応）
+    前処理済みのイベントデータと派生テーブルをまとめたデータセットのハンドルを取得する（データバージョンでキャッシュ）
+    cache_resource なのでセッション間で同じハンドルを共有し、派生テーブルもデータセットごとに1回だけ作る
     """
-    # 期間フィルター
-    # datetime.date型の場合はpd.Timestampに変換して比較
-    start_ts = pd.to_datetime(start_date)
-    end_ts = pd.to_datetime(end_date)
-    
-    mask = (df['event_date'] >= start_ts) & (df['event_date'] <= end_ts)
-    
-    if lp_url:
-        mask &= (df['lp_base_url'] == lp_url)
-    
-    if device != "すべて":
-        mask &= (df['device_type'] == device)
-        
-    if user_type != "すべて":
-        mask &= (df['user_type'] == user_type)
-        
-    if cv_status != "すべて":
-        mask &= (df['conversion_status'] == cv_status)
-        
-    if channel != "すべて":
-        mask &= (df['channel'] == channel)
-        
-    if source_medium != "すべて":
-        mask &= (df['source_medium'] == source_medium)
-        
-    return df[mask]
+    profiling.note_cache_miss()
+    return open_dataset(_df, data_version)
+
+
+@st.cache_resource(show_spinner=False)
+def get_result_cache():
+    """
+    集計結果の共有キャッシュ（プロセス内で1つ。ディスクの段は同じディレクトリを使う他のプロセス・ローカルAPIとも共有する）
+    上限・TTL・保存先は config.yaml の result_cache で変えられる
+    """
+    cache_config = config.get('result_cache', {})
+    directory = cache_config.get('directory', DEFAULT_CACHE_DIR)
+    if directory and not os.path.isabs(directory):
+        directory = os.path.join(project_root, directory)
+    return ResultCache(
+        directory,
+        max_memory_bytes=int(cache_config.get('max_memory_mb', DEFAULT_MAX_MEMORY_BYTES / 1024 / 1024) * 1024 * 1024),
+        max_disk_bytes=int(cache_config.get('max_disk_mb', DEFAULT_MAX_DISK_BYTES / 1024 / 1024) * 1024 * 1024),
+        ttl_sec=cache_config.get('ttl_sec', DEFAULT_TTL_SEC),
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_export_manager():
+    """
+    ダウンロード用ファイルのマネージャー（プロセス内で1つ。大きなファイルはバックグラウンドのスレッドで作る）
+    保存先・バックグラウンドにする行数・容量の上限は config.yaml の exports で変えられる
+    """
+    export_config = config.get('exports', {})
+    directory = export_config.get('directory', data_export.DEFAULT_EXPORT_DIR)
+    if not os.path.isabs(directory):
+        directory = os.path.join(project_root, directory)
+    return data_export.ExportManager(
+        directory,
+        background_rows=export_config.get('background_rows', data_export.DEFAULT_BACKGROUND_ROWS),
+        max_disk_bytes=int(export_config.get('max_disk_mb', data_export.DEFAULT_MAX_DISK_BYTES / 1024 / 1024) * 1024 * 1024),
+    )
+
+
+def load_report(name, spec, **options):
+    """
+    表示中のデータセットのレポートを取得する（各ページはこの戻り値を描画する）
+    データバージョン＋レポート名＋フィルター条件＋オプションで共有キャッシュに保存し、同じ条件を見た他のセッションの結果も使う
+    """
+    return cached_report(result_cache, dataset, name, spec, **options)
+
+
+@profiling.profiled('prefecture_geojson', cached=True)
+@st.cache_data(show_spinner=False)
+def get_prefecture_geojson():
+    """同梱の都道府県GeoJSONを取得する"""
+    profiling.note_cache_miss()
+    return demographics.load_prefecture_geojson()
+
+
+@profiling.profiled('chart_spec', cached=True)
+@st.cache_data(show_spinner=False, max_entries=256)
+def get_chart_spec(data_version, filter_key, chart_id, _build_figure):
+    """チャートの図を作って間引いた dict とペイロードのバイト数を取得する（データバージョン＋フィルター条件＋チャートIDでキャッシュ）"""
+    profiling.note_cache_miss()
+    spec = chart_payload.downsample_figure(_build_figure())
+    return spec, chart_payload.payload_bytes(spec)
+
+
+def show_plotly_chart(fig, key, cache_key=None, chart_id=None):
+    """
+    長い時系列を間引いてからチャートを表示し、チャートごとのペイロードのバイト数を記録する
+
+    Args:
+        fig: plotly の Figure。cache_key を渡すときは Figure を作る関数
+        key: Streamlit の要素キー
+        cache_key: (データバージョン, フィルター条件) のタプル。渡すと作った図をキャッシュし、同じ条件の再描画では図を作り直さない
+        chart_id: キャッシュとバイト数の記録に使うチャートID（省略時は key）
+    """
+    chart_id = chart_id or key
+    with profiling.stage(f"chart:{chart_id}"):
+        if cache_key is not None:
+            spec, n_bytes = get_chart_spec(cache_key[0], cache_key[1], chart_id, fig)
+        else:
+            spec = chart_payload.downsample_figure(fig)
+            n_bytes = chart_payload.payload_bytes(spec)
+        st.session_state.setdefault('chart_payloads', {})[chart_id] = {
+            'points': chart_payload.count_points(spec), 'bytes': n_bytes, 'cached': cache_key is not None,
+        }
+        st.plotly_chart(spec, use_container_width=True, key=key)
+
+
+@st.fragment(run_every=2)
+def show_export_progress(export_key):
+    """作成中のダウンロード用ファイルの状態（この欄だけを数秒ごとに再実行し、作り終えたらページ全体を再実行する）"""
+    export_job = export_manager.job(export_key)
+    if export_job is None or export_job['status'] != 'running':
+        st.rerun()
+    st.info(f"ファイルを作成しています（{export_job['rows']:,}行）。作成が終わるとダウンロードボタンに変わります。")
+
+
+def show_export_panel(spec, frames, file_prefix='analysis_data'):
+    """
+    フィルター適用後のデータのダウンロード欄（ボタンを押したときだけファイルを作り、表示のたびに書き出さない）
+
+    Args:
+        spec: filter_spec() の戻り値（作ったファイルはデータバージョン＋フィルター条件＋単位＋形式ごとに使い回す）
+        frames: {単位（app.export.EXPORT_LEVELS のキー）: 書き出すデータフレーム}
+        file_prefix: ダウンロードするファイル名の先頭
+    """
+    export_cols = st.columns([2, 2, 3])
+    export_level = export_cols[0].selectbox("単位", list(frames), format_func=data_export.EXPORT_LEVELS.get, key="export_level")
+    export_format = export_cols[1].selectbox("形式", data_export.available_formats(), format_func=lambda f: data_export.EXPORT_FORMATS[f]['label'], key="export_format")
+    export_key = (dataset_version, spec_key(spec), export_level, export_format)
+    with export_cols[2]:
+        export_job = export_manager.job(export_key)
+        if export_job is None or export_job['status'] == 'error':
+            if export_job is not None:
+                st.caption(f"⚠️ ファイルを作成できませんでした: {export_job['error']}")
+            if st.button("ダウンロード用ファイルを作成", key="export_request", type="primary", use_container_width=True):
+                export_job = export_manager.request(export_key, frames[export_level])
+        if export_job is not None and export_job['status'] == 'running':
+            show_export_progress(export_key)
+        elif export_job is not None and export_job['status'] == 'done':
+            with open(export_job['path'], 'rb') as export_file:
+                st.download_button(
+                    label=f"{data_export.EXPORT_FORMATS[export_format]['label']}形式でダウンロード（{export_job['bytes'] / 1024 / 1024:,.1f} MB）",
+                    data=export_file,
+                    file_name=data_export.export_file_name(file_prefix, spec['start_date'], spec['end_date'], export_level, export_format),
+                    mime=data_export.EXPORT_FORMATS[export_format]['mime'],
+                    use_container_width=True,
+                    type="primary",
+                    key="export_download",
+                )
+
+
+@st.cache_resource(show_spinner=False)
+def get_alert_scheduler():
+    """アラートを定期評価するバックグラウンドスケジューラ（プロセス内で1つだけ起動する）"""
+    alert_config = config.get('alerts', {})
+    store_path = alert_config.get('store_path', DEFAULT_STORE_PATH)
+    if not os.path.isabs(store_path):
+        store_path = os.path.join(project_root, store_path)
+    scheduler = AlertScheduler(AlertStore(store_path), interval_sec=alert_config.get('interval_sec', DEFAULT_INTERVAL_SEC),
+                               max_datasets=alert_config.get('max_datasets', 8))
+    return scheduler.start()
 
 # --- 分析対象のDataFrameを決定 ---
 # セッションに生成されたデータがあればそれを使用し、なければ元のCSVデータを使用します。
@@ -830,32 +1040,46 @@ if "generated_data" not in st.session_state or st.session_state.generated_data.e
     st.stop()
 else:
     df = st.session_state.generated_data
-    df['event_date'] = pd.to_datetime(df['event_date'])
-    df['event_timestamp'] = pd.to_datetime(df['event_timestamp'])
+    # クライアントを選び、以降の前処理・集計・キャッシュはそのクライアントの行だけを対象にする
+    client_partitions = get_partitions(st.session_state.get('data_version'), 'client_id', df)
+    selected_client = None
+    if len(client_partitions) > 1:
+        selected_client = st.sidebar.selectbox("クライアント", list(client_partitions), key="selected_client")
+        df = lp_partitions.select(df, client_partitions, selected_client)
+    # キャッシュキーに使うデータセットのバージョン（クライアントごとに別のデータセットとして扱う）
+    dataset_version = f"{st.session_state.get('data_version')}:{selected_client}" if selected_client else st.session_state.get('data_version')
 
 
 # グルーピングされたメニュー項目
 menu_groups = {
-    "基本分析": ["全体サマリー", "リアルタイムビュー", "時系列分析", "デモグラフィック情報", "アラート"],
-    "LP最適化分析": ["ページ分析", "A/Bテスト分析"],
+    "基本分析": ["全体サマリー", "リアルタイムビュー", "時系列分析", "コホート分析", "デモグラフィック情報", "アラート"],
+    "LP最適化分析": ["ページ分析", "パフォーマンス分析", "A/Bテスト分析"],
     "詳細分析": ["広告分析", "インタラクション分析", "動画・スクロール分析", "瞬フォーム分析", "AIアナリスト（チャット）"],
     "ヘルプ": ["学習テスト", "LPOの基礎知識", "専門用語解説", "FAQ"]
 }
 
 # --- 共通の前処理 ---
-# channel列を追加
-df['channel'] = df.apply(assign_channel, axis=1)
-# LPのベースURL列を追加
-df['lp_base_url'] = df['page_location'].str.split('#').str[0]
-# twitterをXに置換
-df['utm_source_display'] = df['utm_source'].replace('twitter', 'X')
-# NaN値を '(none)' に置換
-df['utm_source_display'].fillna('(direct)', inplace=True)
-df['utm_medium'].fillna('(none)', inplace=True)
-# source / medium を作成
-df['source_medium'] = df['utm_source_display'] + ' / ' + df['utm_medium']
-# 論理的に不自然な組み合わせを除外 (例: direct / cpc)
-df = df[~((df['utm_source_display'] == '(direct)') & (df['utm_medium'] != '(none)'))]
+# channel, lp_base_url, source_medium, user_type, conversion_status, セッション開始の時間帯・曜日・週・月などの列を
+# データセットごとに1回だけ追加する（app.analytics.dataset.prepare_events()）。df は読み取り専用として扱い、各ページで列を書き込まない
+dataset = get_dataset(dataset_version, df)
+df = dataset['events']
+# このリランで表示したチャートのペイロード（点数・バイト数）
+st.session_state.chart_payloads = {}
+# LPごとの行番号（LPを選んだページはこのパーティションだけを絞り込む）
+lp_partition_index = dataset['partitions']
+lp_catalog = st.session_state.get('lp_catalog', {})
+
+# 集計結果の共有キャッシュとダウンロード用ファイル（データを作り直したら古いバージョンの結果・ファイルを捨てる）
+result_cache = get_result_cache()
+export_manager = get_export_manager()
+stale_data_version = st.session_state.pop('stale_data_version', None)
+if stale_data_version:
+    result_cache.invalidate(stale_data_version)
+    export_manager.invalidate(stale_data_version)
+
+# アラートの定期評価にデータセットを登録（同じデータセットの再登録は無視される）
+alert_scheduler = get_alert_scheduler()
+alert_scheduler.submit(dataset_version, df)
 
 
 DEFAULT_PAGE = "全体サマリー"
@@ -890,6 +1114,8 @@ for group_name, items in menu_groups.items():
     st.sidebar.markdown("---")
 
 # 選択された分析項目に応じて表示を切り替え
+profiling.set_trace_label(selected_analysis)
+page_stage = profiling.begin_stage(f"page:{selected_analysis}")
 
 if selected_analysis == "全体サマリー":
     st.markdown('<div class="sub-header">全体サマリー</div>', unsafe_allow_html=True)
@@ -910,7 +1136,7 @@ if selected_analysis == "全体サマリー":
 
     with filter_cols_1[1]:
         # LP選択
-        lp_options = sorted(df['lp_base_url'].dropna().unique().tolist())
+        lp_options = list(lp_partition_index)
         selected_lp_base_url = st.selectbox(
             "LP選択", 
             lp_options, 
@@ -980,76 +1206,31 @@ if selected_analysis == "全体サマリー":
 
     # ページ上部にフィルターを配置ここまで
     comparison_type = None # 初期化
-    # 期間フィルターのみを適用したDataFrame（テーブル表示用）
-    period_filtered_df = df[
-        (df['event_date'] >= pd.to_datetime(start_date)) &
-        (df['event_date'] <= pd.to_datetime(end_date))
-    ]
-
-    # --- 新規/リピート、CV/非CVの列を追加 ---
-    df['user_type'] = np.where(df['ga_session_number'] == 1, '新規', 'リピート')
-    conversion_session_ids = df[df['cv_type'].notna()]['session_id'].unique()
-    df['conversion_status'] = np.where(df['session_id'].isin(conversion_session_ids), 'コンバージョン', '非コンバージョン')
-
-    # KPIカードやグラフ用のデータフィルタリング（期間＋LP）
-    # キャッシュされたフィルタリング関数を使用
-    filtered_df = filter_dataframe(
-        df, 
-        start_date, 
-        end_date, 
-        selected_lp_base_url, 
-        selected_device, 
-        selected_user_type, 
-        selected_conversion_status, 
-        selected_channel, 
-        selected_source_medium
-    )
-
-    # --- データダウンロード機能 ---
-    st.markdown("##### フィルター適用後のデータをダウンロード")
-    st.markdown('<div class="graph-description">現在選択されているフィルター条件で絞り込んだ生データをCSVファイルとしてダウンロードできます。日報や週報の作成にご活用ください。</div>', unsafe_allow_html=True)
-
-    # CSVに変換する関数
-    @st.cache_data()
-    def convert_df_to_csv(df_to_convert):
-        # IMPORTANT: utf-8-sig を使用してExcelでの日本語文字化けを防ぐ
-        return df_to_convert.to_csv(index=False).encode('utf-8-sig')
-
-    csv_data = convert_df_to_csv(filtered_df)
-    
-    # ダウンロードボタン
-    st.download_button(
-       label="CSV形式でダウンロード",
-       data=csv_data,
-       file_name=f"analysis_data_{pd.to_datetime(start_date).strftime('%Y%m%d')}_{pd.to_datetime(end_date).strftime('%Y%m%d')}.csv",
-       mime='text/csv',
-       use_container_width=True,
-       type="primary"
-    )
+    # KPIカードやグラフ用のデータフィルタリング（期間＋LP＋クロス分析用フィルター）
+    summary_spec = filter_spec(start_date, end_date, selected_lp_base_url, selected_device, selected_user_type,
+                               selected_conversion_status, selected_channel, selected_source_medium)
+    filtered_df = select_events(dataset, summary_spec)
 
     # データが空の場合の処理
     if len(filtered_df) == 0:
         st.warning("⚠️ 選択した条件に該当するデータがありません。フィルターを変更してください。")
         st.stop()
 
-    # 基本メトリクス計算
-    total_sessions = filtered_df['session_id'].nunique()
-    total_conversions = filtered_df[filtered_df['cv_type'].notna()]['session_id'].nunique()
-    conversion_rate = safe_rate(total_conversions, total_sessions) * 100
-    clicked_sessions = filtered_df[filtered_df['event_name'] == 'click']['session_id'].nunique()
-    total_clicks = clicked_sessions
-    click_rate = (total_clicks / total_sessions * 100) if total_sessions > 0 else 0
-    avg_stay_time = filtered_df['stay_ms'].mean() / 1000  # 秒に変換
-    avg_pages_reached = filtered_df.groupby('session_id')['max_page_reached'].max().mean()
-    fv_retention_rate = (filtered_df[filtered_df['max_page_reached'] >= 2]['session_id'].nunique() / total_sessions * 100) if total_sessions > 0 else 0
-    final_cta_rate = (filtered_df[filtered_df['max_page_reached'] >= 10]['session_id'].nunique() / total_sessions * 100) if total_sessions > 0 else 0
-    avg_load_time = filtered_df['load_time_ms'].mean()
+    # 信頼区間の計算に使うセッションテーブル（フィルター条件ごとにキャッシュ）
+    data_version = dataset_version
+    summary_filter_key = make_filter_key(start_date, end_date, selected_lp_base_url, selected_device, selected_user_type, selected_conversion_status, selected_channel, selected_source_medium)
+    summary_sessions = get_session_table(data_version, summary_filter_key, filtered_df)
+
+    # --- データダウンロード機能 ---
+    st.markdown("##### フィルター適用後のデータをダウンロード")
+    st.markdown('<div class="graph-description">現在選択されているフィルター条件で絞り込んだデータを、イベント単位（生データ）またはセッション単位でダウンロードできます。CSVはExcelでそのまま開けます。大きなデータはgzip圧縮のCSVかParquetがおすすめです。日報や週報の作成にご活用ください。</div>', unsafe_allow_html=True)
+    show_export_panel(summary_spec, {'events': filtered_df, 'sessions': summary_sessions})
 
     st.markdown('<div class="sub-header">主要指標（KPI）</div>', unsafe_allow_html=True)
 
     # 主要KPIを算出して表示
     # 比較機能をKPIヘッダーの下に配置
-    comp_cols = st.columns([1, 1, 4]) # チェックボックス、選択ボックス、スペーサー
+    comp_cols = st.columns([1, 1, 2, 2]) # チェックボックス、選択ボックス、概算モード、スペーサー
     with comp_cols[0]:
         enable_comparison = st.checkbox("比較機能を有効化", value=False, key="summary_comparison_checkbox")
     with comp_cols[1]:
@@ -1060,18 +1241,39 @@ if selected_analysis == "全体サマリー":
             }
             selected_comparison = st.selectbox("比較対象", list(comparison_options.keys()), key="summary_comparison_selector", label_visibility="collapsed")
             comparison_type = comparison_options[selected_comparison]
+    with comp_cols[2]:
+        approx_distinct = st.toggle("ユニーク数を概算（HyperLogLog）", value=False, key="summary_approx_distinct",
+                                    help="セッション数・ユーザー数を日別スケッチのマージで概算します。長期間でも高速ですが、誤差があります。")
+
+    # KPI・日別KPI・ページパス別の表（app.analytics.summary。データバージョン＋フィルター条件でキャッシュ）
+    # 概算モードではイベントデータの nunique による正確なKPIを計算せず、件数はセッションテーブルから求める
+    summary_tables = load_report('summary', summary_spec, kpis=not approx_distinct)
+
+    # 基本メトリクス計算
+    if approx_distinct:
+        kpis = summary_analytics.summary_kpis(filtered_df, sessions=summary_sessions)
+    else:
+        kpis = summary_tables['kpis'].to_dict('records')[0]
+    total_sessions = kpis['sessions']
+    total_conversions = kpis['conversions']
+    conversion_rate = kpis['conversion_rate']
+    total_clicks = kpis['clicks']
+    click_rate = kpis['click_rate']
+    avg_stay_time = kpis['avg_stay_time']
+    avg_pages_reached = kpis['avg_pages_reached']
+    fv_retention_rate = kpis['fv_retention_rate']
+    final_cta_rate = kpis['final_cta_rate']
+    avg_load_time = kpis['avg_load_time']
 
     # 比較データの取得
     comparison_df = None
     comp_start = None
     comp_end = None
     if enable_comparison and comparison_type:
-        result = get_comparison_data(df, pd.Timestamp(start_date), pd.Timestamp(end_date), comparison_type)
+        # 比較データにも同じLPのパーティションだけを使う
+        result = get_comparison_data(lp_partitions.select(df, lp_partition_index, selected_lp_base_url or None), pd.Timestamp(start_date), pd.Timestamp(end_date), comparison_type)
         if result is not None:
             comparison_df, comp_start, comp_end = result
-            # 比較データにも同じフィルターを適用
-            if selected_lp_base_url:
-                comparison_df = comparison_df[comparison_df['lp_base_url'] == selected_lp_base_url]
             # --- 比較データにもクロス分析用フィルターを適用 ---
             if selected_device != "すべて":
                 comparison_df = comparison_df[comparison_df['device_type'] == selected_device]
@@ -1093,30 +1295,22 @@ if selected_analysis == "全体サマリー":
     # 比較データのKPI計算
     comp_kpis = {}
     if comparison_df is not None and len(comparison_df) > 0:
-        comp_total_sessions = comparison_df['session_id'].nunique()
-        comp_total_conversions = comparison_df[comparison_df['cv_type'].notna()]['session_id'].nunique()
-        comp_conversion_rate = (comp_total_conversions / comp_total_sessions * 100) if comp_total_sessions > 0 else 0
-        comp_clicked_sessions = comparison_df[comparison_df['event_name'] == 'click']['session_id'].nunique()
-        comp_total_clicks = comp_clicked_sessions
-        comp_click_rate = (comp_total_clicks / comp_total_sessions * 100) if comp_total_sessions > 0 else 0
-        comp_avg_stay_time = comparison_df['stay_ms'].mean() / 1000
-        comp_avg_pages_reached = comparison_df.groupby('session_id')['max_page_reached'].max().mean()
-        comp_fv_retention_rate = (comparison_df[comparison_df['max_page_reached'] >= 2]['session_id'].nunique() / comp_total_sessions * 100) if comp_total_sessions > 0 else 0
-        comp_final_cta_rate = (comparison_df[comparison_df['max_page_reached'] >= 10]['session_id'].nunique() / comp_total_sessions * 100) if comp_total_sessions > 0 else 0
-        comp_avg_load_time = comparison_df['load_time_ms'].mean()
-        
-        comp_kpis = {
-            'sessions': comp_total_sessions,
-            'conversions': comp_total_conversions,
-            'conversion_rate': comp_conversion_rate,
-            'clicks': comp_total_clicks,
-            'click_rate': comp_click_rate,
-            'avg_stay_time': comp_avg_stay_time,
-            'avg_pages_reached': comp_avg_pages_reached,
-            'fv_retention_rate': comp_fv_retention_rate,
-            'final_cta_rate': comp_final_cta_rate,
-            'avg_load_time': comp_avg_load_time
-        }
+        comp_kpis = summary_analytics.summary_kpis(comparison_df)
+
+    # ユニーク数: 概算モードではスケッチをマージして求める（誤差範囲つき）
+    sessions_label = f"{total_sessions:,}"
+    sessions_help = None
+    sketch_filters = cube_filters(summary_spec)
+    if not approx_distinct:
+        total_users = filtered_df['user_pseudo_id'].nunique()
+        users_label = f"{total_users:,}"
+    else:
+        sketches = dataset_table(dataset, 'distinct_sketches')
+        approx_sessions = distinct_sketch.query_distinct(sketches, 'session_id', start_date, end_date, sketch_filters)
+        approx_users = distinct_sketch.query_distinct(sketches, 'user_pseudo_id', start_date, end_date, sketch_filters)
+        sessions_label = f"≈{approx_sessions['estimate']:,.0f}"
+        sessions_help = f"95%範囲: {approx_sessions['low']:,.0f}〜{approx_sessions['high']:,.0f}（相対誤差 ±{approx_sessions['relative_error']:.1%}）"
+        users_label = f"≈{approx_users['estimate']:,.0f}（95%範囲: {approx_users['low']:,.0f}〜{approx_users['high']:,.0f}）"
 
     # KPIカード表示
     col1, col2, col3, col4, col5 = st.columns(5)
@@ -1124,7 +1318,7 @@ if selected_analysis == "全体サマリー":
     with col1:
         # セッション数
         delta_sessions = total_sessions - comp_kpis.get('sessions', 0) if comp_kpis else None
-        st.metric("セッション数", f"{total_sessions:,}", delta=f"{delta_sessions:+,}" if delta_sessions is not None else None)
+        st.metric("セッション数", sessions_label, delta=f"{delta_sessions:+,}" if delta_sessions is not None else None, help=sessions_help)
         
         # FV残存率
         delta_fv = fv_retention_rate - comp_kpis.get('fv_retention_rate', 0) if comp_kpis else None
@@ -1166,6 +1360,8 @@ if selected_analysis == "全体サマリー":
         delta_load = avg_load_time - comp_kpis.get('avg_load_time', 0) if comp_kpis else None
         st.metric("平均読込時間", f"{avg_load_time:.0f}ms", delta=f"{delta_load:+.0f} ms" if delta_load is not None else None, delta_color="inverse")
 
+    st.caption(f"ユニークユーザー数: {users_label}" + ("（HyperLogLog による概算）" if approx_distinct else ""))
+
     # KPIスコアカードと日別KPIテーブルの間にスペースを設ける
     st.markdown("<br>", unsafe_allow_html=True)
     st.markdown("<br>", unsafe_allow_html=True)
@@ -1174,47 +1370,8 @@ if selected_analysis == "全体サマリー":
     st.markdown("##### 日別KPI詳細")
     st.markdown('<div class="graph-description">選択した期間内の日ごとの主要指標です。</div>', unsafe_allow_html=True)
 
-    # 日別にKPIを計算
-    daily_df = filtered_df.groupby(filtered_df['event_date'].dt.date).agg(
-        セッション数=('session_id', 'nunique'),
-        クリック数=('event_name', lambda x: (x == 'click').sum()), # この計算は後で上書きされるのでそのままでOK
-        平均滞在時間=('stay_ms', 'mean')
-    ).reset_index()
-    daily_df.rename(columns={'event_date': '日付'}, inplace=True)
-
-    # --- 平均到達ページ数の正しい計算ロジック ---
-    # 日ごと、セッションごとに最大到達ページ数を取得
-    daily_session_max_page = filtered_df.groupby([filtered_df['event_date'].dt.date, 'session_id'])['max_page_reached'].max().reset_index()
-    # 日ごとにその平均を計算
-    daily_avg_pages = daily_session_max_page.groupby('event_date')['max_page_reached'].mean().reset_index()
-    daily_avg_pages.rename(columns={'event_date': '日付', 'max_page_reached': '平均到達ページ'}, inplace=True)
-
-    # 日別コンバージョン数
-    daily_cv = filtered_df[filtered_df['cv_type'].notna()].groupby(filtered_df['event_date'].dt.date)['session_id'].nunique().reset_index()
-    daily_cv.columns = ['日付', 'CV数']
-    daily_df = pd.merge(daily_df, daily_cv, on='日付', how='left').fillna(0)
-
-    # 日別FV残存数
-    daily_fv = filtered_df[filtered_df['max_page_reached'] >= 2].groupby(filtered_df['event_date'].dt.date)['session_id'].nunique().reset_index()
-    daily_fv.columns = ['日付', 'FV残存数']
-    daily_df = pd.merge(daily_df, daily_fv, on='日付', how='left').fillna(0)
-
-    # 日別最終CTA到達数
-    daily_final_cta = filtered_df[filtered_df['max_page_reached'] >= 10].groupby(filtered_df['event_date'].dt.date)['session_id'].nunique().reset_index()
-    daily_final_cta.columns = ['日付', '最終CTA到達数']
-    daily_df = pd.merge(daily_df, daily_final_cta, on='日付', how='left').fillna(0)
-
-    # 率を計算
-    daily_df['CVR'] = daily_df.apply(lambda row: safe_rate(row['CV数'], row['セッション数']) * 100, axis=1)
-    daily_df['CTR'] = daily_df.apply(lambda row: safe_rate(row['クリック数'], row['セッション数']) * 100, axis=1)
-    daily_df['FV残存率'] = daily_df.apply(lambda row: safe_rate(row['FV残存数'], row['セッション数']) * 100, axis=1)
-    daily_df['最終CTA到達率'] = daily_df.apply(lambda row: safe_rate(row['最終CTA到達数'], row['セッション数']) * 100, axis=1)
-    daily_df['平均滞在時間'] = daily_df['平均滞在時間'] / 1000
-    # 正しく計算した平均到達ページ数をマージ
-    daily_df = pd.merge(daily_df, daily_avg_pages, on='日付', how='left')
-
-    # 日付を降順にソート
-    daily_df = daily_df.sort_values(by='日付', ascending=False)
+    # 日別のKPI（日付の降順）
+    daily_df = summary_tables['daily']
 
     # 表示する列を選択
     display_cols_daily = ['日付', 'セッション数', 'CV数', 'CVR', 'クリック数', 'CTR', 'FV残存率', '最終CTA到達率', '平均到達ページ', '平均滞在時間']
@@ -1224,70 +1381,16 @@ if selected_analysis == "全体サマリー":
         'CVR': '{:.2f}%', 'CTR': '{:.2f}%', 'FV残存率': '{:.1f}%', '最終CTA到達率': '{:.1f}%',
         '平均到達ページ': '{:.1f}', '平均滞在時間': '{:.1f}秒'
     }), use_container_width=True, height=282, hide_index=True)
-    # page_pathごとのKPIを計算（期間フィルターのみ適用したデータを使用）
-    path_sessions = period_filtered_df.groupby('page_path')['session_id'].nunique()
-    path_users = period_filtered_df.groupby('page_path')['user_pseudo_id'].nunique()
-    path_conversions = period_filtered_df[period_filtered_df['cv_type'].notna()].groupby('page_path')['session_id'].nunique()
-    path_clicks = period_filtered_df[period_filtered_df['event_name'] == 'click'].groupby('page_path').size()
-    kpi_by_path = pd.DataFrame({
-        'セッション数': path_sessions,
-        'CV数': path_conversions,
-        'クリック数': path_clicks,
-        '平均滞在時間': period_filtered_df.groupby('page_path')['stay_ms'].mean() / 1000,
-        '平均到達ページ': period_filtered_df.groupby('page_path')['max_page_reached'].mean()
-    }).fillna(0)
-
-    kpi_by_path['CVR'] = kpi_by_path.apply(lambda row: safe_rate(row['CV数'], row['セッション数']) * 100, axis=1)
-    kpi_by_path['CTR'] = kpi_by_path.apply(lambda row: safe_rate(row['クリック数'], row['セッション数']) * 100, axis=1)
-    # FV残存率
-    fv_sessions = period_filtered_df[period_filtered_df['max_page_reached'] >= 2].groupby('page_path')['session_id'].nunique()
-    kpi_by_path['FV残存率'] = (safe_rate(fv_sessions, path_sessions) * 100).fillna(0) # safe_rateがSeriesを返すように
-    # 最終CTA到達率
-    final_cta_sessions = period_filtered_df[period_filtered_df['max_page_reached'] >= 10].groupby('page_path')['session_id'].nunique()
-    kpi_by_path['最終CTA到達率'] = (safe_rate(final_cta_sessions, path_sessions) * 100).fillna(0) # こちらも同様に修正
-
-    kpi_by_path = kpi_by_path.reset_index()
-    kpi_by_path.rename(columns={'page_path': 'ページパス'}, inplace=True)
-
-    # 表示する列を定義（変更なし）
+    # page_pathごとのKPI・インタラクション指標（期間フィルターのみ適用したデータで集計したもの）
+    kpi_by_path = summary_tables['paths']
+    interaction_kpis = summary_tables['path_interactions']
+
+    # 表示する列を定義
     display_cols = [
-        'ページパス', 'セッション数', 'CV数', 'CVR', 'クリック数', 'CTR', 
+        'ページパス', 'セッション数', 'CV数', 'CVR', 'クリック数', 'CTR',
         'FV残存率', '最終CTA到達率', '平均到達ページ', '平均滞在時間'
     ]
 
-    # --- インタラクションKPIの計算ロジック（期間フィルターのみ適用したデータを使用） ---
-    # CTAクリック
-    cta_clicks = period_filtered_df[
-        (period_filtered_df['event_name'] == 'click') & 
-        (period_filtered_df['elem_classes'].str.contains('cta|btn-primary', na=False))
-    ].groupby('page_path').size()
-
-    # フローティングバナークリック
-    floating_clicks = period_filtered_df[
-        (period_filtered_df['event_name'] == 'click') & 
-        (period_filtered_df['elem_classes'].str.contains('floating', na=False))
-    ].groupby('page_path').size()
-
-    # 離脱防止ポップアップクリック
-    exit_popup_clicks = period_filtered_df[
-        (period_filtered_df['event_name'] == 'click') & 
-        (period_filtered_df['elem_classes'].str.contains('exit', na=False))
-    ].groupby('page_path').size()
-
-    interaction_kpis = pd.DataFrame({
-        'セッション数': path_sessions,
-        'ユニークユーザー数': path_users,
-        'CTAクリック数': cta_clicks,
-        'FBクリック数': floating_clicks,
-        '離脱防止POPクリック数': exit_popup_clicks
-    }).fillna(0)
-
-    interaction_kpis['CTAクリック率'] = interaction_kpis.apply(lambda row: safe_rate(row['CTAクリック数'], row['セッション数']) * 100, axis=1)
-    interaction_kpis['FBクリック率'] = interaction_kpis.apply(lambda row: safe_rate(row['FBクリック数'], row['セッション数']) * 100, axis=1)
-    interaction_kpis['離脱防止POPクリック率'] = interaction_kpis.apply(lambda row: safe_rate(row['離脱防止POPクリック数'], row['セッション数']) * 100, axis=1)
-
-    interaction_kpis = interaction_kpis.reset_index().rename(columns={'page_path': 'ページパス'})
-
     interaction_display_cols = [
         'ページパス', 'ユニークユーザー数', 'CTAクリック数', 'CTAクリック率',
         'FBクリック数', 'FBクリック率',
@@ -1368,7 +1471,7 @@ if selected_analysis == "全体サマリー":
             fig = px.line(daily_sessions, x='日付', y='セッション数', markers=True)
             fig.update_layout(height=400, dragmode=False)
         
-        st.plotly_chart(fig, use_container_width=True, key='plotly_chart_1') # This already has use_container_width=True
+        show_plotly_chart(fig, key='plotly_chart_1') # This already has use_container_width=True
     
     # コンバージョン率の推移
     if show_cvr_trend:
@@ -1386,6 +1489,10 @@ if selected_analysis == "全体サマリー":
         
         daily_cvr = daily_cvr.merge(daily_cv, on='日付', how='left').fillna(0) # type: ignore
         daily_cvr['コンバージョン率'] = daily_cvr.apply(lambda row: safe_rate(row['コンバージョン数'], row['セッション数']) * 100, axis=1)
+
+        # 日別CVRの95%ブートストラップ信頼区間
+        daily_cvr_ci = get_bootstrap_ci(data_version, summary_filter_key, 'cvr', 'event_date', summary_sessions)
+        daily_cvr_ci['日付'] = pd.to_datetime(daily_cvr_ci['event_date']).dt.date
         
         if comparison_df is not None and len(comparison_df) > 0:
             # 比較データを追加
@@ -1401,6 +1508,7 @@ if selected_analysis == "全体サマリー":
             comp_daily_cvr['比較期間CVR'] = comp_daily_cvr.apply(lambda row: safe_rate(row['コンバージョン数'], row['セッション数']) * 100, axis=1)
             
             fig = go.Figure()
+            add_ci_band(fig, daily_cvr_ci['日付'], daily_cvr_ci['ci_low'] * 100, daily_cvr_ci['ci_high'] * 100)
             fig.add_trace(go.Scatter(x=daily_cvr['日付'], y=daily_cvr['コンバージョン率'],
                                     mode='lines+markers', name='現在期間', line=dict(color='#002060'),
                                     hovertemplate='日付: %{x}<br>コンバージョン率: %{y:.2f}%<extra></extra>'))
@@ -1411,9 +1519,11 @@ if selected_analysis == "全体サマリー":
             fig.update_layout(dragmode=False)
         else:
             fig = px.line(daily_cvr, x='日付', y='コンバージョン率', markers=True)
+            add_ci_band(fig, daily_cvr_ci['日付'], daily_cvr_ci['ci_low'] * 100, daily_cvr_ci['ci_high'] * 100)
             fig.update_layout(height=400, dragmode=False)
         
-        st.plotly_chart(fig, use_container_width=True, key='plotly_chart_2') # This already has use_container_width=True
+        st.markdown('<div class="graph-description">網掛けはセッションを再抽出したブートストラップによる95%信頼区間です。セッション数が少ない日ほど区間が広く、その日の変動はノイズの可能性があります。</div>', unsafe_allow_html=True)
+        show_plotly_chart(fig, key='plotly_chart_2') # This already has use_container_width=True
     
     # デバイス別分析
     if show_device_breakdown:
@@ -1447,7 +1557,7 @@ if selected_analysis == "全体サマリー":
             dragmode=False, # type: ignore
             legend=dict(orientation="h", yanchor="bottom", y=-0.3, xanchor="center", x=0.5)
         )
-        st.plotly_chart(fig, use_container_width=True, key='plotly_chart_device_combined')
+        show_plotly_chart(fig, key='plotly_chart_device_combined')
     
     # チャネル別分析
     if show_channel_breakdown:
@@ -1465,6 +1575,13 @@ if selected_analysis == "全体サマリー":
         
         channel_stats = channel_stats.merge(channel_cv, on='チャネル', how='left').fillna(0)
         channel_stats['コンバージョン率'] = channel_stats.apply(lambda row: safe_rate(row['コンバージョン数'], row['セッション数']) * 100, axis=1)
+
+        # チャネル別CVRの95%ブートストラップ信頼区間（エラーバー用）
+        channel_cvr_ci = get_bootstrap_ci(data_version, summary_filter_key, 'cvr', 'channel', summary_sessions)
+        channel_cvr_ci = channel_cvr_ci.rename(columns={'channel': 'チャネル'})
+        channel_stats = channel_stats.merge(channel_cvr_ci[['チャネル', 'ci_low', 'ci_high']], on='チャネル', how='left')
+        channel_stats['CI上側'] = (channel_stats['ci_high'] * 100 - channel_stats['コンバージョン率']).clip(lower=0)
+        channel_stats['CI下側'] = (channel_stats['コンバージョン率'] - channel_stats['ci_low'] * 100).clip(lower=0)
         
         col1, col2 = st.columns(2)
         
@@ -1475,16 +1592,17 @@ if selected_analysis == "全体サマリー":
                 dragmode=False,
                 legend=dict(orientation="h", yanchor="bottom", y=-0.2, xanchor="center", x=0.5)
             )
-            st.plotly_chart(fig, use_container_width=True, key='plotly_chart_4')
+            show_plotly_chart(fig, key='plotly_chart_4')
         
         with col2:
-            fig = px.bar(channel_stats, x='チャネル', y='コンバージョン率', title='チャネル別コンバージョン率')
+            fig = px.bar(channel_stats, x='チャネル', y='コンバージョン率', title='チャネル別コンバージョン率（95%信頼区間）',
+                         error_y='CI上側', error_y_minus='CI下側')
             fig.update_traces(hovertemplate='チャネル: %{x}<br>コンバージョン率: %{y:.2f}%<extra></extra>')
             fig.update_layout(
                 dragmode=False,
                 legend=dict(orientation="h", yanchor="bottom", y=-0.2, xanchor="center", x=0.5)
             )
-            st.plotly_chart(fig, use_container_width=True, key='plotly_chart_5')
+            show_plotly_chart(fig, key='plotly_chart_5')
 
     # LP進行ファネルと滞在時間別ファネル
     if show_funnel:
@@ -1512,7 +1630,7 @@ if selected_analysis == "全体サマリー":
             fig_funnel.update_layout(height=600, dragmode=False)
             st.markdown("**LP進行ファネル**")
             st.markdown('<div class="graph-description">各ページに到達したセッション数と、次のページへの遷移率です。急激に減少している箇所が大きな離脱ポイントです。</div>', unsafe_allow_html=True) # type: ignore
-            st.plotly_chart(fig_funnel, use_container_width=True, key='plotly_chart_funnel_revived')
+            show_plotly_chart(fig_funnel, key='plotly_chart_funnel_revived')
 
         with col2:
             # 滞在時間セグメントを定義
@@ -1577,52 +1695,42 @@ if selected_analysis == "全体サマリー":
                               xaxis_ticksuffix='%', legend=dict(traceorder='normal', orientation="h", yanchor="bottom", y=-0.3, xanchor="center", x=0.5))
             st.markdown("**ページ内滞在時間の分布**")
             st.markdown('<div class="graph-description">各ページに到達し、滞在時間が計測されたセッションの行動内訳です。横軸は割合（%）を表します。</div>', unsafe_allow_html=True) # type: ignore
-            st.plotly_chart(fig_stay_pct, use_container_width=True, key='plotly_chart_stay_percentage')
+            show_plotly_chart(fig_stay_pct, key='plotly_chart_stay_percentage')
     
+    # 時間帯別・曜日別CVRはセッション開始の時間帯・曜日で事前集計したキューブから読む
+    if show_hourly_cvr or show_dow_cvr:
+        summary_hourly_cube = dataset_table(dataset, 'hourly_cube')
+        summary_calendar_filters = cube_filters(summary_spec)
+
     # 時間帯別CVR
     if show_hourly_cvr:
         st.markdown("#### 時間帯別コンバージョン率")
         st.markdown('<div class="graph-description">1日の中で、どの時間帯にCVRが高いかを分析します。広告配信の最適な時間帯を見つけることができます。</div>', unsafe_allow_html=True) # type: ignore
-        filtered_df['hour'] = filtered_df['event_timestamp'].dt.hour
-        
-        hourly_sessions = filtered_df.groupby('hour')['session_id'].nunique().reset_index()
-        hourly_sessions.columns = ['時間', 'セッション数']
-        
-        hourly_cv = filtered_df[filtered_df['cv_type'].notna()].groupby('hour')['session_id'].nunique().reset_index()
-        hourly_cv.columns = ['時間', 'コンバージョン数']
-        
-        hourly_cvr = hourly_sessions.merge(hourly_cv, on='時間', how='left').fillna(0)
-        hourly_cvr['コンバージョン率'] = hourly_cvr.apply(lambda row: safe_rate(row['コンバージョン数'], row['セッション数']) * 100, axis=1)
-        
-        fig = px.bar(hourly_cvr, x='時間', y='コンバージョン率')
-        fig.update_traces(hovertemplate='時間: %{x}時台<br>コンバージョン率: %{y:.2f}%<extra></extra>')
-        fig.update_layout(height=400, xaxis_title='時間帯', dragmode=False, legend=dict(orientation="h", yanchor="bottom", y=-0.3, xanchor="center", x=0.5))
-        st.plotly_chart(fig, use_container_width=True, key='plotly_chart_7')
+        def build_hourly_cvr_figure():
+            # セッション開始の時間帯ごとに、事前集計キューブから集計する
+            hourly_cvr = calendar_cube.calendar_breakdown(summary_hourly_cube, 'session_hour', start_date, end_date, summary_calendar_filters)
+            hourly_cvr = hourly_cvr.rename(columns={'session_hour': '時間'})
+
+            fig = px.bar(hourly_cvr, x='時間', y='コンバージョン率')
+            fig.update_traces(hovertemplate='時間: %{x}時台<br>コンバージョン率: %{y:.2f}%<extra></extra>')
+            fig.update_layout(height=400, xaxis_title='時間帯', dragmode=False, legend=dict(orientation="h", yanchor="bottom", y=-0.3, xanchor="center", x=0.5))
+            return fig
+        show_plotly_chart(build_hourly_cvr_figure, key='plotly_chart_7', cache_key=(dataset_version, summary_filter_key))
     
     # 曜日別CVR
     if show_dow_cvr:
         st.markdown("#### 曜日別コンバージョン率")
         st.markdown('<div class="graph-description">曜日ごとのCVRの違いを分析します。平日と週末でのユーザー行動の変化を把握できます。</div>', unsafe_allow_html=True) # type: ignore
-        filtered_df['dow'] = filtered_df['event_timestamp'].dt.day_name()
-        dow_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-        dow_map = {'Monday': '月', 'Tuesday': '火', 'Wednesday': '水', 'Thursday': '木', 'Friday': '金', 'Saturday': '土', 'Sunday': '日'}
-        
-        dow_sessions = filtered_df.groupby('dow')['session_id'].nunique().reset_index()
-        dow_sessions.columns = ['曜日', 'セッション数']
-        
-        dow_cv = filtered_df[filtered_df['cv_type'].notna()].groupby('dow')['session_id'].nunique().reset_index()
-        dow_cv.columns = ['曜日', 'コンバージョン数']
-        
-        dow_cvr = dow_sessions.merge(dow_cv, on='曜日', how='left').fillna(0)
-        dow_cvr['コンバージョン率'] = dow_cvr.apply(lambda row: safe_rate(row['コンバージョン数'], row['セッション数']) * 100, axis=1)
-        dow_cvr['曜日_日本語'] = dow_cvr['曜日'].map(dow_map)
-        dow_cvr['曜日_order'] = dow_cvr['曜日'].apply(lambda x: dow_order.index(x))
-        dow_cvr = dow_cvr.sort_values('曜日_order')
-        
-        fig = px.bar(dow_cvr, x='曜日_日本語', y='コンバージョン率')
-        fig.update_traces(hovertemplate='曜日: %{x}<br>コンバージョン率: %{y:.2f}%<extra></extra>')
-        fig.update_layout(height=400, xaxis_title='曜日', dragmode=False, legend=dict(orientation="h", yanchor="bottom", y=-0.3, xanchor="center", x=0.5))
-        st.plotly_chart(fig, use_container_width=True, key='plotly_chart_8')
+        def build_dow_cvr_figure():
+            # セッション開始の曜日（0=月曜）ごとに、事前集計キューブから集計する（曜日コード順＝月曜始まり）
+            dow_cvr = calendar_cube.calendar_breakdown(summary_hourly_cube, 'session_weekday', start_date, end_date, summary_calendar_filters)
+            dow_cvr['曜日_日本語'] = [calendar_cube.WEEKDAY_LABELS_JP[int(d)] for d in dow_cvr['session_weekday']]
+
+            fig = px.bar(dow_cvr, x='曜日_日本語', y='コンバージョン率')
+            fig.update_traces(hovertemplate='曜日: %{x}<br>コンバージョン率: %{y:.2f}%<extra></extra>')
+            fig.update_layout(height=400, xaxis_title='曜日', dragmode=False, legend=dict(orientation="h", yanchor="bottom", y=-0.3, xanchor="center", x=0.5))
+            return fig
+        show_plotly_chart(build_dow_cvr_figure, key='plotly_chart_8', cache_key=(dataset_version, summary_filter_key))
     
     # UTM分析
     if show_utm_analysis:
@@ -1640,7 +1748,7 @@ if selected_analysis == "全体サマリー":
             fig = px.bar(utm_source_stats, x='UTMソース', y='セッション数')
             fig.update_layout(dragmode=False, legend=dict(orientation="h", yanchor="bottom", y=-0.3, xanchor="center", x=0.5))
             fig.update_traces(hovertemplate='UTMソース: %{x}<br>セッション数: %{y:,}<extra></extra>')
-            st.plotly_chart(fig, use_container_width=True, key='plotly_chart_9') # type: ignore
+            show_plotly_chart(fig, key='plotly_chart_9') # type: ignore
         
         with col2:
             st.markdown("**UTMメディア別**")
@@ -1651,20 +1759,37 @@ if selected_analysis == "全体サマリー":
             fig = px.bar(utm_medium_stats, x='UTMメディア', y='セッション数')
             fig.update_layout(dragmode=False, legend=dict(orientation="h", yanchor="bottom", y=-0.3, xanchor="center", x=0.5))
             fig.update_traces(hovertemplate='UTMメディア: %{x}<br>セッション数: %{y:,}<extra></extra>')
-            st.plotly_chart(fig, use_container_width=True, key='plotly_chart_10') # type: ignore
+            show_plotly_chart(fig, key='plotly_chart_10') # type: ignore
     
     # 読込時間分析
     if show_load_time:
         st.markdown("#### 読込時間分析")
         st.markdown('<div class="graph-description">デバイスごとのページ読込時間を分析します。読込が遅いと離脱率が上がるため、最適化が重要です。</div>', unsafe_allow_html=True) # type: ignore
         
-        load_time_stats = filtered_df.groupby('device_type')['load_time_ms'].mean().reset_index()
-        load_time_stats.columns = ['デバイス', '平均読込時間(ms)']
-        
-        fig = px.bar(load_time_stats, x='デバイス', y='平均読込時間(ms)')
-        fig.update_traces(hovertemplate='デバイス: %{x}<br>平均読込時間: %{y:.0f}ms<extra></extra>')
-        fig.update_layout(height=400, yaxis_title='平均読込時間 (ms)', dragmode=False, legend=dict(orientation="h", yanchor="bottom", y=-0.3, xanchor="center", x=0.5))
-        st.plotly_chart(fig, use_container_width=True, key='plotly_chart_11')
+        # 読込時間は右に裾の長い分布のため、平均ではなくパーセンタイルで比較する（分位点スケッチから取得）
+        quantile_sketches = dataset_table(dataset, 'quantile_sketches')
+        load_time_stats = quantile_sketch.quantiles(quantile_sketches, 'load_time_ms', start_date=start_date, end_date=end_date,
+                                                    filters=sketch_filters, by='device_type')
+        load_time_stats = load_time_stats.reset_index().rename(columns={'device_type': 'デバイス'})
+        load_time_plot = load_time_stats.melt(id_vars='デバイス', value_vars=['p50', 'p90', 'p99'], var_name='パーセンタイル', value_name='読込時間(ms)')
+
+        load_cols = st.columns(2)
+        with load_cols[0]:
+            fig = px.bar(load_time_plot, x='デバイス', y='読込時間(ms)', color='パーセンタイル', barmode='group')
+            fig.update_traces(hovertemplate='デバイス: %{x}<br>%{fullData.name}: %{y:.0f}ms<extra></extra>')
+            fig.update_layout(height=400, yaxis_title='読込時間 (ms)', dragmode=False, legend=dict(orientation="h", yanchor="bottom", y=-0.3, xanchor="center", x=0.5))
+            show_plotly_chart(fig, key='plotly_chart_11')
+        with load_cols[1]:
+            load_hist = quantile_sketch.histogram(quantile_sketches, 'load_time_ms', start_date, end_date, sketch_filters, bins=30)
+            fig = go.Figure(go.Bar(
+                x=np.sqrt(load_hist['lower'] * load_hist['upper']),
+                y=load_hist['share'] * 100,
+                width=load_hist['upper'] - load_hist['lower'],
+                customdata=load_hist[['lower', 'upper', 'count']].to_numpy(),
+                hovertemplate='%{customdata[0]:.0f}〜%{customdata[1]:.0f}ms<br>割合: %{y:.1f}%<br>件数: %{customdata[2]:,}<extra></extra>'
+            ))
+            fig.update_layout(height=400, xaxis_title='読込時間 (ms)', yaxis_title='割合 (%)', dragmode=False, bargap=0)
+            show_plotly_chart(fig, key='plotly_chart_load_time_histogram')
 
     st.markdown("---")
 
@@ -1751,7 +1876,7 @@ elif selected_analysis == "ページ分析":
 
     with filter_cols_1[1]:
         # LP選択
-        lp_options = sorted(df['lp_base_url'].dropna().unique().tolist())
+        lp_options = list(lp_partition_index)
         selected_lp_base_url = st.selectbox(
             "LP選択", 
             lp_options, 
@@ -1820,39 +1945,11 @@ elif selected_analysis == "ページ分析":
         with col2:
             end_date = st.date_input("終了日", df['event_date'].max(), key="page_analysis_end_date")
 
-    # --- 新規/リピート、CV/非CVの列を追加 ---
-    df['user_type'] = np.where(df['ga_session_number'] == 1, '新規', 'リピート')
-    conversion_session_ids = df[df['cv_type'].notna()]['session_id'].unique()
-    df['conversion_status'] = np.where(df['session_id'].isin(conversion_session_ids), 'コンバージョン', '非コンバージョン')
-
     # データフィルタリング
-    filtered_df = df.copy()
-
-    # 期間フィルター
-    filtered_df = filtered_df[
-        (filtered_df['event_date'] >= pd.to_datetime(start_date)) &
-        (filtered_df['event_date'] <= pd.to_datetime(end_date))
-    ]
-
-    # LPフィルター
-    if selected_lp_base_url:
-        filtered_df = filtered_df[filtered_df['lp_base_url'] == selected_lp_base_url]
-
-    # --- クロス分析用フィルター適用 ---
-    if selected_device != "すべて":
-        filtered_df = filtered_df[filtered_df['device_type'] == selected_device]
-
-    if selected_user_type != "すべて":
-        filtered_df = filtered_df[filtered_df['user_type'] == selected_user_type]
-
-    if selected_conversion_status != "すべて":
-        filtered_df = filtered_df[filtered_df['conversion_status'] == selected_conversion_status]
-
-    if selected_channel != "すべて":
-        filtered_df = filtered_df[filtered_df['channel'] == selected_channel]
-
-    if selected_source_medium != "すべて":
-        filtered_df = filtered_df[filtered_df['source_medium'] == selected_source_medium]
+    # 選択したLPのパーティションだけを絞り込む
+    page_spec = filter_spec(start_date, end_date, selected_lp_base_url, selected_device, selected_user_type,
+                             selected_conversion_status, selected_channel, selected_source_medium)
+    filtered_df = select_events(dataset, page_spec)
 
     # 比較機能は無効化
     comparison_df = None
@@ -1871,35 +1968,16 @@ elif selected_analysis == "ページ分析":
     
     # --- BigQueryデータシミュレーション ---
     # --- コンテンツ情報取得ロジック ---
-    # ご指定のURLリストをここに定義します。
-    lp_content_urls = {
-        1: "https://shungene.lm-c.jp/tst08/01.mp4", # P1
-        2: "https://shungene.lm-c.jp/tst08/01.jpg",
-        3: "https://shungene.lm-c.jp/tst08/02.jpg",
-        4: "https://shungene.lm-c.jp/tst08/03.jpg",
-        5: "https://shungene.lm-c.jp/tst08/04.jpg",
-        6: "https://shungene.lm-c.jp/tst08/05.jpg",
-        7: "https://shungene.lm-c.jp/tst08/06.jpg",
-        8: "https://shungene.lm-c.jp/tst08/06.mp4",
-        9: "https://shungene.lm-c.jp/tst08/07.jpg", # P9
-        10: "https://shungene.lm-c.jp/tst08/08.jpg",
-        11: "https://shungene.lm-c.jp/tst08/09.jpg",
-        12: "https://shungene.lm-c.jp/tst08/10.jpg",
-        13: "https://shungene.lm-c.jp/tst08/11.jpg",
-        14: "https://shungene.lm-c.jp/tst08/12.jpg",
-        15: "https://shungene.lm-c.jp/tst08/13.jpg", # P15
-        16: "https://shungene.lm-c.jp/tst08/14.jpg",
-        17: "https://shungene.lm-c.jp/tst08/15.jpg",
-        18: "https://shungene.lm-c.jp/tst08/16.jpg",
-    }
+    # tst08 の素材（LP一覧にないLPの表示に使用）
+    lp_content_urls = DEFAULT_LP_CONTENT_URLS
 
     # BigQueryからコンテンツ情報を取得する関数をシミュレート
     def get_lp_content_info(lp_url, page_num):
         """
         指定されたページ番号に基づいて、コンテンツのタイプとソースを返します。
-        現在はハードコードされたURLリストを使用します。
+        生成時のLP一覧（lp_catalog）にあるLPはそのLPの素材を、それ以外はtst08の素材を使用します。
         """
-        url = lp_content_urls.get(page_num) # type: ignore
+        url = lp_catalog.get(lp_url, {}).get('content_urls', lp_content_urls).get(page_num) # type: ignore
         if url:
             if url.endswith(('.mp4', '.webm', '.mov')):
                 return {'page_number': page_num, 'content_type': 'video', 'content_source': url}
@@ -1915,66 +1993,15 @@ elif selected_analysis == "ページ分析":
     # --- BigQueryデータシミュレーションここまで ---
 
 
-    # ページ別メトリクス計算
-    page_stats = filtered_df.groupby('page_num_dom').agg({
-        'session_id': 'nunique'
-    }).reset_index()
-    page_stats.rename(columns={'page_num_dom': 'ページ番号', 'session_id': 'ビュー数'}, inplace=True)
-
-    # 逆行回数を計算
-    # セッションごと、ページごとに逆行イベントをカウント
-    backflow_df = filtered_df[filtered_df['direction'] == 'backward'].copy()
-    if not backflow_df.empty:
-        # ページごとの逆行イベントが発生したセッションのユニーク数をカウント
-        backflow_counts = backflow_df.groupby('page_num_dom')['session_id'].nunique().reset_index()
-        backflow_counts.rename(columns={'page_num_dom': 'ページ番号', 'session_id': '逆行セッション数'}, inplace=True)
-        
-        # page_statsにマージ
-        page_stats = pd.merge(page_stats, backflow_counts, on='ページ番号', how='left').fillna(0)
-        page_stats['逆行率'] = page_stats.apply(lambda row: safe_rate(row['逆行セッション数'], row['ビュー数']) * 100, axis=1)
-    else:
-        page_stats['逆行率'] = 0
-    
     # LPの実際のページ数を取得（画像取得が成功した場合はそれを使用、失敗した場合は推測値）
     # フィルターをかける前の元のデータから最大ページ数を取得することで、フィルターによってページ数が1になる問題を回避
-    unfiltered_lp_df = df[df['lp_base_url'] == selected_lp_base_url]
-    actual_page_count = int(unfiltered_lp_df['page_num_dom'].max()) if not unfiltered_lp_df.empty and not unfiltered_lp_df['page_num_dom'].isnull().all() else 1
+    actual_page_count = page_analytics.lp_page_count(dataset, selected_lp_base_url)
+
+    # ページ別メトリクス計算（離脱率はセッションテーブルの最大到達ページから信頼区間つきで求める）
+    page_filter_key = make_filter_key(start_date, end_date, selected_lp_base_url, selected_device, selected_user_type, selected_conversion_status, selected_channel, selected_source_medium)
+    page_session_table = get_session_table(dataset_version, page_filter_key, filtered_df)
+    page_stats = load_report('page', page_spec)['pages']
 
-    
-    # 離脱率計算（LPの実際のページ数を使用）
-    page_exit = []
-    for page_num in range(1, actual_page_count + 1):
-        reached = filtered_df[filtered_df['max_page_reached'] >= page_num]['session_id'].nunique()
-        exited = filtered_df[filtered_df['max_page_reached'] == page_num]['session_id'].nunique()
-        exit_rate = (exited / reached * 100) if reached > 0 else 0
-        page_exit.append({'ページ番号': page_num, '離脱率': exit_rate})
-    
-    page_exit_df = pd.DataFrame(page_exit)
-    page_stats = page_stats.merge(page_exit_df, on='ページ番号', how='left')
-
-    # 平均滞在時間(秒)を計算して列を追加
-    stay_time_df = filtered_df.groupby('page_num_dom')['stay_ms'].mean().reset_index() # type: ignore
-    stay_time_df.rename(columns={'page_num_dom': 'ページ番号', 'stay_ms': '平均滞在時間(秒)'}, inplace=True)
-    stay_time_df['平均滞在時間(秒)'] /= 1000
-    page_stats = page_stats.merge(stay_time_df, on='ページ番号', how='left')
-    
-    # ダミーデータにないページを追加（ダミーデータが10ページまでしかない場合）
-    for page_num in range(1, actual_page_count + 1):
-        if page_num not in page_stats['ページ番号'].values:
-            # ダミーデータがないページはランダムなダミー値で追加
-            # ページが進むほどビュー数が減少するパターン
-            new_row = pd.DataFrame([{
-                'ページ番号': page_num,
-                'ビュー数': 0,
-                '平均逆行回数': 0,
-                '平均滞在時間(秒)': 0,
-                '離脱率': 0  # 離脱率は別途計算
-            }])
-            page_stats = pd.concat([page_stats, new_row], ignore_index=True)
-    
-    # ページ番号でソート
-    page_stats = page_stats.sort_values('ページ番号').reset_index(drop=True)
-    
     # 包括的なページメトリクステーブル
     st.markdown("#### ページごとのパフォーマンス詳細")
     st.markdown('<div class="graph-description">各ページのプレビューと主要指標を一覧で確認できます。</div>', unsafe_allow_html=True)
@@ -2102,6 +2129,14 @@ elif selected_analysis == "ページ分析":
             hover_name='ページ番号',
             hover_data={'ページ番号': False, 'ビュー数': ':,', '離脱率': ':.1f', '平均滞在時間(秒)': ':.1f'}
         )
+        # 離脱率の95%信頼区間を横方向のエラーバーで表示
+        if '離脱率_上限' in plot_data.columns:
+            fig_scatter.update_traces(error_x=dict(
+                type='data',
+                array=(plot_data['離脱率_上限'] - plot_data['離脱率']).clip(lower=0).fillna(0),
+                arrayminus=(plot_data['離脱率'] - plot_data['離脱率_下限']).clip(lower=0).fillna(0),
+                color='lightgray'
+            ))
 
         # 平均線を追加
         fig_scatter.add_vline(x=avg_exit_rate, line_dash="dash", line_color="gray", annotation_text=f"平均離脱率: {avg_exit_rate:.1f}%")
@@ -2132,7 +2167,7 @@ elif selected_analysis == "ページ分析":
             showlegend=False,
             dragmode=False
         )
-        st.plotly_chart(fig_scatter, use_container_width=True, key='plotly_chart_scatter_exit_stay')
+        show_plotly_chart(fig_scatter, key='plotly_chart_scatter_exit_stay')
     else:
         st.info("ポジショニングマップを表示するには、2ページ以上のデータが必要です。")
     
@@ -2163,8 +2198,10 @@ elif selected_analysis == "ページ分析":
     with col2:
         st.markdown('##### 離脱率が高いページ TOP5')
         st.markdown('<div class="graph-description">ユーザーが最も離脱しやすいボトルネックとなっている可能性が高いページです。</div>', unsafe_allow_html=True)
-        high_exit_pages = page_stats.nlargest(5, '離脱率')[['ページ番号', '離脱率']]
+        high_exit_pages = page_stats.nlargest(5, '離脱率')[['ページ番号', '離脱率', '離脱率_下限', '離脱率_上限']].copy()
         high_exit_pages['ページ番号'] = high_exit_pages['ページ番号'].astype(int)
+        high_exit_pages['95%信頼区間'] = high_exit_pages.apply(lambda row: f"{row['離脱率_下限']:.1f}〜{row['離脱率_上限']:.1f}%", axis=1)
+        high_exit_pages = high_exit_pages[['ページ番号', '離脱率', '95%信頼区間']]
         st.dataframe(high_exit_pages.style.format({'離脱率': '{:.1f}%'}), use_container_width=True, hide_index=True, height=212) # 高さを固定
 
     with col3:
@@ -2179,6 +2216,146 @@ elif selected_analysis == "ページ分析":
         else:
             st.info("逆行率のデータがありません。")
     
+    # --- 滞在時間の分布（パーセンタイル） ---
+    st.markdown('##### ページ別 滞在時間の分布')
+    st.markdown('<div class="graph-description">滞在時間は一部の長時間滞在に平均が引っ張られやすいため、中央値（p50）と上位10%・1%の境界（p90・p99）で比較します。p50 が短いページは多くのユーザーが読み飛ばしており、p90 だけが長いページは一部のユーザーが熟読しています。</div>', unsafe_allow_html=True)
+    page_sketch_filters = cube_filters(page_spec)
+    page_stay_quantiles = quantile_sketch.quantiles(dataset_table(dataset, 'quantile_sketches'), 'stay_ms',
+                                                    start_date=start_date, end_date=end_date, filters=page_sketch_filters, by='page_num_dom')
+    if page_stay_quantiles.empty:
+        st.info("滞在時間のデータがありません。")
+    else:
+        page_stay_plot = (page_stay_quantiles[['p50', 'p90', 'p99']] / 1000).reset_index()
+        page_stay_plot['page_num_dom'] = page_stay_plot['page_num_dom'].astype(int)
+        page_stay_plot = page_stay_plot.melt(id_vars='page_num_dom', var_name='パーセンタイル', value_name='滞在時間(秒)')
+        fig_stay_quantiles = px.line(page_stay_plot, x='page_num_dom', y='滞在時間(秒)', color='パーセンタイル', markers=True,
+                                     labels={'page_num_dom': 'ページ番号'})
+        fig_stay_quantiles.update_traces(hovertemplate='ページ%{x}<br>%{fullData.name}: %{y:.1f}秒<extra></extra>')
+        fig_stay_quantiles.update_layout(height=400, xaxis=dict(dtick=1), dragmode=False, legend=dict(orientation="h", yanchor="bottom", y=-0.3, xanchor="center", x=0.5))
+        show_plotly_chart(fig_stay_quantiles, key='plotly_chart_page_stay_quantiles')
+
+    # --- クリックヒートマップ ---
+    st.markdown('##### クリックヒートマップ')
+    st.markdown('<div class="graph-description">ページ内のどこがクリックされたかを、ページ画像の上に重ねて表示します。CTAボタン以外の場所（画像やテキスト）に多くのクリックが集まっている場合、ユーザーがリンクだと誤認している可能性があります。期間・LP・デバイスのフィルターが反映されます。</div>', unsafe_allow_html=True)
+    heatmap_page = st.selectbox("ページ", list(range(1, max(actual_page_count, 1) + 1)), index=0, key="page_analysis_heatmap_page")
+    click_grid = click_heatmap.query_grid(
+        dataset_table(dataset, 'click_grids'), start_date, end_date,
+        filters={'lp_base_url': selected_lp_base_url, 'page_num_dom': heatmap_page, 'device_type': selected_device},
+    )
+    if click_grid.sum() == 0:
+        st.info("このページのクリックデータがありません。")
+    else:
+        heatmap_cols = st.columns([2, 3])
+        with heatmap_cols[0]:
+            n_y, n_x = click_grid.shape
+            fig_click_heatmap = go.Figure(go.Heatmap(
+                z=click_grid,
+                x=(np.arange(n_x) + 0.5) / n_x,
+                y=1 - (np.arange(n_y) + 0.5) / n_y,
+                colorscale=[[0, 'rgba(255,255,0,0)'], [0.2, 'rgba(255,200,0,0.5)'], [1, 'rgba(220,0,0,0.85)']],
+                zsmooth='best',
+                hovertemplate='クリック数: %{z:,}<extra></extra>',
+                colorbar=dict(title='クリック数'),
+            ))
+            page_thumbnail = capture_lp.fetch_page_thumbnail(get_lp_content_info(selected_lp_base_url, heatmap_page)['content_source'])
+            if page_thumbnail is not None:
+                fig_click_heatmap.add_layout_image(dict(source=page_thumbnail, xref='x', yref='y', x=0, y=1, sizex=1, sizey=1,
+                                                        xanchor='left', yanchor='top', sizing='stretch', layer='below'))
+            fig_click_heatmap.update_layout(height=640, margin=dict(l=10, r=10, t=10, b=10), dragmode=False, plot_bgcolor='white',
+                                            xaxis=dict(range=[0, 1], visible=False), yaxis=dict(range=[0, 1], visible=False))
+            show_plotly_chart(fig_click_heatmap, key='plotly_chart_click_heatmap')
+            if page_thumbnail is None:
+                st.caption("このページは動画または画像を取得できないため、背景なしで表示しています。")
+        with heatmap_cols[1]:
+            st.markdown('**クリックが集中している位置 TOP5**')
+            st.markdown('<div class="graph-description">位置はページの左上を (0%, 0%)、右下を (100%, 100%) とした相対座標です。</div>', unsafe_allow_html=True)
+            st.dataframe(click_heatmap.hot_zones(click_grid).style.format({'横位置': '{:.0%}', '縦位置': '{:.0%}', 'クリック数': '{:,}', '割合': '{:.1%}'}),
+                         use_container_width=True, hide_index=True)
+            st.metric("クリック数（合計）", f"{int(click_grid.sum()):,}")
+
+    st.markdown("---")
+
+    # --- ページ遷移パス分析 ---
+    st.markdown('### ページ遷移パス分析')
+    st.markdown('<div class="graph-description">セッションごとのページの閲覧順序を復元し、どのページからどこへ進んだか（離脱・CVを含む）、よく通られるパス、前のページへの戻り（逆行ループ）、次のページへ進むまでの時間を分析します。</div>', unsafe_allow_html=True)
+    path_results = get_path_analysis(dataset_version, page_filter_key, actual_page_count, filtered_df)
+
+    transition_rates = path_results['transition_rates']
+    if not transition_rates.empty:
+        fig_transition = go.Figure(data=go.Heatmap(
+            z=transition_rates.to_numpy() * 100,
+            x=[str(c) for c in transition_rates.columns],
+            y=[str(i) for i in transition_rates.index],
+            colorscale='Blues',
+            customdata=path_results['transitions'].to_numpy(),
+            hovertemplate='ページ%{y} → %{x}<br>遷移率: %{z:.1f}%<br>遷移数: %{customdata:,}<extra></extra>',
+            colorbar=dict(title='遷移率(%)')
+        ))
+        fig_transition.update_layout(height=500, xaxis_title='遷移先', yaxis_title='遷移元ページ', yaxis=dict(autorange='reversed'), dragmode=False)
+        show_plotly_chart(fig_transition, key='plotly_chart_transition_matrix')
+
+    path_cols = st.columns(2)
+    with path_cols[0]:
+        st.markdown('##### よく通られるパス TOP10')
+        st.markdown('<div class="graph-description">セッションが閲覧したページの順序（同じページの連続はまとめて表示）と、そのパスのCVRです。</div>', unsafe_allow_html=True)
+        st.dataframe(path_results['top_paths'].style.format({'割合': '{:.1%}', 'CVR': '{:.1%}', 'セッション数': '{:,}'}), use_container_width=True, hide_index=True)
+    with path_cols[1]:
+        st.markdown('##### 逆行ループ TOP10')
+        st.markdown('<div class="graph-description">どのページからどのページへ戻ったかの組み合わせです。戻ったセッションのCVRが高い場合は、情報の確認行動である可能性があります。</div>', unsafe_allow_html=True)
+        if path_results['backflow'].empty:
+            st.info("逆行は発生していません。")
+        else:
+            st.dataframe(path_results['backflow'].head(10).style.format({'CVR': '{:.1%}'}), use_container_width=True, hide_index=True)
+
+    st.markdown('##### 次のページへ進むまでの時間')
+    st.markdown('<div class="graph-description">各ページから次のページへ進むまでの時間の中央値（棒）と、25〜75パーセンタイルの範囲（エラーバー）です。特定のページだけ時間が長い場合、内容が重い・分かりにくい可能性があります。</div>', unsafe_allow_html=True)
+    time_to_next = path_results['time_to_next']
+    if not time_to_next.empty:
+        fig_next = go.Figure(go.Bar(
+            x=time_to_next['ページ番号'],
+            y=time_to_next['p50(秒)'],
+            error_y=dict(
+                type='data',
+                array=time_to_next['p75(秒)'] - time_to_next['p50(秒)'],
+                arrayminus=time_to_next['p50(秒)'] - time_to_next['p25(秒)']
+            ),
+            customdata=time_to_next[['遷移数', 'p90(秒)']].to_numpy(),
+            hovertemplate='ページ%{x}<br>中央値: %{y:.1f}秒<br>p90: %{customdata[1]:.1f}秒<br>遷移数: %{customdata[0]:,}<extra></extra>'
+        ))
+        fig_next.update_layout(height=400, xaxis_title='ページ番号', yaxis_title='次のページまでの時間（秒）', dragmode=False)
+        show_plotly_chart(fig_next, key='plotly_chart_time_to_next_page')
+
+    # --- 生存分析（打ち切り補正後の到達率と離脱ハザード） ---
+    st.markdown('### 到達率と離脱ハザード（生存分析）')
+    st.markdown('<div class="graph-description">セッションごとにLPのページ数が異なるため、最終ページまで読んだセッションやCVしたセッションを「打ち切り」として扱うカプラン・マイヤー法で、各ページへの到達率と、そのページでの離脱確率（ハザード）を推定します。単純な離脱率よりも、ページ数の違いによる偏りが少ない指標です。</div>', unsafe_allow_html=True)
+    survival_dimensions = {'なし（全体）': None, 'デバイス': 'device_type', 'チャネル': 'channel', 'A/Bバリアント': 'ab_variant', '新規/リピート': 'user_type'}
+    survival_dim_label = st.radio("比較するセグメント", list(survival_dimensions.keys()), horizontal=True, key="page_analysis_survival_dim")
+    survival_by = survival_dimensions[survival_dim_label]
+    survival_df = get_survival_curves(dataset_version, page_filter_key, survival_by, actual_page_count or None, page_session_table)
+
+    if survival_df.empty:
+        st.info("生存分析に必要なデータがありません。")
+    else:
+        survival_cols = st.columns(2)
+        with survival_cols[0]:
+            fig_retention = px.line(survival_df, x='page', y='retention', color='segment', markers=True,
+                                    labels={'page': 'ページ番号', 'retention': '到達率', 'segment': 'セグメント'},
+                                    title='ページ到達率（カプラン・マイヤー）')
+            if survival_by is None:
+                add_ci_band(fig_retention, survival_df['page'], survival_df['ci_low'], survival_df['ci_high'])
+            fig_retention.update_layout(height=420, yaxis_tickformat='.0%', dragmode=False, legend=dict(orientation="h", yanchor="bottom", y=-0.35, xanchor="center", x=0.5))
+            show_plotly_chart(fig_retention, key='plotly_chart_survival_retention')
+        with survival_cols[1]:
+            fig_hazard = px.line(survival_df, x='page', y='hazard', color='segment', markers=True,
+                                 labels={'page': 'ページ番号', 'hazard': '離脱ハザード', 'segment': 'セグメント'},
+                                 title='ページ別 離脱ハザード', hover_data={'at_risk': ':,', 'exits': ':,'})
+            fig_hazard.update_layout(height=420, yaxis_tickformat='.0%', dragmode=False, legend=dict(orientation="h", yanchor="bottom", y=-0.35, xanchor="center", x=0.5))
+            show_plotly_chart(fig_hazard, key='plotly_chart_survival_hazard')
+
+        survival_summary = survival_analysis.median_depth(survival_df)
+        survival_summary = survival_summary.rename(columns={'segment': 'セグメント', 'median_page': '到達ページ数の中央値', 'sessions': 'セッション数'})
+        st.dataframe(survival_summary.style.format({'到達ページ数の中央値': '{:.0f}', 'セッション数': '{:,}'}, na_rep='最終ページまで50%以上'), use_container_width=True, hide_index=True)
+
     st.markdown("---")
 
     # --- AI分析と考察 ---
@@ -2251,7 +2428,7 @@ elif selected_analysis == "広告分析":
         selected_period = st.selectbox("期間を選択", period_options, index=2, key="ad_analysis_period")
 
     with filter_cols_1[1]:
-        lp_options = sorted(df['page_location'].dropna().unique().tolist())
+        lp_options = list(lp_partition_index)
         selected_lp = st.selectbox(
             "LP選択", 
             lp_options, 
@@ -2310,28 +2487,10 @@ elif selected_analysis == "広告分析":
         with c2:
             end_date = st.date_input("終了日", df['event_date'].max(), key="ad_analysis_end")
 
-    # --- 新規/リピート、CV/非CVの列を追加 ---
-    df['user_type'] = np.where(df['ga_session_number'] == 1, '新規', 'リピート')
-    conversion_session_ids = df[df['cv_type'].notna()]['session_id'].unique()
-    df['conversion_status'] = np.where(df['session_id'].isin(conversion_session_ids), 'コンバージョン', '非コンバージョン')
-
     # --- データフィルタリング ---
-    filtered_df = df[
-        (df['event_date'] >= pd.to_datetime(start_date)) &
-        (df['event_date'] <= pd.to_datetime(end_date))
-    ]
-    if selected_lp:
-        filtered_df = filtered_df[filtered_df['page_location'] == selected_lp]
-    if selected_device != "すべて":
-        filtered_df = filtered_df[filtered_df['device_type'] == selected_device]
-    if selected_user_type != "すべて":
-        filtered_df = filtered_df[filtered_df['user_type'] == selected_user_type]
-    if selected_conversion_status != "すべて":
-        filtered_df = filtered_df[filtered_df['conversion_status'] == selected_conversion_status]
-    if selected_channel != "すべて":
-        filtered_df = filtered_df[filtered_df['channel'] == selected_channel]
-    if selected_source_medium != "すべて":
-        filtered_df = filtered_df[filtered_df['source_medium'] == selected_source_medium]
+    ad_spec = filter_spec(start_date, end_date, selected_lp, selected_device, selected_user_type,
+                           selected_conversion_status, selected_channel, selected_source_medium)
+    filtered_df = select_events(dataset, ad_spec)
 
     # --- 分析対象の選択 ---
     st.markdown('<div class="sub-header">分析軸の選択</div>', unsafe_allow_html=True)
@@ -2339,7 +2498,7 @@ elif selected_analysis == "広告分析":
 
     analysis_target = st.radio(
         "分析の切り口を選択してください",
-        ('キャンペーン別', '広告コンテンツ別'),
+        ('キャンペーン別', '広告コンテンツ別', '参照元/メディア別', 'キャンペーン×広告コンテンツ別'),
         horizontal=True,
         key="ad_analysis_target"
     )
@@ -2347,59 +2506,28 @@ elif selected_analysis == "広告分析":
     st.markdown("---") # type: ignore
 
     # --- 分析テーブル表示 ---
-    if analysis_target == 'キャンペーン別':
-        st.markdown("#### キャンペーン別 パフォーマンス")
-        segment_col = 'utm_campaign'
-        segment_name = 'キャンペーン'
-        display_df = filtered_df.dropna(subset=['utm_campaign'])
-    else:
-        st.markdown("#### 広告コンテンツ別 パフォーマンス")
-        segment_col = 'utm_content'
-        segment_name = '広告コンテンツ'
-        display_df = filtered_df.dropna(subset=['utm_content'])
+    # 分析軸ごとの (見出し, 集計する次元, 表示名)
+    ad_targets = {
+        'キャンペーン別': ('キャンペーン別 パフォーマンス', ('utm_campaign',), 'キャンペーン'),
+        '広告コンテンツ別': ('広告コンテンツ別 パフォーマンス', ('utm_content',), '広告コンテンツ'),
+        '参照元/メディア別': ('参照元/メディア別 パフォーマンス', ('utm_source', 'utm_medium'), '参照元/メディア'),
+        'キャンペーン×広告コンテンツ別': ('キャンペーン×広告コンテンツ別 パフォーマンス', ('utm_campaign', 'utm_content'), 'キャンペーン×広告コンテンツ'),
+    }
+    ad_heading, segment_cols, segment_name = ad_targets[analysis_target]
+    st.markdown(f"#### {ad_heading}")
+
+    # セッション単位のフラグから、全ての広告指標を1回のグループ集計で計算（フィルター条件×分析軸でキャッシュ）
+    segment_stats = load_report('ad', ad_spec, by=segment_cols)['segments']
 
     # データが空の場合の処理
-    if display_df.empty or display_df[segment_col].nunique() == 0:
+    if segment_stats.empty:
         st.info("選択された条件に該当する広告データがありません。")
         st.stop()
 
-    # セグメント別統計を計算
-    segment_stats = display_df.groupby(segment_col).agg(
-        セッション数=('session_id', 'nunique'),
-        # クリック数はユニークセッション数でカウント
-        クリック数=('session_id', lambda x: display_df.loc[x.index][display_df.loc[x.index]['event_name'] == 'click']['session_id'].nunique()),
-        平均滞在時間=('stay_ms', 'mean'),
-        平均到達ページ=('max_page_reached', 'mean')
-    ).reset_index()
-    segment_stats.rename(columns={segment_col: segment_name}, inplace=True)
-    
-    # コンバージョン数
-    segment_cv = display_df[display_df['cv_type'].notna()].groupby(segment_col)['session_id'].nunique().reset_index()
-    segment_cv.rename(columns={segment_col: segment_name, 'session_id': 'CV数'}, inplace=True)
-    segment_stats = pd.merge(segment_stats, segment_cv, on=segment_name, how='left').fillna(0)
-
-    # FV残存数
-    segment_fv = display_df[display_df['max_page_reached'] >= 2].groupby(segment_col)['session_id'].nunique().reset_index()
-    segment_fv.rename(columns={segment_col: segment_name, 'session_id': 'FV残存数'}, inplace=True)
-    segment_stats = pd.merge(segment_stats, segment_fv, on=segment_name, how='left').fillna(0)
-
-    # 最終CTA到達数
-    segment_final_cta = display_df[display_df['max_page_reached'] >= 10].groupby(segment_col)['session_id'].nunique().reset_index()
-    segment_final_cta.rename(columns={segment_col: segment_name, 'session_id': '最終CTA到達数'}, inplace=True)
-    segment_stats = pd.merge(segment_stats, segment_final_cta, on=segment_name, how='left').fillna(0)
-
-    # エンゲージメント率（滞在時間30秒以上）
-    engaged_sessions = display_df[display_df['stay_ms'] >= 30000].groupby(segment_col)['session_id'].nunique().reset_index()
-    engaged_sessions.rename(columns={segment_col: segment_name, 'session_id': 'エンゲージセッション数'}, inplace=True)
-    segment_stats = pd.merge(segment_stats, engaged_sessions, on=segment_name, how='left').fillna(0)
-
-    # 率の計算
-    segment_stats['CVR'] = segment_stats.apply(lambda row: safe_rate(row['CV数'], row['セッション数']) * 100, axis=1)
-    segment_stats['CTR'] = segment_stats.apply(lambda row: safe_rate(row['クリック数'], row['セッション数']) * 100, axis=1)
-    segment_stats['FV残存率'] = segment_stats.apply(lambda row: safe_rate(row['FV残存数'], row['セッション数']) * 100, axis=1)
-    segment_stats['最終CTA到達率'] = segment_stats.apply(lambda row: safe_rate(row['最終CTA到達数'], row['セッション数']) * 100, axis=1)
-    segment_stats['エンゲージメント率'] = segment_stats.apply(lambda row: safe_rate(row['エンゲージセッション数'], row['セッション数']) * 100, axis=1)
-    segment_stats['平均滞在時間'] = segment_stats['平均滞在時間'] / 1000
+    # 掛け合わせの場合は次元の値を連結して1つの表示名にする
+    segment_labels = segment_stats[list(segment_cols)].astype(str)
+    segment_stats.insert(0, segment_name, segment_labels.agg(' / '.join, axis=1) if len(segment_cols) > 1 else segment_labels[segment_cols[0]])
+    segment_stats = segment_stats.drop(columns=list(segment_cols))
 
     # テーブル表示
     display_cols = [
@@ -2449,10 +2577,38 @@ elif selected_analysis == "広告分析":
                 )
                 fig.update_layout(dragmode=False, yaxis_title=metric)
                 fig.update_traces(hovertemplate=f'%{{x}}<br>{metric}: %{{y:,.2f}}{unit}<extra></extra>')
-                st.plotly_chart(fig, use_container_width=True, key=f'ad_analysis_chart_{i}')
+                show_plotly_chart(fig, key=f'ad_analysis_chart_{i}')
     else:
         st.info("グラフを表示するには、上のプルダウンから少なくとも1つの指標を選択してください。")
 
+    # --- マルチタッチアトリビューション ---
+    st.markdown("---")
+    st.markdown("#### マルチタッチアトリビューション")
+    st.markdown('<div class="graph-description">同じユーザーの複数回の訪問を時系列につなげ、CVに至るまでに接触したチャネル・参照元・キャンペーンにCVを配分します。ラストタッチ以外のモデルでは、初回接触や途中の接触の貢献も評価できます。期間以外のフィルターは適用されません。</div>', unsafe_allow_html=True)
+    attribution_dimensions = {'チャネル': 'channel', '参照元': 'utm_source', 'キャンペーン': 'utm_campaign'}
+    attribution_label = st.radio("配分先", list(attribution_dimensions.keys()), horizontal=True, key="ad_attribution_dimension")
+    attribution_dimension = attribution_dimensions[attribution_label]
+
+    # 期間だけで絞り込んだ全ユーザーのセッションを使う（ユーザーの過去の接触を取りこぼさないため。期間以外の条件はキャッシュキーからも外す）
+    attribution_df = load_report('attribution', period_spec(ad_spec), dimension=attribution_dimension)['attribution']
+
+    if attribution_df.empty:
+        st.info("選択した期間にコンバージョンがないため、アトリビューションを計算できません。")
+    else:
+        model_labels = attribution.ATTRIBUTION_MODELS
+        attribution_cv = attribution_df['conversions'].rename(columns=model_labels)
+        attribution_plot = attribution_cv.reset_index().melt(id_vars=attribution_dimension, var_name='モデル', value_name='配分CV数')
+        fig = px.bar(attribution_plot, x=attribution_dimension, y='配分CV数', color='モデル', barmode='group',
+                     labels={attribution_dimension: attribution_label})
+        fig.update_traces(hovertemplate='%{x}<br>%{fullData.name}: %{y:.1f}件<extra></extra>')
+        fig.update_layout(height=450, dragmode=False, legend=dict(orientation="h", yanchor="bottom", y=-0.35, xanchor="center", x=0.5))
+        show_plotly_chart(fig, key='plotly_chart_ad_attribution')
+
+        attribution_table = attribution_cv.copy()
+        attribution_table['ラストタッチとの差(マルコフ)'] = attribution_table[model_labels['markov']] - attribution_table[model_labels['last_touch']]
+        attribution_table.index.name = attribution_label
+        st.dataframe(attribution_table.style.format('{:.1f}'), use_container_width=True)
+
     st.markdown("---")
 
     # --- AI分析と考察 ---
@@ -2514,6 +2670,110 @@ elif selected_analysis == "広告分析":
         if st.session_state.segment_faq_toggle.get(4, False):
             st.info("はい、中長期的には非常に有効な施策です。例えば、PCユーザーには詳細な情報を、スマホユーザーには要点を絞ったコンテンツを見せるなど、セグメントに合わせてLPをパーソナライズすることで、CVRの大幅な向上が期待できます。")
 
+# パフォーマンス分析
+elif selected_analysis == "パフォーマンス分析":
+    st.markdown('<div class="sub-header">パフォーマンス分析</div>', unsafe_allow_html=True)
+    st.markdown('<div class="graph-description">ページの読込時間を、平均ではなく p75（4人に3人がこの時間以内に表示）と p95（遅い5%の境界）で評価します。あわせて、読込が遅い表示が離脱をどれだけ増やしているか、読込時間が100ms延びるごとにCVRがどれだけ下がるかを推定します。</div>', unsafe_allow_html=True)
+
+    perf_cols = st.columns(4)
+    with perf_cols[0]:
+        perf_period_options = {"過去7日間": 7, "過去14日間": 14, "過去30日間": 30, "全期間": None}
+        perf_period = st.selectbox("期間を選択", list(perf_period_options.keys()), index=2, key="performance_period")
+    with perf_cols[1]:
+        lp_options = list(lp_partition_index)
+        perf_lp = st.selectbox("LP選択", ["すべて"] + lp_options, index=0, key="performance_lp")
+    with perf_cols[2]:
+        device_options = ["すべて"] + sorted(df['device_type'].dropna().unique().tolist())
+        perf_device = st.selectbox("デバイス選択", device_options, index=0, key="performance_device")
+    with perf_cols[3]:
+        channel_options = ["すべて"] + sorted(df['channel'].unique().tolist())
+        perf_channel = st.selectbox("チャネル", channel_options, index=0, key="performance_channel")
+
+    perf_end = df['event_date'].max().date()
+    perf_days = perf_period_options[perf_period]
+    perf_start = perf_end - timedelta(days=perf_days - 1) if perf_days else df['event_date'].min().date()
+    perf_lp_url = None if perf_lp == "すべて" else perf_lp
+    perf_df = filter_dataframe(df, perf_start, perf_end, perf_lp_url, perf_device, "すべて", "すべて", perf_channel, "すべて", partitions=lp_partition_index)
+    if perf_df.empty:
+        st.warning("選択した条件に一致するデータがありません。")
+        st.stop()
+    perf_key = make_filter_key(perf_start, perf_end, perf_lp_url, perf_device, "すべて", "すべて", perf_channel, "すべて")
+    perf_filters = {'lp_base_url': perf_lp_url, 'device_type': perf_device, 'channel': perf_channel}
+    perf_sketch = dataset_table(dataset, 'quantile_sketches')
+    perf_overall = quantile_sketch.quantiles(perf_sketch, 'load_time_ms', (0.5, 0.75, 0.95), perf_start, perf_end, perf_filters)
+
+    kpi_cols = st.columns(4)
+    if not perf_overall.empty:
+        kpi_cols[0].metric("表示回数", f"{int(perf_overall['count'].iloc[0]):,}")
+        kpi_cols[1].metric("読込時間 p50", f"{perf_overall['p50'].iloc[0]:,.0f}ms")
+        kpi_cols[2].metric("読込時間 p75", f"{perf_overall['p75'].iloc[0]:,.0f}ms")
+        kpi_cols[3].metric("読込時間 p95", f"{perf_overall['p95'].iloc[0]:,.0f}ms")
+
+    # --- ページ・デバイス・チャネル別のパーセンタイル ---
+    st.markdown("#### 読込時間のパーセンタイル")
+    breakdown = performance_analysis.percentile_breakdown(perf_sketch, start_date=perf_start, end_date=perf_end, filters=perf_filters)
+    breakdown_tabs = st.tabs(list(performance_analysis.PERFORMANCE_DIMENSIONS.values()))
+    for tab, (dim, dim_label) in zip(breakdown_tabs, performance_analysis.PERFORMANCE_DIMENSIONS.items()):
+        with tab:
+            dim_stats = breakdown[breakdown['dimension'] == dim].copy()
+            if dim_stats.empty:
+                st.info("データがありません。")
+                continue
+            if dim == 'page_num_dom':
+                dim_stats['segment'] = dim_stats['segment'].astype(int)
+            plot_df = dim_stats.melt(id_vars='segment', value_vars=['p75', 'p95'], var_name='パーセンタイル', value_name='読込時間(ms)')
+            fig = px.bar(plot_df, x='segment', y='読込時間(ms)', color='パーセンタイル', barmode='group', labels={'segment': dim_label})
+            fig.update_traces(hovertemplate=f'{dim_label}: %{{x}}<br>%{{fullData.name}}: %{{y:,.0f}}ms<extra></extra>')
+            fig.update_layout(height=400, dragmode=False, xaxis=dict(type='category'), legend=dict(orientation="h", yanchor="bottom", y=-0.3, xanchor="center", x=0.5))
+            show_plotly_chart(fig, key=f'plotly_chart_performance_{dim}')
+
+    # --- 遅い表示の離脱への寄与 ---
+    st.markdown("#### 遅い表示の離脱への寄与")
+    st.markdown('<div class="graph-description">しきい値より読込が遅かった表示の離脱率を、同じページの速い表示の離脱率と比べ、遅さによって余分に発生した離脱数（超過離脱数）と全離脱に占める割合を推定します。</div>', unsafe_allow_html=True)
+    default_threshold = int(round(perf_overall['p75'].iloc[0] / 100) * 100) if not perf_overall.empty else 1000
+    slow_threshold = st.slider("遅い表示とみなす読込時間 (ms)", min_value=100, max_value=5000, value=min(max(default_threshold, 100), 5000), step=100, key="performance_slow_threshold")
+    perf_loads = get_page_view_loads(dataset_version, perf_key, perf_df)
+    contribution = performance_analysis.slow_page_exit_contribution(perf_loads, slow_threshold)
+    if contribution.empty:
+        st.info("離脱の分析に必要なデータがありません。")
+    else:
+        total_contribution = contribution['離脱への寄与度'].sum()
+        st.metric("遅い表示による離脱の割合（推定）", f"{total_contribution:.1%}", help=f"超過離脱数の合計: {contribution['超過離脱数'].sum():,.0f}件")
+        fig = go.Figure()
+        fig.add_trace(go.Bar(x=contribution['ページ番号'], y=contribution['離脱率(速い)'] * 100, name=f'{slow_threshold}ms以下'))
+        fig.add_trace(go.Bar(x=contribution['ページ番号'], y=contribution['離脱率(遅い)'] * 100, name=f'{slow_threshold}ms超'))
+        fig.update_traces(hovertemplate='ページ%{x}<br>%{fullData.name}: %{y:.1f}%<extra></extra>')
+        fig.update_layout(height=400, barmode='group', xaxis_title='ページ番号', yaxis_title='離脱率 (%)', xaxis=dict(dtick=1), dragmode=False,
+                          legend=dict(orientation="h", yanchor="bottom", y=-0.3, xanchor="center", x=0.5))
+        show_plotly_chart(fig, key='plotly_chart_performance_exit')
+        with st.expander("ページ別の詳細"):
+            st.dataframe(contribution.style.format({
+                '表示数': '{:,}', '遅い表示の割合': '{:.1%}', '離脱率(速い)': '{:.1%}', '離脱率(遅い)': '{:.1%}',
+                '超過離脱数': '{:.1f}', '離脱への寄与度': '{:.2%}'
+            }, na_rep='-'), use_container_width=True, hide_index=True)
+
+    # --- 読込時間とCVR ---
+    st.markdown("#### 読込時間100msあたりのCVR低下")
+    st.markdown('<div class="graph-description">セッションを平均読込時間で20のグループに分けてCVRを求め、読込時間に対する回帰の傾きから、読込時間が100ms延びたときのCVRの変化を推定します。スマホは読込が遅くCVRも低いといったデバイスの違いが混ざらないよう、デバイスごとにグループを作って調整しています。</div>', unsafe_allow_html=True)
+    perf_sessions = get_session_table(dataset_version, perf_key, perf_df)
+    regression = get_cvr_load_regression(dataset_version, perf_key, 'device_type', perf_sessions)
+    if regression['bins'].empty:
+        st.info("回帰に必要なセッション数が不足しています。")
+    else:
+        reg_cols = st.columns(2)
+        reg_cols[0].metric("100msあたりのCVR変化", f"{regression['slope_per_100ms'] * 100:+.3f}pt",
+                           help=f"95%信頼区間: {regression['ci_low'] * 100:+.3f}〜{regression['ci_high'] * 100:+.3f}pt")
+        reg_cols[1].metric("p値", f"{regression['p_value']:.3f}")
+        if regression['p_value'] >= 0.05:
+            st.caption("95%の信頼水準では、読込時間とCVRの関係は統計的に有意ではありません。")
+        reg_bins = regression['bins']
+        fig = px.scatter(reg_bins, x='load_time_ms', y='cvr', color='segment', size='sessions',
+                         labels={'load_time_ms': '平均読込時間 (ms)', 'cvr': 'CVR', 'segment': 'デバイス', 'sessions': 'セッション数'})
+        for segment, group in reg_bins.groupby('segment'):
+            fig.add_trace(go.Scatter(x=group['load_time_ms'], y=group['fitted'], mode='lines', name=f'{segment}（回帰）', line=dict(dash='dash')))
+        fig.update_layout(height=450, yaxis_tickformat='.1%', dragmode=False, legend=dict(orientation="h", yanchor="bottom", y=-0.35, xanchor="center", x=0.5))
+        show_plotly_chart(fig, key='plotly_chart_performance_regression')
+
 # タブ4: A/Bテスト分析
 elif selected_analysis == "A/Bテスト分析":
 
@@ -2533,7 +2793,7 @@ elif selected_analysis == "A/Bテスト分析":
 
     with filter_cols_1[1]:
         # LP選択
-        lp_options = sorted(df['page_location'].dropna().unique().tolist())
+        lp_options = list(lp_partition_index)
         selected_lp = st.selectbox(
             "LP選択", 
             lp_options, 
@@ -2602,39 +2862,11 @@ elif selected_analysis == "A/Bテスト分析":
         with col2:
             end_date = st.date_input("終了日", df['event_date'].max(), key="ab_test_end_date")
 
-    # --- 新規/リピート、CV/非CVの列を追加 ---
-    df['user_type'] = np.where(df['ga_session_number'] == 1, '新規', 'リピート')
-    conversion_session_ids = df[df['cv_type'].notna()]['session_id'].unique()
-    df['conversion_status'] = np.where(df['session_id'].isin(conversion_session_ids), 'コンバージョン', '非コンバージョン')
-
     # データフィルタリング
-    filtered_df = df.copy()
-
-    # 期間フィルター
-    filtered_df = filtered_df[
-        (filtered_df['event_date'] >= pd.to_datetime(start_date)) &
-        (filtered_df['event_date'] <= pd.to_datetime(end_date))
-    ]
-
-    # LPフィルター
-    if selected_lp:
-        filtered_df = filtered_df[filtered_df['page_location'] == selected_lp]
-
-    # --- クロス分析用フィルター適用 ---
-    if selected_device != "すべて":
-        filtered_df = filtered_df[filtered_df['device_type'] == selected_device]
-
-    if selected_user_type != "すべて":
-        filtered_df = filtered_df[filtered_df['user_type'] == selected_user_type]
-
-    if selected_conversion_status != "すべて":
-        filtered_df = filtered_df[filtered_df['conversion_status'] == selected_conversion_status]
-
-    if selected_channel != "すべて":
-        filtered_df = filtered_df[filtered_df['channel'] == selected_channel]
-
-    if selected_source_medium != "すべて":
-        filtered_df = filtered_df[filtered_df['source_medium'] == selected_source_medium]
+    # 選択したLPのパーティションだけを絞り込む
+    ab_spec = filter_spec(start_date, end_date, selected_lp, selected_device, selected_user_type,
+                           selected_conversion_status, selected_channel, selected_source_medium)
+    filtered_df = select_events(dataset, ab_spec)
 
     # 比較機能は無効化
     comparison_df = None
@@ -2644,88 +2876,9 @@ elif selected_analysis == "A/Bテスト分析":
         st.warning("⚠️ 選択した条件に該当するデータがありません。フィルターを変更してください。")
         st.stop()
 
-    # A/Bテスト種別のマッピング
-    test_type_map = {
-        'hero_image': 'FVテスト',
-        'cta_button': 'CTAテスト',
-        'headline': 'ヘッドラインテスト',
-        'layout': 'レイアウトテスト',
-        'copy': 'コピーテスト',
-        'form': 'フォームテスト',
-        'video': '動画テスト'
-    }
-    if 'ab_test_target' in filtered_df.columns:
-        filtered_df['ab_test_target'] = filtered_df['ab_test_target'].map(test_type_map).fillna('-')
-    else:
-        filtered_df['ab_test_target'] = '-'
-
-    # p_valueカラムが存在するかどうかでaggの内容を分岐
-    agg_dict = {
-        'session_id': 'nunique',
-        'stay_ms': 'mean',
-        'max_page_reached': 'mean',
-        'completion_rate': 'mean'
-    }
-
-    if 'p_value' in filtered_df.columns:
-        agg_dict['p_value'] = 'first'
-        ab_stats = filtered_df.groupby(['ab_test_target', 'ab_variant']).agg(agg_dict).reset_index()
-        ab_stats.columns = ['テスト種別', 'バリアント', 'セッション数', '平均滞在時間(ms)', '平均到達ページ数', '平均完了率', 'p値']
-    else:
-        ab_stats = filtered_df.groupby(['ab_test_target', 'ab_variant']).agg(agg_dict).reset_index()
-        ab_stats.columns = ['テスト種別', 'バリアント', 'セッション数', '平均滞在時間(ms)', '平均到達ページ数', '平均完了率']
-        # p_valueカラムが存在しない場合は、1.0で初期化
-        ab_stats['p値'] = 1.0
-    
-
-    ab_stats['平均滞在時間(秒)'] = ab_stats['平均滞在時間(ms)'] / 1000
-    ab_stats['p値'] = ab_stats['p値'].fillna(1.0) # p値がない場合は1.0で埋める
-    
-    # コンバージョン数（テスト種別とバリアントでグループ化）
-    ab_cv = filtered_df[filtered_df['cv_type'].notna()].groupby(['ab_test_target', 'ab_variant'])['session_id'].nunique().reset_index()
-    ab_cv.columns = ['テスト種別', 'バリアント', 'コンバージョン数']
-    
-    ab_stats = ab_stats.merge(ab_cv, on=['テスト種別', 'バリアント'], how='left').fillna({'コンバージョン数': 0})
-    ab_stats['コンバージョン率'] = ab_stats.apply(lambda row: safe_rate(row['コンバージョン数'], row['セッション数']) * 100, axis=1)
-    
-    # FV残存率（テスト種別とバリアントでグループ化）
-    fv_retention = filtered_df[filtered_df['max_page_reached'] >= 2].groupby(['ab_test_target', 'ab_variant'])['session_id'].nunique().reset_index()
-    fv_retention.columns = ['テスト種別', 'バリアント', 'FV残存数']
-    
-    ab_stats = ab_stats.merge(fv_retention, on=['テスト種別', 'バリアント'], how='left').fillna({'FV残存数': 0})
-    ab_stats['FV残存率'] = ab_stats.apply(lambda row: safe_rate(row['FV残存数'], row['セッション数']) * 100, axis=1)
-    
-    # 最終CTA到達率（テスト種別とバリアントでグループ化）
-    final_cta = filtered_df[filtered_df['max_page_reached'] >= 10].groupby(['ab_test_target', 'ab_variant'])['session_id'].nunique().reset_index()
-    final_cta.columns = ['テスト種別', 'バリアント', '最終CTA到達数']
-    
-    ab_stats = ab_stats.merge(final_cta, on=['テスト種別', 'バリアント'], how='left').fillna({'最終CTA到達数': 0})
-    ab_stats['最終CTA到達率'] = ab_stats.apply(lambda row: safe_rate(row['最終CTA到達数'], row['セッション数']) * 100, axis=1)
-    
-    # テスト種別が'-'の行（テスト対象外のデータ）を除外
-    ab_stats = ab_stats[ab_stats['テスト種別'] != '-'].reset_index(drop=True)
-
-    # --- A/Bテスト統計計算 ---
-    ab_stats['CVR差分(pt)'] = np.nan # デフォルトをNaNに
-
-    # テスト種別ごとにCVR差分を計算
-    for test_type in ab_stats['テスト種別'].unique():
-        test_df = ab_stats[ab_stats['テスト種別'] == test_type]
-        # バリアントAを基準とする
-        if 'A' in test_df['バリアント'].values:
-            baseline_cvr = test_df[test_df['バリアント'] == 'A']['コンバージョン率'].iloc[0]
-            
-            # バリアントAの差分は0
-            a_index = test_df[test_df['バリアント'] == 'A'].index
-            ab_stats.loc[a_index, 'CVR差分(pt)'] = 0.0
-
-            # 他のバリアントの差分を計算
-            other_variants_index = test_df[test_df['バリアント'] != 'A'].index
-            ab_stats.loc[other_variants_index, 'CVR差分(pt)'] = test_df.loc[other_variants_index, 'コンバージョン率'] - baseline_cvr
-
-    # p値から有意差と有意性を計算
-    ab_stats['有意差'] = ab_stats['p値'].apply(lambda x: '★★★' if x < 0.01 else ('★★' if x < 0.05 else ('★' if x < 0.1 else '-')))
-    ab_stats['有意性'] = 1 - ab_stats['p値']  # バブルチャート用
+    # テスト種別×バリアントごとの指標（データバージョン＋フィルター条件でキャッシュ）。日別の推移用にイベントにもテスト種別の日本語名を付ける
+    ab_stats = load_report('ab_test', ab_spec)['variants']
+    filtered_df['ab_test_target'] = ab_analytics.test_type_labels(filtered_df)
 
 
     # A/Bテスト比較
@@ -2819,7 +2972,7 @@ elif selected_analysis == "A/Bテスト分析":
         fig.add_shape(type="rect", xref="paper", yref="paper", x0=0, y0=0, x1=0.5, y1=0.5, fillcolor="rgba(128, 128, 128, 0.1)", layer="below", line_width=0)
         fig.add_annotation(xref="paper", yref="paper", x=0.25, y=0.25, text="<b>判断保留ゾーン</b><br>CVR悪化<br class='mobile-br'>有意差なし", showarrow=False, font=dict(color="grey", size=14), align="center", xanchor="center", yanchor="middle")
 
-        st.plotly_chart(fig, use_container_width=True, key='plotly_chart_ab_bubble')
+        show_plotly_chart(fig, key='plotly_chart_ab_bubble')
     else:
         st.info("バブルチャートを表示するためのバリアント「B」のデータがありません。")
         
@@ -2882,7 +3035,7 @@ elif selected_analysis == "A/Bテスト分析":
         height=500,
         dragmode=False
     )
-    st.plotly_chart(fig_cvr_timeseries, use_container_width=True)
+    show_plotly_chart(fig_cvr_timeseries, key='plotly_chart_ab_cvr_timeseries')
 
     st.markdown("---")
 
@@ -2969,7 +3122,7 @@ elif selected_analysis == "インタラクション分析":
 
     with filter_cols_1[1]:
         # LP選択
-        lp_options = sorted(df['page_location'].dropna().unique().tolist())
+        lp_options = list(lp_partition_index)
         selected_lp = st.selectbox(
             "LP選択", 
             lp_options, 
@@ -3038,39 +3191,11 @@ elif selected_analysis == "インタラクション分析":
         with col2:
             end_date = st.date_input("終了日", df['event_date'].max(), key="interaction_end_date")
 
-    # --- 新規/リピート、CV/非CVの列を追加 ---
-    df['user_type'] = np.where(df['ga_session_number'] == 1, '新規', 'リピート')
-    conversion_session_ids = df[df['cv_type'].notna()]['session_id'].unique()
-    df['conversion_status'] = np.where(df['session_id'].isin(conversion_session_ids), 'コンバージョン', '非コンバージョン')
-
     # データフィルタリング
-    filtered_df = df.copy()
-
-    # 期間フィルター
-    filtered_df = filtered_df[
-        (filtered_df['event_date'] >= pd.to_datetime(start_date)) &
-        (filtered_df['event_date'] <= pd.to_datetime(end_date))
-    ]
-
-    # LPフィルター
-    if selected_lp:
-        filtered_df = filtered_df[filtered_df['page_location'] == selected_lp]
-
-    # --- クロス分析用フィルター適用 ---
-    if selected_device != "すべて":
-        filtered_df = filtered_df[filtered_df['device_type'] == selected_device]
-
-    if selected_user_type != "すべて":
-        filtered_df = filtered_df[filtered_df['user_type'] == selected_user_type]
-
-    if selected_conversion_status != "すべて":
-        filtered_df = filtered_df[filtered_df['conversion_status'] == selected_conversion_status]
-
-    if selected_channel != "すべて":
-        filtered_df = filtered_df[filtered_df['channel'] == selected_channel]
-
-    if selected_source_medium != "すべて":
-        filtered_df = filtered_df[filtered_df['source_medium'] == selected_source_medium]
+    # 選択したLPのパーティションだけを絞り込む
+    interaction_spec = filter_spec(start_date, end_date, selected_lp, selected_device, selected_user_type,
+                                    selected_conversion_status, selected_channel, selected_source_medium)
+    filtered_df = select_events(dataset, interaction_spec)
 
     # 比較機能は無効化
     comparison_df = None
@@ -3087,42 +3212,9 @@ elif selected_analysis == "インタラクション分析":
     st.markdown("#### インタラクション要素一覧")
     st.markdown('<div class="graph-description">LP内の各インタラクション要素について、要素が表示されたセッション数、クリック数、およびクリック率を表示します。</div>', unsafe_allow_html=True)
 
-    interactions_for_list = {
-        'CTAボタンクリック': {'condition': (filtered_df['event_name'] == 'click') & (filtered_df['elem_classes'].str.contains('cta|btn-primary', na=False)), 'page_num': 9},
-        'フローティングバナークリック': {'condition': (filtered_df['event_name'] == 'click') & (filtered_df['elem_classes'].str.contains('floating', na=False)), 'page_num': 1}, # 全ページで表示されると仮定
-        '離脱防止ポップアップクリック': {'condition': (filtered_df['event_name'] == 'click') & (filtered_df['elem_classes'].str.contains('exit', na=False)), 'page_num': 1}, # 全ページで表示されると仮定
-        '動画視聴完了': {'condition': filtered_df['event_name'] == 'video_completion', 'page_num': 1} # 動画はP1にあると仮定
-    }
-
-    interaction_list_data = []
-    for name, details in interactions_for_list.items():
-        condition = details['condition']
-        page_num = details['page_num']
-
-        # クリック数または視聴開始数（イベントの行数）
-        action_count = condition.sum()
-        
-        # その行動を取ったユニークなセッション数
-        action_session_count = filtered_df[condition]['session_id'].nunique()
-
-        # 表示セッション数（要素が存在するページに到達したセッション数）
-        # page_numが1の場合は全セッションが表示機会を持つとみなす
-        if page_num == 1:
-            impression_sessions = total_sessions
-        else:
-            impression_sessions = filtered_df[filtered_df['max_page_reached'] >= page_num]['session_id'].nunique()
-
-        # クリック率（行動セッション数 / 表示セッション数）
-        rate = safe_rate(action_session_count, impression_sessions) * 100
-
-        interaction_list_data.append({
-            'インタラクション要素': name,
-            '表示セッション数': impression_sessions,
-            'クリック数または視聴完了数': action_count,
-            'クリック率または視聴完了率': rate
-        })
-
-    interaction_list_df = pd.DataFrame(interaction_list_data)
+    # 要素一覧と貢献度（全データのセッション × インタラクション要素の行列から、フィルター条件に一致するセッションだけを集計）
+    interaction_tables = load_report('interaction', interaction_spec)
+    interaction_list_df, contribution_df = interaction_tables['elements'], interaction_tables['contribution']
 
     st.dataframe(interaction_list_df.style.format({
         '表示セッション数': '{:,.0f}',
@@ -3133,58 +3225,16 @@ elif selected_analysis == "インタラクション分析":
     st.markdown("---")
 
 
-    # --- CV貢献度分析ロジック ---
-    interactions = {
-        'CTAボタンクリック': (filtered_df['event_name'] == 'click') & (filtered_df['elem_classes'].str.contains('cta|btn-primary', na=False)),
-        'フローティングバナークリック': (filtered_df['event_name'] == 'click') & (filtered_df['elem_classes'].str.contains('floating', na=False)),
-        '離脱防止ポップアップクリック': (filtered_df['event_name'] == 'click') & (filtered_df['elem_classes'].str.contains('exit', na=False)),
-        '動画視聴完了': filtered_df['event_name'] == 'video_completion'
-    }
-
-    contribution_data = []
-
-    for name, condition in interactions.items():
-        # インタラクションを行ったセッションID
-        interacted_session_ids = filtered_df[condition]['session_id'].unique()
-        
-        # 全セッションID
-        all_session_ids = filtered_df['session_id'].unique()
-
-        # インタラクションを行わなかったセッションID
-        non_interacted_session_ids = np.setdiff1d(all_session_ids, interacted_session_ids)
-
-        # CVしたセッションID
-        cv_session_ids = filtered_df[filtered_df['cv_type'].notna()]['session_id'].unique()
-
-        # グループA: インタラクション有り
-        interacted_cv_sessions = np.intersect1d(interacted_session_ids, cv_session_ids)
-        cvr_with_interaction = safe_rate(len(interacted_cv_sessions), len(interacted_session_ids)) * 100
-
-        # グループB: インタラクション無し
-        non_interacted_cv_sessions = np.intersect1d(non_interacted_session_ids, cv_session_ids)
-        cvr_without_interaction = safe_rate(len(non_interacted_cv_sessions), len(non_interacted_session_ids)) * 100
-
-        # CVRリフト率
-        cvr_lift = safe_rate(cvr_with_interaction - cvr_without_interaction, cvr_without_interaction) * 100
-
-        contribution_data.append({
-            'インタラクション要素': name,
-            'インタラクション有りCVR (%)': cvr_with_interaction,
-            'インタラクション無しCVR (%)': cvr_without_interaction,
-            'CVRリフト率 (%)': cvr_lift
-        })
-
-    contribution_df = pd.DataFrame(contribution_data)
-
-    # CV貢献度テーブル
+    # --- CV貢献度（インタラクション有無別のCVR） ---
     st.markdown("#### インタラクション別 CV貢献度")
     st.markdown('<div class="graph-description">各行動（インタラクション）の「有り/無し」でユーザーを分け、それぞれのコンバージョン率（CVR）を比較します。「CVRリフト率」が高いほど、その行動がCVに強く貢献していることを示します。</div>', unsafe_allow_html=True)
 
     st.dataframe(contribution_df.style.format({
         'インタラクション有りCVR (%)': '{:.2f}%',
         'インタラクション無しCVR (%)': '{:.2f}%',
-        'CVRリフト率 (%)': '{:+.1f}%'
-    }), use_container_width=True, hide_index=True)
+        'CVRリフト率 (%)': '{:+.1f}%',
+        'p値': '{:.4f}'
+    }, na_rep='-'), use_container_width=True, hide_index=True)
 
     # CV貢献度 比較グラフ
     st.markdown("#### CV貢献度 比較グラフ")
@@ -3216,7 +3266,42 @@ elif selected_analysis == "インタラクション分析":
         legend=dict(orientation="h", yanchor="bottom", y=-0.3, xanchor="center", x=0.5)
     )
     fig.update_traces(hovertemplate='%{x}<br>%{fullData.name}: %{y:.2f}%<extra></extra>')
-    st.plotly_chart(fig, use_container_width=True, key='plotly_chart_interaction_contribution')
+    show_plotly_chart(fig, key='plotly_chart_interaction_contribution')
+
+    # --- 全要素・セグメント別の貢献度 ---
+    st.markdown("#### 要素別・セグメント別の貢献度")
+    st.markdown('<div class="graph-description">計測されたすべての要素（イベント名・クラス名・要素IDの組み合わせ）について、実行したセッションと実行しなかったセッションのCVRを比較します。p値が小さいほど、CVRの差が偶然ではない可能性が高いことを示します。</div>', unsafe_allow_html=True)
+    element_segments = {'なし（全体）': None, 'デバイス': 'device_type', 'チャネル': 'channel', '新規/リピート': 'user_type'}
+    element_segment_label = st.radio("セグメント", list(element_segments.keys()), horizontal=True, key="interaction_element_segment")
+    element_stats = interaction_matrix.interaction_stats(dataset_table(dataset, 'interaction_matrix'), dataset_table(dataset, 'sessions'), None,
+                                                         select_session_mask(dataset, interaction_spec),
+                                                         segment=element_segments[element_segment_label], min_sessions=1)
+    if element_stats.empty:
+        st.info("選択した条件では、計測された要素のイベントがありません。")
+    else:
+        element_table = element_stats.rename(columns={
+            'interaction': '要素', 'segment': 'セグメント', 'sessions': 'セッション数', 'actions': 'イベント数',
+            'action_sessions': '実行セッション数', 'cvr_with': '実行ありCVR', 'cvr_without': '実行なしCVR',
+            'lift': 'CVRリフト率', 'p_value': 'p値',
+        })[['要素', 'セグメント', 'セッション数', 'イベント数', '実行セッション数', '実行ありCVR', '実行なしCVR', 'CVRリフト率', 'p値']]
+        element_table['実行率'] = element_table['実行セッション数'] / element_table['セッション数'].where(element_table['セッション数'] > 0)
+        st.dataframe(element_table.sort_values('実行セッション数', ascending=False).style.format({
+            'セッション数': '{:,}', 'イベント数': '{:,}', '実行セッション数': '{:,}', '実行率': '{:.1%}',
+            '実行ありCVR': '{:.2%}', '実行なしCVR': '{:.2%}', 'CVRリフト率': '{:+.1%}', 'p値': '{:.4f}'
+        }, na_rep='-'), use_container_width=True, hide_index=True, height=320)
+
+    # --- クリック有無別のページ遷移パス ---
+    st.markdown("#### クリック有無別のページ遷移パス")
+    st.markdown('<div class="graph-description">LP全体のページ遷移から、クリックが発生したセッションとしなかったセッションのよく通られるパスを比較します。クリックしたユーザーがどのような順序でページを見ているかを確認できます。</div>', unsafe_allow_html=True)
+    interaction_sequences = get_path_analysis(dataset_version, spec_key(interaction_spec), None, filtered_df)['sequences']
+    clicked_session_ids = filtered_df.loc[filtered_df['event_name'] == 'click', 'session_id'].unique()
+    clicked_mask = pd.Index(interaction_sequences['session_ids']).isin(clicked_session_ids)
+    click_path_cols = st.columns(2)
+    for col, label, mask in [(click_path_cols[0], 'クリックあり', clicked_mask), (click_path_cols[1], 'クリックなし', ~clicked_mask)]:
+        with col:
+            st.markdown(f"##### {label}（{int(mask.sum()):,}セッション）")
+            paths = path_analysis.top_paths(path_analysis.subset_sequences(interaction_sequences, mask), n=5)
+            st.dataframe(paths.style.format({'割合': '{:.1%}', 'CVR': '{:.1%}', 'セッション数': '{:,}'}), use_container_width=True, hide_index=True)
 
     st.markdown("---")
 
@@ -3292,7 +3377,7 @@ elif selected_analysis == "動画・スクロール分析":
 
     with filter_cols_1[1]:
         # LP選択
-        lp_options = sorted(df['page_location'].dropna().unique().tolist())
+        lp_options = list(lp_partition_index)
         selected_lp = st.selectbox(
             "LP選択", 
             lp_options, 
@@ -3361,39 +3446,11 @@ elif selected_analysis == "動画・スクロール分析":
         with col2:
             end_date = st.date_input("終了日", df['event_date'].max(), key="video_scroll_end_date")
 
-    # --- 新規/リピート、CV/非CVの列を追加 ---
-    df['user_type'] = np.where(df['ga_session_number'] == 1, '新規', 'リピート')
-    conversion_session_ids = df[df['cv_type'].notna()]['session_id'].unique()
-    df['conversion_status'] = np.where(df['session_id'].isin(conversion_session_ids), 'コンバージョン', '非コンバージョン')
-
     # データフィルタリング
-    filtered_df = df.copy()
-
-    # 期間フィルター
-    filtered_df = filtered_df[
-        (filtered_df['event_date'] >= pd.to_datetime(start_date)) &
-        (filtered_df['event_date'] <= pd.to_datetime(end_date))
-    ]
-
-    # LPフィルター
-    if selected_lp:
-        filtered_df = filtered_df[filtered_df['page_location'] == selected_lp]
-
-    # --- クロス分析用フィルター適用 ---
-    if selected_device != "すべて":
-        filtered_df = filtered_df[filtered_df['device_type'] == selected_device]
-
-    if selected_user_type != "すべて":
-        filtered_df = filtered_df[filtered_df['user_type'] == selected_user_type]
-
-    if selected_conversion_status != "すべて":
-        filtered_df = filtered_df[filtered_df['conversion_status'] == selected_conversion_status]
-
-    if selected_channel != "すべて":
-        filtered_df = filtered_df[filtered_df['channel'] == selected_channel]
-
-    if selected_source_medium != "すべて":
-        filtered_df = filtered_df[filtered_df['source_medium'] == selected_source_medium]
+    # 選択したLPのパーティションだけを絞り込む
+    video_spec = filter_spec(start_date, end_date, selected_lp, selected_device, selected_user_type,
+                              selected_conversion_status, selected_channel, selected_source_medium)
+    filtered_df = select_events(dataset, video_spec)
 
     # 比較機能は無効化
     comparison_df = None
@@ -3406,133 +3463,112 @@ elif selected_analysis == "動画・スクロール分析":
     # このページで必要なKPIを計算
     total_sessions = filtered_df['session_id'].nunique()
 
+    depth_segments = {'なし（全体）': None, 'デバイス': 'device_type', 'チャネル': 'channel', '新規/リピート': 'user_type'}
+    depth_segment_label = st.radio("比較するセグメント", list(depth_segments.keys()), horizontal=True, key="video_scroll_segment")
+    depth_segment = depth_segments[depth_segment_label]
+
+    # 動画視聴・スクロールの表（全データのセッションごとの視聴段階・スクロール率から、フィルター条件に一致するセッションだけを集計）
+    video_scroll_tables = load_report('video_scroll', video_spec, segment=depth_segment)
+
     # --- 動画視聴ファネル ---
     st.markdown("#### 動画視聴ファネル")
     st.markdown('<div class="graph-description">動画の再生開始から視聴完了までのユーザーの残存率を可視化します。どの段階で離脱が多いかを把握できます。</div>', unsafe_allow_html=True)
 
-    # GTMで計測されると想定されるイベント名
-    video_events = {
-        '再生開始': 'video_play',
-        '25%視聴': 'video_progress_25',
-        '50%視聴': 'video_progress_50',
-        '75%視聴': 'video_progress_75',
-        '視聴完了': 'video_completion'
-    }
-
-    funnel_data = []
-    # 再生開始したユニークセッション数を基準とする
-    start_sessions_count = filtered_df[filtered_df['event_name'] == video_events['再生開始']]['session_id'].nunique()
-
-    if start_sessions_count > 0:
-        for stage, event_name in video_events.items():
-            # そのイベントを発生させたユニークセッション数をカウント
-            sessions_count = filtered_df[filtered_df['event_name'] == event_name]['session_id'].nunique()
-            funnel_data.append({'段階': stage, 'セッション数': sessions_count})
-
-        video_funnel_df = pd.DataFrame(funnel_data)
-
-        fig_video_funnel = go.Figure(go.Funnel(
-            y=video_funnel_df['段階'],
-            x=video_funnel_df['セッション数'],
-            textinfo="value+percent initial",
-            hovertemplate='段階: %{y}<br>セッション数: %{x:,}<extra></extra>'
-        ))
-        fig_video_funnel.update_layout(height=500, dragmode=False)
-        st.plotly_chart(fig_video_funnel, use_container_width=True, key='plotly_chart_video_funnel')
+    video_funnel_df = video_scroll_tables['video_funnel']
+    if video_funnel_df['sessions'].max() > 0:
+        fig_video_funnel = go.Figure()
+        for segment_name, segment_funnel in video_funnel_df.groupby('segment', sort=False):
+            fig_video_funnel.add_trace(go.Funnel(
+                name=segment_name,
+                y=segment_funnel['stage'],
+                x=segment_funnel['sessions'],
+                textinfo="value+percent initial",
+                hovertemplate='段階: %{y}<br>セッション数: %{x:,}<extra></extra>'
+            ))
+        fig_video_funnel.update_layout(height=500, dragmode=False, showlegend=depth_segment is not None)
+        show_plotly_chart(fig_video_funnel, key='plotly_chart_video_funnel')
     else:
         st.info("選択された期間に動画の再生データがありません。")
 
     st.markdown("---")
 
-    # 逆行率分析
-    st.markdown("ページ別平均逆行率")
-    st.markdown('<div class="graph-description">各ページでユーザーがどれだけ逆方向にスクロールしたかを表示します。逆行率が高いページは、ユーザーが迷っているまたは情報を再確認している可能性があります。</div>', unsafe_allow_html=True) # type: ignore
-    scroll_stats = filtered_df.groupby('page_num_dom')['scroll_pct'].mean().reset_index()
-    scroll_stats.columns = ['ページ番号', '平均逆行率']
-    scroll_stats['平均逆行率(%)'] = scroll_stats['平均逆行率'] * 100
-    
-    fig = px.bar(scroll_stats, x='ページ番号', y='平均逆行率(%)', text='平均逆行率(%)')
-    fig.update_traces(
-        texttemplate='%{text:.1f}%',
-        textposition='outside',
-        hovertemplate='ページ: %{x}<br>逆行率: %{y:.1f}%<extra></extra>'
-    )
-    fig.update_layout(height=400, showlegend=False, xaxis_title='ページ番号', yaxis_title='平均逆行率 (%)', dragmode=False)
-    st.plotly_chart(fig, use_container_width=True, key='plotly_chart_18') # This already has use_container_width=True
-    
-    # 動画視聴分析（動画イベントがある場合）
-    video_df = filtered_df[filtered_df['video_src'].notna()]
-    
-    if len(video_df) > 0:
+    # スクロール到達率分析
+    st.markdown("ページ別スクロール到達率")
+    st.markdown('<div class="graph-description">各ページを表示したセッションのうち、ページの25%・50%・75%・最後までスクロールした割合です。到達率が急に下がるページは、途中で読むのをやめられている可能性があります。</div>', unsafe_allow_html=True) # type: ignore
+    scroll_stats = video_scroll_tables['scroll_reach']
+    scroll_reach_columns = [c for c in scroll_stats.columns if c not in ('ページ番号', '表示数')]
+    scroll_reach_plot = scroll_stats.melt(id_vars=['ページ番号', '表示数'], value_vars=scroll_reach_columns, var_name='到達ライン', value_name='到達率')
+    scroll_reach_plot['到達率(%)'] = scroll_reach_plot['到達率'] * 100
+
+    fig = px.line(scroll_reach_plot, x='ページ番号', y='到達率(%)', color='到達ライン', markers=True, hover_data={'表示数': ':,'})
+    fig.update_traces(hovertemplate='ページ: %{x}<br>到達率: %{y:.1f}%<extra>%{fullData.name}</extra>')
+    fig.update_layout(height=400, xaxis_title='ページ番号', yaxis_title='スクロール到達率 (%)', xaxis=dict(dtick=1), dragmode=False,
+                      legend=dict(orientation="h", yanchor="bottom", y=-0.3, xanchor="center", x=0.5))
+    show_plotly_chart(fig, key='plotly_chart_18') # This already has use_container_width=True
+
+    # 動画視聴分析（動画のあるページを表示したセッションがある場合）
+    video_lift = video_scroll_tables['video_lift']
+    video_overall = video_scroll_tables['video_overall'].iloc[0]
+    video_sessions = int(video_overall['played'])
+    video_cvr = np.nan_to_num(video_overall['cvr_completed']) * 100
+    non_video_cvr = np.nan_to_num(video_overall['cvr_not_completed']) * 100
+
+    if video_overall['exposed'] > 0:
         st.markdown("#### 動画視聴率")
-        
-        video_sessions = video_df['session_id'].nunique()
-        total_sessions_with_video_page = filtered_df[filtered_df['video_src'].notna()]['session_id'].nunique()
-        video_view_rate = safe_rate(video_sessions, total_sessions) * 100
-        
+
         col1, col2, col3 = st.columns(3)
-        
+
         with col1:
-            st.metric("動画が表示されたセッション", f"{total_sessions_with_video_page:,}")
-        
+            st.metric("動画が表示されたセッション", f"{int(video_overall['exposed']):,}")
+
         with col2:
             st.metric("動画を視聴したセッション", f"{video_sessions:,}")
-        
+
         with col3:
-            st.metric("視聴率", f"{video_view_rate:.2f}%")
-        
-        # 視聴率とCVRの相関
+            st.metric("視聴率", f"{safe_rate(video_sessions, video_overall['exposed']) * 100:.2f}%")
+
+        # 視聴完了とCVRの関係
         st.markdown("#### 動画視聴とコンバージョンの関係")
-        
-        video_cv = video_df[video_df['cv_type'].notna()]['session_id'].nunique()
-        video_cvr = safe_rate(video_cv, video_sessions) * 100
-        
-        non_video_sessions = total_sessions - video_sessions
-        non_video_cv = filtered_df[(filtered_df['video_src'].isna()) & (filtered_df['cv_type'].notna())]['session_id'].nunique()
-        non_video_cvr = safe_rate(non_video_cv, non_video_sessions) * 100
-        
-        comparison_data = pd.DataFrame({
-            'グループ': ['動画視聴あり', '動画視聴なし'],
-            'コンバージョン率': [video_cvr, non_video_cvr]
-        })
-        
-        fig = px.bar(comparison_data, x='グループ', y='コンバージョン率', text='コンバージョン率')
+        st.markdown('<div class="graph-description">動画のあるページを表示したセッションを、動画を最後まで視聴したかどうかで分けてCVRを比較します。</div>', unsafe_allow_html=True)
+
+        # 視聴完了あり/なしのCVR（95%ブートストラップ信頼区間つき）
+        completion_plot = video_scroll_tables['completion']
+
+        fig = px.bar(completion_plot, x='セグメント' if depth_segment else 'グループ', y='コンバージョン率', color='グループ', barmode='group',
+                     text='コンバージョン率', error_y='CI上側', error_y_minus='CI下側', hover_data={'セッション数': ':,'})
         fig.update_traces(
             texttemplate='%{text:.2f}%',
             textposition='outside',
-            hovertemplate='%{x}<br>CVR: %{y:.2f}%<extra></extra>'
+            hovertemplate='%{x}<br>CVR: %{y:.2f}%<extra>%{fullData.name}</extra>'
         )
-        fig.update_layout(height=400, showlegend=False, yaxis_title='コンバージョン率 (%)', dragmode=False)
-        st.plotly_chart(fig, use_container_width=True, key='plotly_chart_19') # This already has use_container_width=True
-    
-    # 逆行率別CVR
-    st.markdown("逆行率別コンバージョン率")
-    st.markdown('<div class="graph-description">逆行率の範囲ごとにコンバージョン率を表示します。逆行率が高いほどコンバージョン率が低い傾向があるかを確認できます。</div>', unsafe_allow_html=True) # type: ignore
-    
-    # 逆行率を区間に分ける
-    filtered_df_scroll = filtered_df.copy()
-    filtered_df_scroll['scroll_range'] = pd.cut(filtered_df_scroll['scroll_pct'], bins=[0, 0.25, 0.5, 0.75, 1.0], labels=['0-25%', '25-50%', '50-75%', '75-100%'])
-    
-    scroll_range_sessions = filtered_df_scroll.groupby('scroll_range', observed=True)['session_id'].nunique().reset_index()
-    scroll_range_sessions.columns = ['逆行率', 'セッション数']
-    scroll_range_sessions['逆行率'] = scroll_range_sessions['逆行率'].astype(str)
-    
-    scroll_range_cv = filtered_df_scroll[filtered_df_scroll['cv_type'].notna()].groupby('scroll_range', observed=True)['session_id'].nunique().reset_index()
-    scroll_range_cv.columns = ['逆行率', 'コンバージョン数']
-    scroll_range_cv['逆行率'] = scroll_range_cv['逆行率'].astype(str)
-    
-    scroll_range_stats = scroll_range_sessions.merge(scroll_range_cv, on='逆行率', how='left')
-    scroll_range_stats['コンバージョン数'] = scroll_range_stats['コンバージョン数'].fillna(0)
-    scroll_range_stats['コンバージョン率'] = scroll_range_stats.apply(lambda row: safe_rate(row['コンバージョン数'], row['セッション数']) * 100, axis=1)
-    
-    fig = px.bar(scroll_range_stats, x='逆行率', y='コンバージョン率', text='コンバージョン率')
+        fig.update_layout(height=400, showlegend=depth_segment is not None, xaxis_title='', yaxis_title='コンバージョン率 (%)', dragmode=False)
+        show_plotly_chart(fig, key='plotly_chart_19') # This already has use_container_width=True
+
+        video_lift_display = video_lift.rename(columns={
+            'segment': 'セグメント', 'exposed': '動画表示', 'played': '再生', 'completed': '視聴完了',
+            'cvr_completed': 'CVR(視聴完了)', 'cvr_not_completed': 'CVR(視聴完了なし)', 'lift': 'リフト', 'p_value': 'p値',
+        }).drop(columns='z')
+        st.dataframe(video_lift_display.style.format({
+            '動画表示': '{:,}', '再生': '{:,}', '視聴完了': '{:,}', 'CVR(視聴完了)': '{:.2%}', 'CVR(視聴完了なし)': '{:.2%}', 'リフト': '{:+.1%}', 'p値': '{:.3f}',
+        }, na_rep='-'), use_container_width=True, hide_index=True)
+
+    # スクロール率別CVR
+    st.markdown("スクロール率別コンバージョン率")
+    st.markdown('<div class="graph-description">セッションのスクロール率（表示した各ページの最大スクロール率の平均）の範囲ごとにコンバージョン率を表示します。よく読み込んだセッションほどコンバージョン率が高い傾向があるかを確認できます。</div>', unsafe_allow_html=True) # type: ignore
+
+    # 区間ごとのCVR（95%ブートストラップ信頼区間つき）
+    scroll_range_stats = video_scroll_tables['scroll_range']
+
+    fig = px.bar(scroll_range_stats, x='スクロール率', y='コンバージョン率', text='コンバージョン率',
+                 color='セグメント' if depth_segment else None, barmode='group',
+                 error_y='CI上側', error_y_minus='CI下側', hover_data={'セッション数': ':,'})
     fig.update_traces(
         texttemplate='%{text:.2f}%',
         textposition='outside',
-        hovertemplate='逆行率: %{x}<br>CVR: %{y:.2f}%<extra></extra>'
+        hovertemplate='スクロール率: %{x}<br>CVR: %{y:.2f}%<extra></extra>'
     )
-    fig.update_layout(height=400, showlegend=False, xaxis_title='逆行率', yaxis_title='コンバージョン率 (%)', dragmode=False)
-    st.plotly_chart(fig, use_container_width=True, key='plotly_chart_20') # This already has use_container_width=True
+    fig.update_layout(height=400, showlegend=depth_segment is not None, xaxis_title='スクロール率', yaxis_title='コンバージョン率 (%)', dragmode=False)
+    show_plotly_chart(fig, key='plotly_chart_20') # This already has use_container_width=True
 
     st.markdown("---")
 
@@ -3550,20 +3586,9 @@ elif selected_analysis == "動画・スクロール分析":
     if st.session_state.video_scroll_ai_open:
         with st.container():
             with st.spinner("AIがエンゲージメントデータを分析中..."):
-                # AI分析を実行
-                # video_dfなどはフィルタリング済みデータから再取得する必要があるが、
-                # ここでは簡略化のため、必要な統計情報を渡す形にする
+                # AI分析を実行（上で計算した動画視聴・スクロール到達率の統計を渡す）
                 video_stats = None
-                if len(filtered_df[filtered_df['video_src'].notna()]) > 0:
-                    video_df = filtered_df[filtered_df['video_src'].notna()]
-                    video_sessions = video_df['session_id'].nunique()
-                    video_cv = video_df[video_df['cv_type'].notna()]['session_id'].nunique()
-                    video_cvr = safe_rate(video_cv, video_sessions) * 100
-                    
-                    non_video_sessions = total_sessions - video_sessions
-                    non_video_cv = filtered_df[(filtered_df['video_src'].isna()) & (filtered_df['cv_type'].notna())]['session_id'].nunique()
-                    non_video_cvr = safe_rate(non_video_cv, non_video_sessions) * 100
-                    
+                if video_sessions > 0:
                     video_stats = {
                         'video_cvr': video_cvr,
                         'non_video_cvr': non_video_cvr,
@@ -3587,8 +3612,8 @@ elif selected_analysis == "動画・スクロール分析":
             st.session_state.video_faq_toggle[1] = not st.session_state.video_faq_toggle[1]
             st.session_state.video_faq_toggle[2], st.session_state.video_faq_toggle[3], st.session_state.video_faq_toggle[4] = False, False, False
         if st.session_state.video_faq_toggle[1]:
-            if len(video_df) > 0:
-                st.info(f"はい、貢献している可能性が高いです。動画視聴ユーザーのCVRは{video_cvr:.2f}%で、非視聴ユーザーの{non_video_cvr:.2f}%より高いです。")
+            if video_sessions > 0:
+                st.info(f"はい、貢献している可能性が高いです。動画を最後まで視聴したユーザーのCVRは{video_cvr:.2f}%で、視聴完了しなかったユーザーの{non_video_cvr:.2f}%より高いです。")
             else:
                 st.info("このLPには動画データがありません。")
         
@@ -3631,7 +3656,7 @@ elif selected_analysis == "時系列分析":
 
     with filter_cols_1[1]:
         # LP選択
-        lp_options = sorted(df['page_location'].dropna().unique().tolist())
+        lp_options = list(lp_partition_index)
         selected_lp = st.selectbox(
             "LP選択", 
             lp_options, 
@@ -3700,24 +3725,10 @@ elif selected_analysis == "時系列分析":
         with col2:
             end_date = st.date_input("終了日", df['event_date'].max(), key="timeseries_end_date")
 
-    # --- 新規/リピート、CV/非CVの列を追加 ---
-    df['user_type'] = np.where(df['ga_session_number'] == 1, '新規', 'リピート')
-    conversion_session_ids = df[df['cv_type'].notna()]['session_id'].unique()
-    df['conversion_status'] = np.where(df['session_id'].isin(conversion_session_ids), 'コンバージョン', '非コンバージョン')
-
     # データフィルタリング
-    # キャッシュされたフィルタリング関数を使用
-    filtered_df = filter_dataframe(
-        df, 
-        start_date, 
-        end_date, 
-        selected_lp, # Note: Variable name is selected_lp here, not selected_lp_base_url
-        selected_device, 
-        selected_user_type, 
-        selected_conversion_status, 
-        selected_channel, 
-        selected_source_medium
-    )
+    timeseries_spec = filter_spec(start_date, end_date, selected_lp, selected_device, selected_user_type,
+                                  selected_conversion_status, selected_channel, selected_source_medium)
+    filtered_df = select_events(dataset, timeseries_spec)
 
     # 比較機能は無効化
     comparison_df = None
@@ -3727,48 +3738,18 @@ elif selected_analysis == "時系列分析":
         st.warning("⚠️ 選択した条件に該当するデータがありません。フィルターを変更してください。")
         st.stop()
 
+    # 日別推移・月間推移・曜日×時間帯の表（app.analytics.timeseries。データバージョン＋フィルター条件でキャッシュ）
+    timeseries_tables = load_report('timeseries', timeseries_spec)
+
     # 日別推移
     st.markdown("#### 日別推移") # type: ignore
 
     # テスト種別でフィルタリングするためのプルダウンメニュー
     # filtered_dfにab_test_target列がない場合があるため、ここでマッピングを適用
     if 'ab_test_target' not in filtered_df.columns:
-        filtered_df['ab_test_target'] = df['ab_test_target'].map(test_type_map).fillna('-')
-
-    # daily_statsの計算
-    daily_stats = filtered_df.groupby(filtered_df['event_date'].dt.date).agg({
-        'session_id': 'nunique',
-        'stay_ms': 'mean',
-        'max_page_reached': 'mean'
-    }).reset_index()
-    daily_stats.columns = ['日付', 'セッション数', '平均滞在時間(ms)', '平均到達ページ数']
-    daily_stats['平均滞在時間(秒)'] = daily_stats['平均滞在時間(ms)'] / 1000
-    
-    daily_cv = filtered_df[filtered_df['cv_type'].notna()].groupby(
-        filtered_df[filtered_df['cv_type'].notna()]['event_date'].dt.date
-    )['session_id'].nunique().reset_index()
-    daily_cv.columns = ['日付', 'コンバージョン数']
-    
-    daily_stats = daily_stats.merge(daily_cv, on='日付', how='left').fillna(0) # type: ignore
-    daily_stats['コンバージョン率'] = daily_stats.apply(lambda row: safe_rate(row['コンバージョン数'], row['セッション数']) * 100, axis=1) # type: ignore
-    
-    # FV残存率
-    daily_fv = filtered_df[filtered_df['max_page_reached'] >= 2].groupby(
-        filtered_df[filtered_df['max_page_reached'] >= 2]['event_date'].dt.date
-    )['session_id'].nunique().reset_index()
-    daily_fv.columns = ['日付', 'FV残存数']
-    
-    daily_stats = daily_stats.merge(daily_fv, on='日付', how='left').fillna(0) # type: ignore
-    daily_stats['FV残存率'] = daily_stats.apply(lambda row: safe_rate(row['FV残存数'], row['セッション数']) * 100, axis=1)
-    
-    # 最終CTA到達率
-    daily_cta = filtered_df[filtered_df['max_page_reached'] >= 10].groupby(
-        filtered_df[filtered_df['max_page_reached'] >= 10]['event_date'].dt.date
-    )['session_id'].nunique().reset_index()
-    daily_cta.columns = ['日付', '最終CTA到達数']
-    
-    daily_stats = daily_stats.merge(daily_cta, on='日付', how='left').fillna(0)
-    daily_stats['最終CTA到達率'] = daily_stats.apply(lambda row: safe_rate(row['最終CTA到達数'], row['セッション数']) * 100, axis=1)
+        filtered_df['ab_test_target'] = ab_analytics.test_type_labels(filtered_df)
+
+    daily_stats = timeseries_tables['daily']
 
     # グラフ選択
     metric_to_plot = st.selectbox("表示する指標を選択", [
@@ -3776,49 +3757,45 @@ elif selected_analysis == "時系列分析":
         "最終CTA到達率", "平均到達ページ数", "平均滞在時間(秒)"
     ], key="timeseries_metric_select")
     
-    fig = px.line(daily_stats, x='日付', y=metric_to_plot, markers=True)
-    # Add appropriate hovertemplate based on metric type
-    if '率' in metric_to_plot or 'CVR' in metric_to_plot or 'CTR' in metric_to_plot:
-        fig.update_traces(hovertemplate='日付: %{x}<br>' + metric_to_plot + ': %{y:.2f}<extra></extra>')
-    elif 'ページ' in metric_to_plot:
-        fig.update_traces(hovertemplate='日付: %{x}<br>' + metric_to_plot + ': %{y:.2f}<extra></extra>')
-    elif '時間' in metric_to_plot:
-        fig.update_traces(hovertemplate='日付: %{x}<br>' + metric_to_plot + ': %{y:.2f}<extra></extra>')
-    else:
-        fig.update_traces(hovertemplate='日付: %{x}<br>' + metric_to_plot + ': %{y:,}<extra></extra>')
-    fig.update_layout(height=400, yaxis_title=metric_to_plot, dragmode=False)
-    st.plotly_chart(fig, use_container_width=True, key='plotly_chart_21')
+    # 図はデータバージョン＋フィルター条件＋指標ごとにキャッシュする
+    timeseries_filter_key = make_filter_key(start_date, end_date, selected_lp, selected_device, selected_user_type, selected_conversion_status, selected_channel, selected_source_medium)
+
+    def build_daily_figure():
+        fig = px.line(daily_stats, x='日付', y=metric_to_plot, markers=True)
+        # Add appropriate hovertemplate based on metric type
+        if '率' in metric_to_plot or 'CVR' in metric_to_plot or 'CTR' in metric_to_plot:
+            fig.update_traces(hovertemplate='日付: %{x}<br>' + metric_to_plot + ': %{y:.2f}<extra></extra>')
+        elif 'ページ' in metric_to_plot:
+            fig.update_traces(hovertemplate='日付: %{x}<br>' + metric_to_plot + ': %{y:.2f}<extra></extra>')
+        elif '時間' in metric_to_plot:
+            fig.update_traces(hovertemplate='日付: %{x}<br>' + metric_to_plot + ': %{y:.2f}<extra></extra>')
+        else:
+            fig.update_traces(hovertemplate='日付: %{x}<br>' + metric_to_plot + ': %{y:,}<extra></extra>')
+        fig.update_layout(height=400, yaxis_title=metric_to_plot, dragmode=False)
+        return fig
+    show_plotly_chart(build_daily_figure, key='plotly_chart_21', cache_key=(dataset_version, timeseries_filter_key + (metric_to_plot,)))
     
+    # 月間推移・曜日×時間帯ヒートマップは、セッション開始の月・曜日・時間帯で事前集計したキューブから読む
     # 月間推移（データが十分にある場合）
     if len(daily_stats) > 0 and (pd.to_datetime(daily_stats['日付'].max()) - pd.to_datetime(daily_stats['日付'].min())).days >= 60:
         st.markdown("#### 月間推移")
         
-        filtered_df_monthly = filtered_df.copy()
-        filtered_df_monthly['月'] = filtered_df_monthly['event_date'].dt.to_period('M').astype(str)
-        
-        monthly_stats = filtered_df_monthly.groupby('月').agg({
-            'session_id': 'nunique',
-            'max_page_reached': 'mean'
-        }).reset_index()
-        monthly_stats.columns = ['月', 'セッション数', '平均到達ページ数']
-        
-        monthly_cv = filtered_df_monthly[filtered_df_monthly['cv_type'].notna()].groupby('月')['session_id'].nunique().reset_index()
-        monthly_cv.columns = ['月', 'コンバージョン数']
-        
-        monthly_stats = monthly_stats.merge(monthly_cv, on='月', how='left').fillna(0) # type: ignore
-        monthly_stats['コンバージョン率'] = monthly_stats.apply(lambda row: safe_rate(row['コンバージョン数'], row['セッション数']) * 100, axis=1)
-        
-        fig = go.Figure()
-        fig.add_trace(go.Bar(name='セッション数', x=monthly_stats['月'], y=monthly_stats['セッション数'], yaxis='y'))
-        fig.add_trace(go.Scatter(name='コンバージョン率', x=monthly_stats['月'], y=monthly_stats['コンバージョン率'], yaxis='y2', mode='lines+markers'))
-        
-        fig.update_layout(
-            yaxis=dict(title='セッション数'),
-            yaxis2=dict(title='コンバージョン率 (%)', overlaying='y', side='right'),
-            height=400,
-            dragmode=False
-        )
-        st.plotly_chart(fig, use_container_width=True, key='plotly_chart_22')
+        def build_monthly_figure():
+            # セッション開始の月ごとに、事前集計キューブから集計したもの
+            monthly_stats = timeseries_tables['monthly']
+
+            fig = go.Figure()
+            fig.add_trace(go.Bar(name='セッション数', x=monthly_stats['月'], y=monthly_stats['セッション数'], yaxis='y'))
+            fig.add_trace(go.Scatter(name='コンバージョン率', x=monthly_stats['月'], y=monthly_stats['コンバージョン率'], yaxis='y2', mode='lines+markers'))
+
+            fig.update_layout(
+                yaxis=dict(title='セッション数'),
+                yaxis2=dict(title='コンバージョン率 (%)', overlaying='y', side='right'),
+                height=400,
+                dragmode=False
+            )
+            return fig
+        show_plotly_chart(build_monthly_figure, key='plotly_chart_22', cache_key=(dataset_version, timeseries_filter_key))
 
     st.markdown("---")
 
@@ -3826,40 +3803,28 @@ elif selected_analysis == "時系列分析":
     st.markdown("#### 曜日・時間帯別 CVRヒートマップ")
     st.markdown('<div class="graph-description">曜日と時間帯をクロス集計し、コンバージョン率（CVR）をヒートマップで表示します。色が濃い部分がCVRの高い曜日と時間帯です。</div>', unsafe_allow_html=True)
 
-    # 曜日と時間の列を追加
-    heatmap_df = filtered_df.copy()
-    heatmap_df['hour'] = heatmap_df['event_timestamp'].dt.hour
-    heatmap_df['dow_name'] = heatmap_df['event_timestamp'].dt.day_name()
-
-    # 時間と曜日でグループ化してセッション数とCV数を計算
-    heatmap_sessions = heatmap_df.groupby(['hour', 'dow_name'])['session_id'].nunique().reset_index(name='セッション数')
-    heatmap_cv = heatmap_df[heatmap_df['cv_type'].notna()].groupby(['hour', 'dow_name'])['session_id'].nunique().reset_index(name='コンバージョン数')
-
-    # データをマージしてCVRを計算
-    heatmap_stats = pd.merge(heatmap_sessions, heatmap_cv, on=['hour', 'dow_name'], how='left').fillna(0)
-    heatmap_stats['コンバージョン率'] = heatmap_stats.apply(lambda row: safe_rate(row['コンバージョン数'], row['セッション数']) * 100, axis=1)
-
-    # 曜日の順序を定義
-    dow_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    dow_map_jp = {'Monday': '月', 'Tuesday': '火', 'Wednesday': '水', 'Thursday': '木', 'Friday': '金', 'Saturday': '土', 'Sunday': '日'}
-    heatmap_stats['dow_name'] = pd.Categorical(heatmap_stats['dow_name'], categories=dow_order, ordered=True)
-    heatmap_stats = heatmap_stats.sort_values(['dow_name', 'hour'])
-
-    # ピボットテーブルを作成
-    heatmap_pivot = heatmap_stats.pivot_table(index='dow_name', columns='hour', values='コンバージョン率')
-    heatmap_pivot = heatmap_pivot.reindex(dow_order) # 曜日の順序を保証
-    heatmap_pivot.index = heatmap_pivot.index.map(dow_map_jp) # 曜日を日本語に変換
-
-    # ヒートマップを描画
-    fig_heatmap = go.Figure(data=go.Heatmap(
-        z=heatmap_pivot.values,
-        x=[f"{h}時" for h in heatmap_pivot.columns],
-        y=heatmap_pivot.index,
-        colorscale='Blues',
-        hovertemplate='曜日: %{y}<br>時間帯: %{x}<br>CVR: %{z:.2f}%<extra></extra>'
-    ))
-    fig_heatmap.update_layout(title='曜日・時間帯別 CVR', height=500, dragmode=False)
-    st.plotly_chart(fig_heatmap, use_container_width=True, key='plotly_chart_heatmap_cvr')
+    # 曜日×時間帯ごとのセッション数とCV数（事前集計キューブから集計したもの。AI分析・FAQ は英語の曜日名の dow_name 列を使う）
+    heatmap_stats = timeseries_tables['weekday_hour']
+    dow_order = calendar_cube.WEEKDAY_NAMES
+    dow_map_jp = dict(zip(calendar_cube.WEEKDAY_NAMES, calendar_cube.WEEKDAY_LABELS_JP))
+
+    def build_heatmap_figure():
+        # ピボットテーブルを作成
+        heatmap_pivot = heatmap_stats.pivot_table(index='dow_name', columns='hour', values='コンバージョン率')
+        heatmap_pivot = heatmap_pivot.reindex(dow_order) # 曜日の順序を保証
+        heatmap_pivot.index = heatmap_pivot.index.map(dow_map_jp) # 曜日を日本語に変換
+
+        # ヒートマップを描画
+        fig_heatmap = go.Figure(data=go.Heatmap(
+            z=heatmap_pivot.values,
+            x=[f"{h}時" for h in heatmap_pivot.columns],
+            y=heatmap_pivot.index,
+            colorscale='Blues',
+            hovertemplate='曜日: %{y}<br>時間帯: %{x}<br>CVR: %{z:.2f}%<extra></extra>'
+        ))
+        fig_heatmap.update_layout(title='曜日・時間帯別 CVR', height=500, dragmode=False)
+        return fig_heatmap
+    show_plotly_chart(build_heatmap_figure, key='plotly_chart_heatmap_cvr', cache_key=(dataset_version, timeseries_filter_key))
 
     st.markdown("---")
 
@@ -3917,6 +3882,91 @@ elif selected_analysis == "時系列分析":
         if st.session_state.time_faq_toggle[4]:
             st.info("CVRが著しく低い時間帯は、広告の配信を停止または抑制することで、無駄な広告費を削減し、全体の広告費用対効果（ROAS）を改善できます。")
 
+# コホート分析
+elif selected_analysis == "コホート分析":
+    st.markdown('<div class="sub-header">コホート分析</div>', unsafe_allow_html=True)
+    st.markdown('<div class="graph-description">ユーザーを初回訪問日（または初回訪問週）ごとのグループ（コホート）に分け、その後の再訪率・再訪時のCV率・1人あたり累積CV価値を経過期間ごとに比較します。右下ほど観測期間が短いため、空欄になります。</div>', unsafe_allow_html=True)
+
+    cohort_cols = st.columns(4)
+    with cohort_cols[0]:
+        lp_options = list(lp_partition_index)
+        cohort_lp = st.selectbox("LP選択", ["すべて"] + lp_options, index=0, key="cohort_lp")
+    with cohort_cols[1]:
+        device_options = ["すべて"] + sorted(df['device_type'].dropna().unique().tolist())
+        cohort_device = st.selectbox("デバイス選択", device_options, index=0, key="cohort_device")
+    with cohort_cols[2]:
+        cohort_freq_label = st.radio("コホートの単位", list(cohort_analysis.COHORT_FREQS.values()), horizontal=True, key="cohort_freq")
+        cohort_freq = {label: freq for freq, label in cohort_analysis.COHORT_FREQS.items()}[cohort_freq_label]
+    with cohort_cols[3]:
+        cohort_metrics = {'再訪率': 'retention', '再訪時のCV率': 'repeat_cvr', '累積CV価値（1人あたり）': 'cumulative_value'}
+        cohort_metric_label = st.radio("指標", list(cohort_metrics.keys()), key="cohort_metric")
+
+    cohort_lp_url = None if cohort_lp == "すべて" else cohort_lp
+    cohort_start, cohort_end = df['event_date'].min().date(), df['event_date'].max().date()
+    cohort_df = filter_dataframe(df, cohort_start, cohort_end, cohort_lp_url, cohort_device, "すべて", "すべて", "すべて", "すべて", partitions=lp_partition_index)
+    cohort_key = make_filter_key(cohort_start, cohort_end, cohort_lp_url, cohort_device, "すべて", "すべて", "すべて", "すべて")
+    cohort_sessions = get_session_table(dataset_version, cohort_key, cohort_df)
+    cohort_result = get_cohort_matrix(dataset_version, cohort_key, cohort_freq, cohort_sessions)
+
+    if cohort_result['cohort_size'].empty:
+        st.warning("選択した条件に一致するデータがありません。")
+    else:
+        cohort_size = cohort_result['cohort_size']
+        kpi_cols = st.columns(3)
+        kpi_cols[0].metric("ユーザー数", f"{int(cohort_size.sum()):,}")
+        kpi_cols[1].metric("コホート数", f"{len(cohort_size):,}")
+        age_1 = cohort_result['retention'][1] if 1 in cohort_result['retention'].columns else pd.Series(dtype=float)
+        weighted_age_1 = (age_1 * cohort_size).sum() / cohort_size[age_1.notna()].sum() if age_1.notna().any() else np.nan
+        period_unit = '週' if cohort_freq == 'W' else '日'
+        kpi_cols[2].metric(f"1{period_unit}後の再訪率", f"{weighted_age_1:.1%}" if pd.notna(weighted_age_1) else "-")
+
+        cohort_metric = cohort_metrics[cohort_metric_label]
+        matrix = cohort_result[cohort_metric]
+        if cohort_metric == 'repeat_cvr' and matrix.shape[1] > 1:
+            # 初回訪問期間はリピート訪問ではないため（値は NaN）、1期間後から表示する
+            matrix = matrix.iloc[:, 1:]
+        date_format = '%m/%d'
+        y_labels = [f"{d.strftime(date_format)}（{n:,}人）" for d, n in zip(matrix.index, cohort_size)]
+        x_labels = [f"{a}{period_unit}後" if a > 0 else "初回" for a in matrix.columns]
+        if cohort_metric == 'cumulative_value':
+            text = matrix.map(lambda v: f"{v:,.0f}" if pd.notna(v) else "")
+            hover = '%{y}<br>%{x}: %{z:,.0f}円<extra></extra>'
+            colorbar_title = '円'
+        else:
+            text = matrix.map(lambda v: f"{v:.1%}" if pd.notna(v) else "")
+            hover = '%{y}<br>%{x}: %{z:.1%}<extra></extra>'
+            colorbar_title = '%'
+        # 初回期間の再訪率は常に100%のため、色の範囲から外して再訪の差を見やすくする
+        z_max = np.nanmax(matrix.iloc[:, 1:].to_numpy()) if cohort_metric == 'retention' and matrix.shape[1] > 1 else None
+        fig = go.Figure(data=go.Heatmap(
+            z=matrix.to_numpy(),
+            x=x_labels,
+            y=y_labels,
+            text=text.to_numpy(),
+            texttemplate='%{text}' if matrix.size <= 400 else None,
+            hovertemplate=hover,
+            colorscale='Blues',
+            zmin=0,
+            zmax=z_max if z_max is not None and np.isfinite(z_max) else None,
+            colorbar=dict(title=colorbar_title),
+        ))
+        fig.update_layout(
+            height=max(400, 28 * len(y_labels) + 120),
+            xaxis=dict(side='top'),
+            yaxis=dict(autorange='reversed'),
+            dragmode=False,
+        )
+        show_plotly_chart(fig, key='plotly_chart_cohort_heatmap')
+
+        with st.expander("コホート別の数値"):
+            summary_ages = (1, 4, 8) if cohort_freq == 'W' else (1, 7, 14, 28)
+            summary = cohort_analysis.cohort_summary(cohort_result, summary_ages)
+            summary.index = summary.index.strftime('%Y-%m-%d')
+            format_dict = {col: '{:.1%}' for col in summary.columns if '率' in col}
+            format_dict.update({col: '{:,.0f}' for col in summary.columns if 'CV価値' in col})
+            format_dict['ユーザー数'] = '{:,}'
+            st.dataframe(summary.style.format(format_dict, na_rep='-'), use_container_width=True)
+
 # タブ7: リアルタイム分析
 elif selected_analysis == "リアルタイムビュー":
 
@@ -3956,6 +4006,11 @@ elif selected_analysis == "リアルタイムビュー":
         
         # 初期データ（過去1時間分）
         current_df = df[df['event_timestamp'] >= (base_time - timedelta(hours=1))].copy()
+        # 推移グラフは1回だけ作り、更新のたびに棒のデータだけを差し替える
+        live_fig = go.Figure(go.Bar(x=[], y=[], hovertemplate='時刻: %{x}<br>アクティビティ: %{y}<extra></extra>'))
+        live_fig.update_layout(title="リアルタイム・アクティビティ推移", height=350, xaxis_title='時刻', yaxis_title='アクティビティ')
+        # 滞在時間・読込時間の分布は分位点スケッチで持ち、新着イベント分だけを足し込む
+        live_sketch = quantile_sketch.build_quantile_sketches(current_df, dimensions=[])
         
         # ループ実行（最大100回または停止されるまで）
         for i in range(100):
@@ -3987,6 +4042,8 @@ elif selected_analysis == "リアルタイムビュー":
             
             new_df = pd.DataFrame(new_data)
             new_df['event_timestamp'] = pd.to_datetime(new_df['event_timestamp'])
+            new_df['event_date'] = new_df['event_timestamp'].dt.normalize()
+            live_sketch = quantile_sketch.merge_sketches(live_sketch, quantile_sketch.build_quantile_sketches(new_df, dimensions=[]))
             
             # データフレームに追加
             current_df = pd.concat([current_df, new_df], ignore_index=True)
@@ -3998,7 +4055,10 @@ elif selected_analysis == "リアルタイムビュー":
             rt_sessions = display_df['session_id'].nunique()
             rt_active_users = display_df[display_df['event_timestamp'] >= (display_df['event_timestamp'].max() - timedelta(minutes=5))]['session_id'].nunique()
             rt_cvs = display_df[display_df['event_name'] == 'conversion'].shape[0]
-            rt_avg_stay = display_df['stay_ms'].mean() / 1000 if len(display_df) > 0 else 0
+            live_stay = quantile_sketch.quantiles(live_sketch, 'stay_ms', qs=(0.5, 0.9))
+            live_load = quantile_sketch.quantiles(live_sketch, 'load_time_ms', qs=(0.5, 0.9))
+            rt_stay_p50 = live_stay['p50'].iloc[0] / 1000 if not live_stay.empty else 0
+            rt_stay_p90 = live_stay['p90'].iloc[0] / 1000 if not live_stay.empty else 0
             
             # KPI更新
             with kpi_placeholder.container():
@@ -4006,17 +4066,16 @@ elif selected_analysis == "リアルタイムビュー":
                 cols[0].metric("現在のアクティブユーザー", f"{rt_active_users}人", delta=random.choice([-1, 0, 1, 2]))
                 cols[1].metric("直近1時間のセッション", f"{rt_sessions}人")
                 cols[2].metric("直近1時間のCV数", f"{rt_cvs}件", delta_color="inverse")
-                cols[3].metric("平均滞在時間", f"{rt_avg_stay:.1f}秒")
+                cols[3].metric("滞在時間（中央値）", f"{rt_stay_p50:.1f}秒", help=f"p90: {rt_stay_p90:.1f}秒（モニタリング開始以降）")
+                if not live_load.empty:
+                    st.caption(f"読込時間 p50: {live_load['p50'].iloc[0]:.0f}ms / p90: {live_load['p90'].iloc[0]:.0f}ms（モニタリング開始以降）")
 
             # グラフ更新
             with chart_placeholder.container():
-                display_df['minute_bin'] = display_df['event_timestamp'].dt.floor('1T') # 1分単位
-                trend = display_df.groupby('minute_bin')['session_id'].count().reset_index() # イベント数
-                trend.columns = ['時刻', 'アクティビティ']
-                
-                fig = px.bar(trend, x='時刻', y='アクティビティ', title="リアルタイム・アクティビティ推移")
-                fig.update_layout(height=350)
-                st.plotly_chart(fig, use_container_width=True, key=f"rt_chart_{i}")
+                trend = display_df.groupby(display_df['event_timestamp'].dt.floor('1min'))['session_id'].count() # 1分単位のイベント数
+                live_fig.data[0].x = trend.index
+                live_fig.data[0].y = trend.to_numpy()
+                show_plotly_chart(live_fig, key=f"rt_chart_{i}", chart_id='rt_chart')
             
             # ログ更新
             with log_placeholder.container():
@@ -4038,7 +4097,9 @@ elif selected_analysis == "リアルタイムビュー":
         cols[0].metric("現在のアクティブユーザー", "-")
         cols[1].metric("直近1時間のセッション", f"{static_df['session_id'].nunique()}")
         cols[2].metric("直近1時間のCV数", f"{static_df[static_df['cv_type'].notna()]['session_id'].nunique()}")
-        cols[3].metric("平均滞在時間", f"{static_df['stay_ms'].mean()/1000:.1f}秒")
+        static_stay = quantile_sketch.quantiles(quantile_sketch.build_quantile_sketches(static_df, metrics=('stay_ms',), dimensions=[]), 'stay_ms', qs=(0.5, 0.9))
+        cols[3].metric("滞在時間（中央値）", f"{static_stay['p50'].iloc[0]/1000:.1f}秒" if not static_stay.empty else "-",
+                       help=f"p90: {static_stay['p90'].iloc[0]/1000:.1f}秒" if not static_stay.empty else None)
 
 
 # タブ8: カスタムオーディエンス
@@ -4057,7 +4118,7 @@ elif selected_analysis == "デモグラフィック情報":
         selected_period = st.selectbox("期間を選択", list(period_options.keys()), index=1, key="demographic_period")
 
     with filter_cols_1[1]:
-        lp_options = sorted(df['page_location'].dropna().unique().tolist())
+        lp_options = list(lp_partition_index)
         selected_lp = st.selectbox(
             "LP選択", 
             lp_options, 
@@ -4106,18 +4167,9 @@ elif selected_analysis == "デモグラフィック情報":
 
     st.markdown("---")
 
-    # キャッシュされたフィルタリング関数を使用
-    filtered_df = filter_dataframe(
-        df, 
-        start_date, 
-        end_date, 
-        selected_lp, # Note: Variable name is selected_lp here, not selected_lp_base_url
-        selected_device, 
-        selected_user_type, 
-        selected_conversion_status, 
-        selected_channel, 
-        selected_source_medium
-    )
+    demographic_spec = filter_spec(start_date, end_date, selected_lp, selected_device, selected_user_type,
+                                   selected_conversion_status, selected_channel, selected_source_medium)
+    filtered_df = select_events(dataset, demographic_spec)
 
     # 比較機能は無効化
     comparison_df = None
@@ -4127,35 +4179,19 @@ elif selected_analysis == "デモグラフィック情報":
         st.warning("⚠️ 選択した条件に該当するデータがありません。フィルターを変更してください。")
         st.stop()
 
-    # このページで必要なKPIを計算
-    total_sessions = filtered_df['session_id'].nunique()
-
     st.markdown("ユーザーの属性情報（年齢、性別、地域、デバイス）を分析します。")
 
+    # 年齢層・性別・都道府県は、生成時にユーザーごとに決めた属性列を (日, LP, デバイスなど) ごとに事前集計したキューブから集計する
+    demographic_tables = load_report('demographics', demographic_spec)
+    age_demo_df = demographic_tables['age_group']
+    gender_demo_df = demographic_tables['gender']
+    prefecture_demo_df = demographic_tables['prefecture']
+    if not dataset_table(dataset, 'demographic_cube'):
+        st.info("このデータには年齢・性別・都道府県の列がないため、デバイス別分析のみ表示します。")
+
     # 年齢層別分析
     with st.expander("年齢層別分析", expanded=False):
         st.markdown('<div class="graph-description">年齢層ごとのセッション数、コンバージョン率、平均滞在時間を表示します。</div>', unsafe_allow_html=True)
-        # 年齢層のダミーデータを 'age_group' 列として追加（BigQueryに実データがあればこの処理は不要）
-        if 'age_group' not in filtered_df.columns:
-            age_bins = [18, 25, 35, 45, 55, 65, 100]
-            age_labels = ['18-24', '25-34', '35-44', '45-54', '55-64', '65+']
-            # 'age' 列がない場合はダミーの年齢を生成
-            if 'age' not in filtered_df.columns:
-                filtered_df['age'] = np.random.randint(18, 80, size=len(filtered_df))
-            filtered_df['age_group'] = pd.cut(filtered_df['age'], bins=age_bins, labels=age_labels, right=False)
-
-        # 年齢層別に集計
-        age_sessions = filtered_df.groupby('age_group')['session_id'].nunique()
-        age_cv = filtered_df[filtered_df['cv_type'].notna()].groupby('age_group')['session_id'].nunique()
-        age_stay = filtered_df.groupby('age_group')['stay_ms'].mean() / 1000
-
-        age_demo_df = pd.DataFrame({ # type: ignore
-            'セッション数': age_sessions,
-            'CV数': age_cv,
-            '平均滞在時間 (秒)': age_stay
-        }).fillna(0).reset_index().rename(columns={'age_group': '年齢層'}) # type: ignore
-        age_demo_df['CVR (%)'] = age_demo_df.apply(lambda row: safe_rate(row['CV数'], row['セッション数']) * 100, axis=1)
-
         st.dataframe(age_demo_df.style.format({
             'セッション数': '{:,.0f}',
             'CV数': '{:,.0f}',
@@ -4170,26 +4206,10 @@ elif selected_analysis == "デモグラフィック情報":
             hovertemplate='%{x}<br>CVR: %{y:.1f}%<extra></extra>'
         )
         fig.update_layout(height=400, showlegend=False, xaxis_title='年齢層', yaxis_title='CVR (%)', dragmode=False)
-        st.plotly_chart(fig, use_container_width=True, key='plotly_chart_age_cvr')
+        show_plotly_chart(fig, key='plotly_chart_age_cvr')
 
     with st.expander("性別分析", expanded=False):
         st.markdown('<div class="graph-description">性別ごとのセッション数、コンバージョン率、平均滞在時間を表示します。</div>', unsafe_allow_html=True)
-        # 性別のダミーデータを 'gender' 列として追加（BigQueryに実データがあればこの処理は不要）
-        if 'gender' not in filtered_df.columns:
-            filtered_df['gender'] = np.random.choice(['男性', '女性', 'その他/未回答'], size=len(filtered_df), p=[0.52, 0.45, 0.03])
-
-        # 性別で集計
-        gender_sessions = filtered_df.groupby('gender')['session_id'].nunique()
-        gender_cv = filtered_df[filtered_df['cv_type'].notna()].groupby('gender')['session_id'].nunique()
-        gender_stay = filtered_df.groupby('gender')['stay_ms'].mean() / 1000
-
-        gender_demo_df = pd.DataFrame({ # type: ignore
-            'セッション数': gender_sessions,
-            'CV数': gender_cv,
-            '平均滞在時間 (秒)': gender_stay
-        }).fillna(0).reset_index().rename(columns={'gender': '性別'}) # type: ignore
-        gender_demo_df['CVR (%)'] = gender_demo_df.apply(lambda row: safe_rate(row['CV数'], row['セッション数']) * 100, axis=1)
-
         st.dataframe(gender_demo_df.style.format({
             'セッション数': '{:,.0f}',
             'CV数': '{:,.0f}',
@@ -4201,7 +4221,7 @@ elif selected_analysis == "デモグラフィック情報":
         with col1:
             fig = px.pie(gender_demo_df, values='セッション数', names='性別', title='性別割合')
             fig.update_layout(height=400, dragmode=False)
-            st.plotly_chart(fig, use_container_width=True, key='plotly_chart_gender_pie')
+            show_plotly_chart(fig, key='plotly_chart_gender_pie')
         with col2:
             fig = px.bar(gender_demo_df, x='性別', y='CVR (%)', text='CVR (%)')
             fig.update_traces(
@@ -4210,110 +4230,59 @@ elif selected_analysis == "デモグラフィック情報":
                 hovertemplate='%{x}<br>CVR: %{y:.1f}%<extra></extra>'
             )
             fig.update_layout(height=400, showlegend=False, xaxis_title='性別', yaxis_title='CVR (%)', dragmode=False)
-            st.plotly_chart(fig, use_container_width=True, key='plotly_chart_gender_cvr')
+            show_plotly_chart(fig, key='plotly_chart_gender_cvr')
     
     # 地域別分析
     with st.expander("地域別分析", expanded=False):
-        st.markdown('<div class="graph-description">都道府県ごとのセッション数、コンバージョン率を表示します。</div>', unsafe_allow_html=True)
-        
-        # 地域別ダミーデータ（サマリー表用） - これはBigQueryに地域データがない場合の代替として残します
-        # BigQueryに地域データがある場合は、以下も動的生成に切り替えます
-        region_demo_data = {
-            '地域': ['東京都', '大阪府', '神奈川県', '愛知県', '福岡県', '北海道', 'その他'],
-            'セッション数': [int(total_sessions * 0.25), int(total_sessions * 0.15), int(total_sessions * 0.10), int(total_sessions * 0.08), int(total_sessions * 0.07), int(total_sessions * 0.06), int(total_sessions * 0.29)],
-            'CVR (%)': [3.8, 3.5, 3.2, 3.1, 3.4, 2.9, 3.0]
-        }
-        region_demo_df = pd.DataFrame(region_demo_data)
+        st.markdown('<div class="graph-description">都道府県ごとのセッション数、コンバージョン率を表示します。表はセッション数の多い6都道府県とその他です。</div>', unsafe_allow_html=True)
+
+        # セッション数の上位6都道府県以外は「その他」にまとめる
+        region_top_df = prefecture_demo_df.head(6)
+        region_other_df = prefecture_demo_df.iloc[6:]
+        region_demo_df = region_top_df[['地域', 'セッション数', 'CV数', 'CVR (%)']]
+        if not region_other_df.empty:
+            other_sessions, other_cv = region_other_df['セッション数'].sum(), region_other_df['CV数'].sum()
+            region_demo_df = pd.concat([region_demo_df, pd.DataFrame([{
+                '地域': 'その他', 'セッション数': other_sessions, 'CV数': other_cv, 'CVR (%)': safe_rate(other_cv, other_sessions) * 100,
+            }])], ignore_index=True)
         st.dataframe(region_demo_df.style.format({
             'セッション数': '{:,.0f}',
+            'CV数': '{:,.0f}',
             'CVR (%)': '{:.1f}'
         }), use_container_width=True, hide_index=True)
 
         st.markdown("---")
         st.markdown("##### 都道府県別 CVRマップ")
 
-        # GeoJSONデータを読み込む
-        try:
-            geojson_url = "https://raw.githubusercontent.com/dataofjapan/land/master/japan.geojson"
-            import json
-            import requests
-            
-            @st.cache_data
-            def get_geojson():
-                res = requests.get(geojson_url)
-                return res.json()
-
-            japan_geojson = get_geojson()
-
-            # GeoJSONの各featureに、キーとして使える都道府県名（'東京', '大阪'など）を追加
-            for feature in japan_geojson["features"]:
-                pref_name_full = feature["properties"]["nam_ja"]
-                # '北海道'はそのまま、他は'都','府','県'を削除
-                feature["properties"]["pref_key"] = pref_name_full if pref_name_full == '北海道' else pref_name_full[:-1]
-
-            # 表示用データフレームにもキー列を追加
-            region_demo_df_for_map = region_demo_df.copy()
-            region_demo_df_for_map['pref_key'] = region_demo_df_for_map['地域'].apply(
-                lambda x: x if x == '北海道' else x[:-1] if x not in ['その他'] else 'その他'
-            )
-
-            # 地図用のデータフレームを作成
-            map_df = pd.DataFrame({
-                'pref_key': [f["properties"]["pref_key"] for f in japan_geojson["features"]]
-            })
-
-            # CVRデータをマージ
-            map_df = map_df.merge(region_demo_df_for_map[['pref_key', 'CVR (%)']].rename(columns={'CVR (%)': 'コンバージョン率'}), on='pref_key', how='left')
-
-            # 表にない都道府県は 'その他' のCVRで埋める
-            other_cvr = region_demo_df[region_demo_df['地域'] == 'その他']['CVR (%)'].iloc[0]
-            map_df['コンバージョン率'] = map_df['コンバージョン率'].fillna(other_cvr)
-
-            # 地図を作成
-            fig_map = px.choropleth_mapbox(
-                map_df,
-                geojson=japan_geojson,
-                locations='pref_key', # locationsをキー列に変更
-                featureidkey="properties.pref_key", # featureidkeyをキー列に変更
-                color='コンバージョン率',
-                color_continuous_scale="Blues",
-                range_color=(map_df['コンバージョン率'].min(), map_df['コンバージョン率'].max()),
-                mapbox_style="carto-positron",
-                zoom=4.5,
-                center={"lat": 36.2048, "lon": 138.2529},
-                opacity=0.7,
-                labels={'コンバージョン率': 'CVR (%)'},
-                hover_name='pref_key' # ホバー時に都道府県名を表示
-            )
-            fig_map.update_layout(
-                margin={"r":0,"t":0,"l":0,"b":0},
-                height=600,
-                coloraxis_colorbar=dict(
-                    title="CVR (%)",
-                    tickvals=[map_df['コンバージョン率'].min(), map_df['コンバージョン率'].max()],
-                    ticktext=[f"{map_df['コンバージョン率'].min():.1f}%", f"{map_df['コンバージョン率'].max():.1f}%"]
+        # 同梱の簡略化済みGeoJSONで描画する（オフラインでも表示でき、描画時にダウンロードしない）
+        if not prefecture_demo_df.empty:
+            def build_prefecture_map():
+                fig_map = px.choropleth(
+                    prefecture_demo_df,
+                    geojson=get_prefecture_geojson(),
+                    locations='地域',
+                    featureidkey="properties.name",
+                    color='CVR (%)',
+                    color_continuous_scale="Blues",
+                    hover_data={'セッション数': ':,', 'CV数': ':,', 'CVR (%)': ':.1f'},
                 )
-            )
-            
-            st.plotly_chart(fig_map, use_container_width=True)
-
-        except Exception as e:
-            st.error(f"地図の描画に失敗しました: {e}")
+                fig_map.update_geos(fitbounds="locations", visible=False)
+                fig_map.update_layout(
+                    margin={"r":0,"t":0,"l":0,"b":0},
+                    height=600,
+                    coloraxis_colorbar=dict(title="CVR (%)"),
+                    dragmode=False
+                )
+                return fig_map
+            # GeoJSONを含む大きな図なので、データバージョン＋フィルター条件ごとにキャッシュする
+            demographic_filter_key = make_filter_key(start_date, end_date, selected_lp, selected_device, selected_user_type, selected_conversion_status, selected_channel, selected_source_medium)
+            show_plotly_chart(build_prefecture_map, key='plotly_chart_prefecture_map', cache_key=(dataset_version, demographic_filter_key))
     
     # デバイス別分析
     with st.expander("デバイス別分析", expanded=False):
         st.markdown('<div class="graph-description">デバイスごとのセッション数、コンバージョン率、平均滞在時間を表示します。</div>', unsafe_allow_html=True)
-        # デバイス別に集計
-        device_sessions = filtered_df.groupby('device_type')['session_id'].nunique()
-        device_cv = filtered_df[filtered_df['cv_type'].notna()].groupby('device_type')['session_id'].nunique()
-        device_stay = filtered_df.groupby('device_type')['stay_ms'].mean() / 1000
-
-        device_demo_df = pd.DataFrame({ # type: ignore
-            'セッション数': device_sessions,
-            'CV数': device_cv,
-            '平均滞在時間 (秒)': device_stay,
-        }).fillna(0).reset_index().rename(columns={'device_type': 'デバイス'}) # type: ignore
-        device_demo_df['CVR (%)'] = device_demo_df.apply(lambda row: safe_rate(row['CV数'], row['セッション数']) * 100, axis=1)
+        # デバイス別の集計
+        device_demo_df = demographic_tables['device']
 
         st.dataframe(device_demo_df.style.format({
             'セッション数': '{:,.0f}',
@@ -4326,7 +4295,7 @@ elif selected_analysis == "デモグラフィック情報":
         with col1:
             fig = px.pie(device_demo_df, values='セッション数', names='デバイス', title='デバイス別セッション数')
             fig.update_layout(height=400, dragmode=False)
-            st.plotly_chart(fig, use_container_width=True, key='plotly_chart_device_pie')
+            show_plotly_chart(fig, key='plotly_chart_device_pie')
         with col2:
             fig = px.bar(device_demo_df, x='デバイス', y='CVR (%)', text='CVR (%)')
             fig.update_traces(
@@ -4335,7 +4304,7 @@ elif selected_analysis == "デモグラフィック情報":
                 hovertemplate='%{x}<br>CVR: %{y:.1f}%<extra></extra>'
             )
             fig.update_layout(height=400, showlegend=False, xaxis_title='デバイス', yaxis_title='CVR (%)', dragmode=False)
-            st.plotly_chart(fig, use_container_width=True, key='plotly_chart_device_cvr')
+            show_plotly_chart(fig, key='plotly_chart_device_cvr')
 
     st.markdown("---")
 
@@ -4416,7 +4385,7 @@ elif selected_analysis == "AIによる分析・考察":
 
     with filter_cols_1[1]:
         # LP選択
-        lp_options = sorted(df['lp_base_url'].dropna().unique().tolist())
+        lp_options = list(lp_partition_index)
         selected_lp_base_url = st.selectbox(
             "LP選択", 
             lp_options, 
@@ -4484,40 +4453,12 @@ elif selected_analysis == "AIによる分析・考察":
         with col2:
             end_date = st.date_input("終了日", df['event_date'].max(), key="ai_analysis_end_date")
 
-    # --- 新規/リピート、CV/非CVの列を追加 ---
-    df['user_type'] = np.where(df['ga_session_number'] == 1, '新規', 'リピート')
-    conversion_session_ids = df[df['cv_type'].notna()]['session_id'].unique()
-    df['conversion_status'] = np.where(df['session_id'].isin(conversion_session_ids), 'コンバージョン', '非コンバージョン')
-
     comparison_type = None # 初期化
     # データフィルタリング
-    filtered_df = df.copy()
-
-    # 期間フィルター
-    filtered_df = filtered_df[
-        (filtered_df['event_date'] >= pd.to_datetime(start_date)) &
-        (filtered_df['event_date'] <= pd.to_datetime(end_date))
-    ]
-
-    # LPフィルター
-    if selected_lp_base_url:
-        filtered_df = filtered_df[filtered_df['lp_base_url'] == selected_lp_base_url]
-
-    # --- クロス分析用フィルター適用 ---
-    if selected_device != "すべて":
-        filtered_df = filtered_df[filtered_df['device_type'] == selected_device]
-
-    if selected_user_type != "すべて":
-        filtered_df = filtered_df[filtered_df['user_type'] == selected_user_type]
-
-    if selected_conversion_status != "すべて":
-        filtered_df = filtered_df[filtered_df['conversion_status'] == selected_conversion_status]
-
-    if selected_channel != "すべて":
-        filtered_df = filtered_df[filtered_df['channel'] == selected_channel]
-
-    if selected_source_medium != "すべて":
-        filtered_df = filtered_df[filtered_df['source_medium'] == selected_source_medium]
+    # 選択したLPのパーティションだけを絞り込む
+    ai_spec = filter_spec(start_date, end_date, selected_lp_base_url, selected_device, selected_user_type,
+                           selected_conversion_status, selected_channel, selected_source_medium)
+    filtered_df = select_events(dataset, ai_spec)
 
     # is_conversion列を作成
     filtered_df['is_conversion'] = filtered_df['cv_type'].notna().astype(int)
@@ -4527,19 +4468,18 @@ elif selected_analysis == "AIによる分析・考察":
         st.warning("⚠️ 選択した条件に該当するデータがありません。フィルターを変更してください。")
         st.stop()
 
-    # 基本メトリクス計算
-    total_sessions = filtered_df['session_id'].nunique()
-    total_conversions = filtered_df[filtered_df['cv_type'].notna()]['session_id'].nunique()
-    conversion_rate = safe_rate(total_conversions, total_sessions) * 100 # type: ignore
-    # クリックしたユニークなセッション数をカウント
-    clicked_sessions = filtered_df[filtered_df['event_name'] == 'click']['session_id'].nunique()
-    total_clicks = clicked_sessions
-    click_rate = safe_rate(total_clicks, total_sessions) * 100
-    avg_stay_time = filtered_df['stay_ms'].mean() / 1000  # 秒に変換
-    avg_pages_reached = filtered_df.groupby('session_id')['max_page_reached'].max().mean()
-    fv_retention_rate = safe_rate(filtered_df[filtered_df['max_page_reached'] >= 2]['session_id'].nunique(), total_sessions) * 100
-    final_cta_rate = safe_rate(filtered_df[filtered_df['max_page_reached'] >= 10]['session_id'].nunique(), total_sessions) * 100
-    avg_load_time = filtered_df['load_time_ms'].mean()
+    # 基本メトリクス計算（全体サマリーと同じレポート。データバージョン＋フィルター条件でキャッシュ）
+    kpis = load_report('summary', ai_spec)['kpis'].to_dict('records')[0]
+    total_sessions = kpis['sessions']
+    total_conversions = kpis['conversions']
+    conversion_rate = kpis['conversion_rate']
+    total_clicks = kpis['clicks']
+    click_rate = kpis['click_rate']
+    avg_stay_time = kpis['avg_stay_time']
+    avg_pages_reached = kpis['avg_pages_reached']
+    fv_retention_rate = kpis['fv_retention_rate']
+    final_cta_rate = kpis['final_cta_rate']
+    avg_load_time = kpis['avg_load_time']
 
     st.markdown('<div class="sub-header">主要指標（KPI）</div>', unsafe_allow_html=True)
 
@@ -4561,12 +4501,10 @@ elif selected_analysis == "AIによる分析・考察":
     comp_start = None
     comp_end = None
     if enable_comparison and comparison_type:
-        result = get_comparison_data(df, pd.Timestamp(start_date), pd.Timestamp(end_date), comparison_type)
+        # 比較データにも同じLPのパーティションだけを使う
+        result = get_comparison_data(lp_partitions.select(df, lp_partition_index, selected_lp_base_url or None), pd.Timestamp(start_date), pd.Timestamp(end_date), comparison_type)
         if result is not None:
             comparison_df, comp_start, comp_end = result
-            # 比較データにも同じフィルターを適用
-            if selected_lp_base_url:
-                comparison_df = comparison_df[comparison_df['lp_base_url'] == selected_lp_base_url]
             # --- 比較データにもクロス分析用フィルターを適用 ---
             if selected_device != "すべて":
                 comparison_df = comparison_df[comparison_df['device_type'] == selected_device]
@@ -4588,30 +4526,7 @@ elif selected_analysis == "AIによる分析・考察":
     # 比較データのKPI計算
     comp_kpis = {}
     if comparison_df is not None and len(comparison_df) > 0:
-        comp_total_sessions = comparison_df['session_id'].nunique()
-        comp_total_conversions = comparison_df[comparison_df['cv_type'].notna()]['session_id'].nunique() # type: ignore
-        comp_conversion_rate = safe_rate(comp_total_conversions, comp_total_sessions) * 100
-        comp_clicked_sessions = comparison_df[comparison_df['event_name'] == 'click']['session_id'].nunique()
-        comp_total_clicks = comp_clicked_sessions
-        comp_click_rate = safe_rate(comp_total_clicks, comp_total_sessions) * 100
-        comp_avg_stay_time = comparison_df['stay_ms'].mean() / 1000
-        comp_avg_pages_reached = comparison_df.groupby('session_id')['max_page_reached'].max().mean()
-        comp_fv_retention_rate = (comparison_df[comparison_df['max_page_reached'] >= 2]['session_id'].nunique() / comp_total_sessions * 100) if comp_total_sessions > 0 else 0
-        comp_final_cta_rate = (comparison_df[comparison_df['max_page_reached'] >= 10]['session_id'].nunique() / comp_total_sessions * 100) if comp_total_sessions > 0 else 0
-        comp_avg_load_time = comparison_df['load_time_ms'].mean()
-        
-        comp_kpis = {
-            'sessions': comp_total_sessions,
-            'conversions': comp_total_conversions,
-            'conversion_rate': comp_conversion_rate,
-            'clicks': comp_total_clicks,
-            'click_rate': comp_click_rate,
-            'avg_stay_time': comp_avg_stay_time,
-            'avg_pages_reached': comp_avg_pages_reached,
-            'fv_retention_rate': comp_fv_retention_rate,
-            'final_cta_rate': comp_final_cta_rate,
-            'avg_load_time': comp_avg_load_time
-        }
+        comp_kpis = summary_analytics.summary_kpis(comparison_df)
 
     # KPIカード表示 (他のページからコピー)
     col1, col2, col3, col4, col5 = st.columns(5)
@@ -5194,67 +5109,10 @@ elif selected_analysis == "アラート":
     has_high_alerts = False
     has_medium_alerts = False
 
-    # BigQueryのv_alertsビューと同様の計算をpandasで実行
-    # 1. 日次KPIサマリーを作成 (v_kpi_daily相当)
-    daily_kpi = df.groupby(df['event_date'].dt.date).agg(
-        sessions=('session_id', 'nunique'), # type: ignore
-        # cv_typeがNaNでないセッションのユニーク数をカウント
-        conversions=('session_id', lambda x: df.loc[x.index][df.loc[x.index]['cv_type'].notna()]['session_id'].nunique())
-    ).reset_index()
-    daily_kpi['cvr'] = safe_rate(daily_kpi['conversions'], daily_kpi['sessions'])
-
-    # 2. 移動平均と前日比を計算 (ma相当)
-    if len(daily_kpi) > 7:
-        daily_kpi = daily_kpi.sort_values('event_date').reset_index(drop=True)
-        daily_kpi['sessions_ma7'] = daily_kpi['sessions'].rolling(window=7, min_periods=1).mean().shift(1)
-        daily_kpi['cvr_ma7'] = daily_kpi['cvr'].rolling(window=7, min_periods=1).mean().shift(1)
-        daily_kpi['sessions_prev'] = daily_kpi['sessions'].shift(1)
-        daily_kpi['cvr_prev'] = daily_kpi['cvr'].shift(1)
-
-        # 3. 変化率を計算
-        daily_kpi['sessions_dod'] = safe_rate(daily_kpi['sessions'] - daily_kpi['sessions_prev'], daily_kpi['sessions_prev'])
-        daily_kpi['cvr_dod'] = safe_rate(daily_kpi['cvr'] - daily_kpi['cvr_prev'], daily_kpi['cvr_prev'])
-        daily_kpi['sessions_vs_ma7'] = safe_rate(daily_kpi['sessions'] - daily_kpi['sessions_ma7'], daily_kpi['sessions_ma7'])
-        daily_kpi['cvr_vs_ma7'] = safe_rate(daily_kpi['cvr'] - daily_kpi['cvr_ma7'], daily_kpi['cvr_ma7'])
-
-        # 最新日のデータを取得
-        latest_alert_data = daily_kpi.iloc[-1]
-
-        # アラートフラグ
-        alerts = []
-
-        # --- 重要度：高 ---
-        if latest_alert_data['cvr_dod'] < -0.5:
-            alerts.append({
-                'level': 'high', 'title': 'CVRが急落',
-                'description': f"**コンバージョン率が前日比で {abs(latest_alert_data['cvr_dod']):.1%} 大幅に低下しました。**",
-                'details': f"前日: {latest_alert_data['cvr_prev']:.2%}, 本日: {latest_alert_data['cvr']:.2%}",
-                'action': '時系列分析で確認', 'page': '時系列分析'
-            })
-        if latest_alert_data['sessions_dod'] < -0.5:
-            alerts.append({
-                'level': 'high', 'title': 'セッションが急減',
-                'description': f"**セッション数が前日比で {abs(latest_alert_data['sessions_dod']):.1%} 大幅に減少しました。**",
-                'details': f"前日: {int(latest_alert_data['sessions_prev']):,}, 本日: {int(latest_alert_data['sessions']):,}",
-                'action': '全体サマリで確認', 'page': '全体サマリ'
-            })
-
-        # --- 重要度：中 ---
-        if -0.5 <= latest_alert_data['cvr_dod'] < -0.3:
-            alerts.append({
-                'level': 'medium', 'title': 'CVRが低下',
-                'description': f"**コンバージョン率が前日比で {abs(latest_alert_data['cvr_dod']):.1%} 低下しています。**",
-                'details': f"前日: {latest_alert_data['cvr_prev']:.2%}, 本日: {latest_alert_data['cvr']:.2%}",
-                'action': '時系列分析で確認', 'page': '時系列分析'
-            })
-        if -0.5 <= latest_alert_data['sessions_dod'] < -0.3:
-            alerts.append({
-                'level': 'medium', 'title': 'セッションが減少',
-                'description': f"**セッション数が前日比で {abs(latest_alert_data['sessions_dod']):.1%} 減少しています。**",
-                'details': f"前日: {int(latest_alert_data['sessions_prev']):,}, 本日: {int(latest_alert_data['sessions']):,}",
-                'action': '時系列分析で確認', 'page': '時系列分析'
-            })
-
+    # BigQueryのv_alertsビューと同様の計算をpandasで実行（日次KPI・移動平均・前日比と、最新日のアラート判定）
+    alert_tables = load_report('alerts', full_spec(dataset))
+    daily_kpi, alerts = alert_tables['daily_kpi'], alert_tables['alerts'].to_dict('records')
+    if len(daily_kpi) > alert_analytics.MIN_DAYS_FOR_ALERTS:
         # アラートを表示
         high_alerts = [a for a in alerts if a['level'] == 'high']
         medium_alerts = [a for a in alerts if a['level'] == 'medium']
@@ -5297,13 +5155,97 @@ elif selected_analysis == "アラート":
     if not has_medium_alerts and has_high_alerts: # 高アラートはあるが中アラートはない場合
         st.markdown("---")
         st.info("現在、重要度：中のアラートはありません。")
-    else: # type: ignore
+    elif len(daily_kpi) <= alert_analytics.MIN_DAYS_FOR_ALERTS: # type: ignore
         st.info("アラートを生成するための十分なデータがありません（最低8日分のデータが必要です）。")
 
+    # --- アラート履歴（バックグラウンド評価の結果） ---
+    st.markdown("---")
+    st.markdown("#### アラート履歴")
+    st.markdown(f'<div class="graph-description">アラートはバックグラウンドで{int(alert_scheduler.interval_sec // 60)}分ごとに新しく追加された日のデータだけを評価し、履歴として保存しています。同じアラートは1件にまとめ、再検知された回数を表示します。</div>', unsafe_allow_html=True)
+    alert_feed = alert_scheduler.store.fetch(dataset=dataset_version, limit=200)
+    feed_cols = st.columns([4, 1])
+    with feed_cols[0]:
+        if alert_scheduler.last_run is not None:
+            st.caption(f"最終評価: {alert_scheduler.last_run:%Y-%m-%d %H:%M:%S}")
+        if alert_scheduler.last_error:
+            st.caption(f"⚠️ 前回の評価でエラーが発生しました: {alert_scheduler.last_error}")
+    with feed_cols[1]:
+        if st.button("今すぐ評価", key="alert_run_now", use_container_width=True):
+            with st.spinner("アラートを評価中..."):
+                alert_scheduler.run_once(dataset_version)
+            alert_feed = alert_scheduler.store.fetch(dataset=dataset_version, limit=200)
+    if alert_feed.empty:
+        st.info("保存されたアラートはまだありません。初回の評価が完了すると、ここに表示されます。")
+    else:
+        alert_history_table = pd.DataFrame({
+            '重要度': alert_feed['level'].map({'high': '高', 'medium': '中'}),
+            '日付': alert_feed['event_date'],
+            'アラート': alert_feed['title'],
+            'セグメント': alert_feed['series'],
+            '変化率': alert_feed['change'] * 100,
+            '影響度(CV数)': alert_feed['impact_cv'],
+            '検知回数': alert_feed['occurrences'],
+            '初回検知': alert_feed['first_seen'],
+        })
+        st.dataframe(alert_history_table.style.format({'変化率': '{:+.1f}%', '影響度(CV数)': '{:+.1f}'}, na_rep='-'), use_container_width=True, hide_index=True, height=300)
+
+    # --- セグメント別の異常検知 ---
+    st.markdown("---")
+    st.markdown("#### セグメント別の異常検知")
+    st.markdown('<div class="graph-description">デバイス・チャネル・LP・A/Bバリアントの全ての組み合わせについて日次のセッション数とCVRを監視します。曜日ごとの傾向を補正したロバストzスコアで最新日の異常を、変化点検出で「ある日を境に急降下した」系列を検知し、失ったコンバージョン数（影響度）の大きい順に表示します。</div>', unsafe_allow_html=True)
+
+    anomalies = get_anomaly_report(dataset_version, dataset)
+    if anomalies.empty:
+        st.info("統計的に有意な異常は検知されませんでした。")
+    else:
+        metric_labels = {'sessions': 'セッション数', 'cvr': 'CVR'}
+        kind_labels = {'spike': '最新日の異常', 'changepoint': '変化点'}
+        metric_pages = {'sessions': '全体サマリー', 'cvr': '時系列分析'}
+
+        # 影響度の大きい重要度：高の異常をカードで表示
+        for idx, anomaly in anomalies[anomalies['level'] == 'high'].head(5).iterrows():
+            metric_label = metric_labels[anomaly['metric']]
+            direction_label = '低下' if anomaly['direction'] == 'down' else '上昇'
+            if anomaly['metric'] == 'cvr':
+                detail = f"基準: {anomaly['baseline']:.2%} → {anomaly['value']:.2%}"
+            else:
+                detail = f"基準: {anomaly['baseline']:,.0f} → {anomaly['value']:,.0f}（1日あたり）"
+            if anomaly['kind'] == 'changepoint':
+                description = f"**{anomaly['series']}** の{metric_label}が {anomaly['date']:%Y-%m-%d} を境に {abs(anomaly['change']):.1%} {direction_label}しています。"
+            else:
+                description = f"**{anomaly['series']}** の{metric_label}が {anomaly['date']:%Y-%m-%d} に基準比 {abs(anomaly['change']):.1%} {direction_label}しました。"
+            with st.container(): # type: ignore
+                col1, col2, col3 = st.columns([1, 4, 1.5])
+                with col1:
+                    if anomaly['direction'] == 'down':
+                        st.error(f"{metric_label}{direction_label}")
+                    else:
+                        st.success(f"{metric_label}{direction_label}")
+                with col2:
+                    st.markdown(description)
+                    st.markdown(f"<small>{detail} / z={anomaly['z']:.1f} / 影響: {anomaly['impact_cv']:+.1f} CV</small>", unsafe_allow_html=True)
+                with col3:
+                    st.button(f"{metric_pages[anomaly['metric']]}で確認", key=f"anomaly_{idx}", use_container_width=True, on_click=navigate_to, args=(metric_pages[anomaly['metric']],))
+
+        anomaly_table = pd.DataFrame({
+            '重要度': anomalies['level'].map({'high': '高', 'medium': '中'}),
+            'セグメント': anomalies['series'],
+            '指標': anomalies['metric'].map(metric_labels),
+            '種類': anomalies['kind'].map(kind_labels),
+            '日付': anomalies['date'].dt.date,
+            '実績': [f"{v:.2%}" if m == 'cvr' else f"{v:,.0f}" for v, m in zip(anomalies['value'], anomalies['metric'])],
+            '基準': [f"{v:.2%}" if m == 'cvr' else f"{v:,.0f}" for v, m in zip(anomalies['baseline'], anomalies['metric'])],
+            '変化率': anomalies['change'] * 100,
+            'zスコア': anomalies['z'],
+            '影響度(CV数)': anomalies['impact_cv'],
+        })
+        with st.expander(f"検知された異常の一覧（{len(anomaly_table)}件）", expanded=False):
+            st.dataframe(anomaly_table.style.format({'変化率': '{:+.1f}%', 'zスコア': '{:+.1f}', '影響度(CV数)': '{:+.1f}'}), use_container_width=True, hide_index=True)
+
 elif selected_analysis == "瞬フォーム分析":
 
     st.markdown('<div class="sub-header">瞬フォーム分析</div>', unsafe_allow_html=True)
-    st.markdown('<div class="graph-description">このページは現在開発中のデモです。表示されている数値はダミーであり、他の分析ページとは連動していません。</div>', unsafe_allow_html=True)
+    st.markdown('<div class="graph-description">LPの最終ページにある入力フォーム（瞬フォーム）の開始から送信までを、フォームのページごとに分析します。</div>', unsafe_allow_html=True)
 
     # --- フィルター設定 ---
     st.markdown('<div class="sub-header">フィルター設定</div>', unsafe_allow_html=True)
@@ -5316,7 +5258,7 @@ elif selected_analysis == "瞬フォーム分析":
         selected_period = st.selectbox("期間を選択", period_options, index=2, key="shun_form_period")
 
     with filter_cols_1[1]:
-        lp_options = sorted(df['page_location'].dropna().unique().tolist())
+        lp_options = list(lp_partition_index)
         selected_lp = st.selectbox(
             "LP選択", 
             lp_options, 
@@ -5393,34 +5335,15 @@ elif selected_analysis == "瞬フォーム分析":
 
     st.markdown("---")
 
-    # --- 新規/リピート、CV/非CVの列を追加 ---
-    df['user_type'] = np.where(df['ga_session_number'] == 1, '新規', 'リピート')
-    conversion_session_ids = df[df['cv_type'].notna()]['session_id'].unique()
-    df['conversion_status'] = np.where(df['session_id'].isin(conversion_session_ids), 'コンバージョン', '非コンバージョン')
-
     # データフィルタリング
-    filtered_df = df[
-        (df['event_date'] >= pd.to_datetime(start_date)) &
-        (df['event_date'] <= pd.to_datetime(end_date))
-    ]
-    if selected_lp:
-        filtered_df = filtered_df[filtered_df['page_location'] == selected_lp]
-    if selected_device != "すべて":
-        filtered_df = filtered_df[filtered_df['device_type'] == selected_device]
-    if selected_user_type != "すべて":
-        filtered_df = filtered_df[filtered_df['user_type'] == selected_user_type]
-    if selected_conversion_status != "すべて":
-        filtered_df = filtered_df[filtered_df['conversion_status'] == selected_conversion_status]
-    if selected_channel != "すべて":
-        filtered_df = filtered_df[filtered_df['channel'] == selected_channel]
-    if selected_source_medium != "すべて":
-        filtered_df = filtered_df[filtered_df['source_medium'] == selected_source_medium]
-
-    # フォーム関連のイベントに絞る
-    form_events = ['form_start', 'form_submit', 'form_progress', 'form_field_interaction']
-    form_df = filtered_df[filtered_df['event_name'].isin(form_events)]
-
-    if form_df.empty:
+    form_spec = filter_spec(start_date, end_date, selected_lp, selected_device, selected_user_type,
+                             selected_conversion_status, selected_channel, selected_source_medium)
+    filtered_df = select_events(dataset, form_spec)
+
+    # フォーム行動をセッション単位に集計したスコアカードとページごとの表（データバージョン＋フィルター条件でキャッシュ）
+    form_tables = load_report('form', form_spec)
+
+    if form_tables['summary'].empty:
         st.warning("選択された条件に該当するフォームのデータがありません。")
         st.stop()
 
@@ -5429,70 +5352,55 @@ elif selected_analysis == "瞬フォーム分析":
     col1, col2, col3, col4 = st.columns(4)
 
     # KPI計算
-    form_start_sessions = form_df[form_df['event_name'] == 'form_start']['session_id'].nunique()
-    form_submit_sessions = form_df[form_df['event_name'] == 'form_submit']['session_id'].nunique()
-    form_submission_rate = safe_rate(form_submit_sessions, form_start_sessions) * 100
-
-    # フォーム表示直帰（フォームを開始したが、次のインタラクションがない）
-    form_interaction_sessions = form_df[form_df['event_name'] != 'form_start']['session_id'].nunique()
-    form_bounce_sessions = form_start_sessions - form_interaction_sessions
-    form_bounce_rate = safe_rate(form_bounce_sessions, form_start_sessions) * 100
-
-    # 平均進行ページ数
-    if 'form_page_number' in form_df.columns:
-        avg_progress_page = form_df.groupby('session_id')['form_page_number'].max().mean()
-    else:
-        avg_progress_page = 0
-
-    # 平均滞在時間
-    if 'form_duration_ms' in form_df.columns:
-        avg_form_duration = form_df.groupby('session_id')['form_duration_ms'].sum().mean() / 1000
-    else:
-        avg_form_duration = 0
-
-    # ページ逆行率
-    if 'form_direction' in form_df.columns:
-        backflow_sessions = form_df[form_df['form_direction'] == 'backward']['session_id'].nunique()
-        backflow_rate = safe_rate(backflow_sessions, form_start_sessions) * 100
-    else:
-        backflow_rate = 0
+    form_kpis = form_tables['summary'].to_dict('records')[0]
+    form_start_sessions = form_kpis['start_sessions']
+    form_submit_sessions = form_kpis['submit_sessions']
+    form_submission_rate = form_kpis['submission_rate'] * 100
+    # フォーム表示直帰（フォームを開始したが、何も入力せずに離れた）
+    form_bounce_rate = form_kpis['bounce_rate'] * 100
+    avg_progress_page = form_kpis['avg_max_step']
+    avg_form_duration = form_kpis['avg_duration_sec']
+    backflow_rate = form_kpis['backflow_rate'] * 100
 
     col1.metric("フォーム開始セッション", f"{form_start_sessions:,}")
     col2.metric("フォーム送信セッション", f"{form_submit_sessions:,}")
     col3.metric("フォーム送信率", f"{form_submission_rate:.1f}%")
     col4.metric("フォーム表示直帰率", f"{form_bounce_rate:.1f}%", delta_color="inverse")
     col1.metric("平均進行ページ数", f"{avg_progress_page:.1f}")
-    col2.metric("平均滞在時間", f"{avg_form_duration:.1f}秒")
+    col2.metric("平均入力時間", f"{avg_form_duration:.1f}秒")
     col3.metric("ページ逆行率", f"{backflow_rate:.1f}%", delta_color="inverse")
 
     # --- ページごとの分析 ---
     st.markdown('<div class="sub-header">ページごとの分析</div>', unsafe_allow_html=True)
-    st.markdown('<div class="graph-description">各ページの滞在時間や逆行率などを確認し、ユーザーがどの質問でつまずいているか（ボトルネック）を特定します。</div>', unsafe_allow_html=True)
-    
-    # ダミーデータ
-    if 'form_page_number' in form_df.columns:
-        page_analysis = form_df.groupby('form_page_number').agg(
-            セッション数=('session_id', 'nunique'),
-            平均滞在時間_ms=('form_duration_ms', 'mean'),
-        ).reset_index()
-        page_analysis.rename(columns={'form_page_number': 'ページ'}, inplace=True)
-        page_analysis['平均滞在時間(秒)'] = page_analysis['平均滞在時間_ms'] / 1000
-
-        # 離脱率
-        exit_counts = []
-        total_form_sessions = form_df['session_id'].nunique()
-        for page_num in page_analysis['ページ']:
-            reached_sessions = form_df[form_df['form_page_number'] >= page_num]['session_id'].nunique()
-            exited_sessions = form_df[form_df.groupby('session_id')['form_page_number'].transform('max') == page_num]['session_id'].nunique()
-            exit_rate = safe_rate(exited_sessions, reached_sessions) * 100
-            exit_counts.append({'ページ': page_num, '離脱率(%)': exit_rate})
-        
-        exit_df = pd.DataFrame(exit_counts)
-        page_analysis = pd.merge(page_analysis, exit_df, on='ページ', how='left')
-
-        st.dataframe(page_analysis[['ページ', 'セッション数', '平均滞在時間(秒)', '離脱率(%)']].style.format({'平均滞在時間(秒)': '{:.1f}', '離脱率(%)': '{:.1f}%'}), use_container_width=True, hide_index=True)
-    else:
-        st.info("フォームのページ別データを表示できません。")
+    st.markdown('<div class="graph-description">各ページの到達率・離脱率・入力時間を確認し、ユーザーがどの質問でつまずいているか（ボトルネック）を特定します。離脱率は、そのページまで到達したセッションのうち、送信せずにそのページで離れた割合です。</div>', unsafe_allow_html=True)
+
+    page_analysis = form_tables['steps']
+    # 離脱率が最も高いページ（最終ページは確認画面のため除く）をボトルネックとする
+    bottleneck_candidates = page_analysis[page_analysis['ページ'] < page_analysis['ページ'].max()]
+    if bottleneck_candidates.empty:
+        bottleneck_candidates = page_analysis
+    bottleneck_step = bottleneck_candidates.loc[bottleneck_candidates['離脱率'].idxmax()]
+
+    form_funnel_cols = st.columns([3, 2])
+    with form_funnel_cols[0]:
+        fig_form_funnel = go.Figure(go.Funnel(
+            y=[f"ページ{p}" for p in page_analysis['ページ']] + ['送信'],
+            x=list(page_analysis['到達数']) + [form_submit_sessions],
+            textinfo="value+percent initial",
+            hovertemplate='%{y}<br>セッション数: %{x:,}<extra></extra>'
+        ))
+        fig_form_funnel.update_layout(height=400, dragmode=False, margin=dict(t=20))
+        show_plotly_chart(fig_form_funnel, key='plotly_chart_form_funnel')
+    with form_funnel_cols[1]:
+        fig_form_time = px.bar(page_analysis, x='ページ', y='平均入力時間(秒)', text='平均入力時間(秒)',
+                               hover_data={'入力時間の中央値(秒)': ':.1f'})
+        fig_form_time.update_traces(texttemplate='%{text:.1f}秒', textposition='outside')
+        fig_form_time.update_layout(height=400, xaxis=dict(dtick=1), yaxis_title='平均入力時間（秒）', dragmode=False, margin=dict(t=20))
+        show_plotly_chart(fig_form_time, key='plotly_chart_form_step_time')
+
+    st.dataframe(page_analysis.style.format({
+        '到達数': '{:,}', '到達率': '{:.1%}', '離脱数': '{:,}', '離脱率': '{:.1%}', '平均入力時間(秒)': '{:.1f}', '入力時間の中央値(秒)': '{:.1f}',
+    }, na_rep='-'), use_container_width=True, hide_index=True)
 
     st.markdown("---")
 
@@ -5512,14 +5420,14 @@ elif selected_analysis == "瞬フォーム分析":
                 st.markdown("#### 1. 現状の評価")
                 st.info(f"""
                 フォーム全体のパフォーマンスを分析した結果、**フォーム送信率（{form_submission_rate:.1f}%）** に改善の余地があることが分かりました。
-                特に、**ページ3** での平均滞在時間が短く、ページ逆行率が他のページより高い傾向にあります。このページがユーザーにとってのボトルネックとなっている可能性が高いです。（※この部分は現在デモ用の固定テキストです）
-                一方で、離脱防止POPや一時保存からの再開率は高く、フォームを完了したいというユーザーの意欲は高いと推察されます。
+                特に、**ページ{int(bottleneck_step['ページ'])}** での離脱率が{bottleneck_step['離脱率']:.1%}と最も高く、平均入力時間は{bottleneck_step['平均入力時間(秒)']:.1f}秒です。このページがユーザーにとってのボトルネックとなっている可能性が高いです。
+                また、フォームを開始したセッションの{backflow_rate:.1f}%が前のページへ戻っており、入力内容の確認や修正が発生しています。
                 """)
 
                 st.markdown("#### 2. 今後の考察と改善案")
-                st.warning("""
-                **ページ3の質問内容の見直しが最優先課題です。（※この部分は現在デモ用の固定テキストです）**
-                - **考察**: ページ3の質問がユーザーにとって分かりにくい、または答えるのが面倒だと感じさせている可能性があります。
+                st.warning(f"""
+                **ページ{int(bottleneck_step['ページ'])}の質問内容の見直しが最優先課題です。**
+                - **考察**: ページ{int(bottleneck_step['ページ'])}の質問がユーザーにとって分かりにくい、または答えるのが面倒だと感じさせている可能性があります。
                 - **改善案**:
                     1. **質問文の簡略化**: より直感的で分かりやすい言葉に修正します。
                     2. **選択肢の見直し**: 選択肢が多すぎる場合は減らす、またはラジオボタンからプルダウンに変更するなど、UIを改善します。
@@ -5542,7 +5450,7 @@ elif selected_analysis == "瞬フォーム分析":
             st.session_state.shun_form_faq_toggle[1] = not st.session_state.shun_form_faq_toggle[1]
             st.session_state.shun_form_faq_toggle[2], st.session_state.shun_form_faq_toggle[3], st.session_state.shun_form_faq_toggle[4] = False, False, False
         if st.session_state.shun_form_faq_toggle[1]:
-            st.info("ページごとの分析表で「ページ逆行率」が高いページや、「平均滞在時間」が極端に短いページが離脱の多いボトルネックです。このダミーデータでは「ページ3」が該当します。")
+            st.info(f"ページごとの分析表で「離脱率」が高いページや、「平均入力時間」が極端に長い・短いページが離脱の多いボトルネックです。選択中の条件では「ページ{int(bottleneck_step['ページ'])}」（離脱率 {bottleneck_step['離脱率']:.1%}）が該当します。")
 
         if st.button("フォーム送信率を上げるには？", key="faq_shun_form_3", use_container_width=True):
             st.session_state.shun_form_faq_toggle[3] = not st.session_state.shun_form_faq_toggle[3]
@@ -5756,7 +5664,84 @@ elif selected_analysis == "学習テスト":
     elif 'quiz_data' in st.session_state and not st.session_state.quiz_data:
         pass
 
+# パフォーマンス診断（メニューには出さない。URLに ?page=パフォーマンス診断 を付けて開く）
+elif selected_analysis == "パフォーマンス診断":
+    st.markdown('<div class="sub-header">パフォーマンス診断</div>', unsafe_allow_html=True)
+    st.markdown(f'<div class="graph-description">直近{PROFILING_HISTORY_SIZE}回までのリランについて、前処理・フィルター・キャッシュ取得・グラフ作成・AI呼び出しなどの段階ごとの処理時間を集計します。途中で止まったリラン（データが空のページなど）は完了した段階だけを集計します。</div>', unsafe_allow_html=True)
+
+    # このページ自身のリランは集計に含めない
+    diagnostic_traces = [t for t in st.session_state.get('profiling_traces', []) if t['label'] != selected_analysis]
+    trace_labels = sorted({t['label'] for t in diagnostic_traces if t['label']})
+    selected_trace_label = st.selectbox("ページ", ["すべて"] + trace_labels, key="diagnostics_page_filter")
+    if selected_trace_label != "すべて":
+        diagnostic_traces = [t for t in diagnostic_traces if t['label'] == selected_trace_label]
+
+    if not diagnostic_traces:
+        st.info("まだ計測したリランがありません。他のページを表示してから開いてください。")
+    else:
+        st.markdown(f"#### 段階ごとの処理時間（{len(diagnostic_traces)}回のリラン）")
+        st.dataframe(profiling.stage_summary(diagnostic_traces).style.format({
+            'p50 (ms)': '{:,.1f}', 'p95 (ms)': '{:,.1f}', '平均 (ms)': '{:,.1f}', '最大 (ms)': '{:,.1f}',
+            'キャッシュヒット率 (%)': '{:.0f}', '平均入力行数': '{:,.0f}', '平均出力行数': '{:,.0f}',
+        }, na_rep='-'), use_container_width=True, hide_index=True)
+
+        latest_trace = diagnostic_traces[-1]
+        st.markdown(f"#### 直近のリラン（{latest_trace['label']} / {latest_trace['started_at']}）")
+        latest_df = pd.DataFrame([{
+            '段階': '　' * r['depth'] + r['stage'], '処理時間 (ms)': r['ms'], '入力行数': r['rows_in'], '出力行数': r['rows_out'],
+            'キャッシュ': {'hit': 'ヒット', 'miss': 'ミス'}.get(r['cache'], ''),
+        } for r in latest_trace['stages']])
+        st.dataframe(latest_df.style.format({'処理時間 (ms)': '{:,.1f}', '入力行数': '{:,.0f}', '出力行数': '{:,.0f}'}, na_rep='-'),
+                     use_container_width=True, hide_index=True)
+
+        diag_cols = st.columns(2)
+        with diag_cols[0]:
+            st.download_button(
+                label="トレースをJSONでダウンロード",
+                data=profiling.traces_to_json(diagnostic_traces).encode('utf-8'),
+                file_name=f"profiling_traces_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+                mime='application/json',
+                use_container_width=True,
+            )
+        with diag_cols[1]:
+            if st.button("計測履歴をクリア", key="diagnostics_clear", use_container_width=True):
+                st.session_state.profiling_traces = []
+                st.rerun()
+
+    # 集計結果の共有キャッシュ（このプロセスの全セッションの合計）
+    st.markdown("#### 集計結果の共有キャッシュ")
+    cache_stats = result_cache.stats()
+    cache_cols = st.columns(4)
+    cache_cols[0].metric("ヒット率", f"{cache_stats['hit_rate']:.0%}" if cache_stats['hit_rate'] is not None else "-",
+                         help=f"メモリ {cache_stats['memory_hits']:,}件 / ディスク {cache_stats['disk_hits']:,}件 / ミス {cache_stats['misses']:,}件")
+    cache_cols[1].metric("メモリ", f"{cache_stats['memory_bytes'] / 1024 / 1024:,.1f} MB",
+                         help=f"{cache_stats['memory_entries']:,}件（上限 {cache_stats['max_memory_bytes'] / 1024 / 1024:,.0f} MB）")
+    if cache_stats['disk_enabled']:
+        cache_cols[2].metric("ディスク", f"{cache_stats['disk_bytes'] / 1024 / 1024:,.1f} MB",
+                             help=f"{cache_stats['disk_entries']:,}件（上限 {cache_stats['max_disk_bytes'] / 1024 / 1024:,.0f} MB）")
+    else:
+        cache_cols[2].metric("ディスク", "無効", help="pyarrow がインストールされていないため、メモリだけを使います")
+    cache_cols[3].metric("TTL", f"{cache_stats['ttl_sec'] / 3600:,.1f} 時間" if cache_stats['ttl_sec'] is not None else "なし")
+    eviction_labels = {'size': '容量超過', 'ttl': '期限切れ', 'invalidated': 'データ更新'}
+    st.dataframe(pd.DataFrame([
+        {'段': {'memory': 'メモリ', 'disk': 'ディスク'}[tier], **{eviction_labels[reason]: n for reason, n in reasons.items()}}
+        for tier, reasons in cache_stats['evictions'].items()
+    ]), use_container_width=True, hide_index=True)
+    if st.button("共有キャッシュを空にする", key="diagnostics_clear_result_cache"):
+        result_cache.clear()
+        st.rerun()
+
+profiling.end_stage(page_stage)
+
 # フッター（チャット画面以外で表示）
 if selected_analysis != "AIアナリスト（チャット）":
     st.markdown("---")
-    st.markdown("**瞬ジェネ AIアナライザー** - Powered by Gemini 3.0Pro")
\ No newline at end of file
+    chart_payloads = st.session_state.get('chart_payloads', {})
+    if chart_payloads:
+        with st.expander("このページのチャートの転送量", expanded=False):
+            payload_df = pd.DataFrame([{'チャート': chart_id, '点数': p['points'], 'バイト数': p['bytes'], 'キャッシュ': '○' if p['cached'] else ''} for chart_id, p in chart_payloads.items()])
+            st.caption(f"合計 {payload_df['バイト数'].sum() / 1024:,.1f} KB（折れ線は1系列 {chart_payload.DEFAULT_MAX_POINTS:,} 点までに間引き）")
+            st.dataframe(payload_df.style.format({'点数': '{:,}', 'バイト数': '{:,}'}), use_container_width=True, hide_index=True)
+    st.markdown("**瞬ジェネ AIアナライザー** - Powered by Gemini 3.0Pro")
+
+profiling.finish_trace()
@@ -0,0 +1,251 @@
+"""
+セッションパス分析エンジン
+ページビューイベントをセッション・時刻順に並べた配列からページ遷移列を復元し、
+遷移行列、主要パス、逆行ループ、次ページまでの時間分布を計算する。
+セッションごとのPythonループを使わず、ソート済み配列とランレングス処理で集計する
+"""
+import numpy as np
+import pandas as pd
+
+PAGE_VIEW_EVENTS = ('session_start', 'page_view')
+EXIT_LABEL = '離脱'
+CV_LABEL = 'CV'
+
+# パスのハッシュに使う基数（uint64 の桁あふれはハッシュとしてそのまま利用する）
+_HASH_BASE = np.uint64(1_000_003)
+
+
+def build_page_sequences(df: pd.DataFrame) -> dict:
+    """
+    イベントデータからセッションごとのページ遷移列を作成する
+
+    ページビューイベントを (セッション, 時刻) でソートし、同じページが連続するイベントは
+    ランレングス圧縮で1つにまとめる。
+
+    Args:
+        df: イベント単位のデータフレーム（フィルター適用済みでも可）
+
+    Returns:
+        dict: 'session'（セッション番号）, 'page', 'timestamp_ms', 'backward'（逆行フラグ）の配列、
+              'starts'（各セッションの先頭位置）, 'session_ids', 'converted'（セッションごとのCV有無）
+    """
+    views = df[df['event_name'].isin(PAGE_VIEW_EVENTS) & df['page_num_dom'].notna()]
+    session_codes, session_ids = pd.factorize(views['session_id'])
+    timestamps = views['event_timestamp'].to_numpy(dtype='datetime64[ms]').astype(np.int64)
+    pages = views['page_num_dom'].to_numpy(dtype=np.int64)
+    backward = (views['direction'] == 'backward').to_numpy() if 'direction' in views.columns else np.zeros(len(views), dtype=bool)
+
+    order = np.lexsort((timestamps, session_codes))
+    session_codes, pages, timestamps, backward = session_codes[order], pages[order], timestamps[order], backward[order]
+
+    # ランレングス圧縮: セッションが変わるか、ページが変わる位置だけを残す
+    keep = np.ones(len(pages), dtype=bool)
+    keep[1:] = (session_codes[1:] != session_codes[:-1]) | (pages[1:] != pages[:-1])
+    # 圧縮で落とした行の逆行フラグは、残した行に引き継ぐ
+    run_id = np.cumsum(keep) - 1
+    backward = np.bincount(run_id, weights=backward, minlength=int(keep.sum())) > 0 if len(pages) else backward
+    session_codes, pages, timestamps = session_codes[keep], pages[keep], timestamps[keep]
+
+    starts = np.flatnonzero(np.r_[True, session_codes[1:] != session_codes[:-1]]) if len(pages) else np.zeros(0, dtype=np.int64)
+    cv_sessions = df.loc[df['cv_type'].notna(), 'session_id'].unique()
+    converted = pd.Index(session_ids).isin(cv_sessions)
+    return {
+        'session': session_codes,
+        'page': pages,
+        'timestamp_ms': timestamps,
+        'backward': backward,
+        'starts': starts,
+        'session_ids': np.asarray(session_ids),
+        'converted': converted,
+    }
+
+
+def subset_sequences(seq: dict, session_mask) -> dict:
+    """
+    セッションの真偽マスクでページ遷移列を絞り込む（セッション番号は詰め直す）
+
+    Args:
+        seq: build_page_sequences() の戻り値
+        session_mask: セッションごとの真偽配列（seq['session_ids'] と同じ並び）
+
+    Returns:
+        dict: build_page_sequences() と同じ形式の遷移列
+    """
+    session_mask = np.asarray(session_mask, dtype=bool)
+    keep = session_mask[seq['session']]
+    new_codes = np.cumsum(session_mask) - 1
+    session = new_codes[seq['session'][keep]]
+    return {
+        'session': session,
+        'page': seq['page'][keep],
+        'timestamp_ms': seq['timestamp_ms'][keep],
+        'backward': seq['backward'][keep],
+        'starts': np.flatnonzero(np.r_[True, session[1:] != session[:-1]]) if len(session) else np.zeros(0, dtype=np.int64),
+        'session_ids': seq['session_ids'][session_mask],
+        'converted': seq['converted'][session_mask],
+    }
+
+
+def _transitions(seq: dict):
+    """同一セッション内の連続するページの組 (遷移元の位置, 遷移先の位置) を返す"""
+    same_session = seq['session'][1:] == seq['session'][:-1]
+    src = np.flatnonzero(same_session)
+    return src, src + 1
+
+
+def transition_matrix(seq: dict, page_count: int = None, normalize: bool = False) -> pd.DataFrame:
+    """
+    ページ遷移行列（行: 遷移元ページ、列: 遷移先ページ + 離脱 + CV）を作成する
+
+    Args:
+        seq: build_page_sequences() の戻り値
+        page_count: ページ数（None ならデータ中の最大ページ）
+        normalize: True なら行ごとの割合（遷移確率）にする
+
+    Returns:
+        pd.DataFrame: 遷移数または遷移確率の行列
+    """
+    pages = seq['page']
+    if page_count is None:
+        page_count = int(pages.max()) if len(pages) else 0
+    exit_col, cv_col = page_count + 1, page_count + 2
+    size = page_count + 3
+
+    src, dst = _transitions(seq)
+    from_pages = pages[src]
+    to_pages = pages[dst]
+
+    # セッション最後のページからは CV または離脱に遷移する
+    last = np.r_[seq['starts'][1:] - 1, len(pages) - 1] if len(pages) else np.zeros(0, dtype=np.int64)
+    last_to = np.where(seq['converted'][seq['session'][last]], cv_col, exit_col)
+    from_all = np.clip(np.r_[from_pages, pages[last]], 0, page_count)
+    to_all = np.r_[np.clip(to_pages, 0, page_count), last_to]
+
+    counts = np.bincount(from_all * size + to_all, minlength=size * size).reshape(size, size)
+    labels = list(range(1, page_count + 1))
+    matrix = pd.DataFrame(counts[1:page_count + 1, 1:], index=labels, columns=labels + [EXIT_LABEL, CV_LABEL])
+    matrix.index.name = '遷移元ページ'
+    if normalize:
+        totals = matrix.sum(axis=1)
+        matrix = matrix.div(totals.where(totals > 0), axis=0).fillna(0)
+    return matrix
+
+
+def _path_hashes(seq: dict) -> np.ndarray:
+    """セッションごとのページ列を多項式ハッシュに変換する（np.add.reduceat で一括計算）"""
+    pages = seq['page'].astype(np.uint64)
+    positions = np.arange(len(pages)) - np.repeat(seq['starts'], np.diff(np.r_[seq['starts'], len(pages)]))
+    with np.errstate(over='ignore'):
+        powers = np.cumprod(np.r_[np.uint64(1), np.full(max(int(positions.max(initial=0)), 0), _HASH_BASE)])
+        terms = (pages + np.uint64(1)) * powers[positions]
+        return np.add.reduceat(terms, seq['starts']) if len(pages) else np.zeros(0, dtype=np.uint64)
+
+
+def top_paths(seq: dict, n: int = 10) -> pd.DataFrame:
+    """
+    出現回数の多いページ遷移パスを返す
+
+    パスをハッシュ値と長さで同一判定して np.unique で数え、上位 n 件のパスだけを文字列に戻す。
+
+    Args:
+        seq: build_page_sequences() の戻り値
+        n: 返すパスの件数
+
+    Returns:
+        pd.DataFrame: 'パス', 'ページ数', 'セッション数', '割合', 'CV数', 'CVR'
+    """
+    n_sessions = len(seq['starts'])
+    if n_sessions == 0:
+        return pd.DataFrame(columns=['パス', 'ページ数', 'セッション数', '割合', 'CV数', 'CVR'])
+    lengths = np.diff(np.r_[seq['starts'], len(seq['page'])])
+    hashes = _path_hashes(seq)
+    keys = np.stack([hashes, lengths.astype(np.uint64)], axis=1)
+    _, first, inverse, counts = np.unique(keys, axis=0, return_index=True, return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+    cv_counts = np.bincount(inverse, weights=seq['converted'].astype(float), minlength=len(counts))
+
+    top = np.argsort(-counts, kind='stable')[:n]
+    rows = []
+    for k in top:
+        start = seq['starts'][first[k]]
+        path = seq['page'][start:start + lengths[first[k]]]
+        rows.append({
+            'パス': ' → '.join(map(str, path)),
+            'ページ数': len(path),
+            'セッション数': int(counts[k]),
+            '割合': counts[k] / n_sessions,
+            'CV数': int(cv_counts[k]),
+            'CVR': cv_counts[k] / counts[k],
+        })
+    return pd.DataFrame(rows)
+
+
+def backflow_loops(seq: dict) -> pd.DataFrame:
+    """
+    逆行（前のページへの戻り）をページの組ごとに集計する
+
+    ページ列の中で番号が小さいページに戻った遷移を数える。逆行フラグ（direction == 'backward'）は
+    戻り元のページのページビューに付く（そのページから1つ前へ戻った）ので、直後にページ列の戻りの遷移が
+    続いていないフラグだけを「フラグの付いたページ → 1つ前のページ」の逆行として補う（同じ戻りを二重に数えない）。
+
+    Args:
+        seq: build_page_sequences() の戻り値
+
+    Returns:
+        pd.DataFrame: '戻り元ページ', '戻り先ページ', '逆行回数', '逆行セッション数', 'CVR'（逆行回数の多い順）
+    """
+    src, dst = _transitions(seq)
+    is_back = seq['page'][dst] < seq['page'][src]
+    left_back = np.zeros(len(seq['page']), dtype=bool)
+    left_back[src[is_back]] = True
+    flag_only = np.flatnonzero(seq['backward'] & ~left_back & (seq['page'] > 1))
+    from_pages = np.r_[seq['page'][src[is_back]], seq['page'][flag_only]]
+    to_pages = np.r_[seq['page'][dst[is_back]], seq['page'][flag_only] - 1]
+    sessions = np.r_[seq['session'][src[is_back]], seq['session'][flag_only]]
+    loops = pd.DataFrame({
+        '戻り元ページ': from_pages,
+        '戻り先ページ': to_pages,
+        'session': sessions,
+        'converted': seq['converted'][sessions],
+    })
+    if loops.empty:
+        return pd.DataFrame(columns=['戻り元ページ', '戻り先ページ', '逆行回数', '逆行セッション数', 'CVR'])
+    summary = loops.groupby(['戻り元ページ', '戻り先ページ']).agg(
+        逆行回数=('session', 'size'),
+        逆行セッション数=('session', 'nunique'),
+    )
+    # CVR はセッション単位（同じ組を複数回戻ったセッションも1と数える）
+    per_session = loops.drop_duplicates(['戻り元ページ', '戻り先ページ', 'session'])
+    summary['CVR'] = per_session.groupby(['戻り元ページ', '戻り先ページ'])['converted'].mean()
+    return summary.reset_index().sort_values('逆行回数', ascending=False).reset_index(drop=True)
+
+
+def time_to_next_page(seq: dict, quantiles=(0.25, 0.5, 0.75, 0.9)) -> pd.DataFrame:
+    """
+    各ページから次のページへ進むまでの時間の分布を集計する
+
+    Args:
+        seq: build_page_sequences() の戻り値
+        quantiles: 計算する分位点
+
+    Returns:
+        pd.DataFrame: 'ページ番号', '遷移数', '平均(秒)', 各分位点 'p25(秒)' など
+    """
+    src, dst = _transitions(seq)
+    forward = seq['page'][dst] > seq['page'][src]
+    src, dst = src[forward], dst[forward]
+    seconds = (seq['timestamp_ms'][dst] - seq['timestamp_ms'][src]) / 1000
+    pages = seq['page'][src]
+    columns = ['ページ番号', '遷移数', '平均(秒)'] + [f"p{int(q * 100)}(秒)" for q in quantiles]
+    if len(pages) == 0:
+        return pd.DataFrame(columns=columns)
+
+    # ページ順にソートした配列を境界で区切り、グループごとに分位点を計算する
+    order = np.lexsort((seconds, pages))
+    pages, seconds = pages[order], seconds[order]
+    bounds = np.flatnonzero(np.r_[True, pages[1:] != pages[:-1], True])
+    rows = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        values = seconds[start:end]
+        rows.append([int(pages[start]), end - start, values.mean()] + list(np.quantile(values, quantiles)))
+    return pd.DataFrame(rows, columns=columns)
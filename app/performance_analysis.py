@@ -0,0 +1,175 @@
+"""
+表示速度（読込時間）のパフォーマンス分析
+分位点スケッチから読込時間の p75/p95 をページ・デバイス・チャネル別に求め、
+遅い読込が離脱にどれだけ寄与しているかと、読込時間が100ms延びるごとのCVR低下を推定する
+"""
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+import app.quantile_sketch as quantile_sketch
+
+PERFORMANCE_QUANTILES = (0.75, 0.95)
+PERFORMANCE_DIMENSIONS = {'page_num_dom': 'ページ', 'device_type': 'デバイス', 'channel': 'チャネル'}
+PAGE_VIEW_EVENTS = ('session_start', 'page_view')
+
+
+def percentile_breakdown(sketch: dict, dimensions=PERFORMANCE_DIMENSIONS, qs=PERFORMANCE_QUANTILES,
+                         start_date=None, end_date=None, filters: dict = None) -> pd.DataFrame:
+    """
+    ディメンションごとの読込時間パーセンタイルを分位点スケッチから求める
+
+    Args:
+        sketch: quantile_sketch.build_quantile_sketches() の戻り値
+        dimensions: 集計するディメンション列（{列名: 表示名} または列名のリスト）
+        qs: 求める分位点
+        start_date, end_date: 期間（両端を含む）
+        filters: {ディメンション列: 値}
+
+    Returns:
+        pd.DataFrame: 'dimension', 'segment', 'count', 'mean' と各分位点 'p75', 'p95' など
+    """
+    frames = []
+    for dim in dimensions:
+        if dim not in sketch['dimensions']:
+            continue
+        result = quantile_sketch.quantiles(sketch, 'load_time_ms', qs, start_date, end_date, filters, by=dim)
+        frames.append(result.reset_index(names='segment').assign(dimension=dim))
+    if not frames:
+        return pd.DataFrame(columns=['dimension', 'segment', 'count', 'mean'] + [f"p{q * 100:g}" for q in qs])
+    result = pd.concat(frames, ignore_index=True)
+    return result[['dimension'] + [c for c in result.columns if c != 'dimension']]
+
+
+def page_view_loads(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    セッション × ページごとの読込時間と、そのページで離脱したかを求める
+
+    同じページを複数回表示した場合は最初の表示の読込時間を使う。離脱は
+    「CVしていないセッションの最大到達ページで、LPの最終ページではない」表示とする。
+
+    Args:
+        df: イベント単位のデータフレーム（フィルター適用済みでも可）
+
+    Returns:
+        pd.DataFrame: 'session_id', 'page', 'load_time_ms', 'exited'
+    """
+    views = df[df['event_name'].isin(PAGE_VIEW_EVENTS) & df['page_num_dom'].notna() & df['load_time_ms'].notna()]
+    views = views.sort_values('event_timestamp', kind='stable').drop_duplicates(['session_id', 'page_num_dom'])
+    session_codes, session_ids = pd.factorize(views['session_id'])
+    pages = views['page_num_dom'].to_numpy(dtype=np.int64)
+
+    last_page = np.zeros(len(session_ids), dtype=np.int64)
+    np.maximum.at(last_page, session_codes, pages)
+    converted = pd.Index(session_ids).isin(df.loc[df['cv_type'].notna(), 'session_id'].unique())
+    total_pages = views['total_pages'].fillna(np.inf).to_numpy(dtype=float) if 'total_pages' in views.columns else np.full(len(views), np.inf)
+    exited = (pages == last_page[session_codes]) & ~converted[session_codes] & (pages < total_pages)
+    return pd.DataFrame({
+        'session_id': views['session_id'].to_numpy(),
+        'page': pages,
+        'load_time_ms': views['load_time_ms'].to_numpy(dtype=float),
+        'exited': exited,
+    })
+
+
+def slow_page_exit_contribution(loads: pd.DataFrame, threshold_ms: float) -> pd.DataFrame:
+    """
+    読込が遅いページ表示（threshold_ms 超）が離脱に与えた影響をページごとに集計する
+
+    同じページの速い表示の離脱率を基準に、遅い表示で「余分に」発生した離脱数を求め、
+    全離脱数に対する割合を寄与度とする。
+
+    Args:
+        loads: page_view_loads() の戻り値
+        threshold_ms: 遅い表示とみなす読込時間（ms）
+
+    Returns:
+        pd.DataFrame: 'ページ番号', '表示数', '遅い表示の割合', '離脱率(速い)', '離脱率(遅い)',
+            '超過離脱数', '離脱への寄与度'
+    """
+    columns = ['ページ番号', '表示数', '遅い表示の割合', '離脱率(速い)', '離脱率(遅い)', '超過離脱数', '離脱への寄与度']
+    if loads.empty:
+        return pd.DataFrame(columns=columns)
+    pages = loads['page'].to_numpy()
+    slow = loads['load_time_ms'].to_numpy() > threshold_ms
+    exited = loads['exited'].to_numpy()
+    size = int(pages.max()) + 1
+
+    def count(mask):
+        return np.bincount(pages[mask], minlength=size)[1:].astype(float)
+
+    views_slow, views_fast = count(slow), count(~slow)
+    exits_slow, exits_fast = count(slow & exited), count(~slow & exited)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rate_fast = np.where(views_fast > 0, exits_fast / views_fast, np.nan)
+        rate_slow = np.where(views_slow > 0, exits_slow / views_slow, np.nan)
+    excess = np.clip(exits_slow - views_slow * np.nan_to_num(rate_fast), 0, None)
+    total_exits = exited.sum()
+    result = pd.DataFrame({
+        'ページ番号': np.arange(1, size),
+        '表示数': (views_slow + views_fast).astype(np.int64),
+        '遅い表示の割合': np.where(views_slow + views_fast > 0, views_slow / np.maximum(views_slow + views_fast, 1), 0.0),
+        '離脱率(速い)': rate_fast,
+        '離脱率(遅い)': rate_slow,
+        '超過離脱数': excess,
+        '離脱への寄与度': excess / total_exits if total_exits > 0 else 0.0,
+    })
+    return result[result['表示数'] > 0].reset_index(drop=True)
+
+
+def cvr_load_regression(sessions: pd.DataFrame, n_bins: int = 20, control: str = 'device_type', alpha: float = 0.05) -> dict:
+    """
+    読込時間が100ms延びるごとのCVRの変化を、セッションのビン集計に対する加重回帰で推定する
+
+    セッションを平均読込時間の分位でビンに分け、ビンごとのCVRを平均読込時間に回帰する（重み = セッション数）。
+    デバイスによって読込時間とCVRがともに異なる交絡を避けるため、control 列ごとにビンを作り、
+    control の値ごとの切片（固定効果）を入れて共通の傾きを推定する。
+
+    Args:
+        sessions: build_session_table() で作成したセッションテーブル
+        n_bins: control の値ごとのビン数
+        control: 固定効果として調整する列（None なら調整しない）
+        alpha: 信頼区間の有意水準
+
+    Returns:
+        dict: 'slope_per_100ms'（CVRの変化、割合）, 'ci_low', 'ci_high', 'p_value',
+            'bins'（ビンごとの 'segment', 'load_time_ms', 'sessions', 'cvr', 'fitted'）
+    """
+    data = sessions[['load_time_ms_mean', 'is_cv']].copy()
+    data['segment'] = sessions[control].fillna('(not set)').astype(str) if control else '全体'
+    data = data.dropna(subset=['load_time_ms_mean'])
+    empty = {'slope_per_100ms': np.nan, 'ci_low': np.nan, 'ci_high': np.nan, 'p_value': np.nan,
+             'bins': pd.DataFrame(columns=['segment', 'load_time_ms', 'sessions', 'cvr', 'fitted'])}
+    if len(data) < n_bins:
+        return empty
+
+    # セグメント内の順位からビン番号を付け、(セグメント, ビン) ごとに集計する
+    rank = data.groupby('segment')['load_time_ms_mean'].rank(method='first', pct=True)
+    data['bin'] = np.minimum((rank * n_bins).astype(int), n_bins - 1)
+    bins = data.groupby(['segment', 'bin']).agg(
+        load_time_ms=('load_time_ms_mean', 'mean'), sessions=('is_cv', 'size'), cvr=('is_cv', 'mean')
+    ).reset_index()
+
+    segment_codes, segment_labels = pd.factorize(bins['segment'])
+    x = bins['load_time_ms'].to_numpy() / 100
+    design = np.column_stack([x, np.eye(len(segment_labels))[segment_codes]])
+    weights = bins['sessions'].to_numpy(dtype=float)
+    y = bins['cvr'].to_numpy(dtype=float)
+    sqrt_w = np.sqrt(weights)
+    coef, *_ = np.linalg.lstsq(design * sqrt_w[:, None], y * sqrt_w, rcond=None)
+    fitted = design @ coef
+    dof = len(y) - design.shape[1]
+    if dof <= 0:
+        return empty
+    residual_var = np.sum(weights * (y - fitted) ** 2) / dof
+    xtwx = design.T @ (design * weights[:, None])
+    se = np.sqrt(residual_var * np.linalg.pinv(xtwx)[0, 0])
+    z = norm.ppf(1 - alpha / 2)
+    bins['fitted'] = fitted
+    return {
+        'slope_per_100ms': float(coef[0]),
+        'ci_low': float(coef[0] - z * se),
+        'ci_high': float(coef[0] + z * se),
+        'p_value': float(2 * norm.sf(abs(coef[0] / se))) if se > 0 else np.nan,
+        'bins': bins.drop(columns='bin'),
+    }
@@ -0,0 +1,199 @@
+"""
+処理時間の計測（プロファイリング）
+リランごとにトレース（段階名・所要時間・入出力の行数・キャッシュのヒット/ミス）を記録し、
+直近のリランをまとめて段階ごとの p50 / p95 を出したり、JSON に書き出して別の環境と比べたりできるようにする。
+トレースを開始していないとき（ベンチマークやテストから呼んだとき）は記録せず、計測のコストもほぼかからない
+"""
+import contextlib
+import contextvars
+import functools
+import json
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# 実行中のリランのトレース（Streamlit はリランごとにスクリプト用のスレッドを作るので、セッション間で混ざらない）
+_current_trace = contextvars.ContextVar('profiling_trace', default=None)
+
+STAGE_SUMMARY_COLUMNS = ['段階', '回数', 'p50 (ms)', 'p95 (ms)', '平均 (ms)', '最大 (ms)', 'キャッシュヒット率 (%)', '平均入力行数', '平均出力行数']
+
+
+def start_trace(label: str = None) -> dict:
+    """
+    リランのトレースを開始する（以降の stage() / profiled() の計測がこのトレースに記録される）
+
+    Args:
+        label: トレースの名前（表示しているページなど。あとから set_trace_label() で変えられる）
+
+    Returns:
+        dict: 'label', 'started_at'（ISO形式）, 'total_ms'（finish_trace() まで None）, 'stages'（段階の記録のリスト）
+    """
+    trace = {'label': label, 'started_at': datetime.now().isoformat(timespec='seconds'), 'total_ms': None, 'stages': [],
+             '_t0': time.perf_counter(), '_open': []}
+    _current_trace.set(trace)
+    return trace
+
+
+def set_trace_label(label: str):
+    """実行中のトレースの名前を設定する"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace['label'] = label
+
+
+def finish_trace() -> dict:
+    """
+    実行中のトレースを終了し、全体の所要時間を記録する
+
+    Returns:
+        dict: 終了したトレース（トレースを開始していなければ None）
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    trace['total_ms'] = (time.perf_counter() - trace['_t0']) * 1000
+    _current_trace.set(None)
+    return trace
+
+
+def _row_count(value):
+    """DataFrame・Series・配列なら行数、それ以外は None"""
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return int(len(value))
+    return None
+
+
+def begin_stage(name: str, rows_in=None, cached: bool = False) -> dict:
+    """
+    段階の計測を始める（with で囲めない処理用。終わったら end_stage() を呼ぶ）
+
+    Args:
+        name: 段階名（'preprocess', 'filter_dataframe', 'chart:plotly_chart_7' など）
+        rows_in: 入力の行数（DataFrame を渡すとその行数）
+        cached: キャッシュする処理なら True（計測中に note_cache_miss() が呼ばれなければヒットとして記録する）
+
+    Returns:
+        dict: 段階の記録（'stage', 'depth', 'ms', 'rows_in', 'rows_out', 'cache'）。計測中に 'rows_out' などを書き込める
+    """
+    trace = _current_trace.get()
+    record = {
+        'stage': name,
+        'depth': len(trace['_open']) if trace is not None else 0,
+        'ms': None,
+        'rows_in': rows_in if isinstance(rows_in, int) else _row_count(rows_in),
+        'rows_out': None,
+        'cache': 'hit' if cached else None,
+        '_t0': time.perf_counter(),
+    }
+    if trace is not None:
+        trace['stages'].append(record)
+        trace['_open'].append(record)
+    return record
+
+
+def end_stage(record: dict):
+    """begin_stage() で始めた段階の所要時間を記録する"""
+    record['ms'] = (time.perf_counter() - record.pop('_t0')) * 1000
+    trace = _current_trace.get()
+    if trace is not None and record in trace['_open']:
+        trace['_open'].remove(record)
+
+
+@contextlib.contextmanager
+def stage(name: str, rows_in=None, cached: bool = False):
+    """
+    with ブロックの所要時間を段階として記録する（引数は begin_stage() と同じ）
+
+    Yields:
+        dict: 段階の記録。ブロック内で 'rows_out' などを書き込める
+    """
+    record = begin_stage(name, rows_in=rows_in, cached=cached)
+    try:
+        yield record
+    finally:
+        end_stage(record)
+
+
+def note_cache_miss():
+    """キャッシュする関数の本体から呼び、実行中でいちばん内側のキャッシュ段階をミスとして記録する"""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    for record in reversed(trace['_open']):
+        if record['cache'] is not None:
+            record['cache'] = 'miss'
+            return
+
+
+def profiled(name: str = None, cached: bool = False):
+    """
+    関数の呼び出しを段階として記録するデコレーター
+
+    引数の最初の DataFrame の行数を入力行数、戻り値が DataFrame などならその行数を出力行数として記録する。
+    st.cache_data の関数には外側に付け、関数本体で note_cache_miss() を呼ぶとキャッシュのヒット/ミスも記録できる
+
+    Args:
+        name: 段階名（省略時は '<モジュール名>.<関数名>'）
+        cached: キャッシュする関数なら True
+    """
+    def decorator(func):
+        stage_name = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            rows_in = next((v for v in list(args) + list(kwargs.values()) if isinstance(v, pd.DataFrame)), None)
+            with stage(stage_name, rows_in=rows_in, cached=cached) as record:
+                result = func(*args, **kwargs)
+                record['rows_out'] = _row_count(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def clean_trace(trace: dict) -> dict:
+    """トレースから内部用のキー（'_' で始まるもの）を除く（JSON に書き出すとき用）"""
+    cleaned = {k: v for k, v in trace.items() if not k.startswith('_')}
+    cleaned['stages'] = [{k: v for k, v in r.items() if not k.startswith('_')} for r in trace['stages']]
+    return cleaned
+
+
+def stage_summary(traces) -> pd.DataFrame:
+    """
+    複数のリランのトレースを段階ごとにまとめる
+
+    Args:
+        traces: トレースのリスト（start_trace() の戻り値）
+
+    Returns:
+        pd.DataFrame: STAGE_SUMMARY_COLUMNS（合計時間の長い順）。'リラン全体' の行は各トレースの total_ms
+    """
+    rows = [r for t in traces for r in t['stages'] if r['ms'] is not None]
+    rows += [{'stage': 'リラン全体', 'ms': t['total_ms'], 'rows_in': None, 'rows_out': None, 'cache': None} for t in traces if t['total_ms'] is not None]
+    if not rows:
+        return pd.DataFrame(columns=STAGE_SUMMARY_COLUMNS)
+    records = pd.DataFrame(rows)
+    for col in ['ms', 'rows_in', 'rows_out']:
+        records[col] = pd.to_numeric(records[col], errors='coerce')
+    records['hit'] = records['cache'].map({'hit': 1.0, 'miss': 0.0})
+    grouped = records.groupby('stage', sort=False)
+    counts = grouped['ms'].size()
+    summary = pd.DataFrame({
+        '段階': counts.index.to_numpy(),
+        '回数': counts.to_numpy(),
+        'p50 (ms)': grouped['ms'].quantile(0.5).to_numpy(),
+        'p95 (ms)': grouped['ms'].quantile(0.95).to_numpy(),
+        '平均 (ms)': grouped['ms'].mean().to_numpy(),
+        '最大 (ms)': grouped['ms'].max().to_numpy(),
+        'キャッシュヒット率 (%)': grouped['hit'].mean().to_numpy() * 100,
+        '平均入力行数': grouped['rows_in'].mean().to_numpy(),
+        '平均出力行数': grouped['rows_out'].mean().to_numpy(),
+    })
+    total = grouped['ms'].sum().to_numpy()
+    return summary.iloc[np.argsort(-total, kind='stable')].reset_index(drop=True)
+
+
+def traces_to_json(traces) -> str:
+    """トレースを JSON 文字列にする（オフラインでの比較用）"""
+    return json.dumps([clean_trace(t) for t in traces], ensure_ascii=False, indent=2)
@@ -0,0 +1,260 @@
+"""
+分位点スケッチ
+stay_ms / load_time_ms の分布を (日, ページ, デバイスなどのディメンション) のセルごとに
+対数幅のバケットのヒストグラム（DDSketch 方式、相対誤差保証つき）として保持する。
+セルどうしはバケットの件数を足すだけでマージできるため、任意の期間・フィルターの
+p50/p90/p99 とヒストグラムを生イベントを走査せずに求められる
+"""
+import numpy as np
+import pandas as pd
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+QUANTILE_METRICS = ('stay_ms', 'load_time_ms')
+# 指標ごとにスケッチに入れるイベント（None なら値のある全イベント）。読込時間はクリック・CVの行にも
+# 同じページの値が入っているので、ページ表示の行だけを数える（performance_analysis.PAGE_VIEW_EVENTS と同じ）
+METRIC_EVENTS = {'load_time_ms': ('session_start', 'page_view')}
+QUANTILE_DIMENSIONS = ['page_num_dom', 'device_type', 'lp_base_url', 'channel', 'source_medium', 'user_type', 'conversion_status']
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+ALL_LABEL = 'すべて'
+NOT_SET = '(not set)'
+
+
+def _gamma(relative_accuracy: float) -> float:
+    """バケット幅の比（隣り合うバケットの境界の比）"""
+    return (1 + relative_accuracy) / (1 - relative_accuracy)
+
+
+def _bucket_index(values: np.ndarray, gamma: float) -> np.ndarray:
+    """値をバケット番号 ceil(log_gamma(x)) に変換する（1未満の値はバケット0）"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        index = np.ceil(np.log(np.maximum(values, 1.0)) / np.log(gamma))
+    return index.astype(np.int64)
+
+
+def bucket_value(index, gamma: float) -> np.ndarray:
+    """バケットの代表値（境界の調和的な中点: 相対誤差が relative_accuracy 以内になる値）"""
+    return 2 * np.power(gamma, np.asarray(index, dtype=float)) / (gamma + 1)
+
+
+def _cell_codes(df: pd.DataFrame, dimensions):
+    """(日, ディメンション) の組み合わせを整数コードとセル表に変換する（数値のディメンションは欠損を NaN のまま残す）"""
+    cell_frame = df[dimensions].copy()
+    for dim in dimensions:
+        if not pd.api.types.is_numeric_dtype(cell_frame[dim]):
+            cell_frame[dim] = cell_frame[dim].astype(object).fillna(NOT_SET)
+    cell_frame.insert(0, 'day', df['event_date'].to_numpy(dtype='datetime64[D]'))
+    codes = cell_frame.groupby(list(cell_frame.columns), sort=False, dropna=False).ngroup().to_numpy()
+    first_rows = np.unique(codes, return_index=True)[1]
+    return codes, cell_frame.iloc[first_rows].reset_index(drop=True)
+
+
+def _sum_by_key(keys: np.ndarray, counts: np.ndarray):
+    """同じキーの件数を合計する（ソート済みの一意なキーと合計を返す）"""
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    return unique_keys, np.bincount(inverse.ravel(), weights=counts, minlength=len(unique_keys)).astype(np.int64)
+
+
+def build_quantile_sketches(df: pd.DataFrame, metrics=QUANTILE_METRICS, dimensions=None,
+                            relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY) -> dict:
+    """
+    イベントデータから (日, ディメンションの組み合わせ) ごとの分位点スケッチを作成する
+
+    Args:
+        df: イベント単位のデータフレーム
+        metrics: 分布を保持する列（METRIC_EVENTS にある列はそのイベントの行だけを使う）
+        dimensions: セルを分けるディメンション列（None なら QUANTILE_DIMENSIONS のうち存在する列）
+        relative_accuracy: 分位点の相対誤差の上限
+
+    Returns:
+        dict: 'cells'（セルごとの 'day' とディメンション値）, 'dimensions', 'gamma',
+            'metrics'（列名 -> {'key': セル番号とバケット番号の組を表すキー, 'count': 件数,
+            'n_buckets': バケット数, 'cell_sum': セルごとの合計, 'cell_count': セルごとの件数}）
+    """
+    if dimensions is None:
+        dimensions = [d for d in QUANTILE_DIMENSIONS if d in df.columns]
+    gamma = _gamma(relative_accuracy)
+    cell_codes, cells = _cell_codes(df, list(dimensions))
+    sketch = {'cells': cells, 'dimensions': list(dimensions), 'gamma': gamma, 'metrics': {}}
+    for metric in metrics:
+        values = df[metric].to_numpy(dtype=float)
+        valid = ~np.isnan(values)
+        if METRIC_EVENTS.get(metric) and 'event_name' in df.columns:
+            valid &= df['event_name'].isin(METRIC_EVENTS[metric]).to_numpy()
+        buckets = _bucket_index(values[valid], gamma)
+        n_buckets = int(buckets.max()) + 1 if len(buckets) else 1
+        keys, counts = _sum_by_key(cell_codes[valid] * n_buckets + buckets, np.ones(len(buckets)))
+        sketch['metrics'][metric] = {
+            'key': keys,
+            'count': counts,
+            'n_buckets': n_buckets,
+            'cell_sum': np.bincount(cell_codes[valid], weights=values[valid], minlength=len(cells)),
+            'cell_count': np.bincount(cell_codes[valid], minlength=len(cells)),
+        }
+    return sketch
+
+
+def _split_keys(entry: dict):
+    """キーを (セル番号, バケット番号) に分解する"""
+    return entry['key'] // entry['n_buckets'], entry['key'] % entry['n_buckets']
+
+
+def merge_sketches(a: dict, b: dict) -> dict:
+    """
+    同じ設定で作成した2つのスケッチを1つにまとめる（新着イベント分を取り込む場合など）
+
+    Args:
+        a, b: build_quantile_sketches() の戻り値（dimensions と gamma が同じもの）
+
+    Returns:
+        dict: build_quantile_sketches() と同じ形式のスケッチ
+    """
+    if a['dimensions'] != b['dimensions'] or not np.isclose(a['gamma'], b['gamma']):
+        raise ValueError("ディメンションと精度が同じスケッチだけをマージできます")
+    cells = pd.concat([a['cells'], b['cells']], ignore_index=True)
+    remap = cells.groupby(list(cells.columns), sort=False, dropna=False).ngroup().to_numpy()
+    first_rows = np.unique(remap, return_index=True)[1]
+    n_cells = len(first_rows)
+    offset = len(a['cells'])
+    merged = {'cells': cells.iloc[first_rows].reset_index(drop=True), 'dimensions': a['dimensions'],
+              'gamma': a['gamma'], 'metrics': {}}
+    for metric in a['metrics'].keys() & b['metrics'].keys():
+        n_buckets = max(a['metrics'][metric]['n_buckets'], b['metrics'][metric]['n_buckets'])
+        keys, counts, sums, cell_counts = [], [], np.zeros(n_cells), np.zeros(n_cells, dtype=np.int64)
+        for sketch, cell_map in ((a, remap[:offset]), (b, remap[offset:])):
+            entry = sketch['metrics'][metric]
+            cell, bucket = _split_keys(entry)
+            keys.append(cell_map[cell] * n_buckets + bucket)
+            counts.append(entry['count'])
+            np.add.at(sums, cell_map, entry['cell_sum'])
+            np.add.at(cell_counts, cell_map, entry['cell_count'])
+        merged_keys, merged_counts = _sum_by_key(np.concatenate(keys), np.concatenate(counts))
+        merged['metrics'][metric] = {'key': merged_keys, 'count': merged_counts, 'n_buckets': n_buckets,
+                                     'cell_sum': sums, 'cell_count': cell_counts}
+    return merged
+
+
+def cell_mask(sketch: dict, start_date=None, end_date=None, filters: dict = None) -> np.ndarray:
+    """
+    期間とフィルター条件に一致するセルの真偽配列を返す
+
+    Args:
+        sketch: build_quantile_sketches() の戻り値
+        start_date, end_date: 期間（両端を含む。None なら制限なし）
+        filters: {ディメンション列: 値}。値が None または 'すべて' の条件は無視する
+
+    Returns:
+        np.ndarray: セルごとの真偽値
+
+    Raises:
+        KeyError: スケッチにないディメンションでフィルターした場合
+    """
+    cells = sketch['cells']
+    days = cells['day'].to_numpy(dtype='datetime64[D]')
+    mask = np.ones(len(cells), dtype=bool)
+    if start_date is not None:
+        mask &= days >= np.datetime64(pd.Timestamp(start_date).date(), 'D')
+    if end_date is not None:
+        mask &= days <= np.datetime64(pd.Timestamp(end_date).date(), 'D')
+    for dim, value in (filters or {}).items():
+        if value is None or value == ALL_LABEL:
+            continue
+        if dim not in sketch['dimensions']:
+            raise KeyError(f"スケッチにないディメンションです: {dim}")
+        mask &= (cells[dim] == value).to_numpy()
+    return mask
+
+
+def grouped_histogram(sketch: dict, metric: str, mask: np.ndarray, by: str = None):
+    """
+    マスクで選んだセルのバケット件数をグループごとに合計する
+
+    Args:
+        sketch: build_quantile_sketches() の戻り値
+        metric: 'stay_ms' または 'load_time_ms'
+        mask: cell_mask() の戻り値
+        by: グループに分けるディメンション列（None なら全体で1グループ）
+
+    Returns:
+        tuple: (グループのラベル配列, グループ × バケットの件数行列, グループごとの合計値)
+    """
+    entry = sketch['metrics'][metric]
+    if by is None:
+        group_codes = np.zeros(len(sketch['cells']), dtype=np.int64)
+        labels = np.array([ALL_LABEL], dtype=object)
+    else:
+        group_codes, labels = pd.factorize(sketch['cells'][by], sort=True)
+        # 欠損値のセル（コード -1）はどのグループにも含めない
+        mask = mask & (group_codes >= 0)
+    n_groups, n_buckets = len(labels), entry['n_buckets']
+    cell, bucket = _split_keys(entry)
+    selected = mask[cell]
+    counts = np.bincount(group_codes[cell[selected]] * n_buckets + bucket[selected],
+                         weights=entry['count'][selected], minlength=n_groups * n_buckets).reshape(n_groups, n_buckets)
+    sums = np.bincount(group_codes[mask], weights=entry['cell_sum'][mask], minlength=n_groups)
+    return np.asarray(labels), counts, sums
+
+
+def quantiles(sketch: dict, metric: str, qs=DEFAULT_QUANTILES, start_date=None, end_date=None,
+              filters: dict = None, by: str = None) -> pd.DataFrame:
+    """
+    期間・フィルター条件での分位点をスケッチから求める
+
+    Args:
+        sketch: build_quantile_sketches() の戻り値
+        metric: 'stay_ms' または 'load_time_ms'
+        qs: 求める分位点（0〜1）
+        start_date, end_date: 期間（両端を含む）
+        filters: {ディメンション列: 値}
+        by: グループに分けるディメンション列（'page_num_dom', 'device_type' など）
+
+    Returns:
+        pd.DataFrame: 行がグループ、列が 'count', 'mean' と各分位点 'p50', 'p90', 'p99' など
+    """
+    mask = cell_mask(sketch, start_date, end_date, filters)
+    labels, counts, sums = grouped_histogram(sketch, metric, mask, by)
+    totals = counts.sum(axis=1)
+    cumulative = np.cumsum(counts, axis=1)
+    result = pd.DataFrame({'count': totals.astype(np.int64)}, index=pd.Index(labels, name=by or 'segment'))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result['mean'] = np.where(totals > 0, sums / totals, np.nan)
+    for q in qs:
+        # 順位 q * (n - 1) の値を含む最初のバケット
+        rank = q * (totals - 1)
+        index = np.argmax(cumulative > rank[:, None], axis=1)
+        result[f"p{q * 100:g}"] = np.where(totals > 0, bucket_value(index, sketch['gamma']), np.nan)
+    return result[result['count'] > 0]
+
+
+def histogram(sketch: dict, metric: str, start_date=None, end_date=None, filters: dict = None,
+              bins: int = 40) -> pd.DataFrame:
+    """
+    期間・フィルター条件での値の分布（対数幅のビン）をスケッチから求める
+
+    スケッチの細かいバケットを、データのある範囲で bins 個の等比ビンにまとめ直す。
+
+    Args:
+        sketch: build_quantile_sketches() の戻り値
+        metric: 'stay_ms' または 'load_time_ms'
+        start_date, end_date: 期間（両端を含む）
+        filters: {ディメンション列: 値}
+        bins: ビンの数
+
+    Returns:
+        pd.DataFrame: 'lower', 'upper'（ビンの境界）, 'count', 'share'（全体に対する割合）
+    """
+    mask = cell_mask(sketch, start_date, end_date, filters)
+    _, counts, _ = grouped_histogram(sketch, metric, mask)
+    counts = counts[0]
+    occupied = np.flatnonzero(counts)
+    if len(occupied) == 0:
+        return pd.DataFrame(columns=['lower', 'upper', 'count', 'share'])
+    first, last = occupied[0], occupied[-1]
+    edges = np.unique(np.linspace(first, last + 1, bins + 1).round().astype(np.int64))
+    binned = np.add.reduceat(counts[first:last + 1], edges[:-1] - first)
+    gamma = sketch['gamma']
+    return pd.DataFrame({
+        'lower': np.power(gamma, edges[:-1] - 1.0),
+        'upper': np.power(gamma, edges[1:] - 1.0),
+        'count': binned.astype(np.int64),
+        'share': binned / counts.sum(),
+    })
@@ -0,0 +1,407 @@
+"""
+集計結果の共有キャッシュ
+データセットのバージョンID＋正規化したキー（レポート名・フィルター条件・オプションなど）で集計結果を保持し、
+同じデータセットを見ている複数のセッション（と、ディスクを共有する別のプロセス）で計算結果を使い回す。
+
+    1段目: メモリ上のLRU（バイト数の上限を超えたら最も古く使われたものから追い出す）
+    2段目: ディスク上の Arrow ファイル（DataFrame と {名前: DataFrame} だけを保存する。pyarrow がなければ使わない）
+
+どちらの段も TTL を過ぎた結果は使わず、データセットを作り直したり追記したりしたときは invalidate() で
+古いバージョンの結果をまとめて捨てる。ヒット・ミス・追い出しの件数とバイト数は stats() で確認できる
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # ディスクの段は使わず、メモリの段だけで動く
+    pa = None
+    feather = None
+
+DEFAULT_MAX_MEMORY_BYTES = 512 * 1024 * 1024
+DEFAULT_MAX_DISK_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_TTL_SEC = 6 * 60 * 60
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'result_cache')
+
+# 追い出しの理由（stats() の 'evictions' のキー）
+EVICTION_REASONS = ['size', 'ttl', 'invalidated']
+
+_META_FILE = 'meta.json'
+_VERSION_FILE = 'VERSION'
+
+
+def value_nbytes(value) -> int:
+    """
+    集計結果のおおよそのバイト数（DataFrame はインデックスと object 列の中身を含む）
+
+    Args:
+        value: DataFrame / Series / ndarray、またはそれらを値に持つ dict・list・tuple
+
+    Returns:
+        int: バイト数
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sum(value_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(value_nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+def _shallow_copy(value):
+    """
+    呼び出し側が列を追加・変更してもキャッシュした結果が変わらないようにする
+    （コピーオンライトなので DataFrame の浅いコピーはデータをコピーしない）
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy(deep=False)
+    if isinstance(value, dict):
+        return {k: _shallow_copy(v) for k, v in value.items()}
+    return value
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:20]
+
+
+def version_matches(version: str, prefix: str) -> bool:
+    """version が prefix そのもの、または prefix のクライアント別のバージョン（'<prefix>:<クライアント>'）なら True"""
+    return version == prefix or version.startswith(f"{prefix}:")
+
+
+class ResultCache:
+    """
+    2段（メモリのLRU＋ディスクの Arrow ファイル）の集計結果キャッシュ
+
+    キーは (データセットのバージョンID, ...) のタプルで、残りの要素は repr() が安定する値
+    （文字列・数値・None・タプル）にしておく。キャッシュから返す値は読み取り専用として扱うが、
+    浅いコピーを返すので列を追加しても他のセッションの結果には影響しない。
+    """
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_memory_bytes: int = DEFAULT_MAX_MEMORY_BYTES,
+                 max_disk_bytes: int = DEFAULT_MAX_DISK_BYTES, ttl_sec: float = DEFAULT_TTL_SEC):
+        """
+        Args:
+            directory: ディスクの段を置くディレクトリ（None なら、または pyarrow がなければメモリの段だけを使う）
+            max_memory_bytes, max_disk_bytes: 段ごとのバイト数の上限
+            ttl_sec: 結果を使う秒数（None なら期限なし）
+        """
+        self.directory = directory if pa is not None else None
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        # 同じキーを複数のセッションが同時に計算しないためのキーごとのロック
+        self._key_locks = {}
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'puts': 0, 'disk_writes': 0, 'disk_skipped': 0}
+        self._evictions = {tier: dict.fromkeys(EVICTION_REASONS, 0) for tier in ('memory', 'disk')}
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    # --- 公開API ---
+
+    def get(self, key: tuple, default=None):
+        """
+        キャッシュした結果を取得する（メモリ → ディスクの順に探し、ディスクで見つけたらメモリにも載せる）
+
+        Returns:
+            結果の浅いコピー（なければ default）
+        """
+        found, value = self._lookup(key)
+        return _shallow_copy(value) if found else default
+
+    def put(self, key: tuple, value):
+        """結果を保存する（メモリの上限を超える大きさの結果はディスクの段だけに保存する）"""
+        n_bytes = value_nbytes(value)
+        with self._lock:
+            self._counters['puts'] += 1
+            self._put_memory(key, value, n_bytes)
+        self._put_disk(key, value)
+
+    def get_or_compute(self, key: tuple, compute):
+        """
+        キャッシュした結果を返し、なければ compute() で計算して保存する
+
+        同じキーを同時に計算しようとしたセッションは、先に始めたセッションの計算が終わるのを待ってその結果を使う。
+
+        Args:
+            key: (データセットのバージョンID, ...) のタプル
+            compute: 引数なしで結果を返す関数
+
+        Returns:
+            結果の浅いコピー
+        """
+        found, value = self._lookup(key, count_miss=False)
+        if found:
+            return _shallow_copy(value)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # 待っている間に他のセッションが計算し終えていればヒット、まだなければミスとして数える
+            found, value = self._lookup(key)
+            if not found:
+                value = compute()
+                self.put(key, value)
+        with self._lock:
+            self._key_locks.pop(key, None)
+        return _shallow_copy(value)
+
+    def invalidate(self, version: str, keep: str = None) -> int:
+        """
+        データセットのバージョンの結果をまとめて捨てる（作り直し・追記で古くなったとき）
+
+        Args:
+            version: 捨てるバージョンID（'<version>:<クライアント>' のクライアント別の結果も捨てる）
+            keep: 捨てずに残すバージョンID（追記後の新しいバージョンが同じ接頭辞を持つとき）
+
+        Returns:
+            int: 捨てた結果の件数（メモリとディスクの合計）
+        """
+        def stale(v):
+            return version_matches(v, version) and v != keep
+
+        removed = 0
+        with self._lock:
+            for key in [k for k in self._memory if stale(k[0])]:
+                self._drop_memory(key, 'invalidated')
+                removed += 1
+        if self.directory:
+            for version_dir, dir_version in self._disk_versions():
+                if stale(dir_version):
+                    n_entries = len(self._entry_dirs(version_dir))
+                    shutil.rmtree(version_dir, ignore_errors=True)
+                    with self._lock:
+                        self._evictions['disk']['invalidated'] += n_entries
+                    removed += n_entries
+        return removed
+
+    def purge_expired(self) -> int:
+        """TTL を過ぎた結果をメモリとディスクから消す（get() でも消すが、使われない結果はここで片付ける）"""
+        if self.ttl_sec is None:
+            return 0
+        now = time.time()
+        removed = 0
+        with self._lock:
+            for key in [k for k, entry in self._memory.items() if entry['expires_at'] <= now]:
+                self._drop_memory(key, 'ttl')
+                removed += 1
+        if self.directory:
+            for entry_dir, meta in self._disk_entries():
+                if meta['expires_at'] is not None and meta['expires_at'] <= now:
+                    self._drop_disk(entry_dir, 'ttl')
+                    removed += 1
+        return removed
+
+    def clear(self):
+        """すべての結果を捨てる（件数は追い出しに数えない）"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        if self.directory:
+            for version_dir, _ in self._disk_versions():
+                shutil.rmtree(version_dir, ignore_errors=True)
+
+    def stats(self) -> dict:
+        """
+        キャッシュの状態
+
+        Returns:
+            dict: 'memory_entries', 'memory_bytes', 'max_memory_bytes', 'disk_enabled', 'disk_entries', 'disk_bytes',
+                'max_disk_bytes', 'ttl_sec', 'memory_hits', 'disk_hits', 'misses', 'hit_rate', 'puts', 'disk_writes',
+                'disk_skipped'（Arrow で保存できず、メモリだけに置いた件数）, 'evictions'（{段: {理由: 件数}}）
+        """
+        disk_entries = self._disk_entries() if self.directory else []
+        with self._lock:
+            counters = dict(self._counters)
+            lookups = counters['memory_hits'] + counters['disk_hits'] + counters['misses']
+            return {
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'max_memory_bytes': self.max_memory_bytes,
+                'disk_enabled': bool(self.directory),
+                'disk_entries': len(disk_entries),
+                'disk_bytes': sum(meta['disk_bytes'] for _, meta in disk_entries),
+                'max_disk_bytes': self.max_disk_bytes,
+                'ttl_sec': self.ttl_sec,
+                **counters,
+                'hit_rate': (counters['memory_hits'] + counters['disk_hits']) / lookups if lookups else None,
+                'evictions': {tier: dict(reasons) for tier, reasons in self._evictions.items()},
+            }
+
+    # --- メモリの段 ---
+
+    def _lookup(self, key, count_miss=True):
+        """(見つかったか, 値) を返す。値はキャッシュ内のオブジェクトそのもの"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry['expires_at'] > now:
+                    self._memory.move_to_end(key)
+                    self._counters['memory_hits'] += 1
+                    return True, entry['value']
+                self._drop_memory(key, 'ttl')
+        value = self._read_disk(key) if self.directory else None
+        with self._lock:
+            if value is not None:
+                self._counters['disk_hits'] += 1
+                self._put_memory(key, value, value_nbytes(value))
+                return True, value
+            if count_miss:
+                self._counters['misses'] += 1
+        return False, None
+
+    def _put_memory(self, key, value, n_bytes):
+        """self._lock を持った状態で呼ぶ"""
+        if key in self._memory:
+            self._memory_bytes -= self._memory.pop(key)['bytes']
+        if n_bytes > self.max_memory_bytes:
+            return
+        expires_at = time.time() + self.ttl_sec if self.ttl_sec is not None else float('inf')
+        self._memory[key] = {'value': value, 'bytes': n_bytes, 'expires_at': expires_at}
+        self._memory_bytes += n_bytes
+        while self._memory_bytes > self.max_memory_bytes:
+            self._drop_memory(next(iter(self._memory)), 'size')
+
+    def _drop_memory(self, key, reason):
+        """self._lock を持った状態で呼ぶ"""
+        self._memory_bytes -= self._memory.pop(key)['bytes']
+        self._evictions['memory'][reason] += 1
+
+    # --- ディスクの段 ---
+
+    def _entry_dir(self, key):
+        return os.path.join(self.directory, _digest(str(key[0])), _digest(repr(key)))
+
+    def _disk_versions(self):
+        """[(バージョンのディレクトリ, バージョンID)]"""
+        versions = []
+        for name in os.listdir(self.directory):
+            version_dir = os.path.join(self.directory, name)
+            try:
+                with open(os.path.join(version_dir, _VERSION_FILE), encoding='utf-8') as f:
+                    versions.append((version_dir, f.read()))
+            except OSError:
+                continue
+        return versions
+
+    def _entry_dirs(self, version_dir):
+        return [os.path.join(version_dir, name) for name in os.listdir(version_dir)
+                if os.path.isfile(os.path.join(version_dir, name, _META_FILE))]
+
+    def _disk_entries(self):
+        """[(結果のディレクトリ, メタデータ)]（書き込み中・壊れたものは除く）"""
+        entries = []
+        for version_dir, _ in self._disk_versions():
+            for entry_dir in self._entry_dirs(version_dir):
+                try:
+                    with open(os.path.join(entry_dir, _META_FILE), encoding='utf-8') as f:
+                        meta = json.load(f)
+                    meta['last_used'] = os.path.getmtime(os.path.join(entry_dir, _META_FILE))
+                except (OSError, ValueError):
+                    continue
+                entries.append((entry_dir, meta))
+        return entries
+
+    def _drop_disk(self, entry_dir, reason):
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        with self._lock:
+            self._evictions['disk'][reason] += 1
+
+    def _read_disk(self, key):
+        entry_dir = self._entry_dir(key)
+        meta_path = os.path.join(entry_dir, _META_FILE)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # ファイル名の衝突に備えてキーそのものも確かめる
+        if meta['key'] != repr(key):
+            return None
+        if meta['expires_at'] is not None and meta['expires_at'] <= time.time():
+            self._drop_disk(entry_dir, 'ttl')
+            return None
+        try:
+            tables = {name: feather.read_table(os.path.join(entry_dir, f"{i}.arrow")).to_pandas()
+                      for i, name in enumerate(meta['tables'])}
+            # 最後に使った時刻（ディスクの段の LRU に使う）
+            os.utime(meta_path)
+        except (OSError, pa.ArrowException):
+            return None
+        return tables[None] if meta['kind'] == 'frame' else tables
+
+    def _put_disk(self, key, value):
+        if not self.directory:
+            return
+        if isinstance(value, pd.DataFrame):
+            kind, tables = 'frame', {None: value}
+        elif isinstance(value, dict) and value and all(isinstance(v, pd.DataFrame) for v in value.values()):
+            kind, tables = 'tables', value
+        else:
+            with self._lock:
+                self._counters['disk_skipped'] += 1
+            return
+
+        entry_dir = self._entry_dir(key)
+        version_dir = os.path.dirname(entry_dir)
+        os.makedirs(version_dir, exist_ok=True)
+        version_path = os.path.join(version_dir, _VERSION_FILE)
+        if not os.path.exists(version_path):
+            with open(version_path, 'w', encoding='utf-8') as f:
+                f.write(str(key[0]))
+        # 一時ディレクトリに書いてから名前を変え、別のプロセスが書きかけのファイルを読まないようにする
+        tmp_dir = os.path.join(version_dir, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp_dir)
+        try:
+            disk_bytes = 0
+            for i, table in enumerate(tables.values()):
+                path = os.path.join(tmp_dir, f"{i}.arrow")
+                feather.write_feather(pa.Table.from_pandas(table), path)
+                disk_bytes += os.path.getsize(path)
+            meta = {
+                'key': repr(key), 'kind': kind, 'tables': list(tables), 'disk_bytes': disk_bytes,
+                'created_at': time.time(),
+                'expires_at': time.time() + self.ttl_sec if self.ttl_sec is not None else None,
+            }
+            with open(os.path.join(tmp_dir, _META_FILE), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, entry_dir)
+        except (OSError, TypeError, ValueError, pa.ArrowException):
+            # Arrow の型にできない列（dict の列など）を含む結果はメモリの段だけに置く
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            with self._lock:
+                self._counters['disk_skipped'] += 1
+            return
+        with self._lock:
+            self._counters['disk_writes'] += 1
+        self._enforce_disk_limit()
+
+    def _enforce_disk_limit(self):
+        """ディスクの段のバイト数が上限を超えていたら、最後に使った時刻が古いものから消す"""
+        entries = sorted(self._disk_entries(), key=lambda e: e[1]['last_used'])
+        total = sum(meta['disk_bytes'] for _, meta in entries)
+        for entry_dir, meta in entries:
+            if total <= self.max_disk_bytes:
+                break
+            self._drop_disk(entry_dir, 'size')
+            total -= meta['disk_bytes']
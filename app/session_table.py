@@ -0,0 +1,75 @@
+"""
+セッションテーブル作成モジュール
+イベント単位のデータ（1行1イベント）を1セッション1行に集約し、
+各分析エンジンが共通で利用するセッション単位の配列を提供する
+"""
+import numpy as np
+import pandas as pd
+
+# セッション内で値が変わらない（先頭イベントの値を採用する）属性列
+SESSION_DIMENSIONS = [
+    'user_pseudo_id', 'ga_session_number', 'device_type', 'channel', 'source_medium',
+    'lp_base_url', 'page_location', 'utm_source', 'utm_medium', 'utm_campaign', 'utm_content',
+    'ab_variant', 'ab_test_target', 'user_type', 'conversion_status', 'total_pages',
+    'age', 'gender', 'prefecture',
+    'session_hour', 'session_weekday', 'session_week', 'session_month',
+]
+
+SESSION_TABLE_COLUMNS = [
+    'session_id', 'event_date', 'session_start', 'n_events', 'is_cv', 'clicked',
+    'max_page_reached', 'stay_ms_sum', 'stay_ms_count', 'stay_ms_max', 'load_time_ms_mean', 'scroll_pct_max', 'cv_value',
+]
+
+
+def build_session_table(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    イベントデータをセッション単位に集約する
+
+    Args:
+        df: イベント単位のデータフレーム（フィルター適用済みでも可）
+
+    Returns:
+        pd.DataFrame: 1セッション1行のテーブル。
+            is_cv / clicked はbool、stay_ms_sum はイベントの滞在時間合計（stay_ms_count で割ると滞在時間のあるイベントの平均）
+    """
+    dims = [c for c in SESSION_DIMENSIONS if c in df.columns]
+    if df.empty:
+        return pd.DataFrame(columns=SESSION_TABLE_COLUMNS + dims)
+
+    # 集計用のフラグ列を一度だけ作成（groupby内でのlambdaを避ける）
+    work = pd.DataFrame({
+        'session_id': df['session_id'].to_numpy(),
+        'event_date': df['event_date'].to_numpy(),
+        'event_timestamp': df['event_timestamp'].to_numpy(),
+        'is_cv': df['cv_type'].notna().to_numpy(),
+        'clicked': (df['event_name'] == 'click').to_numpy(),
+        'max_page_reached': df['max_page_reached'].to_numpy(),
+        'stay_ms': df['stay_ms'].to_numpy(dtype=float),
+        'load_time_ms': df['load_time_ms'].to_numpy(dtype=float),
+        'scroll_pct': df['scroll_pct'].to_numpy(dtype=float) if 'scroll_pct' in df.columns else np.nan,
+        'cv_value': pd.to_numeric(df['cv_value'], errors='coerce').to_numpy(dtype=float) if 'cv_value' in df.columns else np.nan,
+    })
+    for col in dims:
+        work[col] = df[col].to_numpy()
+
+    agg_spec = {
+        'event_date': ('event_date', 'min'),
+        'session_start': ('event_timestamp', 'min'),
+        'n_events': ('session_id', 'size'),
+        'is_cv': ('is_cv', 'max'),
+        'clicked': ('clicked', 'max'),
+        'max_page_reached': ('max_page_reached', 'max'),
+        'stay_ms_sum': ('stay_ms', 'sum'),
+        'stay_ms_count': ('stay_ms', 'count'),
+        'stay_ms_max': ('stay_ms', 'max'),
+        'load_time_ms_mean': ('load_time_ms', 'mean'),
+        'scroll_pct_max': ('scroll_pct', 'max'),
+        'cv_value': ('cv_value', 'sum'),
+    }
+    for col in dims:
+        agg_spec[col] = (col, 'first')
+
+    sessions = work.groupby('session_id', sort=False).agg(**agg_spec).reset_index()
+    sessions['is_cv'] = sessions['is_cv'].astype(bool)
+    sessions['clicked'] = sessions['clicked'].astype(bool)
+    return sessions
@@ -0,0 +1,129 @@
+"""
+生存分析モジュール
+スワイプの到達ページ数を「生存時間」とみなし、カプラン・マイヤー法で到達率（リテンション）と
+ページごとの離脱ハザードを計算する。
+セッションごとにLPのページ数（total_pages）が異なるため、最終ページまで到達したセッションや
+CVしたセッションは「打ち切り」として扱い、単純な離脱率の偏りを補正する
+"""
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+ALL_SEGMENT = '全体'
+
+
+def _event_arrays(sessions: pd.DataFrame):
+    """セッションテーブルから (到達ページ数, 離脱イベントか, 打ち切りか) の配列を作成する"""
+    depth = sessions['max_page_reached'].to_numpy(dtype=np.int64)
+    if 'total_pages' in sessions.columns:
+        total_pages = sessions['total_pages'].fillna(depth.max() if len(depth) else 0).to_numpy(dtype=np.int64)
+    else:
+        total_pages = np.full(len(depth), depth.max() if len(depth) else 0)
+    converted = sessions['is_cv'].to_numpy(dtype=bool)
+    # 最終ページでは次のページが存在しないため「離脱」は観測できない（打ち切り）
+    exited = ~converted & (depth < total_pages)
+    return depth, exited, ~exited
+
+
+def kaplan_meier(sessions: pd.DataFrame, by: str = None, max_page: int = None, alpha: float = 0.05) -> pd.DataFrame:
+    """
+    セグメントごとのカプラン・マイヤー到達率とページ別離脱ハザードを計算する
+
+    (セグメント × ページ) の2次元 bincount で離脱数・打ち切り数を数え、
+    リスク集合は後ろからの累積和で、生存率は累積積で全セグメント同時に求める。
+
+    Args:
+        sessions: build_session_table() で作成したセッションテーブル
+        by: セグメントに分ける列名（'device_type', 'channel', 'ab_variant' など）。None なら全体
+        max_page: 集計する最大ページ（None ならデータ中の最大到達ページ）
+        alpha: 到達率の信頼区間の有意水準（Greenwoodの式）
+
+    Returns:
+        pd.DataFrame: 'segment', 'page', 'at_risk'（そのページで離脱しうるセッション数）, 'exits', 'censored',
+            'reached'（そのページまで到達したセッション数）,
+            'hazard'（そのページでの離脱確率）, 'survival'（そのページを越えて進む確率）,
+            'retention'（そのページに到達する確率）, 'ci_low', 'ci_high'（retention の信頼区間）
+    """
+    depth, exited, censored = _event_arrays(sessions)
+    if by is None:
+        codes = np.zeros(len(depth), dtype=np.int64)
+        labels = np.array([ALL_SEGMENT], dtype=object)
+    else:
+        codes, labels = pd.factorize(sessions[by].fillna('(not set)'), sort=True)
+    n_segments = len(labels)
+    if max_page is None:
+        max_page = int(depth.max()) if len(depth) else 0
+    depth = np.clip(depth, 1, max_page) if max_page else depth
+    size = max_page + 1
+
+    flat = codes * size + depth
+    exits = np.bincount(flat, weights=exited, minlength=n_segments * size).reshape(n_segments, size)[:, 1:]
+    cens = np.bincount(flat, weights=censored, minlength=n_segments * size).reshape(n_segments, size)[:, 1:]
+    # ページ d 以降まで到達したセッション数（後ろからの累積和）
+    reached = np.cumsum((exits + cens)[:, ::-1], axis=1)[:, ::-1]
+    # ページ d が最終ページのセッション（打ち切り）は d で離脱できないためリスク集合から除く
+    at_risk = reached - cens
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        hazard = np.where(at_risk > 0, exits / at_risk, 0.0)
+        survival = np.cumprod(1 - hazard, axis=1)
+        retention = np.hstack([np.ones((n_segments, 1)), survival[:, :-1]])
+        # Greenwood の分散（到達率 = 直前ページまでの生存率）
+        greenwood = np.where(at_risk > exits, exits / (at_risk * (at_risk - exits)), 0.0)
+        var_terms = np.hstack([np.zeros((n_segments, 1)), np.cumsum(greenwood, axis=1)[:, :-1]])
+    z = norm.ppf(1 - alpha / 2)
+    half_width = z * retention * np.sqrt(var_terms)
+
+    pages = np.arange(1, size)
+    result = pd.DataFrame({
+        'segment': np.repeat(labels, max_page),
+        'page': np.tile(pages, n_segments),
+        'at_risk': at_risk.ravel().astype(np.int64),
+        'exits': exits.ravel().astype(np.int64),
+        'censored': cens.ravel().astype(np.int64),
+        'reached': reached.ravel().astype(np.int64),
+        'hazard': hazard.ravel(),
+        'survival': survival.ravel(),
+        'retention': retention.ravel(),
+        'ci_low': np.clip(retention - half_width, 0, 1).ravel(),
+        'ci_high': np.clip(retention + half_width, 0, 1).ravel(),
+    })
+    # 誰も到達していないページは除く
+    return result[result['reached'] > 0].reset_index(drop=True)
+
+
+def median_depth(km: pd.DataFrame) -> pd.DataFrame:
+    """
+    セグメントごとの到達ページ数の中央値（到達率が50%を下回る最初のページ）を返す
+
+    Args:
+        km: kaplan_meier() の戻り値
+
+    Returns:
+        pd.DataFrame: 'segment', 'median_page'（50%を下回らない場合は NaN）, 'sessions'
+    """
+    below = km[km['retention'] < 0.5]
+    median = below.groupby('segment', sort=False)['page'].min()
+    sessions = km[km['page'] == 1].set_index('segment')['reached']
+    return pd.DataFrame({'median_page': median.reindex(sessions.index), 'sessions': sessions}).reset_index()
+
+
+def compare_segments(sessions: pd.DataFrame, dimensions, max_page: int = None) -> pd.DataFrame:
+    """
+    複数の次元についてセグメント別のカプラン・マイヤー結果をまとめて計算する
+
+    Args:
+        sessions: build_session_table() で作成したセッションテーブル
+        dimensions: 比較する次元の列名のリスト
+        max_page: 集計する最大ページ
+
+    Returns:
+        pd.DataFrame: kaplan_meier() の列に 'dimension' を加えたもの（全体は dimension='全体'）
+    """
+    if max_page is None:
+        max_page = int(sessions['max_page_reached'].max()) if not sessions.empty else 0
+    frames = [kaplan_meier(sessions, None, max_page).assign(dimension=ALL_SEGMENT)]
+    for dim in dimensions:
+        if dim in sessions.columns:
+            frames.append(kaplan_meier(sessions, dim, max_page).assign(dimension=dim))
+    return pd.concat(frames, ignore_index=True)
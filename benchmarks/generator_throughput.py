@@ -0,0 +1,54 @@
+"""
+ダミーデータ生成の速度比較（events/sec）
+旧ジェネレーター（app.generate_dummy_data / generate_training_data_legacy）と一括生成エンジン（app.bulk_generator）を
+同じシナリオ・日数で実行し、生成イベント数と1秒あたりのイベント数を表示する
+
+    python benchmarks/generator_throughput.py --days 30
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.bulk_generator import generate_bulk_data  # noqa: E402
+from app.generate_dummy_data import generate_dummy_data  # noqa: E402
+from generate_training_data import generate_training_data_legacy  # noqa: E402
+
+
+def _measure(label: str, func) -> dict:
+    """func() を1回実行して件数と所要時間を測る（旧ジェネレーターのデバッグ出力は捨てる）"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        df = func()
+        elapsed = time.perf_counter() - start
+    return {'label': label, 'events': len(df), 'seconds': elapsed, 'events_per_sec': len(df) / elapsed if elapsed else float('inf')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--scenario', default='標準（ベースライン）', help='generate_dummy_data と比べるシナリオ')
+    parser.add_argument('--training-scenario', default='普通', help='generate_training_data と比べるシナリオ')
+    args = parser.parse_args()
+
+    end = date.today()
+    start = end - timedelta(days=args.days - 1)
+    results = [
+        _measure(f'generate_dummy_data ({args.scenario})', lambda: generate_dummy_data(args.scenario, num_days=args.days)),
+        _measure(f'generate_bulk_data ({args.scenario})', lambda: generate_bulk_data(args.scenario, num_days=args.days, seed=0)),
+        _measure(f'generate_training_data_legacy ({args.training_scenario})', lambda: generate_training_data_legacy(start, end, args.training_scenario)),
+        _measure(f'generate_bulk_data ({args.training_scenario})', lambda: generate_bulk_data(args.training_scenario, start_date=start, end_date=end, seed=0)),
+    ]
+    width = max(len(r['label']) for r in results)
+    print(f"{'generator':<{width}}  {'events':>9}  {'seconds':>8}  {'events/sec':>12}")
+    for r in results:
+        print(f"{r['label']:<{width}}  {r['events']:>9,}  {r['seconds']:>8.2f}  {r['events_per_sec']:>12,.0f}")
+
+
+if __name__ == '__main__':
+    main()
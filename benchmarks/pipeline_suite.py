@@ -0,0 +1,242 @@
+"""
+分析パイプラインのベンチマーク（ページの計算を画面なしで実行する）
+シナリオ（SCENARIO_CONFIGS）× 期間（7 / 30 / 90 / 365日）ごとに、前処理・フィルター・各ページの集計を順に実行し、
+段階ごとの所要時間とピークメモリ（tracemalloc）を測る。結果を JSON に保存しておき、変更後に --compare で比べると
+しきい値を超えて遅くなった段階を表示して終了コード 1 を返す（CI やリリース前の確認用）
+
+    python benchmarks/pipeline_suite.py --output baseline.json
+    python benchmarks/pipeline_suite.py --compare baseline.json --threshold 0.2
+    python benchmarks/pipeline_suite.py --days 30 --scenario 標準（ベースライン） --repeat 3
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from app import ad_aggregation, form_funnel, interaction_matrix, lp_partitions  # noqa: E402
+from app.analytics import ab_test, alerts, interaction, page_analysis, summary  # noqa: E402
+from app.analytics.common import ALL_LABEL, enrich_events, filter_events, session_mask  # noqa: E402
+from app.bulk_generator import SCENARIO_CONFIGS, generate_bulk_data  # noqa: E402
+from app.session_table import build_session_table  # noqa: E402
+
+DEFAULT_DAYS = [7, 30, 90, 365]
+# 比較で無視する差（秒）。これより短い差は計測のぶれとみなす
+DEFAULT_NOISE_FLOOR_SEC = 0.01
+
+
+def _pipeline():
+    """
+    段階名と処理の組を実行順に返す。各処理は状態の dict を受け取り、次の段階で使う値を書き込む
+    （アプリの各ページが呼ぶのと同じ関数を、同じ引数の作り方で呼ぶ）
+    """
+    def enrich(state):
+        state['df'] = enrich_events(state['raw'])
+
+    def filter_lp(state):
+        df = state['df']
+        state['partitions'] = lp_partitions.build_partitions(df, 'lp_base_url')
+        lp_url = df['lp_base_url'].iloc[0]
+        state['filtered'] = filter_events(df, df['event_date'].min(), df['event_date'].max(), lp_url,
+                                          ALL_LABEL, ALL_LABEL, ALL_LABEL, ALL_LABEL, ALL_LABEL, partitions=state['partitions'])
+
+    def session_tables(state):
+        state['all_sessions'] = build_session_table(state['df'])
+        state['sessions'] = build_session_table(state['filtered'])
+
+    def summary_page(state):
+        summary.summary_kpis(state['filtered'])
+        summary.daily_kpis(state['filtered'])
+
+    def page_page(state):
+        filtered = state['filtered']
+        actual_page_count = int(filtered['page_num_dom'].max())
+        page_analysis.page_stats(filtered, state['sessions'], actual_page_count)
+
+    def ab_page(state):
+        labeled = state['filtered'].copy(deep=False)
+        labeled['ab_test_target'] = ab_test.test_type_labels(labeled)
+        ab_test.ab_stats(labeled)
+
+    def ad_page(state):
+        flags = ad_aggregation.build_ad_flags(state['sessions'])
+        for by in (['utm_campaign'], ['utm_content'], ['utm_source', 'utm_medium'], ['utm_campaign', 'utm_content']):
+            ad_aggregation.aggregate_ad_segments(flags, by)
+
+    def interaction_page(state):
+        df, all_sessions = state['df'], state['all_sessions']
+        matrix = interaction_matrix.build_interaction_matrix(df, all_sessions)
+        mask = session_mask(all_sessions, df['event_date'].min(), df['event_date'].max())
+        interaction.interaction_tables(matrix, all_sessions, mask)
+
+    def alerts_page(state):
+        alerts.daily_kpi_alerts(state['df'])
+
+    def form_page(state):
+        form = form_funnel.build_form_sessions(state['filtered'])
+        form_funnel.form_summary(form)
+        form_funnel.form_step_funnel(form)
+
+    return [
+        ('enrich', enrich),
+        ('filter_dataframe', filter_lp),
+        ('session_table', session_tables),
+        ('summary', summary_page),
+        ('page_stats', page_page),
+        ('ab_stats', ab_page),
+        ('ad_segments', ad_page),
+        ('interaction', interaction_page),
+        ('alerts', alerts_page),
+        ('form_funnel', form_page),
+    ]
+
+
+def _run_once(raw: pd.DataFrame, trace_memory: bool) -> dict:
+    """パイプラインを1回実行し、段階ごとの秒数（trace_memory なら加えてピークメモリ MB）を返す"""
+    state = {'raw': raw}
+    results = {}
+    for name, func in _pipeline():
+        if trace_memory:
+            tracemalloc.start()
+            func(state)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[name] = peak / 1024 / 1024
+        else:
+            start = time.perf_counter()
+            func(state)
+            results[name] = time.perf_counter() - start
+    return results
+
+
+def run_case(scenario: str, days: int, repeat: int = 1, measure_memory: bool = True) -> dict:
+    """
+    1つのシナリオ・期間でパイプラインを実行する
+
+    時間は repeat 回のうち最短の値（tracemalloc はメモリ確保ごとにコストがかかるので、時間を測る回では止めておき、
+    ピークメモリは別の1回で測る）。
+
+    Returns:
+        dict: 'scenario', 'days', 'events', 'stages'（{段階名: {'seconds', 'peak_mb'}}）, 'total_seconds'
+    """
+    raw = generate_bulk_data(scenario, num_days=days, seed=0)
+    raw['event_date'] = pd.to_datetime(raw['event_date'])
+    raw['event_timestamp'] = pd.to_datetime(raw['event_timestamp'])
+    timings = [_run_once(raw, trace_memory=False) for _ in range(max(repeat, 1))]
+    memory = _run_once(raw, trace_memory=True) if measure_memory else {}
+    stages = {
+        name: {'seconds': min(t[name] for t in timings), 'peak_mb': memory.get(name)}
+        for name, _ in _pipeline()
+    }
+    return {
+        'scenario': scenario,
+        'days': days,
+        'events': len(raw),
+        'stages': stages,
+        'total_seconds': sum(s['seconds'] for s in stages.values()),
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float, noise_floor: float = DEFAULT_NOISE_FLOOR_SEC) -> list:
+    """
+    ベースラインより遅くなった段階を探す
+
+    Args:
+        current, baseline: main() が保存する JSON の dict
+        threshold: 許容する増加率（0.2 なら 20% まで）
+        noise_floor: これより小さい差（秒）は無視する
+
+    Returns:
+        list: 遅くなった段階の dict（'scenario', 'days', 'stage', 'baseline', 'current', 'ratio'）
+    """
+    base_index = {(r['scenario'], r['days']): r for r in baseline.get('results', [])}
+    regressions = []
+    for result in current['results']:
+        base = base_index.get((result['scenario'], result['days']))
+        if base is None:
+            continue
+        for stage, values in result['stages'].items():
+            base_values = base['stages'].get(stage)
+            if not base_values or not base_values['seconds']:
+                continue
+            ratio = values['seconds'] / base_values['seconds']
+            if ratio > 1 + threshold and values['seconds'] - base_values['seconds'] > noise_floor:
+                regressions.append({
+                    'scenario': result['scenario'], 'days': result['days'], 'stage': stage,
+                    'baseline': base_values['seconds'], 'current': values['seconds'], 'ratio': ratio,
+                })
+    return regressions
+
+
+def _print_result(result: dict, baseline: dict = None):
+    """1つのケースの段階ごとの時間・メモリ（ベースラインがあれば比）を表示する"""
+    print(f"\n{result['scenario']} / {result['days']}日 / {result['events']:,} events")
+    header = f"  {'stage':<18} {'seconds':>9} {'peak MB':>9}"
+    if baseline:
+        header += f" {'baseline':>9} {'ratio':>7}"
+    print(header)
+    for stage, values in list(result['stages'].items()) + [('total', {'seconds': result['total_seconds'], 'peak_mb': None})]:
+        peak = f"{values['peak_mb']:>9.1f}" if values['peak_mb'] is not None else f"{'-':>9}"
+        line = f"  {stage:<18} {values['seconds']:>9.3f} {peak}"
+        if baseline:
+            base_seconds = baseline['total_seconds'] if stage == 'total' else baseline['stages'].get(stage, {}).get('seconds')
+            if base_seconds:
+                line += f" {base_seconds:>9.3f} {values['seconds'] / base_seconds:>7.2f}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, nargs='+', default=DEFAULT_DAYS)
+    parser.add_argument('--scenario', nargs='+', default=list(SCENARIO_CONFIGS), help='SCENARIO_CONFIGS のキー（既定はすべて）')
+    parser.add_argument('--repeat', type=int, default=1, help='時間を測る回数（最短の値を使う）')
+    parser.add_argument('--no-memory', action='store_true', help='ピークメモリを測らない')
+    parser.add_argument('--output', help='結果を保存する JSON のパス')
+    parser.add_argument('--compare', help='比べるベースラインの JSON のパス')
+    parser.add_argument('--threshold', type=float, default=0.2, help='遅くなったとみなす増加率（--compare 用）')
+    parser.add_argument('--noise-floor', type=float, default=DEFAULT_NOISE_FLOOR_SEC, help='無視する差の秒数（--compare 用）')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    base_index = {(r['scenario'], r['days']): r for r in baseline['results']} if baseline else {}
+
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'environment': {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__, 'machine': platform.machine()},
+        'repeat': args.repeat,
+        'results': [],
+    }
+    for scenario in args.scenario:
+        for days in args.days:
+            result = run_case(scenario, days, repeat=args.repeat, measure_memory=not args.no_memory)
+            report['results'].append(result)
+            _print_result(result, base_index.get((scenario, days)))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n結果を保存しました: {args.output}")
+
+    if baseline:
+        regressions = compare(report, baseline, args.threshold, args.noise_floor)
+        if regressions:
+            print(f"\n{args.threshold:.0%} を超えて遅くなった段階: {len(regressions)}件")
+            for r in regressions:
+                print(f"  {r['scenario']} / {r['days']}日 / {r['stage']}: {r['baseline']:.3f}s → {r['current']:.3f}s（{r['ratio']:.2f}倍）")
+            sys.exit(1)
+        print(f"\n{args.threshold:.0%} を超えて遅くなった段階はありません")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,9 +2,29 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 
-def generate_training_data(start_date, end_date, scenario='普通'):
+from app.bulk_generator import generate_bulk_data
+
+
+def generate_training_data(start_date, end_date, scenario='普通', seed=None):
     """
     指定されたシナリオと期間に基づいてトレーニングデータを生成する関数。
+    app.bulk_generator の一括生成エンジンで生成し、列と型はアプリのダミーデータと共通（BULK_SCHEMA）。
+
+    Args:
+        start_date (datetime.date): データ生成の開始日。
+        end_date (datetime.date): データ生成の終了日。
+        scenario (str): '好調', '普通', '不調' のいずれか。
+        seed (int): 乱数シード。
+
+    Returns:
+        pd.DataFrame: 生成されたトレーニングデータ。
+    """
+    return generate_bulk_data(scenario, start_date=start_date, end_date=end_date, seed=seed)
+
+
+def generate_training_data_legacy(start_date, end_date, scenario='普通'):
+    """
+    旧実装（セッション・イベントごとのループで生成する）。速度比較のためだけに残している。
 
     Args:
         start_date (datetime.date): データ生成の開始日。